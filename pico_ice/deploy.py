@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import select
+import struct
+import sys
+import time
+import tty
+import zlib
+
+# Program tinyQV firmware into the QSPI PMOD's flash on a pico-ice and run it,
+# in one command.  Talks to MicroPython's raw REPL on the pico's USB serial
+# port, and needs flash_prog.py and run_tinyqv.py from micropython/ on the
+# pico's filesystem.
+#
+#   ./deploy.py firmware.bin                 program, run and tail the UART
+#   ./deploy.py --port /dev/ttyACM1 --compress --no-run firmware.bin
+#
+# The image isn't copied to the pico's filesystem first.  The pico sends the
+# CRC32 of each 4KB sector of the flash and only the sectors that differ are
+# sent, each with its CRC32, starting while the pico erases them.  The pico
+# acknowledges a sector as soon as it has arrived intact, so the next one is
+# sent while it programs (see flash_prog.receive).  --compress deflates the sectors, which helps with
+# images that are mostly padding.  The UART is tailed until Ctrl-C, or for
+# --tail seconds.
+#
+# micropython/host/pico.py stands in for the pico, on a pseudo-terminal.
+
+SECTOR_SIZE = 4096
+
+class ReplError(Exception):
+    pass
+
+# A serial port, or a pseudo-terminal, in raw mode
+class Port:
+    def __init__(self, path, timeout=10):
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        self.timeout = timeout
+        self.pending = b""
+
+    def close(self):
+        os.close(self.fd)
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    # What has arrived, waiting up to timeout seconds for something.  Returns
+    # b"" on a timeout.
+    def read(self, timeout=None):
+        if self.pending:
+            data, self.pending = self.pending, b""
+            return data
+        timeout = self.timeout if timeout is None else timeout
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return b""
+        return os.read(self.fd, 4096)
+
+    def read_byte(self):
+        data = self.read()
+        self.unread(data[1:])
+        return data[:1]
+
+    # Put back data read too far
+    def unread(self, data):
+        self.pending = data + self.pending
+
+    def read_until(self, ending):
+        data = b""
+        while ending not in data:
+            chunk = self.read()
+            if not chunk:
+                raise ReplError("Timed out waiting for {!r} after {!r}".format(ending, data[-80:]))
+            data += chunk
+        end = data.index(ending)
+        self.unread(data[end + len(ending):])
+        return data[:end]
+
+class RawRepl:
+    def __init__(self, port):
+        self.port = port
+        port.write(b"\r\x03\x03")
+        while port.read(0.1):
+            pass
+        port.write(b"\r\x01")
+        port.read_until(b"raw REPL; CTRL-B to exit\r\n>")
+
+    # Start running code, leaving its output to be read
+    def start(self, code):
+        self.port.write(code.encode() + b"\x04")
+        self.port.read_until(b"OK")
+
+    # The output of the code once it finishes, raising ReplError with the
+    # traceback if it raised
+    def finish(self):
+        output = self.port.read_until(b"\x04")
+        error = self.port.read_until(b"\x04")
+        self.port.read_until(b">")
+        if error:
+            raise ReplError(error.decode(errors="replace").strip())
+        return output.decode(errors="replace").replace("\r\n", "\n")
+
+    def exec(self, code):
+        self.start(code)
+        return self.finish()
+
+    # Copy the output of the running code to out until it finishes, or until
+    # Ctrl-C or seconds have passed, when it is interrupted
+    def follow(self, out, seconds=None):
+        deadline = None if seconds is None else time.monotonic() + seconds
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                data = self.port.read(0.1)
+                if b"\x04" in data:
+                    self.port.unread(data)
+                    return self.finish()
+                out.write(data.decode(errors="replace").replace("\r\n", "\n"))
+                out.flush()
+        except KeyboardInterrupt:
+            pass
+        self.port.write(b"\x03")
+        try:
+            self.finish()
+        except ReplError as e:
+            if "KeyboardInterrupt" not in str(e):
+                raise
+
+    # Back to the friendly REPL
+    def close(self):
+        self.port.write(b"\x02")
+
+# A sector as sent: its length and CRC32 then the data
+def frame(data):
+    return struct.pack("<II", len(data), zlib.crc32(data)) + data
+
+def compress(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 12)
+    return compressor.compress(data) + compressor.flush()
+
+# Program the image, returning the number of sectors programmed and unchanged
+def deploy(repl, image, compressed=False, full=False, out=None):
+    out = out or sys.stdout
+    sectors = [image[addr:addr + SECTOR_SIZE] for addr in range(0, len(image), SECTOR_SIZE)]
+    if full:
+        changed = list(range(len(sectors)))
+    else:
+        crcs = repl.exec("import flash_prog\nflash_prog.sector_crcs({})".format(len(image))).split()
+        changed = [i for i, sector in enumerate(sectors) if int(crcs[i], 16) != zlib.crc32(sector)]
+    unchanged = len(sectors) - len(changed)
+
+    start = time.monotonic()
+    sent = 0
+    if changed:
+        repl.start("import flash_prog\nflash_prog.receive({}, {})".format(changed, compressed))
+        chunks = [compress(sectors[i]) if compressed else sectors[i] for i in changed]
+        i = 0
+        while i < len(chunks):
+            ack = repl.port.read_byte()
+            if not ack:
+                raise ReplError("Timed out waiting for sector {}".format(changed[i]))
+            if ack == b"*":
+                out.write("*")
+            elif ack in (b"R", b"N", b"A"):
+                if ack == b"A":
+                    out.write(".")
+                    i += 1
+                if i < len(chunks):
+                    data = frame(chunks[i])
+                    repl.port.write(data)
+                    sent += len(data)
+            else:
+                repl.port.unread(ack)
+                repl.finish()
+                raise ReplError("Unexpected {!r} waiting for sector {}".format(ack, changed[i]))
+            out.flush()
+        repl.finish()
+        out.write("\n")
+
+    out.write("{} sectors programmed, {} unchanged, {} bytes sent in {:.1f}s\n".format(
+        len(changed), unchanged, sent, time.monotonic() - start))
+    return len(changed), unchanged
+
+# Start the design and copy the UART to out
+def run(repl, seconds=None, out=None):
+    out = out or sys.stdout
+    repl.start("import run_tinyqv\nrun_tinyqv.run(query=False, stop=False)\nrun_tinyqv.tail_uart()")
+    repl.follow(out, seconds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Program tinyQV firmware on a pico-ice and run it")
+    parser.add_argument("image", help="firmware binary for the QSPI PMOD's flash")
+    parser.add_argument("--port", default="/dev/ttyACM0", help="the pico's serial port")
+    parser.add_argument("--compress", action="store_true", help="deflate sectors before sending them")
+    parser.add_argument("--full", action="store_true", help="program every sector, even if unchanged")
+    parser.add_argument("--no-run", action="store_true", help="only program the flash")
+    parser.add_argument("--tail", type=float, help="seconds to tail the UART for, rather than until Ctrl-C")
+    args = parser.parse_args(argv)
+
+    with open(args.image, "rb") as f:
+        image = f.read()
+
+    port = Port(args.port)
+    try:
+        repl = RawRepl(port)
+        deploy(repl, image, args.compress, args.full)
+        if not args.no_run:
+            run(repl, args.tail)
+        repl.close()
+    finally:
+        port.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,164 @@
+import binascii
+import io
+import select
+import struct
+import sys
 import time
 import machine
+import micropython
 from machine import SPI, Pin
 
-def program(filename):
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+CMD_WRITE = 0x02
+CMD_READ = 0x03
+CMD_READ_SR1 = 0x05
+CMD_WEN = 0x06
+CMD_SECTOR_ERASE = 0x20
+CMD_BLOCK_ERASE_32K = 0x52
+CMD_BLOCK_ERASE_64K = 0xD8
+CMD_ID  = 0x90
+CMD_LEAVE_CM = 0xFF
+
+SECTOR_SIZE = 4096
+PAGE_SIZE = 256
+
+# The longest a sector sent by the host can be: zlib's compressBound, the
+# most a sector that doesn't compress grows by
+MAX_SECTOR_LENGTH = SECTOR_SIZE + (SECTOR_SIZE >> 12) + (SECTOR_SIZE >> 14) + (SECTOR_SIZE >> 25) + 13
+
+def flash_cmd(spi, sel, data, dummy_len=0, read_len=0):
+    dummy_buf = bytearray(dummy_len)
+    read_buf = bytearray(read_len)
+
+    sel.off()
+    spi.write(bytearray(data))
+    if dummy_len > 0:
+        spi.readinto(dummy_buf)
+    if read_len > 0:
+        spi.readinto(read_buf)
+    sel.on()
+
+    return read_buf
+
+def flash_cmd2(spi, sel, data, data2):
+    sel.off()
+    spi.write(bytearray(data))
+    spi.write(data2)
+    sel.on()
+
+def print_bytes(data):
+    for b in data: print("%02x " % (b,), end="")
+    print()
+
+# Wait for an erase or program to finish.  A page program takes under a
+# millisecond, so is polled without sleeping.  An erase takes tens to hundreds
+# of milliseconds, so the poll backs off, doubling the sleep up to max_sleep.
+def wait_busy(spi, sel, max_sleep=0):
+    sleep = max_sleep / 64
+    while flash_cmd(spi, sel, [CMD_READ_SR1], 0, 1)[0] & 1:
+        if max_sleep:
+            time.sleep(sleep)
+            sleep = min(sleep * 2, max_sleep)
+
+def read_flash(spi, sel, addr, length):
+    return flash_cmd(spi, sel, [CMD_READ, addr >> 16, (addr >> 8) & 0xFF, addr & 0xFF], 0, length)
+
+# Check the flash at addr reads back as data.  The buffers are compared whole,
+# and only scanned a byte at a time to report the first difference.
+def verify_flash(spi, sel, addr, data):
+    data_from_flash = read_flash(spi, sel, addr, len(data))
+    if data_from_flash != data:
+        for j in range(len(data)):
+            if data[j] != data_from_flash[j]:
+                raise Exception(f"Error at {addr + j:06x}: {data[j]} != {data_from_flash[j]}")
+
+# Erase the sectors, with the erases from plan_erases
+def erase_sectors(spi, sel, sectors):
+    for cmd, addr in plan_erases(sectors):
+        flash_cmd(spi, sel, [CMD_WEN])
+        flash_cmd(spi, sel, [cmd, addr >> 16, (addr >> 8) & 0xFF, 0])
+        wait_busy(spi, sel, 0.01)
+        print("*", end="")
+
+# Program data at addr a page at a time, returning with the last page still
+# programming
+def program_pages(spi, sel, addr, data):
+    for j in range(0, len(data), PAGE_SIZE):
+        if j:
+            wait_busy(spi, sel)
+        flash_cmd(spi, sel, [CMD_WEN])
+        flash_cmd2(spi, sel, [CMD_WRITE, addr >> 16, ((addr + j) >> 8) & 0xFF, 0], data[j:j+PAGE_SIZE])
+
+# The erases covering a sorted list of sectors: a 64KB or 32KB block erase
+# where every sector of the block is in the list, otherwise sector erases.
+# Returns (command, address) pairs.
+def plan_erases(sectors):
+    wanted = set(sectors)
+    erases = []
+    i = 0
+    while i < len(sectors):
+        sector = sectors[i]
+        for cmd, count in ((CMD_BLOCK_ERASE_64K, 16), (CMD_BLOCK_ERASE_32K, 8), (CMD_SECTOR_ERASE, 1)):
+            if sector % count == 0 and all(s in wanted for s in range(sector, sector + count)):
+                break
+        erases.append((cmd, sector * SECTOR_SIZE))
+        i += count
+    return erases
+
+# Program the file to the flash, then check each sector programmed reads back.
+# With diff set each 4KB sector is read first, and only erased and programmed
+# if it differs from the file, so reflashing after a small change only writes
+# the sectors that changed.  Runs of changed sectors are erased with block
+# erases where they can be, and the next sector is read from the file while
+# the last page of the previous one programs.  Returns the number of sectors
+# programmed and skipped.
+def program_flash(spi, sel, filename, diff=True):
+    buf = bytearray(SECTOR_SIZE)
+    next_buf = bytearray(SECTOR_SIZE)
+    with open(filename, "rb") as f:
+        sectors = []
+        sector = 0
+        while True:
+            num_bytes = f.readinto(buf)
+            if num_bytes == 0:
+                break
+            if not diff or read_flash(spi, sel, sector * SECTOR_SIZE, num_bytes) != buf[:num_bytes]:
+                sectors.append(sector)
+            sector += 1
+        skipped = sector - len(sectors)
+
+        erase_sectors(spi, sel, sectors)
+
+        if sectors:
+            f.seek(sectors[0] * SECTOR_SIZE)
+            num_bytes = f.readinto(buf)
+        for i, sector in enumerate(sectors):
+            addr = sector * SECTOR_SIZE
+            program_pages(spi, sel, addr, memoryview(buf)[:num_bytes])
+
+            if i + 1 < len(sectors):
+                if sectors[i + 1] != sector + 1:
+                    f.seek(sectors[i + 1] * SECTOR_SIZE)
+                next_bytes = f.readinto(next_buf)
+            wait_busy(spi, sel)
+
+            verify_flash(spi, sel, addr, buf[:num_bytes])
+            print(".", end="")
+
+            if i + 1 < len(sectors):
+                buf, next_buf, num_bytes = next_buf, buf, next_bytes
+
+    print()
+    print(f"Program done, {len(sectors)} sectors programmed, {skipped} unchanged")
+    return len(sectors), skipped
+
+# The pins and SPI for the PMOD's flash, with the iCE40 held in reset so it
+# leaves the bus alone.  Returns the SPI and the flash select.
+def setup():
     for i in range(30):
         Pin(i, Pin.IN, pull=None)
 
@@ -13,93 +169,90 @@ def program(filename):
     spi = SPI(0, 35_000_000, sck=Pin(2), mosi=Pin(3), miso=Pin(0))
 
     flash_sel = Pin(1, Pin.OUT)
-    ram_a_sel = Pin(6, Pin.OUT)
-    ram_b_sel = Pin(7, Pin.OUT)
+    ram_a_sel = Pin(4, Pin.OUT)
+    ram_b_sel = Pin(6, Pin.OUT)
+    qspi_sd3 = Pin(7, Pin.OUT)
 
     flash_sel.on()
     ram_a_sel.on()
     ram_b_sel.on()
+    qspi_sd3.on()
+
+    flash_cmd(spi, flash_sel, [CMD_LEAVE_CM])
+    return spi, flash_sel
 
-    def flash_cmd(data, dummy_len=0, read_len=0):
-        dummy_buf = bytearray(dummy_len)
-        read_buf = bytearray(read_len)
-        
-        flash_sel.off()
-        spi.write(bytearray(data))
-        if dummy_len > 0:
-            spi.readinto(dummy_buf)
-        if read_len > 0:
-            spi.readinto(read_buf)
-        flash_sel.on()
-        
-        return read_buf
-
-    def flash_cmd2(data, data2):
-        flash_sel.off()
-        spi.write(bytearray(data))
-        spi.write(data2)
-        flash_sel.on()
-
-    def print_bytes(data):
-        for b in data: print("%02x " % (b,), end="")
-        print()
-
-    CMD_WRITE = 0x02
-    CMD_READ = 0x03
-    CMD_READ_SR1 = 0x05
-    CMD_WEN = 0x06
-    CMD_SECTOR_ERASE = 0x20
-    CMD_ID  = 0x90
-    CMD_LEAVE_CM = 0xFF
-
-    flash_cmd([CMD_LEAVE_CM])
-    id = flash_cmd([CMD_ID], 2, 3)
+def program(filename, diff=True):
+    spi, flash_sel = setup()
+    id = flash_cmd(spi, flash_sel, [CMD_ID], 2, 3)
     print_bytes(id)
 
-    with open(filename, "rb") as f:
-    #if False:
-        buf = bytearray(4096)
-        sector = 0
-        while True:
-            num_bytes = f.readinto(buf)
-            #print_bytes(buf[:512])
-            if num_bytes == 0:
-                break
-            
-            flash_cmd([CMD_WEN])
-            flash_cmd([CMD_SECTOR_ERASE, sector >> 4, (sector & 0xF) << 4, 0])
+    result = program_flash(spi, flash_sel, filename, diff)
 
-            while flash_cmd([CMD_READ_SR1], 0, 1)[0] & 1:
-                print("*", end="")
-                time.sleep(0.01)
-            print(".", end="")
+    data_from_flash = read_flash(spi, flash_sel, 0, 16)
+    print_bytes(data_from_flash)
+    return result
 
-            for i in range(0, num_bytes, 256):
-                flash_cmd([CMD_WEN])
-                flash_cmd2([CMD_WRITE, sector >> 4, ((sector & 0xF) << 4) + (i >> 8), 0], buf[i:min(i+256, num_bytes)])
+###### Streaming from the host ######
 
-                while flash_cmd([CMD_READ_SR1], 0, 1)[0] & 1:
-                    print("-", end="")
-                    time.sleep(0.01)
-            print(".")
-            sector += 1
-            
-        print("Program done")
+# deploy.py on the host drives these over the raw REPL, so an image is
+# programmed without first being copied to the pico's filesystem.
 
-    with open(filename, "rb") as f:
-        data = bytearray(256)
-        i = 0
-        while True:
-            num_bytes = f.readinto(data)
-            if num_bytes == 0:
-                break
-            
-            data_from_flash = flash_cmd([CMD_READ, i >> 8, i & 0xFF, 0], 0, num_bytes)
-            for j in range(num_bytes):
-                if data[j] != data_from_flash[j]:
-                    raise Exception(f"Error at {i:02x}:{j:02x}: {data[j]} != {data_from_flash[j]}")
-            i += 1
-
-    print("Verify done")
-    data_from_flash = flash_cmd([CMD_READ, 0, 0, 0], 0, 16)
-    print_bytes(data_from_flash)
+# Print the CRC32 of each sector of the first length bytes of the flash, so
+# the host only sends the sectors that differ
+def sector_crcs(length):
+    spi, sel = setup()
+    for addr in range(0, length, SECTOR_SIZE):
+        print("%08x" % binascii.crc32(read_flash(spi, sel, addr, min(SECTOR_SIZE, length - addr))))
+
+# With deflate on MicroPython 1.21 and later, and zlib before
+def decompress(data):
+    if deflate:
+        return deflate.DeflateIO(io.BytesIO(data), deflate.ZLIB).read()
+    import zlib
+    return zlib.decompress(data)
+
+# Throw away the rest of a sector whose length can't be trusted, until nothing
+# has arrived for 50ms, so the host's resend is read from its start
+def discard_input(stdin):
+    poll = select.poll()
+    poll.register(sys.stdin, select.POLLIN)
+    while poll.poll(50):
+        stdin.read(1)
+
+# Program the sectors from data sent on stdin.  Ctrl-C is disabled while
+# receiving, as the data is binary, and "R" sent when it is, for the host to
+# start sending while the sectors are erased.  Each sector comes as its length
+# and CRC32, little endian 32 bit, then the data, zlib compressed if
+# compressed is set.  It is acknowledged with "A" as soon as the CRC matches,
+# so the host sends the next sector while this one programs, or with "N" to
+# have it sent again, which is also the reply to a length longer than
+# MAX_SECTOR_LENGTH, before reading any of the data.
+def receive(sectors, compressed=False):
+    spi, sel = setup()
+    stdin = sys.stdin.buffer
+    micropython.kbd_intr(-1)
+    try:
+        sys.stdout.write("R")
+        erase_sectors(spi, sel, sectors)
+
+        for sector in sectors:
+            while True:
+                length, crc = struct.unpack("<II", stdin.read(8))
+                if length > MAX_SECTOR_LENGTH:
+                    discard_input(stdin)
+                    sys.stdout.write("N")
+                    continue
+                data = stdin.read(length)
+                if binascii.crc32(data) == crc:
+                    break
+                sys.stdout.write("N")
+            sys.stdout.write("A")
+
+            if compressed:
+                data = decompress(data)
+            addr = sector * SECTOR_SIZE
+            program_pages(spi, sel, addr, memoryview(data))
+            wait_busy(spi, sel)
+            verify_flash(spi, sel, addr, data)
+    finally:
+        micropython.kbd_intr(3)
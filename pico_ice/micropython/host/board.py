@@ -0,0 +1,242 @@
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "test"))
+from qspi_devices import W25Q128, APS6404L
+
+# A model of the pico-ice for running the MicroPython scripts in the directory
+# above on Linux, behind the machine, rp2 and utime stand-ins here.  It has
+# the RP2040's pins, with the QSPI PMOD's flash and PSRAMs on SPI0 (sck on
+# GPIO 2, selects on GPIO 1, 4 and 6 as run_tinyqv.py has them), the iCE40's
+# configuration flash on SPI1 (sck on GPIO 10) and the iCE40's configuration
+# port.  The memories are the device models from test/qspi_devices.py,
+# clocked a bit at a time.
+#
+#   board = reset()                      # a new board, used by machine.Pin etc
+#   board.ice_flash.memory.write(0, bitstream)
+#   runpy.run_path("fpga_flash_prog.py")
+#   board.commands["ice_flash"][0x20]    # sector erases sent to the flash
+#
+# Accessing a bus the iCE40 is driving is an error: the PMOD when it is out of
+# reset and configured (the design uses the PMOD), and its configuration
+# flash while it is out of reset and not being configured by the RP2040.
+# Every device selected sees a transfer, and more than one of them driving
+# the data back is an error too, as is making one of the PMOD's pins an
+# output while the design is running and out of reset (rst_n on GPIO 12).
+
+PMOD_PINS = range(8)
+PMOD_SCK = 2
+DESIGN_RST_N = 12
+ICE_SCK = 10
+ICE_SI = 8
+ICE_SSN = 17
+ICE_DONE = 26
+ICE_CRESET = 27
+
+class BusConflict(Exception):
+    pass
+
+# A device on an SPI bus, selected by a pin, with the commands sent to it
+# (the first byte after each select) counted
+class SpiDevice:
+    def __init__(self, name, model, commands):
+        self.name = name
+        self.model = model
+        self.commands = commands
+        self.txn = None
+
+    def select(self):
+        self.txn = self.model.select()
+        self.out = next(self.txn)
+        self.first = True
+
+    def deselect(self):
+        self.txn.close()
+        self.txn = None
+
+    # Data goes out on IO0 and comes back on IO1, a bit per SPI clock.  The
+    # level the device is driving on IO1, if it is driving it.
+    def driving(self):
+        return None if self.out is None else (self.out >> 1) & 1
+
+    def clock(self, bit):
+        self.out = self.txn.send(bit)
+
+    # Transfer bytes, with only this device selected
+    def transfer(self, data):
+        result = bytearray()
+        send = self.txn.send
+        for byte in data:
+            value = 0
+            for bit in range(7, -1, -1):
+                value = (value << 1) | (((self.out or 0) >> 1) & 1)
+                self.out = send((byte >> bit) & 1)
+            self.started(byte)
+            result.append(value)
+        return bytes(result)
+
+    def started(self, byte):
+        if self.first:
+            self.commands[byte] += 1
+            self.first = False
+
+# The iCE40's configuration.  When CRESET_B rises with SPI_SS low, the
+# RP2040 sends the bitstream on SPI_SCK and SPI_SI, and CDONE rises after
+# at least 49 more clocks once the bitstream is complete: it has the
+# preamble and finishes with the wakeup command.  With SPI_SS high the
+# iCE40 configures itself from its flash.
+class Ice40:
+    PREAMBLE = bytes([0x7E, 0xAA, 0x99, 0x7E])
+    WAKEUP = bytes([0x01, 0x06])
+
+    def __init__(self, board):
+        self.board = board
+        self.state = "reset"
+        self.done = False
+        self.bitstream = None
+
+    # A bitstream that would configure the iCE40, ignoring the padding
+    # icepack leaves at the end and the erased flash after it
+    @classmethod
+    def valid(cls, data):
+        data = bytes(data).rstrip(b"\0\xff")
+        return cls.PREAMBLE in data[:32] and data.endswith(cls.WAKEUP)
+
+    def pin_changed(self, pin, level):
+        if pin == ICE_CRESET:
+            if not level:
+                self.state, self.done = "reset", False
+            elif self.board.level(ICE_SSN) == 0:
+                self.state, self.received, self.byte, self.bits, self.clocks = "slave", bytearray(), 0, 0, 0
+            else:
+                image = self.board.ice_flash.memory.read(0, 0x20000)
+                self.state, self.done = "master", self.valid(image)
+                self.bitstream = bytes(image) if self.done else None
+        elif pin == ICE_SCK and level and self.state == "slave" and not self.done:
+            self.clock(self.board.level(ICE_SI))
+
+    # A rising SPI_SCK, with the bit on SPI_SI
+    def clock(self, bit):
+        if self.board.level(ICE_SSN) == 0:
+            self.byte = ((self.byte << 1) | bit) & 0xFF
+            self.bits += 1
+            if self.bits == 8:
+                self.received.append(self.byte)
+                self.bits = 0
+        elif self.valid(self.received):
+            self.clocks += 1
+            if self.clocks >= 49:
+                self.done = True
+                self.bitstream = bytes(self.received)
+
+class Board:
+    def __init__(self, pmod_flash=None, ice_flash=None):
+        self.modes = {}
+        self.pulls = {}
+        self.outputs = {}
+        self.levels = {}
+        self.pmod_flash = pmod_flash or W25Q128(continuous=False)
+        self.ram_a = APS6404L(qpi=False)
+        self.ram_b = APS6404L(qpi=False)
+        self.ice_flash = ice_flash or W25Q128(continuous=False)
+        self.ice40 = Ice40(self)
+        self.uart = bytearray()             # sent by the design, for machine.UART
+        self.commands = {name: Counter() for name in ("pmod_flash", "ram_a", "ram_b", "ice_flash")}
+        self.buses = {
+            PMOD_SCK: {1: SpiDevice("pmod_flash", self.pmod_flash, self.commands["pmod_flash"]),
+                       4: SpiDevice("ram_a", self.ram_a, self.commands["ram_a"]),
+                       6: SpiDevice("ram_b", self.ram_b, self.commands["ram_b"])},
+            ICE_SCK: {9: SpiDevice("ice_flash", self.ice_flash, self.commands["ice_flash"])},
+        }
+
+    ###### Pins ######
+
+    def set_mode(self, pin, mode, pull):
+        if mode == "out" and pin in PMOD_PINS and self.design_running():
+            raise BusConflict("GPIO {} made an output while the design is using the PMOD".format(pin))
+        self.modes[pin] = mode
+        self.pulls[pin] = pull
+        self._changed(pin)
+
+    def drive(self, pin, value):
+        self.outputs[pin] = 1 if value else 0
+        self._changed(pin)
+
+    # The level on a pin, as driven by the RP2040, the iCE40 or a pull
+    def level(self, pin):
+        if self.modes.get(pin) == "out":
+            return self.outputs.get(pin, 0)
+        if pin == ICE_DONE:
+            return int(self.ice40.done)
+        return 1 if self.pulls.get(pin) == "up" else 0
+
+    # Configured, and out of reset so it drives the PMOD
+    def design_running(self):
+        return self.ice40.state != "reset" and self.ice40.done and self.level(DESIGN_RST_N) == 1
+
+    # Tell the iCE40 about edges, and end transfers when a select rises
+    def _changed(self, pin):
+        level = self.level(pin)
+        if self.levels.get(pin) != level:
+            self.levels[pin] = level
+            self.ice40.pin_changed(pin, level)
+            self.end_transfers()
+
+    ###### SPI ######
+
+    # The devices selected on the bus with this SCK pin
+    def selected(self, sck):
+        devices = [device for pin, device in self.buses.get(sck, {}).items() if self.level(pin) == 0]
+        for device in devices:
+            self._check_bus(sck, device)
+        return devices
+
+    def _check_bus(self, sck, device):
+        ice40 = self.ice40
+        if sck == PMOD_SCK and ice40.state != "reset" and ice40.done:
+            raise BusConflict("{} accessed while the iCE40 design is running".format(device.name))
+        if sck == ICE_SCK and ice40.state not in ("reset", "slave"):
+            raise BusConflict("{} accessed while the iCE40 is out of reset".format(device.name))
+
+    # Transfer bytes on the bus, returning the bytes read
+    def transfer(self, sck, data):
+        devices = self.selected(sck)
+        for device in devices:
+            if device.txn is None:
+                device.select()
+        if len(devices) == 1:
+            return devices[0].transfer(data)
+        result = bytearray()
+        for byte in data:
+            value = 0
+            for bit in range(7, -1, -1):
+                driving = [device for device in devices if device.driving() is not None]
+                if len(driving) > 1:
+                    raise BusConflict("Both {} driving the bus".format(" and ".join(d.name for d in driving)))
+                value = (value << 1) | (driving[0].driving() if driving else 0)
+                for device in devices:
+                    device.clock((byte >> bit) & 1)
+            for device in devices:
+                device.started(byte)
+            result.append(value)
+        return bytes(result)
+
+    # Deselect anything that was selected when a select pin rises
+    def end_transfers(self):
+        for devices in self.buses.values():
+            for pin, device in devices.items():
+                if device.txn is not None and self.level(pin) == 1:
+                    device.deselect()
+
+_board = None
+
+def reset(**kwargs):
+    global _board
+    _board = Board(**kwargs)
+    return _board
+
+def current():
+    if _board is None:
+        reset()
+    return _board
@@ -0,0 +1,126 @@
+import board
+
+# A stand-in for MicroPython's machine module on the RP2040, with the pins and
+# SPI buses of the current board model (see board.py).  Only what the scripts
+# in the directory above use is here.
+
+def freq(hz=None):
+    return 125_000_000 if hz is None else None
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        b = board.current()
+        if value is not None:
+            b.outputs[self.id] = 1 if value else 0
+        if mode != -1 or pull != -1:
+            mode = b.modes.get(self.id) if mode == -1 else ("out" if mode == Pin.OUT else "in")
+            pull = b.pulls.get(self.id) if pull == -1 else ("up" if pull == Pin.PULL_UP else None)
+            b.set_mode(self.id, mode, pull)
+
+    def value(self, x=None):
+        b = board.current()
+        if x is None:
+            return b.level(self.id)
+        b.drive(self.id, x)
+
+    def __call__(self, x=None):
+        return self.value(x)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def low(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+# The bus is identified by its SCK pin, data goes out on mosi and comes back
+# on miso
+class SPI:
+    def __init__(self, id, baudrate=1_000_000, *, polarity=0, phase=0, bits=8, firstbit=0, sck=None, mosi=None, miso=None):
+        self.id = id
+        self.baudrate = baudrate
+        self.sck = sck.id if sck is not None else (18 if id == 0 else 10)
+
+    def write(self, buf):
+        board.current().transfer(self.sck, bytes(buf))
+
+    def read(self, nbytes, write=0x00):
+        return board.current().transfer(self.sck, bytes([write]) * nbytes)
+
+    def readinto(self, buf, write=0x00):
+        buf[:] = board.current().transfer(self.sck, bytes([write]) * len(buf))
+
+    def write_readinto(self, write_buf, read_buf):
+        read_buf[:] = board.current().transfer(self.sck, bytes(write_buf))
+
+# Receives what the design sends, from the board's uart buffer.  Its pins are
+# claimed as the RP2040 does, TX as an output idling high, and default to
+# the first ones the UART can use.
+class UART:
+    PINS = {0: ((0, 12, 16, 28), (1, 13, 17, 29)),
+            1: ((4, 8, 20, 24), (5, 9, 21, 25))}
+
+    def __init__(self, id, baudrate=115200, *, tx=None, rx=None, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        tx_pins, rx_pins = self.PINS[id]
+        self.tx = tx.id if tx is not None else tx_pins[0]
+        self.rx = rx.id if rx is not None else rx_pins[0]
+        if self.tx not in tx_pins:
+            raise ValueError("bad TX pin")
+        if self.rx not in rx_pins:
+            raise ValueError("bad RX pin")
+        b = board.current()
+        b.outputs[self.tx] = 1
+        b.set_mode(self.tx, "out", None)
+        b.set_mode(self.rx, "in", b.pulls.get(self.rx))
+
+    def any(self):
+        return len(board.current().uart)
+
+    def read(self, nbytes=None):
+        uart = board.current().uart
+        if not uart:
+            return None
+        nbytes = len(uart) if nbytes is None else nbytes
+        data = bytes(uart[:nbytes])
+        del uart[:nbytes]
+        return data
+
+    def write(self, buf):
+        return len(buf)
+
+# Drives the pin as an output, with no notion of time
+class PWM:
+    def __init__(self, dest, *, freq=None, duty_u16=None):
+        self.pin = dest.id
+        self._freq = freq
+        self._duty_u16 = duty_u16
+        board.current().set_mode(self.pin, "out", None)
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty_u16
+        self._duty_u16 = value
+
+    def deinit(self):
+        pass
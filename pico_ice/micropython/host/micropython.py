@@ -0,0 +1,11 @@
+# A stand-in for MicroPython's micropython module.  pico.py interrupts the
+# running code when it receives kbd_intr_char, -1 for never.
+
+kbd_intr_char = 3
+
+def kbd_intr(chr):
+    global kbd_intr_char
+    kbd_intr_char = chr
+
+def const(expr):
+    return expr
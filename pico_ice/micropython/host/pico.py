@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import os
+import queue
+import select
+import signal
+import sys
+import threading
+import time
+import traceback
+import tty
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HOST, os.path.dirname(HOST)]
+
+import board
+import micropython
+import utime
+
+# A stand-in for a pico-ice running MicroPython, for testing deploy.py without
+# a board: a pseudo-terminal with MicroPython's friendly and raw REPLs,
+# running code against the board model (see board.py) with the scripts in the
+# directory above and the stand-ins here.  It prints the path of the terminal,
+# then serves it until killed.
+#
+#   ./pico.py --uart "Hello"                 the design sends Hello on the UART
+#
+# The iCE40's flash has a minimal bitstream, so run_tinyqv.run() finds the
+# design starts.  Code is run in the main thread, with the terminal as stdin
+# and stdout, and Ctrl-C interrupts it as SIGINT, unless disabled with
+# micropython.kbd_intr().
+
+BANNER = b"MicroPython stand-in; pico-ice model with RP2040\r\n"
+RAW_BANNER = b"raw REPL; CTRL-B to exit\r\n>"
+
+# MicroPython's time has utime's functions
+for name in ("sleep_ms", "sleep_us", "ticks_ms", "ticks_us", "ticks_add", "ticks_diff"):
+    setattr(time, name, getattr(utime, name))
+
+class Output(io.RawIOBase):
+    def __init__(self, pico):
+        self.pico = pico
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pico.write(bytes(data))
+        return len(data)
+
+# stdin, and its buffer, reading exactly the bytes asked for
+class Input:
+    def __init__(self, pico):
+        self.pico = pico
+        self.buffer = self
+
+    def read(self, n=1):
+        return bytes(self.pico.read() for _ in range(n))
+
+# MicroPython's select.poll, on stdin, with the timeout in milliseconds
+class Poll:
+    def register(self, stream, eventmask=select.POLLIN):
+        self.stream = stream
+
+    def poll(self, timeout=-1):
+        if self.stream.pico.wait(None if timeout < 0 else timeout / 1000):
+            return [(self.stream, select.POLLIN)]
+        return []
+
+select.poll = Poll
+
+class Pico:
+    def __init__(self, fd):
+        self.fd = fd
+        self.input = queue.Queue()
+        self.pending = None
+        self.running = False
+        self.globals = {"__name__": "__main__"}
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def _receive(self):
+        while True:
+            for byte in os.read(self.fd, 4096):
+                if self.running and byte == micropython.kbd_intr_char:
+                    os.kill(os.getpid(), signal.SIGINT)
+                else:
+                    self.input.put(byte)
+
+    def read(self):
+        if self.pending is not None:
+            byte, self.pending = self.pending, None
+            return byte
+        return self.input.get()
+
+    # Wait up to timeout seconds for a byte, leaving it to be read
+    def wait(self, timeout):
+        if self.pending is None:
+            try:
+                self.pending = self.input.get(timeout=timeout)
+            except queue.Empty:
+                return False
+        return True
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def serve(self):
+        self.write(BANNER + b">>> ")
+        while True:
+            try:
+                self._friendly()
+            except KeyboardInterrupt:
+                pass
+
+    # The friendly REPL only echoes, until Ctrl-A enters the raw REPL
+    def _friendly(self):
+        while True:
+            c = self.read()
+            if c == 1:
+                self._raw()
+            elif c == 3:
+                self.write(b"\r\n>>> ")
+            elif c == 4:
+                self.write(b"\r\nMPY: soft reboot\r\n" + BANNER + b">>> ")
+            else:
+                self.write(bytes([c]))
+
+    def _raw(self):
+        self.write(RAW_BANNER)
+        code = bytearray()
+        while True:
+            c = self.read()
+            if c == 1:
+                code.clear()
+                self.write(RAW_BANNER)
+            elif c == 2:
+                self.write(b"\r\n" + BANNER + b">>> ")
+                return
+            elif c == 3:
+                code.clear()
+            elif c == 4 and not code:
+                self.globals = {"__name__": "__main__"}
+                self.write(b"OK\r\nMPY: soft reboot\r\n" + RAW_BANNER)
+            elif c == 4:
+                self.write(b"OK")
+                error = self._execute(bytes(code))
+                self.write(b"\x04" + error + b"\x04>")
+                code.clear()
+            else:
+                code.append(c)
+
+    # Run code, returning the traceback if it raises
+    def _execute(self, code):
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin = Input(self)
+        sys.stdout = io.TextIOWrapper(Output(self), newline="\r\n", write_through=True)
+        self.running = True
+        try:
+            exec(compile(code, "<stdin>", "exec"), self.globals)
+            return b""
+        except BaseException:
+            return traceback.format_exc().replace("\n", "\r\n").encode()
+        finally:
+            self.running = False
+            micropython.kbd_intr(3)
+            sys.stdout.flush()
+            sys.stdin, sys.stdout = stdin, stdout
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand in for a pico-ice running MicroPython, on a pseudo-terminal")
+    parser.add_argument("--uart", default="", help="text the design sends on the UART")
+    args = parser.parse_args()
+
+    b = board.reset()
+    b.ice_flash.memory.write(0, board.Ice40.PREAMBLE + board.Ice40.WAKEUP)
+    b.uart.extend(args.uart.encode())
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print(os.ttyname(slave), flush=True)
+    Pico(master).serve()
+
+if __name__ == "__main__":
+    main()
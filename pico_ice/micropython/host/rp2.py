@@ -0,0 +1,315 @@
+import types
+
+import board
+
+# A stand-in for MicroPython's rp2 module, with PIO state machines that drive
+# the pins of the current board model (see board.py).  Programs are assembled
+# as MicroPython does, by running the decorated function with the instructions
+# as globals, and run an instruction at a time, with no notion of time: put()
+# runs the state machine until it stalls, and get() until there is something
+# to get.  out, in_, set, nop, jmp, pull and push are supported, with side-set
+# and autopull/autopush; other instructions assemble, but raise
+# NotImplementedError if they are run.  DMA channels complete as soon as they
+# are configured, transferring nothing.
+
+class PIO:
+    IN_LOW = 0
+    IN_HIGH = 1
+    OUT_LOW = 2
+    OUT_HIGH = 3
+
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+class Instruction:
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+        self.sideset = None
+
+    def side(self, value):
+        self.sideset = value
+        return self
+
+    # Delays are accepted and ignored
+    def __getitem__(self, delay):
+        return self
+
+class Program:
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.instructions = []
+        self.labels = {}
+        self.wrap_target = 0
+        self.wrap = None
+
+    def _emit(self, op):
+        def emit(*args):
+            instruction = Instruction(op, *args)
+            self.instructions.append(instruction)
+            return instruction
+        return emit
+
+    def _globals(self):
+        names = {name: name for name in ("pins", "x", "y", "null", "pindirs", "isr", "osr", "pc", "exec",
+                                         "x_dec", "y_dec", "not_x", "not_y", "x_not_y", "pin", "not_osre",
+                                         "gpio", "irq", "block", "noblock", "iffull", "ifempty", "status")}
+        for op in ("out", "in_", "set", "nop", "jmp", "pull", "push", "mov", "wait", "irq"):
+            names[op] = self._emit(op)
+        names["label"] = lambda name: self.labels.__setitem__(name, len(self.instructions))
+        names["wrap_target"] = lambda: setattr(self, "wrap_target", len(self.instructions))
+        names["wrap"] = lambda: setattr(self, "wrap", len(self.instructions) - 1)
+        return names
+
+def asm_pio(**options):
+    def assemble(fn):
+        program = Program(fn.__name__, options)
+        types.FunctionType(fn.__code__, program._globals())()
+        if program.wrap is None:
+            program.wrap = len(program.instructions) - 1
+        return program
+    return assemble
+
+class StateMachine:
+    FIFO_DEPTH = 4
+    MAX_STEPS = 10_000_000
+
+    def __init__(self, id, program=None, freq=-1, **kwargs):
+        self.id = id
+        self.running = False
+        if program is not None:
+            self.init(program, freq, **kwargs)
+
+    def init(self, program, freq=-1, *, in_base=None, out_base=None, set_base=None, sideset_base=None, **kwargs):
+        self.program = program
+        self.freq = freq
+        options = dict(program.options, **kwargs)
+        self.in_base = in_base.id if in_base is not None else 0
+        self.out_base = out_base.id if out_base is not None else 0
+        self.set_base = set_base.id if set_base is not None else 0
+        self.sideset_base = sideset_base.id if sideset_base is not None else 0
+        self.out_left = options.get("out_shiftdir", PIO.SHIFT_LEFT) == PIO.SHIFT_LEFT
+        self.in_left = options.get("in_shiftdir", PIO.SHIFT_LEFT) == PIO.SHIFT_LEFT
+        self.autopull = options.get("autopull", False)
+        self.autopush = options.get("autopush", False)
+        self.pull_thresh = options.get("pull_thresh", 32)
+        self.push_thresh = options.get("push_thresh", 32)
+        self.sideset_count = len(self._tuple(options.get("sideset_init")))
+        for base, init in ((self.out_base, options.get("out_init")), (self.set_base, options.get("set_init")),
+                           (self.sideset_base, options.get("sideset_init"))):
+            for i, state in enumerate(self._tuple(init)):
+                self._init_pin(base + i, state)
+        self.restart()
+
+    @staticmethod
+    def _tuple(init):
+        if init is None:
+            return ()
+        return init if isinstance(init, tuple) else (init,)
+
+    def _init_pin(self, pin, state):
+        b = board.current()
+        b.outputs[pin] = 1 if state in (PIO.OUT_HIGH, PIO.IN_HIGH) else 0
+        b.set_mode(pin, "out" if state in (PIO.OUT_LOW, PIO.OUT_HIGH) else "in", None)
+
+    def restart(self):
+        self.pc = 0
+        self.x = self.y = 0
+        self.osr, self.osr_count = 0, 32
+        self.isr, self.isr_count = 0, 0
+        self.tx, self.rx = [], []
+
+    def active(self, value=None):
+        if value is None:
+            return int(self.running)
+        self.running = bool(value)
+        if self.running:
+            self._run()
+
+    def put(self, value, shift=0):
+        values = [value] if isinstance(value, int) else value
+        for value in values:
+            self.tx.append((value << shift) & 0xFFFFFFFF)
+            if self.running:
+                self._run()
+            assert len(self.tx) <= self.FIFO_DEPTH, "TX FIFO overflow with the state machine stopped"
+
+    def get(self, buf=None, shift=0):
+        if not self.rx and self.running:
+            self._run(until_rx=True)
+        assert self.rx, "get() would block forever"
+        return self.rx.pop(0) >> shift
+
+    # Instructions run with exec() are ignored
+    def exec(self, instruction):
+        pass
+
+    def tx_fifo(self):
+        return len(self.tx)
+
+    def rx_fifo(self):
+        return len(self.rx)
+
+    ###### Execution ######
+
+    def _pins(self, base, count, value):
+        b = board.current()
+        for i in range(count):
+            b.drive(base + i, (value >> i) & 1)
+
+    def _pindirs(self, base, count, value):
+        b = board.current()
+        for i in range(count):
+            b.set_mode(base + i, "out" if (value >> i) & 1 else "in", b.pulls.get(base + i))
+
+    def _shift_out(self, count):
+        count = count or 32
+        if self.out_left:
+            value = self.osr >> (32 - count)
+            self.osr = (self.osr << count) & 0xFFFFFFFF
+        else:
+            value = self.osr & ((1 << count) - 1)
+            self.osr >>= count
+        self.osr_count = min(self.osr_count + count, 32)
+        return value
+
+    def _shift_in(self, count, value):
+        count = count or 32
+        value &= (1 << count) - 1
+        if self.in_left:
+            self.isr = ((self.isr << count) | value) & 0xFFFFFFFF
+        else:
+            self.isr = (self.isr >> count) | (value << (32 - count)) if count < 32 else value
+        self.isr_count = min(self.isr_count + count, 32)
+
+    def _pull(self):
+        self.osr, self.osr_count = self.tx.pop(0), 0
+
+    def _push(self):
+        self.rx.append(self.isr)
+        self.isr, self.isr_count = 0, 0
+
+    # Run until the state machine stalls on the FIFOs, or has something to get
+    def _run(self, until_rx=False):
+        for _ in range(self.MAX_STEPS):
+            if until_rx and self.rx:
+                return
+            if not self._step():
+                return
+        raise RuntimeError("{} ran for {} instructions without stalling".format(self.program.name, self.MAX_STEPS))
+
+    # Execute the instruction at pc, returning False if it stalls
+    def _step(self):
+        instruction = self.program.instructions[self.pc]
+        if instruction.sideset is not None:
+            self._pins(self.sideset_base, self.sideset_count, instruction.sideset)
+        op, args = instruction.op, instruction.args
+        jump = None
+
+        if op == "out":
+            if self.autopull and self.osr_count >= self.pull_thresh:
+                if not self.tx:
+                    return False
+                self._pull()
+            dest, count = args
+            value = self._shift_out(count)
+            if dest == "pins":
+                self._pins(self.out_base, count, value)
+            elif dest == "pindirs":
+                self._pindirs(self.out_base, count, value)
+            elif dest in ("x", "y"):
+                setattr(self, dest, value)
+            elif dest == "pc":
+                jump = value
+            elif dest != "null":
+                raise NotImplementedError("out to {}".format(dest))
+        elif op == "in_":
+            if self.autopush and self.isr_count >= self.push_thresh:
+                if len(self.rx) >= self.FIFO_DEPTH:
+                    return False
+                self._push()
+            src, count = args
+            if src == "pins":
+                b = board.current()
+                value = sum(b.level(self.in_base + i) << i for i in range(count))
+            elif src in ("x", "y", "osr", "isr"):
+                value = getattr(self, src)
+            elif src == "null":
+                value = 0
+            else:
+                raise NotImplementedError("in_ from {}".format(src))
+            self._shift_in(count, value)
+            if self.autopush and self.isr_count >= self.push_thresh and len(self.rx) < self.FIFO_DEPTH:
+                self._push()
+        elif op == "set":
+            dest, value = args
+            if dest in ("x", "y"):
+                setattr(self, dest, value)
+            elif dest == "pins":
+                self._pins(self.set_base, len(self._tuple(self.program.options.get("set_init"))), value)
+            elif dest == "pindirs":
+                self._pindirs(self.set_base, len(self._tuple(self.program.options.get("set_init"))), value)
+            else:
+                raise NotImplementedError("set {}".format(dest))
+        elif op == "nop":
+            pass
+        elif op == "jmp":
+            cond, target = args if len(args) == 2 else (None, args[0])
+            taken = {None: lambda: True, "not_x": lambda: self.x == 0, "not_y": lambda: self.y == 0,
+                     "x_dec": lambda: self.x != 0, "y_dec": lambda: self.y != 0,
+                     "x_not_y": lambda: self.x != self.y, "not_osre": lambda: self.osr_count < self.pull_thresh}[cond]()
+            if cond == "x_dec":
+                self.x = (self.x - 1) & 0xFFFFFFFF
+            elif cond == "y_dec":
+                self.y = (self.y - 1) & 0xFFFFFFFF
+            if taken:
+                jump = self.program.labels[target] if isinstance(target, str) else target
+        elif op == "pull":
+            block = "noblock" not in args
+            if "ifempty" in args and self.osr_count < self.pull_thresh:
+                pass
+            elif self.tx:
+                self._pull()
+            elif block:
+                return False
+            else:
+                self.osr, self.osr_count = self.x, 0
+        elif op == "push":
+            block = "noblock" not in args
+            if "iffull" in args and self.isr_count < self.push_thresh:
+                pass
+            elif len(self.rx) < self.FIFO_DEPTH:
+                self._push()
+            elif block:
+                return False
+        else:
+            raise NotImplementedError(op)
+
+        if jump is not None:
+            self.pc = jump
+        elif self.pc == self.program.wrap:
+            self.pc = self.program.wrap_target
+        else:
+            self.pc += 1
+        return True
+
+class DMA:
+    def __init__(self):
+        self.registers = None
+
+    def pack_ctrl(self, default=None, **kwargs):
+        return kwargs
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        pass
+
+    def active(self, value=None):
+        return False
+
+    def close(self):
+        pass
@@ -0,0 +1,123 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HOST)))
+
+import deploy
+from test_flash_prog import image
+
+# Tests of deploy.py against the pico stand-in on a pseudo-terminal, run with
+#   cd pico_ice/micropython/host
+#   python -m pytest -q
+
+UART = "Hello from tinyQV\n"
+
+@pytest.fixture
+def pico():
+    process = subprocess.Popen([sys.executable, os.path.join(HOST, "pico.py"), "--uart", UART], stdout=subprocess.PIPE, text=True)
+    port = deploy.Port(process.stdout.readline().strip())
+    yield deploy.RawRepl(port)
+    port.close()
+    process.kill()
+    process.wait()
+
+def flash(repl, length):
+    return bytes.fromhex(repl.exec("import board\nprint(bytes(board.current().pmod_flash.read(0, {})).hex())".format(length)))
+
+def test_deploy(pico):
+    data = image(length=5 * 4096 - 100, seed=5)
+    out = io.StringIO()
+    assert deploy.deploy(pico, data, out=out) == (5, 0)
+    assert flash(pico, len(data)) == data
+    assert "5 sectors programmed, 0 unchanged" in out.getvalue()
+
+    # Only the changed sector is sent
+    changed = bytearray(data)
+    changed[3 * 4096 + 7] ^= 0x11
+    assert deploy.deploy(pico, bytes(changed), out=out) == (1, 4)
+    assert flash(pico, len(changed)) == changed
+    assert deploy.deploy(pico, bytes(changed), out=out) == (0, 5)
+
+def test_compressed(pico):
+    data = image(length=3 * 4096, seed=6)[:5000] + bytes(3 * 4096 - 5000)
+    out = io.StringIO()
+    assert deploy.deploy(pico, data, compressed=True, full=True, out=out) == (3, 0)
+    assert flash(pico, len(data)) == data
+    sent = int(out.getvalue().split(" bytes sent")[0].split()[-1])
+    assert sent < 6000
+
+# A sector damaged on the way is sent again
+def test_resend(pico, monkeypatch):
+    frame = deploy.frame
+    frames = []
+    def damaged(data):
+        frames.append(data)
+        sent = bytearray(frame(data))
+        if len(frames) == 2:
+            sent[100] ^= 1
+        return bytes(sent)
+    monkeypatch.setattr(deploy, "frame", damaged)
+    data = image(length=3 * 4096, seed=7)
+    assert deploy.deploy(pico, data, full=True, out=io.StringIO()) == (3, 0)
+    assert len(frames) == 4
+    assert flash(pico, len(data)) == data
+
+# A length past the longest a sector can be is refused before the data is
+# read, and the sector sent again
+def test_bad_length(pico, monkeypatch):
+    frame = deploy.frame
+    frames = []
+    def damaged(data):
+        frames.append(data)
+        sent = bytearray(frame(data))
+        if len(frames) == 2:
+            sent[2] = 0x10
+        return bytes(sent)
+    monkeypatch.setattr(deploy, "frame", damaged)
+    data = image(length=3 * 4096, seed=10)
+    assert deploy.deploy(pico, data, full=True, out=io.StringIO()) == (3, 0)
+    assert len(frames) == 4
+    assert flash(pico, len(data)) == data
+
+def test_verify_error(pico):
+    pico.exec("import board\nboard.current().pmod_flash.memory.write = lambda addr, data: None")
+    with pytest.raises(deploy.ReplError, match="Error at 000001: 0 != 255"):
+        deploy.deploy(pico, image(length=4096, seed=8), full=True, out=io.StringIO())
+
+    # The REPL is still usable
+    assert pico.exec("print(1 + 1)") == "2\n"
+
+def test_run(pico):
+    out = io.StringIO()
+    deploy.run(pico, 0.5, out=out)
+    assert out.getvalue().endswith(UART)
+    assert pico.exec("import board\nprint(board.current().ice40.done)") == "True\n"
+
+    # The UART stays off the PMOD, which the design is driving
+    with pytest.raises(deploy.ReplError, match="GPIO 0 made an output while the design is using the PMOD"):
+        pico.exec("import machine\nmachine.UART(0, tx=machine.Pin(0), rx=machine.Pin(1))")
+
+# With the UART jumper off nothing arrives, and tail_uart says so
+def test_tail_quiet(pico):
+    pico.exec("import board\nboard.current().uart[:] = b''")
+    out = io.StringIO()
+    pico.start("import run_tinyqv\nrun_tinyqv.tail_uart(quiet_ms=100)")
+    pico.follow(out, 0.5)
+    assert out.getvalue() == "Warning: nothing received on GPIO 21 in 100ms, is it connected to the iCE40's pin 4?\n"
+
+def test_main(pico, tmp_path, capsys):
+    data = image(length=2 * 4096, seed=9)
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(data)
+    deploy.main([str(path), "--port", os.ttyname(pico.port.fd), "--tail", "0.5"])
+    output = capsys.readouterr().out
+    assert "2 sectors programmed, 0 unchanged" in output
+    assert output.endswith(UART)
+
+    # main() leaves the raw REPL
+    assert flash(deploy.RawRepl(pico.port), len(data)) == data
@@ -0,0 +1,193 @@
+import os
+import random
+import runpy
+import sys
+import time
+
+import pytest
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.dirname(HOST)
+sys.path.insert(0, HOST)
+sys.path.insert(0, SCRIPTS)
+
+import board
+import flash_prog
+from qspi_devices import W25Q128
+
+# Tests of the flash programming scripts against the board model, run with
+#   cd pico_ice/micropython/host
+#   python -m pytest -q
+
+SECTOR = flash_prog.SECTOR_SIZE
+
+# A bitstream shaped image a few sectors long, ending part way through a sector
+def image(length=3 * SECTOR + 1000, seed=1):
+    rng = random.Random(seed)
+    data = bytearray(rng.randrange(256) for _ in range(length))
+    data[:8] = bytes([0xFF, 0x00, 0x00, 0xFF, 0x7E, 0xAA, 0x99, 0x7E])
+    data[-2:] = bytes([0x01, 0x06])
+    return bytes(data)
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+def write_image(tmp_path, data, name="firmware.bin"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_program(tmp_path):
+    b = board.reset()
+    data = image()
+    assert flash_prog.program(write_image(tmp_path, data)) == (4, 0)
+    assert b.pmod_flash.read(0, len(data)) == data
+    assert b.commands["pmod_flash"][flash_prog.CMD_SECTOR_ERASE] == 4
+
+# The PSRAMs' selects (GPIO 4 and 6) and SD3 (GPIO 7), which is the flash's
+# HOLD, are held high for every transfer, so only the flash is listening
+def test_program_pins(tmp_path):
+    b = board.reset()
+    levels = set()
+    transfer = b.transfer
+    def recording(sck, data):
+        if sck == board.PMOD_SCK:
+            levels.add(tuple(b.level(pin) for pin in (4, 6, 7)))
+        return transfer(sck, data)
+    b.transfer = recording
+
+    flash_prog.program(write_image(tmp_path, image()))
+    assert levels == {(1, 1, 1)}
+    assert not b.commands["ram_a"] and not b.commands["ram_b"]
+
+def test_reprogram_changed_sector(tmp_path):
+    b = board.reset()
+    data = image()
+    flash_prog.program(write_image(tmp_path, data))
+
+    changed = bytearray(data)
+    changed[2 * SECTOR + 10] ^= 0x5A
+    b.commands["pmod_flash"].clear()
+    assert flash_prog.program(write_image(tmp_path, changed)) == (1, 3)
+    assert b.pmod_flash.read(0, len(changed)) == changed
+    assert b.commands["pmod_flash"][flash_prog.CMD_SECTOR_ERASE] == 1
+    assert b.commands["pmod_flash"][flash_prog.CMD_WRITE] == SECTOR // flash_prog.PAGE_SIZE
+
+def test_reprogram_unchanged(tmp_path):
+    b = board.reset()
+    path = write_image(tmp_path, image())
+    flash_prog.program(path)
+    b.commands["pmod_flash"].clear()
+    assert flash_prog.program(path) == (0, 4)
+    assert b.commands["pmod_flash"][flash_prog.CMD_SECTOR_ERASE] == 0
+    assert b.commands["pmod_flash"][flash_prog.CMD_WRITE] == 0
+
+def test_no_diff(tmp_path):
+    b = board.reset()
+    path = write_image(tmp_path, image())
+    flash_prog.program(path)
+    assert flash_prog.program(path, diff=False) == (4, 0)
+    assert b.commands["pmod_flash"][flash_prog.CMD_SECTOR_ERASE] == 8
+
+def test_busy_flash(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    b = board.reset(pmod_flash=W25Q128(continuous=False, erase_busy=20, program_busy=3))
+    data = image()
+    flash_prog.program(write_image(tmp_path, data))
+    assert b.pmod_flash.read(0, len(data)) == data
+
+    # Erases back off up to 10ms, pages are polled without sleeping
+    assert len(sleeps) == 4 * 20
+    assert sleeps[:8] == [0.01 / 64 * 2 ** i for i in range(7)] + [0.01]
+
+# The next sector is read from the file while the last page is programmed
+def test_pipelined(tmp_path, monkeypatch):
+    b = board.reset(pmod_flash=W25Q128(continuous=False, program_busy=3))
+    busy = []
+    class File:
+        def __init__(self, f):
+            self.f = f
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            self.f.close()
+        def seek(self, offset):
+            self.f.seek(offset)
+        def readinto(self, buf):
+            busy.append(b.pmod_flash.busy)
+            return self.f.readinto(buf)
+    monkeypatch.setattr(flash_prog, "open", lambda *args: File(open(*args)), raising=False)
+    data = image()
+    flash_prog.program(write_image(tmp_path, data))
+    assert b.pmod_flash.read(0, len(data)) == data
+    assert busy == [0] * 5 + [0, 3, 3, 3]
+
+# A flash with a byte that erases to 0x00, so programming it fails
+class StuckByte(W25Q128):
+    def __init__(self, addr):
+        super().__init__(continuous=False)
+        self.stuck = addr
+
+    def erase(self, addr, size):
+        super().erase(addr, size)
+        self.memory.write(self.stuck, bytes(1))
+
+def test_verify_error(tmp_path):
+    b = board.reset(pmod_flash=StuckByte(2 * SECTOR + 0x345))
+    data = bytearray(image())
+    data[2 * SECTOR + 0x345] = 0xA5
+    with pytest.raises(Exception, match="Error at 002345: 165 != 0"):
+        flash_prog.program(write_image(tmp_path, data))
+
+def test_plan_erases():
+    D8, S52, S20 = flash_prog.CMD_BLOCK_ERASE_64K, flash_prog.CMD_BLOCK_ERASE_32K, flash_prog.CMD_SECTOR_ERASE
+    assert flash_prog.plan_erases(list(range(40))) == [(D8, 0), (D8, 0x10000), (S52, 0x20000)]
+    assert flash_prog.plan_erases(list(range(3, 20))) == (
+        [(S20, s * SECTOR) for s in range(3, 8)] + [(S52, 0x8000), (S20, 0x10000), (S20, 0x11000), (S20, 0x12000), (S20, 0x13000)])
+    assert flash_prog.plan_erases([0, 1, 2, 4, 5, 6, 7, 8]) == [(S20, s * SECTOR) for s in (0, 1, 2, 4, 5, 6, 7, 8)]
+    assert flash_prog.plan_erases([]) == []
+
+def test_block_erase(tmp_path):
+    b = board.reset()
+    b.pmod_flash.memory.write(0, bytes(0x40000))
+    data = image(length=50 * SECTOR - 100, seed=3)
+    assert flash_prog.program(write_image(tmp_path, data)) == (50, 0)
+    assert b.pmod_flash.read(0, len(data)) == data
+    assert b.pmod_flash.read(50 * SECTOR, 100) == bytes(100)
+    commands = b.commands["pmod_flash"]
+    assert (commands[flash_prog.CMD_BLOCK_ERASE_64K], commands[flash_prog.CMD_BLOCK_ERASE_32K], commands[flash_prog.CMD_SECTOR_ERASE]) == (3, 0, 2)
+
+    # Changing the first half of the second block erases it with a 32KB erase
+    changed = bytearray(data)
+    for sector in range(16, 24):
+        changed[sector * SECTOR] ^= 0xFF
+    commands.clear()
+    assert flash_prog.program(write_image(tmp_path, changed)) == (8, 42)
+    assert b.pmod_flash.read(0, len(changed)) == changed
+    assert (commands[flash_prog.CMD_BLOCK_ERASE_64K], commands[flash_prog.CMD_BLOCK_ERASE_32K], commands[flash_prog.CMD_SECTOR_ERASE]) == (0, 1, 0)
+
+def test_fpga_flash_prog(tmp_path, monkeypatch):
+    b = board.reset()
+    data = image(seed=2)
+    write_image(tmp_path, data, "tinyqv.bin")
+    monkeypatch.chdir(tmp_path)
+    runpy.run_path(os.path.join(SCRIPTS, "fpga_flash_prog.py"))
+    assert b.ice_flash.read(0, len(data)) == data
+
+    # The iCE40 configures itself from the new bitstream once out of reset
+    b.drive(board.ICE_CRESET, 1)
+    assert b.level(board.ICE_DONE) == 1
+    assert b.ice40.bitstream.rstrip(b"\xff").startswith(data)
+
+def test_bus_conflict(tmp_path):
+    b = board.reset()
+    b.ice_flash.memory.write(0, image(seed=2))
+    b.set_mode(board.ICE_SSN, "in", "up")
+    b.set_mode(board.ICE_CRESET, "out", None)
+    b.drive(board.ICE_CRESET, 1)
+    spi = flash_prog.SPI(1, 12_000_000, sck=flash_prog.Pin(10), mosi=flash_prog.Pin(11), miso=flash_prog.Pin(8))
+    sel = flash_prog.Pin(9, flash_prog.Pin.OUT)
+    with pytest.raises(board.BusConflict):
+        flash_prog.read_flash(spi, sel, 0, 16)
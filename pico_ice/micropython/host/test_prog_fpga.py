@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+
+import pytest
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.dirname(HOST)
+sys.path.insert(0, HOST)
+sys.path.insert(0, SCRIPTS)
+
+import board
+import machine
+import prog_fpga
+import rp2
+import utime
+from test_flash_prog import image
+
+# Tests of the iCE40 configuration loader against the board model, run with
+#   cd pico_ice/micropython/host
+#   python -m pytest -q
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+def test_program(tmp_path):
+    b = board.reset()
+    data = image(length=5000, seed=4) + bytes(100)
+    path = tmp_path / "fpga.bin"
+    path.write_bytes(data)
+    prog_fpga.program(str(path))
+    assert b.ice40.state == "slave"
+    assert b.ice40.done
+    assert b.ice40.bitstream == data
+
+    # The pins are released for the design
+    assert [b.modes[pin] for pin in (board.ICE_SCK, board.ICE_SI, board.ICE_SSN)] == ["in"] * 3
+    assert b.level(board.ICE_CRESET) == 1
+
+    # And the cached bitstream can be loaded again
+    prog_fpga.program(str(path))
+    assert b.ice40.done
+    assert b.ice40.bitstream == data
+
+def test_bad_bitstream(tmp_path):
+    board.reset()
+    data = bytearray(image(length=5000, seed=4))
+    data[-1] = 0
+    path = tmp_path / "fpga.bin"
+    path.write_bytes(data)
+    with pytest.raises(Exception, match="CDONE is low"):
+        prog_fpga.program(str(path))
+
+# The loader's PIO program, shifting bytes out MSB first with a rising
+# SPI_SCK for each bit, idling high
+def test_spi_tx():
+    b = board.reset()
+    edges = []
+    ice40 = b.ice40
+    ice40.pin_changed = lambda pin, level: edges.append(b.level(board.ICE_SI)) if pin == board.ICE_SCK and level else None
+    sm = rp2.StateMachine(0, prog_fpga.spi_tx, 24_000_000, out_base=machine.Pin(board.ICE_SI), sideset_base=machine.Pin(board.ICE_SCK))
+    sm.active(1)
+    edges.clear()
+    sm.put(bytes([0xA5, 0x0F]), 24)
+    assert edges == [1, 0, 1, 0, 0, 1, 0, 1, 0, 0, 0, 0, 1, 1, 1, 1]
+    assert b.level(board.ICE_SCK) == 1
+
+# send() waits for the last byte to be clocked out after the FIFO empties,
+# which takes longer the slower SPI_SCK is
+def test_send_wait(monkeypatch):
+    board.reset()
+    sleeps = []
+    monkeypatch.setattr(utime, "sleep_us", sleeps.append)
+    for sck_freq in (12_000_000, 1_000_000, 100_000):
+        sm = rp2.StateMachine(0, prog_fpga.spi_tx, 2 * sck_freq, out_base=machine.Pin(board.ICE_SI), sideset_base=machine.Pin(board.ICE_SCK))
+        sm.active(1)
+        prog_fpga.send(sm, bytes(1), sck_freq)
+    assert sleeps == [2, 9, 81]
@@ -0,0 +1,24 @@
+import time
+
+# A stand-in for MicroPython's utime module, on the host's clock
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+def sleep_us(us):
+    time.sleep(us / 1_000_000)
+
+def ticks_ms():
+    return time.monotonic_ns() // 1_000_000
+
+def ticks_us():
+    return time.monotonic_ns() // 1_000
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
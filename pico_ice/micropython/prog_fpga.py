@@ -1,68 +1,103 @@
-import machine #from machine import Pin, Timer
+import machine
+import rp2
 import utime
+from machine import Pin
 
-ice_creset_b = machine.Pin(27, machine.Pin.OUT)
-ice_creset_b.value(0)
-
-ice_ssn = machine.Pin(17, machine.Pin.OUT)
-ice_ssn.value(0)
-
-ice_done = machine.Pin(26, machine.Pin.IN)
-ice_sck = machine.Pin(10, machine.Pin.OUT)
-ice_sck.value(1)
-ice_si = machine.Pin(8, machine.Pin.OUT)
-
-utime.sleep_us(1) # wait at least 200ns
-ice_creset_b.value(1)
-
-utime.sleep_us(1200) # wait at least 1200us
-
-ice_ssn.value(1)
-for i in range(8): # 8 dummy clocks
-    ice_sck.value(0)
-    utime.sleep_us(1)
-    ice_sck.value(1)
-    utime.sleep_us(1)
-
-ice_ssn.value(0)
-
-fid = open('myfpga_impl_1.bin','rb')
-fid.seek(0, 2)
-filelength = fid.tell()
-fid.seek(0, 0)
-
-counter=0
-while True:
-    ch = fid.read(1)
-    counter+=1
-    if (counter%10000)==0:
-        print(f"{counter*100/filelength:.1f}%")
-    if ch != b"":
-        value = int.from_bytes(ch, 'big')
-        bits = [int(c) for c in f"{value:08b}"]
-        for i in range(8):
-            ice_sck.value(0)
-            ice_si.value(bits[i])
-            ice_sck.value(1)
-    else:
-        break
-print("DONE")
-
-ice_ssn.value(1)
-utime.sleep_us(1)
-
-for i in range(200):
-    ice_sck.value(0)
-    ice_sck.value(1)
-  
-print(f"{ice_done.value()=}")
-
-led_r = machine.Pin(4, machine.Pin.OUT) # Mapped through test-FPGA to control LED
-led_g = machine.Pin(6, machine.Pin.OUT)
-led_b = machine.Pin(7, machine.Pin.OUT)
-
-for i in range(100):
-    led_r.value(i%3==0)
-    led_g.value(i%3==1)
-    led_b.value(i%3==2)
-    utime.sleep_ms(500)
\ No newline at end of file
+# Configure the iCE40 over its SPI slave port from a bitstream file.  The
+# bitstream is cached on the pico's filesystem, so once it has been copied
+# there (mpremote cp myfpga_impl_1.bin :) the FPGA can be reconfigured from it
+# without sending it from the host again:
+#
+#   import prog_fpga
+#   prog_fpga.program()                      # or program("other.bin")
+#
+# SPI_SI is on GPIO 8, which hardware SPI can only receive on, so a PIO state
+# machine shifts the bitstream out on it, a byte per word, with SPI_SCK as
+# side-set.  The file is read in 4KB chunks and each chunk put to the state
+# machine's FIFO as a whole, so configuration takes about as long as clocking
+# the bitstream out.
+
+ICE_SI = 8
+ICE_FLASH_SEL = 9
+ICE_SCK = 10
+ICE_SSN = 17
+ICE_DONE = 26
+ICE_CRESET = 27
+
+BITSTREAM = "myfpga_impl_1.bin"
+CHUNK_SIZE = 4096
+
+# Shift a byte out MSB first, changing SPI_SI while SPI_SCK is low.  SPI_SCK
+# idles high while waiting for the next byte.
+@rp2.asm_pio(out_init=rp2.PIO.OUT_LOW, sideset_init=rp2.PIO.OUT_HIGH, out_shiftdir=rp2.PIO.SHIFT_LEFT)
+def spi_tx():
+    pull().side(1)
+    set(x, 7).side(1)
+    label("bit")
+    out(pins, 1).side(0)
+    jmp(x_dec, "bit").side(1)
+
+# Put bytes to the state machine and wait for them to be clocked out: once
+# the FIFO is empty the last byte still has up to 8 SPI_SCK clocks to go, so
+# wait for those and a microsecond more
+def send(sm, data, sck_freq):
+    sm.put(data, 24)
+    while sm.tx_fifo():
+        pass
+    utime.sleep_us((8_000_000 + sck_freq - 1) // sck_freq + 1)
+
+# Returns the time taken in milliseconds
+def program(filename=BITSTREAM, sck_freq=12_000_000):
+    start = utime.ticks_ms()
+
+    ice_creset_b = Pin(ICE_CRESET, Pin.OUT, value=0)
+    ice_ssn = Pin(ICE_SSN, Pin.OUT, value=0)
+    Pin(ICE_FLASH_SEL, Pin.OUT, value=1)
+    ice_done = Pin(ICE_DONE, Pin.IN)
+
+    sm = rp2.StateMachine(0, spi_tx, 2 * sck_freq, out_base=Pin(ICE_SI), sideset_base=Pin(ICE_SCK))
+    sm.active(1)
+
+    utime.sleep_us(1) # wait at least 200ns
+    ice_creset_b.value(1)
+    utime.sleep_us(1200) # wait at least 1200us
+
+    ice_ssn.value(1)
+    send(sm, bytes(1), sck_freq) # 8 dummy clocks
+    ice_ssn.value(0)
+
+    buf = bytearray(CHUNK_SIZE)
+    data = memoryview(buf)
+    with open(filename, "rb") as f:
+        while True:
+            num_bytes = f.readinto(buf)
+            if num_bytes == 0:
+                break
+            send(sm, data[:num_bytes], sck_freq)
+
+    ice_ssn.value(1)
+    send(sm, bytes(25), sck_freq) # at least 49 clocks to start the design
+
+    sm.active(0)
+    Pin(ICE_SCK, Pin.IN, pull=None)
+    Pin(ICE_SI, Pin.IN, pull=None)
+    Pin(ICE_SSN, Pin.IN, Pin.PULL_UP)
+
+    if ice_done.value() == 0:
+        raise Exception(f"Configuration from {filename} failed, CDONE is low")
+    elapsed = utime.ticks_diff(utime.ticks_ms(), start)
+    print(f"Configured from {filename} in {elapsed}ms")
+    return elapsed
+
+if __name__ == "__main__":
+    program()
+
+    led_r = machine.Pin(4, machine.Pin.OUT) # Mapped through test-FPGA to control LED
+    led_g = machine.Pin(6, machine.Pin.OUT)
+    led_b = machine.Pin(7, machine.Pin.OUT)
+
+    for i in range(100):
+        led_r.value(i%3==0)
+        led_g.value(i%3==1)
+        led_b.value(i%3==2)
+        utime.sleep_ms(500)
@@ -248,6 +248,36 @@ def run(query=True, stop=True):
             print("%01x" % (nibble,), end="")
         print()
 
+# The design's UART TX, uo_out[0], is on the iCE40's pin 4 (see pico_ice.pcf)
+# and is read on UART1's RX on GPIO 21, which needs a jumper to it (see
+# pico_ice/README.md).  Nothing is sent, but UART1 needs a TX pin, and its
+# default of GPIO 4 is RAM A's select on the QSPI PMOD, which the design is
+# driving.
+UART_ID = 1
+UART_TX = 20
+UART_RX = 21
+
+# How long tail_uart waits for anything before warning the jumper may be off
+UART_QUIET_MS = 5000
+
+# Print what the design sends on the UART until interrupted
+def tail_uart(baudrate=115200, quiet_ms=UART_QUIET_MS):
+    uart = UART(UART_ID, baudrate=baudrate, tx=Pin(UART_TX), rx=Pin(UART_RX))
+    start = time.ticks_ms()
+    waiting = True
+    while True:
+        data = uart.read(16)
+        if data is None:
+            if waiting and time.ticks_diff(time.ticks_ms(), start) > quiet_ms:
+                print(f"Warning: nothing received on GPIO {UART_RX} in {quiet_ms}ms, is it connected to the iCE40's pin 4?")
+                waiting = False
+            time.sleep_ms(1)
+            continue
+        waiting = False
+        for d in data:
+            if d > 0 and d <= 127:
+                print(chr(d), end="")
+
 def execute(filename):
     flash_prog.program(filename)
     run(query=False, stop=False)
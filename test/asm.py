@@ -0,0 +1,133 @@
+from isa import INSTRUCTIONS, encode
+
+# A small assembler for test firmware, on top of isa.encode.
+#
+# Instructions are methods named as in isa.INSTRUCTIONS, with the dots as
+# underscores (and or_ and and_), and take the same operands, except that
+# branch and jump targets, or the immediate of any other instruction, can be
+# labels.  Labels are resolved when the program is assembled, relative to the
+# instruction for branches and jumps and as addresses otherwise.
+#
+#   a = Assembler()
+#   a.li(x10, 100)
+#   a.label("loop")
+#   a.c_addi(x10, -1)
+#   a.bne(x10, x0, "loop")
+#   a.sw(x4, x10, 0x3c)
+#   image = a.assemble()
+#
+# There are the usual pseudo instructions (li, la, mv, j, call, ret) and data
+# directives (word, data, align).  Instruction sizes never depend on labels,
+# so a label is resolved in a single pass: li is always two instructions
+# unless the value fits in addi, and la always is.
+
+# Immediate layouts relative to the pc
+PC_RELATIVE = {"b", "j", "cb", "cj"}
+
+# An assembled program, which also has the address of each label
+class Image(bytes):
+    labels = {}
+
+class Assembler:
+    def __init__(self, base=0):
+        self.base = base
+        self.items = []
+        self.labels = {}
+        self.size = 0
+
+    def __getattr__(self, attr):
+        name = attr.rstrip("_").replace("_", ".")
+        if name not in INSTRUCTIONS:
+            raise AttributeError(attr)
+        return lambda *operands: self.instr(name, *operands)
+
+    def instr(self, name, *operands):
+        self._emit(("instr", name, operands), 4 if INSTRUCTIONS[name][0] & 3 == 3 else 2)
+
+    def label(self, name):
+        assert name not in self.labels, "Duplicate label " + name
+        self.labels[name] = self.base + self.size
+
+    def here(self):
+        return self.base + self.size
+
+    def _emit(self, item, size):
+        self.items.append((self.base + self.size, item))
+        self.size += size
+
+    ###### Directives ######
+
+    def word(self, *values):
+        for value in values:
+            self._emit(("word", value), 4)
+
+    def data(self, data):
+        self._emit(("data", bytes(data)), len(data))
+
+    def align(self, alignment):
+        if self.size % alignment:
+            self.data(bytes(alignment - self.size % alignment))
+
+    ###### Pseudo instructions ######
+
+    def li(self, rd, value):
+        if -0x800 <= value < 0x800:
+            self.addi(rd, 0, value)
+        else:
+            self._emit(("hi", rd, value), 4)
+            self._emit(("lo", rd, value), 4)
+
+    def la(self, rd, label):
+        self._emit(("hi", rd, label), 4)
+        self._emit(("lo", rd, label), 4)
+
+    def mv(self, rd, rs):
+        self.addi(rd, rs, 0)
+
+    def j(self, target):
+        self.jal(0, target)
+
+    def call(self, target):
+        self.jal(1, target)
+
+    def ret(self):
+        self.jalr(0, 1, 0)
+
+    ###### Assembly ######
+
+    def address(self, value):
+        return self.labels[value] if isinstance(value, str) else value
+
+    # The program as an Image, loaded at base
+    def assemble(self):
+        image = bytearray()
+        for addr, item in self.items:
+            kind = item[0]
+            if kind == "instr":
+                _, name, operands = item
+                fields = INSTRUCTIONS[name][1]
+                resolved = []
+                for field, operand in zip(fields, operands):
+                    if isinstance(operand, str):
+                        operand = self.labels[operand]
+                        if field[1] in PC_RELATIVE:
+                            operand -= addr
+                    resolved.append(operand)
+                instr = encode(name, *resolved)
+                image += instr.to_bytes(4 if instr & 3 == 3 else 2, "little")
+            elif kind == "word":
+                image += (self.address(item[1]) & 0xFFFFFFFF).to_bytes(4, "little")
+            elif kind == "data":
+                image += item[1]
+            else:
+                _, rd, value = item
+                value = self.address(value) & 0xFFFFFFFF
+                lo = ((value & 0xFFF) ^ 0x800) - 0x800
+                if kind == "hi":
+                    instr = encode("lui", rd, ((value - lo) >> 12) & 0xFFFFF)
+                else:
+                    instr = encode("addi", rd, rd, lo)
+                image += instr.to_bytes(4, "little")
+        image = Image(image)
+        image.labels = dict(self.labels)
+        return image
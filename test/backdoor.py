@@ -0,0 +1,155 @@
+from iss import GP, TP
+
+# Zero time access to the state of tinyqv_core from the tests, through the
+# hierarchy instead of by running loads and stores through the core: the
+# registers, mstatus, mie, mip, mepc and mcause, the cycle and instret
+# counters and the time CSR, which counts every 8 cycles.
+#
+#   regs = Backdoor.cpu(dut)          # tb_cpu, Backdoor(dut.core) for tb_core
+#   regs.set_reg(x5, 0x12345678)
+#   assert regs.get_reg(x5) == 0x12345678
+#   regs.set_csr(MEPC, 0x100)
+#   cycles = regs.get_csr(MCYCLE)
+#
+# The registers, counters and mepc are shift registers that rotate right 4
+# bits every clock (mepc only on counters 0-5), presenting the nibble for
+# the current counter in bits 7:4 (bits 3:0 of mepc).  The values are
+# rotated back using the core's counter, so any clock will do, but writing
+# a register while an instruction writes it loses nibbles, so poke between
+# instructions.  Peek and poke away from the rising edge, after FallingEdge
+# (or peek in ReadOnly): straight after RisingEdge the counter read is the
+# one before the edge, but a write lands after it.  Pokes are applied like
+# any other write from cocotb, so a peek sees them after ReadOnly.
+#
+# The counters add at counter 0 and carry through the other nibbles over
+# the cycle, so after counter 0 the count includes the increment being
+# carried, and a count written then is taken as already incremented.
+
+MASK = 0xFFFFFFFF
+
+MSTATUS = 0x300
+MIE = 0x304
+MEPC = 0x341
+MCAUSE = 0x342
+MIP = 0x344
+MCYCLE = 0xC00
+TIME = 0xC01
+MINSTRET = 0xC02
+
+def _rotl(value, bits, width=32):
+    bits %= width
+    mask = (1 << width) - 1
+    return ((value << bits) | (value >> (width - bits))) & mask
+
+class Backdoor:
+    def __init__(self, core):
+        self.core = core
+
+    @classmethod
+    def cpu(cls, dut):
+        return cls(dut.cpu.i_core)
+
+    @classmethod
+    def soc(cls, dut):
+        return cls(dut.qv.cpu.i_core)
+
+    @property
+    def counter(self):
+        return self.core.counter.value.integer
+
+    # The rotation of the registers and counters at this counter
+    def _rotation(self):
+        return 4 * self.counter - 4
+
+    ###### Registers ######
+
+    def get_reg(self, reg):
+        if reg == 0:
+            return 0
+        if reg == 3:
+            return GP
+        if reg == 4:
+            return TP
+        raw = self.core.i_registers.registers[reg].value.integer
+        return _rotl(raw, self._rotation())
+
+    # Writes to x0, gp and tp are ignored, as in the core
+    def set_reg(self, reg, value):
+        if reg in (0, 3, 4):
+            return
+        self.core.i_registers.registers[reg].value = _rotl(value & MASK, -self._rotation())
+
+    def get_regs(self):
+        return [self.get_reg(i) for i in range(16)]
+
+    def set_regs(self, values):
+        for i, value in enumerate(values):
+            self.set_reg(i, value)
+
+    ###### Counters ######
+
+    def _get_count(self, counter):
+        value = _rotl(counter.register.value.integer, self._rotation())
+        if self.counter != 0:
+            value += counter.cy.value.integer << (4 * self.counter)
+        return value & MASK
+
+    def _set_count(self, counter, value):
+        counter.register.value = _rotl(value & MASK, -self._rotation())
+        counter.cy.value = 0
+
+    ###### CSRs ######
+
+    # A CSR, by number as in the ISS
+    def get_csr(self, csr):
+        core = self.core
+        if csr == MSTATUS:
+            return ((core.mstatus_mpie.value.integer << 7) | (core.mstatus_mie.value.integer << 3) |
+                    (core.mstatus_mte.value.integer << 2))
+        if csr == MIE:
+            mie = core.mie.value.integer
+            return ((mie >> 4) << 7) | ((mie & 0xF) << 16)
+        if csr == MIP:
+            mip = core.mip.value.integer
+            return ((mip >> 4) << 7) | ((mip & 0xF) << 16)
+        if csr == MEPC:
+            rotation = 4 * self.counter if self.counter <= 5 else 0
+            return _rotl(core.mepc.value.integer, rotation, 24)
+        if csr == MCAUSE:
+            mcause = core.mcause.value.integer
+            return ((mcause >> 5) << 31) | (mcause & 0x1F)
+        if csr == MCYCLE:
+            return self._get_count(core.i_cycles)
+        if csr == TIME:
+            return (core.time_hi.value.integer << 29) | (self._get_count(core.i_cycles) >> 3)
+        if csr == MINSTRET:
+            return self._get_count(core.i_instrret)
+        raise ValueError("No backdoor to CSR {:03x}".format(csr))
+
+    # Only the bits the core implements are written.  For mip those are the
+    # pending edges (bits 17:16), the others are the interrupt inputs.
+    def set_csr(self, csr, value):
+        core = self.core
+        if csr == MSTATUS:
+            core.mstatus_mpie.value = (value >> 7) & 1
+            core.mstatus_mie.value = (value >> 3) & 1
+            core.mstatus_mte.value = (value >> 2) & 1
+        elif csr == MIE:
+            core.mie.value = (((value >> 7) & 1) << 4) | ((value >> 16) & 0xF)
+        elif csr == MIP:
+            core.mip_reg.value = (value >> 16) & 3
+        elif csr == MEPC:
+            rotation = 4 * self.counter if self.counter <= 5 else 0
+            core.mepc.value = _rotl(value & 0xFFFFFF, -rotation, 24)
+        elif csr == MCAUSE:
+            core.mcause.value = (((value >> 31) & 1) << 5) | (value & 0x1F)
+        elif csr == MCYCLE:
+            self._set_count(core.i_cycles, value)
+        elif csr == TIME:
+            cycles = self._get_count(core.i_cycles)
+            self._set_count(core.i_cycles, ((value << 3) | (cycles & 7)) & MASK)
+            core.time_hi.value = (value >> 29) & 7
+        elif csr == MINSTRET:
+            self._set_count(core.i_instrret, value)
+        else:
+            raise ValueError("No backdoor to CSR {:03x}".format(csr))
@@ -0,0 +1,969 @@
+import random
+
+from riscvmodel.regnames import x0, ra, sp, gp, tp, t0, t1, t2, s0, s1, a0, a1, a2, a3, a4, a5
+
+from asm import Assembler
+from firmware import EXIT
+from iss import TP, RAM_A, RAM_B
+
+# The benchmark programs for the firmware tests, written with the assembler
+# as there is no RISC-V compiler in the test environment.
+#
+# Each function returns a flash image (an asm.Image, so with the labels for
+# the profiler), which exits with a checkable value:
+#
+#   dhrystone    Dhrystone 2.1's main loop and procedures, hand compiled with
+#                the structure copies done by lw4/sw4 and the multiply and
+#                divide by runtime routines, as the TinyQV toolchain would.
+#                Exits with Arr_2_Glob[8][7], which is runs + 10.
+#   coremark     The CoreMark kernels: a linked list find, reverse and sum,
+#                a 16-bit matrix multiply with mul16 and a table driven number
+#                parsing state machine, with the results combined by crcu16.
+#                Exits with the CRC.
+#   memcpy       Copies a block from flash to RAM A, RAM A to RAM B and back
+#                to RAM A, with word loads and stores then with lw4/sw4.
+#                Exits with the sum of the words copied.
+#   calls        Calls nested functions that return with c.ret, and one that
+#                is only a c.ret, count times.  Exits with the count.
+#   irq_latency  Runs a loop of loads, stores and calls while in0 is raised
+#                by the test, with a handler that writes GPIO_OUT on entry, so
+#                the latency is the clocks from in0 to the write.  Exits after
+#                count interrupts with the count.
+#   timing       Blocks of each class of instruction in TIMING, between
+#                writes to GPIO_OUT, for timing_cycles to measure the cycles
+#                each takes to compare with the README's timing table.
+#
+# Programs start with the vectors: reset jumps to start, the trap vector spins
+# (the firmware tests stop on the trap) and the interrupt vector is the
+# handler or spins.  The stack is at the top of RAM A and globals are gp
+# relative.  Programs finish by storing the exit code to EXIT and spinning,
+# so they also run to completion on the ISS.
+
+STACK = RAM_B
+UART = 0x10
+GPIO_OUT = 0
+
+MIP = 0x344
+MIE = 0x304
+
+def _start(a, interrupt=None):
+    a.label("reset")
+    a.j("start")
+    a.label("trap")
+    a.j("trap")
+    a.label("interrupt")
+    if interrupt is None:
+        a.j("interrupt")
+    else:
+        interrupt(a)
+    a.label("start")
+    a.li(sp, STACK)
+
+def _exit(a):
+    a.label("exit")
+    a.sw(tp, a0, EXIT - TP)
+    a.label("halt")
+    a.j("halt")
+
+# The runtime routines the programs call, following the ABI
+def _runtime(a):
+    # a0 = a0 * a1, with the 32x16 multiply
+    a.label("mulsi3")
+    a.srli(t0, a1, 16)
+    a.mul16(t0, a0, t0)
+    a.slli(t0, t0, 16)
+    a.mul16(a0, a0, a1)
+    a.add(a0, a0, t0)
+    a.ret()
+
+    # a0 = a0 / a1 and a1 = a0 % a1, unsigned
+    a.label("udivsi3")
+    a.mv(t0, a0)
+    a.li(a0, 0)
+    a.li(t1, 0)
+    a.li(t2, 32)
+    a.label("udivsi3_loop")
+    a.srli(a2, t0, 31)
+    a.slli(t1, t1, 1)
+    a.or_(t1, t1, a2)
+    a.slli(t0, t0, 1)
+    a.slli(a0, a0, 1)
+    a.bltu(t1, a1, "udivsi3_next")
+    a.sub(t1, t1, a1)
+    a.ori(a0, a0, 1)
+    a.label("udivsi3_next")
+    a.addi(t2, t2, -1)
+    a.bne(t2, x0, "udivsi3_loop")
+    a.mv(a1, t1)
+    a.ret()
+
+    # strcpy(a0, a1)
+    a.label("strcpy")
+    a.lbu(t0, a1, 0)
+    a.sb(a0, t0, 0)
+    a.addi(a0, a0, 1)
+    a.addi(a1, a1, 1)
+    a.bne(t0, x0, "strcpy")
+    a.ret()
+
+    # a0 = strcmp(a0, a1)
+    a.label("strcmp")
+    a.lbu(t0, a0, 0)
+    a.lbu(t1, a1, 0)
+    a.bne(t0, t1, "strcmp_differ")
+    a.addi(a0, a0, 1)
+    a.addi(a1, a1, 1)
+    a.bne(t0, x0, "strcmp")
+    a.li(a0, 0)
+    a.ret()
+    a.label("strcmp_differ")
+    a.sub(a0, t0, t1)
+    a.ret()
+
+    # a0 = crcu16(a0, a1), CoreMark's CRC of a 16-bit value
+    a.label("crcu16")
+    a.li(t2, 16)
+    a.label("crcu16_loop")
+    a.xor(t0, a0, a1)
+    a.andi(t0, t0, 1)
+    a.srli(a0, a0, 1)
+    a.srli(a1, a1, 1)
+    a.beq(t0, x0, "crcu16_next")
+    a.li(t1, 0x2001)
+    a.xor(a1, a1, t1)
+    a.li(t1, 0x8000)
+    a.or_(a1, a1, t1)
+    a.label("crcu16_next")
+    a.addi(t2, t2, -1)
+    a.bne(t2, x0, "crcu16_loop")
+    a.mv(a0, a1)
+    a.ret()
+
+    # Save and restore ra, s0 and s1 in a 16 byte frame
+    a.label("save")
+    a.addi(sp, sp, -16)
+    a.sw(sp, ra, 0)
+    a.sw(sp, s0, 4)
+    a.sw(sp, s1, 8)
+    a.jalr(x0, t0, 0)
+
+    a.label("restore_ret")
+    a.lw(ra, sp, 0)
+    a.lw(s0, sp, 4)
+    a.lw(s1, sp, 8)
+    a.addi(sp, sp, 16)
+    a.ret()
+
+def _prologue(a):
+    a.jal(t0, "save")
+
+def _epilogue(a):
+    a.j("restore_ret")
+
+###### Dhrystone ######
+
+# Globals, gp relative
+INT_GLOB = 0
+BOOL_GLOB = 4
+CH_1_GLOB = 8
+CH_2_GLOB = 9
+ARR_1_GLOB = 16
+PTR_GLOB = 224
+NEXT_PTR_GLOB = 228
+RECORD_A = 256
+RECORD_B = 320
+ARR_2_GLOB = RAM_A + 0x1000
+
+# Rec_Type fields
+PTR_COMP = 0
+DISCR = 4
+ENUM_COMP = 8
+INT_COMP = 12
+STR_COMP = 16
+
+# Main's locals, sp relative
+STR_1_LOC = 0
+INT_1_LOC = 32
+INT_2_LOC = 36
+INT_3_LOC = 40
+ENUM_LOC = 44
+STR_2_LOC = 48
+FRAME = 80
+
+def dhrystone(runs=10):
+    a = Assembler()
+    _start(a)
+    a.addi(sp, sp, -FRAME)
+
+    a.addi(t0, gp, RECORD_B)
+    a.sw(gp, t0, NEXT_PTR_GLOB)
+    a.addi(t1, gp, RECORD_A)
+    a.sw(gp, t1, PTR_GLOB)
+    a.sw(t1, t0, PTR_COMP)
+    a.sw(t1, x0, DISCR)
+    a.li(t2, 2)
+    a.sw(t1, t2, ENUM_COMP)
+    a.li(t2, 40)
+    a.sw(t1, t2, INT_COMP)
+    a.addi(a0, t1, STR_COMP)
+    a.la(a1, "some_string")
+    a.call("strcpy")
+    a.addi(a0, sp, STR_1_LOC)
+    a.la(a1, "first_string")
+    a.call("strcpy")
+    a.li(t0, ARR_2_GLOB)
+    a.li(t1, 10)
+    a.sw(t0, t1, (8 * 50 + 7) * 4)
+
+    a.li(s0, runs)
+    a.label("main_loop")
+    a.call("proc_5")
+    a.call("proc_4")
+    a.li(t0, 2)
+    a.sw(sp, t0, INT_1_LOC)
+    a.li(t0, 3)
+    a.sw(sp, t0, INT_2_LOC)
+    a.addi(a0, sp, STR_2_LOC)
+    a.la(a1, "second_string")
+    a.call("strcpy")
+    a.li(t0, 1)
+    a.sw(sp, t0, ENUM_LOC)
+    a.addi(a0, sp, STR_1_LOC)
+    a.addi(a1, sp, STR_2_LOC)
+    a.call("func_2")
+    a.sltiu(a0, a0, 1)
+    a.sw(gp, a0, BOOL_GLOB)
+
+    a.label("while")
+    a.lw(a0, sp, INT_1_LOC)
+    a.lw(a1, sp, INT_2_LOC)
+    a.bge(a0, a1, "while_done")
+    a.slli(t0, a0, 2)
+    a.add(t0, t0, a0)
+    a.sub(t0, t0, a1)
+    a.sw(sp, t0, INT_3_LOC)
+    a.addi(a2, sp, INT_3_LOC)
+    a.call("proc_7")
+    a.lw(t0, sp, INT_1_LOC)
+    a.addi(t0, t0, 1)
+    a.sw(sp, t0, INT_1_LOC)
+    a.j("while")
+    a.label("while_done")
+
+    a.addi(a0, gp, ARR_1_GLOB)
+    a.li(a1, ARR_2_GLOB)
+    a.lw(a2, sp, INT_1_LOC)
+    a.lw(a3, sp, INT_3_LOC)
+    a.call("proc_8")
+    a.lw(a0, gp, PTR_GLOB)
+    a.call("proc_1")
+
+    a.li(s1, ord("A"))
+    a.label("for")
+    a.lbu(t0, gp, CH_2_GLOB)
+    a.bltu(t0, s1, "for_done")
+    a.mv(a0, s1)
+    a.li(a1, ord("C"))
+    a.call("func_1")
+    a.lw(t0, sp, ENUM_LOC)
+    a.bne(a0, t0, "for_next")
+    a.li(a0, 0)
+    a.addi(a1, sp, ENUM_LOC)
+    a.call("proc_6")
+    a.addi(a0, sp, STR_2_LOC)
+    a.la(a1, "third_string")
+    a.call("strcpy")
+    a.sw(sp, s0, INT_2_LOC)
+    a.sw(gp, s0, INT_GLOB)
+    a.label("for_next")
+    a.addi(s1, s1, 1)
+    a.j("for")
+    a.label("for_done")
+
+    a.lw(a0, sp, INT_2_LOC)
+    a.lw(a1, sp, INT_1_LOC)
+    a.call("mulsi3")
+    a.sw(sp, a0, INT_2_LOC)
+    a.lw(a1, sp, INT_3_LOC)
+    a.call("udivsi3")
+    a.sw(sp, a0, INT_1_LOC)
+    a.lw(t0, sp, INT_2_LOC)
+    a.lw(t1, sp, INT_3_LOC)
+    a.sub(t0, t0, t1)
+    a.slli(t1, t0, 3)
+    a.sub(t0, t1, t0)
+    a.lw(t1, sp, INT_1_LOC)
+    a.sub(t0, t0, t1)
+    a.sw(sp, t0, INT_2_LOC)
+    a.addi(a0, sp, INT_1_LOC)
+    a.call("proc_2")
+
+    a.addi(s0, s0, -1)
+    a.bne(s0, x0, "main_loop")
+    a.li(t0, ARR_2_GLOB)
+    a.lw(a0, t0, (8 * 50 + 7) * 4)
+    a.j("exit")
+
+    # Proc_1(a0 = Ptr_Val_Par)
+    a.label("proc_1")
+    _prologue(a)
+    a.mv(s0, a0)
+    a.lw(s1, s0, PTR_COMP)
+    a.lw(t0, gp, PTR_GLOB)
+    for offset in range(0, 48, 16):
+        a.lw4(a2, t0, offset)
+        a.sw4(s1, a2, offset)
+    a.li(t0, 5)
+    a.sw(s0, t0, INT_COMP)
+    a.sw(s1, t0, INT_COMP)
+    a.lw(t0, s0, PTR_COMP)
+    a.sw(s1, t0, PTR_COMP)
+    a.mv(a0, s1)
+    a.call("proc_3")
+    a.lw(t0, s1, DISCR)
+    a.bne(t0, x0, "proc_1_else")
+    a.li(t0, 6)
+    a.sw(s1, t0, INT_COMP)
+    a.lw(a0, s0, ENUM_COMP)
+    a.addi(a1, s1, ENUM_COMP)
+    a.call("proc_6")
+    a.lw(t0, gp, PTR_GLOB)
+    a.lw(t0, t0, PTR_COMP)
+    a.sw(s1, t0, PTR_COMP)
+    a.lw(a0, s1, INT_COMP)
+    a.li(a1, 10)
+    a.addi(a2, s1, INT_COMP)
+    a.call("proc_7")
+    _epilogue(a)
+    a.label("proc_1_else")
+    a.lw(t0, s0, PTR_COMP)
+    for offset in range(0, 48, 16):
+        a.lw4(a2, t0, offset)
+        a.sw4(s0, a2, offset)
+    _epilogue(a)
+
+    # Proc_2(a0 = Int_Par_Ref)
+    a.label("proc_2")
+    a.lw(t0, a0, 0)
+    a.addi(t0, t0, 10)
+    a.li(t2, ord("A"))
+    a.label("proc_2_loop")
+    a.lbu(t1, gp, CH_1_GLOB)
+    a.bne(t1, t2, "proc_2_loop")
+    a.addi(t0, t0, -1)
+    a.lw(t1, gp, INT_GLOB)
+    a.sub(t0, t0, t1)
+    a.sw(a0, t0, 0)
+    a.ret()
+
+    # Proc_3(a0 = Ptr_Ref_Par)
+    a.label("proc_3")
+    _prologue(a)
+    a.lw(t0, gp, PTR_GLOB)
+    a.beq(t0, x0, "proc_3_null")
+    a.lw(t1, t0, PTR_COMP)
+    a.sw(a0, t1, 0)
+    a.label("proc_3_null")
+    a.li(a0, 10)
+    a.lw(a1, gp, INT_GLOB)
+    a.lw(a2, gp, PTR_GLOB)
+    a.addi(a2, a2, INT_COMP)
+    a.call("proc_7")
+    _epilogue(a)
+
+    # Proc_4()
+    a.label("proc_4")
+    a.lbu(t0, gp, CH_1_GLOB)
+    a.addi(t0, t0, -ord("A"))
+    a.sltiu(t0, t0, 1)
+    a.lw(t1, gp, BOOL_GLOB)
+    a.or_(t0, t0, t1)
+    a.sw(gp, t0, BOOL_GLOB)
+    a.li(t0, ord("B"))
+    a.sb(gp, t0, CH_2_GLOB)
+    a.ret()
+
+    # Proc_5()
+    a.label("proc_5")
+    a.li(t0, ord("A"))
+    a.sb(gp, t0, CH_1_GLOB)
+    a.sw(gp, x0, BOOL_GLOB)
+    a.ret()
+
+    # Proc_6(a0 = Enum_Val_Par, a1 = Enum_Ref_Par), with Func_3 inlined
+    a.label("proc_6")
+    a.sw(a1, a0, 0)
+    a.li(t0, 2)
+    a.beq(a0, t0, "proc_6_switch")
+    a.li(t1, 3)
+    a.sw(a1, t1, 0)
+    a.label("proc_6_switch")
+    a.beq(a0, x0, "proc_6_store_0")
+    a.li(t0, 1)
+    a.bne(a0, t0, "proc_6_not_1")
+    a.lw(t1, gp, INT_GLOB)
+    a.li(t0, 100)
+    a.blt(t0, t1, "proc_6_store_0")
+    a.li(t0, 3)
+    a.sw(a1, t0, 0)
+    a.ret()
+    a.label("proc_6_not_1")
+    a.li(t0, 2)
+    a.bne(a0, t0, "proc_6_not_2")
+    a.li(t0, 1)
+    a.sw(a1, t0, 0)
+    a.ret()
+    a.label("proc_6_not_2")
+    a.li(t0, 4)
+    a.bne(a0, t0, "proc_6_done")
+    a.li(t0, 2)
+    a.sw(a1, t0, 0)
+    a.label("proc_6_done")
+    a.ret()
+    a.label("proc_6_store_0")
+    a.sw(a1, x0, 0)
+    a.ret()
+
+    # Proc_7(a0 = Int_1_Par_Val, a1 = Int_2_Par_Val, a2 = Int_Par_Ref)
+    a.label("proc_7")
+    a.addi(t0, a0, 2)
+    a.add(t0, t0, a1)
+    a.sw(a2, t0, 0)
+    a.ret()
+
+    # Proc_8(a0 = Arr_1_Par_Ref, a1 = Arr_2_Par_Ref, a2 = Int_1_Par_Val, a3 = Int_2_Par_Val)
+    a.label("proc_8")
+    a.addi(t0, a2, 5)
+    a.slli(t1, t0, 2)
+    a.add(t1, a0, t1)
+    a.sw(t1, a3, 0)
+    a.sw(t1, a3, 4)
+    a.sw(t1, t0, 120)
+    a.li(a4, 200)
+    a.mul16(t2, t0, a4)
+    a.add(t2, a1, t2)
+    a.slli(a5, t0, 2)
+    a.add(t2, t2, a5)
+    a.sw(t2, t0, 0)
+    a.sw(t2, t0, 4)
+    a.lw(a5, t2, -4)
+    a.addi(a5, a5, 1)
+    a.sw(t2, a5, -4)
+    a.lw(a5, t1, 0)
+    a.li(a4, 20 * 200)
+    a.add(t2, t2, a4)
+    a.sw(t2, a5, 0)
+    a.li(t0, 5)
+    a.sw(gp, t0, INT_GLOB)
+    a.ret()
+
+    # a0 = Func_1(a0 = Ch_1_Par_Val, a1 = Ch_2_Par_Val)
+    a.label("func_1")
+    a.bne(a0, a1, "func_1_differ")
+    a.sb(gp, a0, CH_1_GLOB)
+    a.li(a0, 1)
+    a.ret()
+    a.label("func_1_differ")
+    a.li(a0, 0)
+    a.ret()
+
+    # a0 = Func_2(a0 = Str_1_Par_Ref, a1 = Str_2_Par_Ref), with Int_Loc at sp + 12
+    a.label("func_2")
+    _prologue(a)
+    a.mv(s0, a0)
+    a.mv(s1, a1)
+    a.li(t0, 2)
+    a.sw(sp, t0, 12)
+    a.label("func_2_loop")
+    a.lw(t0, sp, 12)
+    a.li(t1, 2)
+    a.blt(t1, t0, "func_2_compare")
+    a.add(t1, s0, t0)
+    a.lbu(a0, t1, 0)
+    a.add(t1, s1, t0)
+    a.lbu(a1, t1, 1)
+    a.call("func_1")
+    a.bne(a0, x0, "func_2_loop")
+    a.lw(t0, sp, 12)
+    a.addi(t0, t0, 1)
+    a.sw(sp, t0, 12)
+    a.j("func_2_loop")
+    a.label("func_2_compare")
+    a.mv(a0, s0)
+    a.mv(a1, s1)
+    a.call("strcmp")
+    a.bge(x0, a0, "func_2_false")
+    a.lw(t0, sp, 12)
+    a.addi(t0, t0, 7)
+    a.sw(gp, t0, INT_GLOB)
+    a.li(a0, 1)
+    _epilogue(a)
+    a.label("func_2_false")
+    a.li(a0, 0)
+    _epilogue(a)
+
+    _runtime(a)
+    _exit(a)
+
+    for label, text in (("some_string", "DHRYSTONE PROGRAM, SOME STRING"),
+                        ("first_string", "DHRYSTONE PROGRAM, 1'ST STRING"),
+                        ("second_string", "DHRYSTONE PROGRAM, 2'ND STRING"),
+                        ("third_string", "DHRYSTONE PROGRAM, 3'RD STRING")):
+        a.label(label)
+        a.data(text.encode() + b"\0")
+    return a.assemble()
+
+###### CoreMark ######
+
+HEAD = 0
+LIST = 16
+LIST_NODES = 16
+MATRIX_A = 256
+MATRIX_B = 384
+MATRIX_C = 512
+COUNTS = 768
+MATRIX_N = 8
+
+NUMBERS = "5012,1234,-874,-102,+122,0.65,1.E-3,-3.5e+2,7..8,abc,19e,--1,.5e3,6e-,4120,+0.1,"
+
+# The number parser's next state for each state and class of character, with
+# states start, sign, int, float, exp, exp sign, exp digits and invalid, and
+# classes digit, sign, dot, e and anything else
+STATES = [
+    [2, 1, 3, 7, 7],
+    [2, 7, 3, 7, 7],
+    [2, 7, 3, 4, 7],
+    [3, 7, 7, 4, 7],
+    [6, 5, 7, 7, 7],
+    [6, 7, 7, 7, 7],
+    [6, 7, 7, 7, 7],
+    [7, 7, 7, 7, 7],
+]
+
+def coremark(iterations=4):
+    a = Assembler()
+    _start(a)
+
+    # The list, with node n holding (n * 37 + 11) & 0xFF
+    a.addi(t0, gp, LIST)
+    a.sw(gp, t0, HEAD)
+    a.li(t1, 0)
+    a.label("list_init")
+    a.addi(t2, t0, 8)
+    a.sw(t0, t2, 0)
+    a.slli(a0, t1, 5)
+    a.add(a0, a0, t1)
+    a.slli(a1, t1, 2)
+    a.add(a0, a0, a1)
+    a.addi(a0, a0, 11)
+    a.andi(a0, a0, 0xFF)
+    a.sw(t0, a0, 4)
+    a.addi(t0, t0, 8)
+    a.addi(t1, t1, 1)
+    a.li(a1, LIST_NODES)
+    a.blt(t1, a1, "list_init")
+    a.sw(t0, x0, -8)
+
+    # The matrices, A[n] = n * 3 - 90 and B[n] = n * 7 & 0x3F
+    a.li(t1, 0)
+    a.addi(t0, gp, MATRIX_A)
+    a.label("matrix_init")
+    a.slli(a0, t1, 1)
+    a.add(a0, a0, t1)
+    a.addi(a0, a0, -90)
+    a.sh(t0, a0, 0)
+    a.slli(a0, t1, 3)
+    a.sub(a0, a0, t1)
+    a.andi(a0, a0, 0x3F)
+    a.sh(t0, a0, MATRIX_B - MATRIX_A)
+    a.addi(t0, t0, 2)
+    a.addi(t1, t1, 1)
+    a.li(a1, MATRIX_N * MATRIX_N)
+    a.blt(t1, a1, "matrix_init")
+
+    a.li(s0, iterations)
+    a.li(s1, 0)
+    a.label("main_loop")
+    a.andi(a0, s0, 0xFF)
+    a.call("list")
+    a.mv(a1, s1)
+    a.call("crcu16")
+    a.mv(s1, a0)
+    a.call("matrix")
+    a.mv(a1, s1)
+    a.call("crcu16")
+    a.mv(s1, a0)
+    a.call("state")
+    for i in range(8):
+        a.lw(a0, gp, COUNTS + i * 4)
+        a.mv(a1, s1)
+        a.call("crcu16")
+        a.mv(s1, a0)
+    a.addi(s0, s0, -1)
+    a.bne(s0, x0, "main_loop")
+    a.mv(a0, s1)
+    a.j("exit")
+
+    # a0 = list(a0 = key): find the key, reverse the list and sum the data,
+    # returning the sum plus the steps to the key << 12
+    a.label("list")
+    a.lw(t0, gp, HEAD)
+    a.li(t1, 0)
+    a.label("list_find")
+    a.beq(t0, x0, "list_found")
+    a.lw(t2, t0, 4)
+    a.beq(t2, a0, "list_found")
+    a.lw(t0, t0, 0)
+    a.addi(t1, t1, 1)
+    a.j("list_find")
+    a.label("list_found")
+    a.li(t2, 0)
+    a.lw(t0, gp, HEAD)
+    a.label("list_reverse")
+    a.beq(t0, x0, "list_reversed")
+    a.lw(a1, t0, 0)
+    a.sw(t0, t2, 0)
+    a.mv(t2, t0)
+    a.mv(t0, a1)
+    a.j("list_reverse")
+    a.label("list_reversed")
+    a.sw(gp, t2, HEAD)
+    a.li(a0, 0)
+    a.label("list_sum")
+    a.beq(t2, x0, "list_done")
+    a.lw(a1, t2, 4)
+    a.add(a0, a0, a1)
+    a.lw(t2, t2, 0)
+    a.j("list_sum")
+    a.label("list_done")
+    a.slli(t1, t1, 12)
+    a.add(a0, a0, t1)
+    a.ret()
+
+    # a0 = matrix(): add 1 to A, C = A * B and return the sum of C
+    a.label("matrix")
+    a.addi(t0, gp, MATRIX_A)
+    a.addi(t1, gp, MATRIX_B)
+    a.label("matrix_add")
+    a.lh(a0, t0, 0)
+    a.addi(a0, a0, 1)
+    a.sh(t0, a0, 0)
+    a.addi(t0, t0, 2)
+    a.bltu(t0, t1, "matrix_add")
+    a.li(a5, 0)
+    a.li(a0, 0)
+    a.label("matrix_i")
+    a.li(a1, 0)
+    a.label("matrix_j")
+    a.li(t2, 0)
+    a.slli(t0, a0, 4)
+    a.add(t0, t0, gp)
+    a.addi(t0, t0, MATRIX_A)
+    a.slli(t1, a1, 1)
+    a.add(t1, t1, gp)
+    a.addi(t1, t1, MATRIX_B)
+    a.li(a4, MATRIX_N)
+    a.label("matrix_k")
+    a.lh(a2, t0, 0)
+    a.lh(a3, t1, 0)
+    a.mul16(a2, a2, a3)
+    a.add(t2, t2, a2)
+    a.addi(t0, t0, 2)
+    a.addi(t1, t1, MATRIX_N * 2)
+    a.addi(a4, a4, -1)
+    a.bne(a4, x0, "matrix_k")
+    a.slli(a2, a0, 3)
+    a.add(a2, a2, a1)
+    a.slli(a2, a2, 2)
+    a.add(a2, a2, gp)
+    a.sw(a2, t2, MATRIX_C)
+    a.add(a5, a5, t2)
+    a.addi(a1, a1, 1)
+    a.li(a2, MATRIX_N)
+    a.blt(a1, a2, "matrix_j")
+    a.addi(a0, a0, 1)
+    a.blt(a0, a2, "matrix_i")
+    a.mv(a0, a5)
+    a.ret()
+
+    # state(): parse the numbers, counting the final state of each
+    a.label("state")
+    a.la(t0, "numbers")
+    a.li(t1, 0)
+    a.label("state_loop")
+    a.lbu(a0, t0, 0)
+    a.beq(a0, x0, "state_done")
+    a.addi(t0, t0, 1)
+    a.li(a1, ord(","))
+    a.bne(a0, a1, "state_char")
+    a.slli(a2, t1, 2)
+    a.add(a2, a2, gp)
+    a.lw(a3, a2, COUNTS)
+    a.addi(a3, a3, 1)
+    a.sw(a2, a3, COUNTS)
+    a.li(t1, 0)
+    a.j("state_loop")
+    a.label("state_char")
+    a.addi(a1, a0, -ord("0"))
+    a.li(a2, 0)
+    a.sltiu(a3, a1, 10)
+    a.bne(a3, x0, "state_next")
+    a.li(a2, 1)
+    a.li(a1, ord("+"))
+    a.beq(a0, a1, "state_next")
+    a.li(a1, ord("-"))
+    a.beq(a0, a1, "state_next")
+    a.li(a2, 2)
+    a.li(a1, ord("."))
+    a.beq(a0, a1, "state_next")
+    a.li(a2, 3)
+    a.ori(a1, a0, 0x20)
+    a.li(a3, ord("e"))
+    a.beq(a1, a3, "state_next")
+    a.li(a2, 4)
+    a.label("state_next")
+    a.slli(a1, t1, 3)
+    a.add(a1, a1, a2)
+    a.la(a3, "state_table")
+    a.add(a1, a1, a3)
+    a.lbu(t1, a1, 0)
+    a.j("state_loop")
+    a.label("state_done")
+    a.ret()
+
+    _runtime(a)
+    _exit(a)
+
+    a.label("state_table")
+    for row in STATES:
+        a.data(bytes(row + [7] * (8 - len(row))))
+    a.label("numbers")
+    a.data(NUMBERS.encode() + b"\0")
+    return a.assemble()
+
+###### memcpy ######
+
+MEMCPY_SIZE = 512
+MEMCPY_A = RAM_A + 0x1000
+MEMCPY_B = RAM_B + 0x1000
+MEMCPY_C = RAM_A + 0x2000
+
+# The data copied, from flash
+def memcpy_data():
+    return random.Random(1).randbytes(MEMCPY_SIZE)
+
+def memcpy():
+    a = Assembler()
+    _start(a)
+
+    for routine in ("memcpy_word", "memcpy_lw4"):
+        for dst, src in ((MEMCPY_A, "data"), (MEMCPY_B, MEMCPY_A), (MEMCPY_C, MEMCPY_B)):
+            a.li(a0, dst)
+            if isinstance(src, str):
+                a.la(a1, src)
+            else:
+                a.li(a1, src)
+            a.li(a2, MEMCPY_SIZE)
+            a.call(routine)
+
+    a.li(t0, MEMCPY_C)
+    a.li(t1, MEMCPY_C + MEMCPY_SIZE)
+    a.li(a0, 0)
+    a.label("sum")
+    a.lw(a1, t0, 0)
+    a.add(a0, a0, a1)
+    a.addi(t0, t0, 4)
+    a.bltu(t0, t1, "sum")
+    a.j("exit")
+
+    # memcpy(a0, a1, a2) a word at a time
+    a.label("memcpy_word")
+    a.add(a2, a1, a2)
+    a.label("memcpy_word_loop")
+    a.lw(t0, a1, 0)
+    a.sw(a0, t0, 0)
+    a.addi(a0, a0, 4)
+    a.addi(a1, a1, 4)
+    a.bltu(a1, a2, "memcpy_word_loop")
+    a.ret()
+
+    # memcpy(a0, a1, a2) 16 bytes at a time
+    a.label("memcpy_lw4")
+    a.add(t0, a1, a2)
+    a.label("memcpy_lw4_loop")
+    a.lw4(a2, a1, 0)
+    a.sw4(a0, a2, 0)
+    a.addi(a0, a0, 16)
+    a.addi(a1, a1, 16)
+    a.bltu(a1, t0, "memcpy_lw4_loop")
+    a.ret()
+
+    _exit(a)
+
+    a.align(4)
+    a.label("data")
+    a.data(memcpy_data())
+    return a.assemble()
+
+###### Calls ######
+
+def calls(count=16):
+    a = Assembler()
+    _start(a)
+    a.li(s1, 0)
+    a.label("loop")
+    a.call("outer")
+    a.call("empty")
+    a.addi(s1, s1, 1)
+    a.li(t1, count)
+    a.blt(s1, t1, "loop")
+    a.mv(a0, s1)
+    a.j("exit")
+
+    a.label("outer")
+    a.mv(s0, ra)
+    a.call("leaf")
+    a.c_add(a0, a1)
+    a.mv(ra, s0)
+    a.c_ret()
+
+    a.label("leaf")
+    a.c_add(a0, a1)
+    a.c_ret()
+
+    a.label("empty")
+    a.c_ret()
+
+    _exit(a)
+    return a.assemble()
+
+###### Interrupt latency ######
+
+def _irq_handler(a):
+    a.sw(tp, x0, GPIO_OUT)
+    a.sw(gp, t0, -8)
+    a.lui(t0, 0x10)
+    a.csrrc(x0, t0, MIP)
+    a.lw(t0, gp, -8)
+    a.addi(s1, s1, 1)
+    a.mret()
+
+def irq_latency(count=8):
+    a = Assembler()
+    _start(a, _irq_handler)
+    a.li(s1, 0)
+    a.lui(t0, 0x10)
+    a.csrrs(x0, t0, MIE)
+    a.label("loop")
+    a.lw(a0, gp, 0)
+    a.addi(a0, a0, 1)
+    a.sw(gp, a0, 0)
+    a.call("leaf")
+    a.li(t1, count)
+    a.blt(s1, t1, "loop")
+    a.mv(a0, s1)
+    a.j("exit")
+
+    a.label("leaf")
+    a.xor(a1, a0, a1)
+    a.ret()
+
+    _exit(a)
+    return a.assemble()
+
+###### Instruction timing ######
+
+TIMING_COUNT = 8
+TIMING_WARMUP = 2
+TIMING_DATA = 0x40
+
+# The classes of instruction timed, each with the bytes fetched per instruction,
+# the cycles the README's table gives (min, max), and how to emit the
+# instruction: given the assembler and the address t0 holds.  Loads and stores
+# are to RAM A at gp or to flash at t1.  Call and c.ret are timed together as
+# the README has them as JAL and RET.  Taken branches are compressed, as
+# 32-bit ones back to back can upset the fetch restart on the RTL.
+TIMING = [
+    ("c.add",         2, (1, 1),   lambda a, base: a.c_add(a0, a1)),
+    ("c.slli",        2, (2, 2),   lambda a, base: a.c_slli(a0, 1)),
+    ("c.mul16",       2, (2, 2),   lambda a, base: a.c_mul16(a0, a1)),
+    ("add",           4, (1, 1),   lambda a, base: a.add(a0, a0, a1)),
+    ("xor",           4, (1, 1),   lambda a, base: a.xor(a0, a0, a1)),
+    ("lui",           4, (1, 1),   lambda a, base: a.lui(a0, 0x12345)),
+    ("slli",          4, (2, 2),   lambda a, base: a.slli(a0, a0, 3)),
+    ("sra",           4, (2, 2),   lambda a, base: a.sra(a0, a0, a1)),
+    ("mul16",         4, (2, 2),   lambda a, base: a.mul16(a0, a0, a1)),
+    ("branch",        4, (1, 1),   lambda a, base: a.bne(x0, x0, 4)),
+    ("c.beqz taken",  2, (7, 7),   lambda a, base: a.c_beqz(a4, 2)),
+    ("jal",           4, (5, 5),   lambda a, base: a.jal(x0, 4)),
+    ("jalr",          4, (6, 6),   lambda a, base: a.jalr(x0, t0, a.here() + 4 - base)),
+    ("call/c.ret",    6, (10, 10), lambda a, base: a.call("timing_ret")),
+    ("sw peripheral", 4, (1, 1),   lambda a, base: a.sw(tp, x0, 4 * 12)),
+    ("lw peripheral", 4, (2, 2),   lambda a, base: a.lw(a0, tp, 4 * 1)),
+    ("sb ram",        4, (5, 6),   lambda a, base: a.sb(gp, a0, TIMING_DATA)),
+    ("sh ram",        4, (5, 6),   lambda a, base: a.sh(gp, a0, TIMING_DATA)),
+    ("sw ram",        4, (6, 7),   lambda a, base: a.sw(gp, a0, TIMING_DATA)),
+    ("sw2 ram",       4, (11, 12), lambda a, base: a.sw2(gp, a0, TIMING_DATA)),
+    ("sw4 ram",       4, (19, 20), lambda a, base: a.sw4(gp, a0, TIMING_DATA)),
+    ("lb ram",        4, (8, 9),   lambda a, base: a.lb(a0, gp, TIMING_DATA)),
+    ("lh ram",        4, (8, 9),   lambda a, base: a.lh(a0, gp, TIMING_DATA)),
+    ("lw ram",        4, (9, 10),  lambda a, base: a.lw(a0, gp, TIMING_DATA)),
+    ("lw2 ram",       4, (15, 16), lambda a, base: a.lw2(a0, gp, TIMING_DATA)),
+    ("lw4 ram",       4, (23, 24), lambda a, base: a.lw4(a0, gp, TIMING_DATA)),
+    ("lb flash",      4, (8, 9),   lambda a, base: a.lb(a0, t1, 0)),
+    ("lh flash",      4, (8, 9),   lambda a, base: a.lh(a0, t1, 0)),
+    ("lw flash",      4, (9, 10),  lambda a, base: a.lw(a0, t1, 0)),
+    ("lw2 flash",     4, (15, 16), lambda a, base: a.lw2(a0, t1, 0)),
+    ("lw4 flash",     4, (23, 24), lambda a, base: a.lw4(a0, t1, 0)),
+]
+
+# Each class is timed by writing its index to GPIO_OUT before a block of
+# TIMING_COUNT instructions, before a block of twice as many, and after it.
+# The difference between the times of the two blocks is the time for
+# TIMING_COUNT instructions, without the writes or how the blocks start, and
+# a few instructions before the first write settle the fetch.
+def timing():
+    a = Assembler()
+    _start(a)
+    a.la(t1, "timing_data")
+    a.li(a4, 0)
+
+    for index, (_, _, _, emit) in enumerate(TIMING):
+        a.li(a5, index)
+        label = "timing_{}".format(index)
+        a.la(t0, label)
+        a.label(label)
+        base = a.here()
+        for _ in range(TIMING_WARMUP):
+            emit(a, base)
+        for count in (TIMING_COUNT, TIMING_COUNT * 2):
+            a.sw(tp, a5, GPIO_OUT)
+            for _ in range(count):
+                emit(a, base)
+        a.sw(tp, a5, GPIO_OUT)
+
+    a.li(a0, 0)
+    a.j("exit")
+
+    a.label("timing_ret")
+    a.c_ret()
+
+    _exit(a)
+
+    a.align(4)
+    a.label("timing_data")
+    a.data(bytes(range(16)))
+    return a.assemble()
+
+# The cycles (of 8 clocks) taken by each class of instruction, from the
+# clocks of the GPIO_OUT writes
+def timing_cycles(gpio_writes):
+    marks = {}
+    for clock, index in gpio_writes:
+        marks.setdefault(index, []).append(clock)
+    cycles = {}
+    for index, (name, _, _, _) in enumerate(TIMING):
+        assert len(marks.get(index, [])) == 3, "Timing for {} didn't run".format(name)
+        start, middle, end = marks[index]
+        cycles[name] = ((end - middle) - (middle - start)) / TIMING_COUNT / 8
+    return cycles
@@ -0,0 +1,63 @@
+import copy
+
+from cocotb.handle import HierarchyObject, HierarchyArrayObject, NonHierarchyIndexableObject, ModifiableObject
+from cocotb.triggers import ReadWrite
+
+# Checkpoint a simulation after a common prefix, such as the reset and set up
+# each test starts with or a firmware boot, and restore it to skip the prefix
+# the next time.  cocotb can't drive Verilator's save and restore, so the
+# state is the value of every signal in the design, found by walking the
+# hierarchy, with copies of the Python models (anything copy.deepcopy takes,
+# such as the ISS or the qspi_devices memories).
+#
+#   await FallingEdge(dut.clk)
+#   checkpoint = await Checkpoint.save(dut, iss=iss)
+#   ...                                     # a test, or a seed
+#   await FallingEdge(dut.clk)
+#   models = await checkpoint.restore()     # the design as it was
+#   iss = models["iss"]                     # and a fresh copy of the ISS
+#
+# Save and restore at the same edge of the clock, straight after awaiting it.
+# Both go on to the ReadWrite phase of that edge, so the saved values include
+# anything written at the edge, and the restored values can be read back, and
+# the inputs driven, as soon as restore() returns.  The clock itself is left
+# alone, and must already be running when restoring.  Combinational signals are
+# written too, with the values their inputs give, so it doesn't matter whether
+# the simulator re-evaluates them.  Verilator's top level outputs are copies of
+# the design's signals, so a testbench keeps any state of its own in internal
+# regs, as tb_tinyqv does.  The simulation time isn't restored, so anything
+# timed by get_sim_time, rather than counted in clocks, carries on from the
+# time of the restore.
+
+# The signals under a handle, recursing into instances, generate blocks and
+# arrays.  A signal is also indexable, by bit, so is checked first.
+def signals(handle):
+    if isinstance(handle, ModifiableObject):
+        yield handle
+    elif isinstance(handle, (HierarchyObject, HierarchyArrayObject, NonHierarchyIndexableObject)):
+        for child in handle:
+            yield from signals(child)
+
+class Checkpoint:
+    def __init__(self, values, models):
+        self.values = values
+        self.models = models
+
+    @classmethod
+    async def save(cls, dut, clock=None, **models):
+        clock = clock if clock is not None else dut.clk
+        await ReadWrite()
+        values = [(signal, signal.value) for signal in signals(dut) if signal._path != clock._path]
+        return cls(values, copy.deepcopy(models))
+
+    # Restore the design, returning copies of the models, which can be
+    # restored again
+    async def restore(self):
+        for signal, value in self.values:
+            signal.value = value
+        await ReadWrite()
+        return copy.deepcopy(self.models)
+
+    # The number of signals saved
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,61 @@
+# Settings shared by the test_*.mk makefiles, included just before cocotb's
+# Makefile.sim.  Only variables here: a rule would become the default goal.
+
+VERILOG_INCLUDE_DIRS += $(PWD)
+
+# Waveforms are off by default, see dump.vh:
+#   make -f test_cpu.mk DUMP=1        dump the whole run to cpu.vcd
+#   make -f test_cpu.mk DUMP=window   only dump where the test turns dumping
+#                                     on, see dump.py
+#   DUMP_FST=1 writes cpu.fst instead, DUMP_DEPTH=n limits the dump to n
+#   levels of hierarchy and DUMP_FILE overrides the file name.
+# Verilator always dumps the whole run, ignoring DUMP=window and DUMP_DEPTH.
+ifneq ($(filter 1 window,$(DUMP)),)
+  PLUSARGS += +dump
+  ifeq ($(DUMP),window)
+    PLUSARGS += +dump_window
+  endif
+  ifdef DUMP_DEPTH
+    PLUSARGS += +dump_depth=$(DUMP_DEPTH)
+  endif
+
+  ifeq ($(DUMP_FST),1)
+    DUMP_FILE ?= $(MODULE:test_%=%).fst
+    ifeq ($(SIM),icarus)
+      PLUSARGS += -fst
+    endif
+    ifeq ($(SIM),verilator)
+      COMPILE_ARGS += --trace-fst
+    endif
+  else
+    DUMP_FILE ?= $(MODULE:test_%=%).vcd
+    ifeq ($(SIM),verilator)
+      COMPILE_ARGS += --trace
+    endif
+  endif
+  PLUSARGS += +dump_file=$(DUMP_FILE)
+
+  # Verilator dumps through cocotb's main rather than the testbench
+  ifeq ($(SIM),verilator)
+    SIM_ARGS += --trace --trace-file $(DUMP_FILE)
+  endif
+endif
+
+# Verilator needs --timing for the delays in the testbenches and SIM models
+ifeq ($(SIM),verilator)
+  COMPILE_ARGS += --timing
+  SIM_VERSION := $(shell verilator --version)
+else ifeq ($(SIM),icarus)
+  SIM_VERSION := $(shell iverilog -V 2>/dev/null | head -n 1)
+endif
+
+# Each compiled model gets its own build directory, named by a hash of the
+# simulator, cocotb version, sources and compile options, so repeat runs
+# reuse the model and only rebuild when something that affects it changes.
+# Nothing in the model depends on file times once the hash matches, so the
+# outputs are touched to stop make rebuilding after e.g. a git checkout.
+# Old builds are left in sim_build/ until it is removed.
+SIM_HASH := $(shell (echo "$(SIM_VERSION) $(shell cocotb-config --version) $(TOPLEVEL) $(COMPILE_ARGS) $(EXTRA_ARGS)"; \
+                     cat $(VERILOG_SOURCES) $(wildcard $(PWD)/*.vh)) | sha1sum | cut -c 1-12)
+SIM_BUILD ?= sim_build/$(SIM)-$(TOPLEVEL)-$(SIM_HASH)
+$(shell touch -c $(SIM_BUILD)/sim.vvp $(SIM_BUILD)/Vtop.mk; touch -c $(SIM_BUILD)/Vtop)
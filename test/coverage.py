@@ -0,0 +1,278 @@
+import itertools
+import random
+
+from isa import INSTRUCTIONS, LAYOUTS, encode, disassemble
+from iss import decode
+
+# Functional coverage of tinyqv_decoder, and random instructions steered
+# towards the bins that haven't been hit yet.
+#
+# The bins are on the instruction fields and on the decoder's outputs:
+#
+#   ("opcode", op)                 every 32-bit opcode, and every compressed
+#                                  quadrant and funct3 ("c0.001" etc.)
+#   ("instr", name)                every row of isa.INSTRUCTIONS, so every
+#                                  opcode/funct combination
+#   ("reg", name, i, class)        register operand i as x0, gp/tp, x8-x15,
+#                                  the other registers or x16-x31, which the
+#                                  RV32E decoder takes the low 4 bits of
+#   ("imm", name, class)           the immediate's sign and edge values: the
+#                                  min, -1, 0, 1 and max steps of its range
+#   ("first"/"count", name, n)     the first register and the register count
+#                                  of c.lcxt and c.scxt
+#   ("decode", class, len)         which of is_load etc. is set, with instr_len
+#   ("alu_op", class, op)          alu_op of the ALU instructions and branches
+#   ("mem_op", class, op)          mem_op of the loads, stores and branches
+#   ("mem_ops", class, n, inc)     additional_mem_ops and mem_op_increment_reg
+#
+# Only bins some instruction can reach are in the model: it is built by
+# sweeping every instruction over the classes of its operands, naming each
+# encoding again with disassemble() (so c.jr x1 is c.ret, not c.jr) and
+# decoding it with the ISS.  Each bin remembers the instructions and operand
+# classes that reach it, which is how directed() aims at it.
+#
+#   coverage = Coverage()
+#   for instr in coverage.directed(rng, 100):
+#       ...                                  # drive the decoder
+#       coverage.sample(instr, outputs)      # outputs as a dict, X as None
+#   print(coverage.report())
+
+FLAGS = ["is_load", "is_alu_imm", "is_auipc", "is_store", "is_alu_reg", "is_lui",
+         "is_branch", "is_jalr", "is_jal", "is_system"]
+OUTPUTS = FLAGS + ["is_ret", "instr_len", "alu_op", "mem_op", "additional_mem_ops", "mem_op_increment_reg"]
+
+REG_CLASSES = {
+    "x0": [0],
+    "gp/tp": [3, 4],
+    "x8-x15": list(range(8, 16)),
+    "other": [1, 2, 5, 6, 7],
+    "x16-x31": list(range(16, 32)),
+}
+IMM_CLASSES = ["min", "negative", "-1", "0", "1", "positive", "max"]
+
+# Tries at drawing an operand that gives the instruction aimed at
+DRAWS = 20
+
+# The class of an immediate, for a range low <= value < high in steps
+def imm_class(value, low, high, step):
+    if value == 0:
+        return "0"
+    if value == low:
+        return "min"
+    if value == high - step:
+        return "max"
+    if value == step:
+        return "1"
+    if value == -step:
+        return "-1"
+    return "negative" if value < 0 else "positive"
+
+class _Immediate:
+    def __init__(self, layout):
+        signed, slices = LAYOUTS[layout]
+        imm_bits = 0
+        for _, _, imm_hi, imm_lo in slices:
+            imm_bits |= ((1 << (imm_hi - imm_lo + 1)) - 1) << imm_lo
+        top = imm_bits.bit_length()
+        self.step = imm_bits & -imm_bits
+        self.low, self.high = (-(1 << (top - 1)), 1 << (top - 1)) if signed else (0, 1 << top)
+
+    def classify(self, value):
+        return imm_class(value, self.low, self.high, self.step)
+
+    # The classes the range has
+    def classes(self):
+        step = self.step
+        points = [self.low, self.low + step, -2 * step, -step, 0, step, 2 * step, self.high - 2 * step, self.high - step]
+        found = {self.classify(value) for value in points if self.low <= value < self.high}
+        return [c for c in IMM_CLASSES if c in found]
+
+    def draw(self, rng, c):
+        step = self.step
+        ranges = {"min": (self.low, self.low), "max": (self.high - step, self.high - step),
+                  "-1": (-step, -step), "0": (0, 0), "1": (step, step),
+                  "negative": (self.low + step, -2 * step), "positive": (2 * step, self.high - 2 * step)}
+        low, high = ranges[c]
+        return rng.randrange(low, high + 1, step)
+
+# An operand of an instruction, with its classes and how to draw a value
+# from one
+class _Operand:
+    def __init__(self, kind, where):
+        self.kind = kind
+        self.immediate = _Immediate(where) if kind == "imm" else None
+
+    def classes(self):
+        if self.kind == "reg":
+            return list(REG_CLASSES)
+        if self.kind == "creg":
+            return ["x8-x15"]
+        if self.kind == "first":
+            return ["x1", "x9"]
+        if self.kind == "count":
+            return [str(n) for n in range(1, 9)]
+        return self.immediate.classes()
+
+    def classify(self, value):
+        if self.kind in ("reg", "creg"):
+            return next(c for c, regs in REG_CLASSES.items() if value in regs)
+        if self.kind == "first":
+            return "x{}".format(value)
+        if self.kind == "count":
+            return str(value)
+        return self.immediate.classify(value)
+
+    def draw(self, rng, c):
+        if self.kind in ("reg", "creg"):
+            return rng.choice(REG_CLASSES[c])
+        if self.kind in ("first", "count"):
+            return int(c.lstrip("x"))
+        return self.immediate.draw(rng, c)
+
+    # The bin for a value of operand i of instruction name
+    def bin(self, name, i, value):
+        if self.kind == "reg":
+            return ("reg", name, i, self.classify(value))
+        if self.kind == "imm":
+            return ("imm", name, self.classify(value))
+        if self.kind in ("first", "count"):
+            return (self.kind, name, self.classify(value))
+        return None
+
+OPERANDS = {name: [_Operand(*field) for field in fields] for name, (_, fields) in INSTRUCTIONS.items()}
+
+def opcode_bin(instr):
+    if instr & 3 == 3:
+        return ("opcode", "{:05b}".format((instr >> 2) & 0x1F))
+    return ("opcode", "c{}.{:03b}".format(instr & 3, (instr >> 13) & 7))
+
+# The outputs of the ISS's decode, as sample() takes them
+def iss_outputs(d):
+    return {name: int(getattr(d, name)) for name in OUTPUTS}
+
+# Which of the decoder's instruction classes is set
+def decode_class(outputs):
+    if outputs["is_ret"]:
+        return "ret"
+    return next((flag[3:] for flag in FLAGS if outputs[flag]), "none")
+
+def output_bins(outputs):
+    c = decode_class(outputs)
+    bins = [("decode", c, outputs["instr_len"])]
+    if c in ("alu_imm", "alu_reg", "branch"):
+        bins.append(("alu_op", c, outputs["alu_op"]))
+    if c in ("load", "store", "branch") and outputs["mem_op"] is not None:
+        bins.append(("mem_op", c, outputs["mem_op"]))
+    if c in ("load", "store"):
+        bins.append(("mem_ops", c, outputs["additional_mem_ops"], outputs["mem_op_increment_reg"]))
+    return bins
+
+# The bins an instruction's fields hit, or just its opcode if it isn't one
+# of the instructions in the table
+def field_bins(instr):
+    bins = [opcode_bin(instr)]
+    named = disassemble(instr)
+    if named:
+        name, operands = named
+        bins.append(("instr", name))
+        for i, (operand, value) in enumerate(zip(OPERANDS[name], operands)):
+            b = operand.bin(name, i, value)
+            if b:
+                bins.append(b)
+    return bins
+
+# Draw an instruction name with its operands from the classes given,
+# returning None if every try names as some other instruction
+def draw_instr(rng, name, classes):
+    for _ in range(DRAWS):
+        operands = [operand.draw(rng, c) for operand, c in zip(OPERANDS[name], classes)]
+        instr = encode(name, *operands)
+        named = disassemble(instr)
+        if named and named[0] == name:
+            return instr
+    return None
+
+# Random bits with the opcode of an opcode bin
+def draw_opcode(rng, op):
+    if op.startswith("c"):
+        quadrant, funct3 = int(op[1]), int(op[3:], 2)
+        return (rng.getrandbits(16) & 0x1FFC) | (funct3 << 13) | quadrant
+    return (rng.getrandbits(32) & ~0x7F) | (int(op, 2) << 2) | 3
+
+# Words for blind random decoding, as test_random uses: half compressed,
+# with the top half cleared and the low bits not 11
+def random_word(rng):
+    instr = rng.getrandbits(32)
+    if rng.getrandbits(1):
+        instr &= 0xFFFF
+        if instr & 3 == 3:
+            instr ^= rng.randint(1, 3)
+    return instr
+
+class Coverage:
+    def __init__(self, seed=0):
+        self.hits = {}
+        self.recipes = {}
+        rng = random.Random(seed)
+
+        for quadrant in range(4):
+            for op in range(32 if quadrant == 3 else 8):
+                key = ("opcode", "{:05b}".format(op) if quadrant == 3 else "c{}.{:03b}".format(quadrant, op))
+                self.hits[key] = 0
+                self.recipes[key] = [("opcode", key[1])]
+
+        for name, operands in OPERANDS.items():
+            for classes in itertools.product(*(operand.classes() for operand in operands)):
+                instr = draw_instr(rng, name, classes)
+                if instr is None:
+                    continue
+                for key in field_bins(instr)[1:] + output_bins(iss_outputs(decode(instr))):
+                    self.hits.setdefault(key, 0)
+                    recipes = self.recipes.setdefault(key, [])
+                    if len(recipes) < 8:
+                        recipes.append((name, classes))
+
+    def sample(self, instr, outputs):
+        for key in field_bins(instr) + output_bins(outputs):
+            if key in self.hits:
+                self.hits[key] += 1
+
+    def missing(self):
+        return [key for key, hits in self.hits.items() if not hits]
+
+    def covered(self):
+        return sum(1 for hits in self.hits.values() if hits)
+
+    def closed(self):
+        return self.covered() == len(self.hits)
+
+    # count instructions, each aimed at a bin not yet hit, picked at random,
+    # or random words once every bin is covered
+    def directed(self, rng, count):
+        missing = self.missing()
+        instrs = []
+        for _ in range(count):
+            instr = None
+            if missing:
+                recipe = rng.choice(self.recipes[rng.choice(missing)])
+                if recipe[0] == "opcode":
+                    instr = draw_opcode(rng, recipe[1])
+                else:
+                    instr = draw_instr(rng, *recipe)
+            instrs.append(random_word(rng) if instr is None else instr)
+        return instrs
+
+    def report(self, limit=20):
+        lines = ["Decoder coverage {} of {} bins, {:.1f}%".format(
+            self.covered(), len(self.hits), 100 * self.covered() / len(self.hits))]
+        groups = {}
+        for key, hits in self.hits.items():
+            covered, total = groups.get(key[0], (0, 0))
+            groups[key[0]] = (covered + (hits > 0), total + 1)
+        for group, (covered, total) in groups.items():
+            lines.append("  {:8} {:5} of {:5}".format(group, covered, total))
+        missing = self.missing()
+        if missing:
+            lines.append("Missing: " + ", ".join(" ".join(str(part) for part in key) for key in missing[:limit]) +
+                         (", ..." if len(missing) > limit else ""))
+        return "\n".join(lines)
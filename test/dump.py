@@ -0,0 +1,27 @@
+import os
+from contextlib import contextmanager
+
+# Control waveform dumping from a test.  The testbench only dumps if run with
+# DUMP=1 or DUMP=window (see common.mk and dump.vh), these are no-ops otherwise.
+# With DUMP=window nothing is written until dump_on is called.
+
+def dump_on(dut):
+    dut.dump_enable.value = 1
+
+def dump_off(dut):
+    dut.dump_enable.value = 0
+
+# Dump only while inside the with block, if enable is set
+@contextmanager
+def dump_window(dut, enable=True):
+    if enable:
+        dump_on(dut)
+    try:
+        yield
+    finally:
+        if enable:
+            dump_off(dut)
+
+# Seeds of randomised tests that should be dumped, from DUMP_SEED=<seed>[,<seed>...]
+def dump_seeds():
+    return [int(seed, 0) for seed in os.environ.get("DUMP_SEED", "").split(",") if seed]
@@ -0,0 +1,52 @@
+// Opt-in waveform dumping for the cocotb testbenches.
+//
+// Included inside each tb_*.v module after defining DUMP_TOP as the name of
+// that module.  Nothing is dumped unless the simulation is run with one of
+// these plusargs, which common.mk adds when DUMP is set:
+//
+//   +dump               dump the whole run
+//   +dump_window        open the dump file but start with dumping off, the
+//                       test then turns it on and off by driving dump_enable
+//                       (see dump.py)
+//   +dump_file=<name>   dump file name, default dump.vcd
+//   +dump_depth=<n>     hierarchy levels to dump, default 0 (everything)
+//
+// iverilog writes FST instead of VCD when vvp is run with -fst.
+//
+// $dumpon/$dumpoff are ignored by verilator, which also needs tracing set up
+// by the C++ harness, so there the dump is written by cocotb's main (see
+// common.mk) and always covers the whole run.
+
+reg dump_enable = 0;
+
+`ifndef VERILATOR
+reg dump_active = 0;
+reg [8*128-1:0] dump_file;
+integer dump_depth;
+
+initial begin
+  if ($test$plusargs("dump")) begin
+    if (!$value$plusargs("dump_file=%s", dump_file))
+      dump_file = "dump.vcd";
+    if (!$value$plusargs("dump_depth=%d", dump_depth))
+      dump_depth = 0;
+
+    $dumpfile (dump_file);
+    $dumpvars (dump_depth, `DUMP_TOP);
+    dump_active = 1;
+
+    if ($test$plusargs("dump_window"))
+      $dumpoff;
+    else
+      dump_enable = 1;
+  end
+end
+
+always @(dump_enable)
+  if (dump_active) begin
+    if (dump_enable)
+      $dumpon;
+    else
+      $dumpoff;
+  end
+`endif
@@ -0,0 +1,295 @@
+import struct
+
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles, Event, First, FallingEdge, RisingEdge, ReadOnly
+
+from iss import Peripherals, TP, FLASH_SIZE, RAM_A, RAM_B, RAM_SIZE
+from qspi_devices import W25Q128, APS6404L, map_file, diff_bytes
+from qspi_pmod import QspiPmod
+from checkpoint import Checkpoint
+
+# Run firmware on the whole of TinyQV (tb_tinyqv), with the QSPI PMOD device
+# models as memory and the pico-ice peripherals from the ISS.
+#
+#   soc = Soc(dut, "firmware.elf")        # or a raw binary for the flash
+#   await soc.reset()
+#   result = await soc.run(max_clocks=1000000)
+#   print(result)
+#
+# Images are preloaded straight into the device models, with files mapped
+# rather than read, so a multi-megabyte image costs nothing until it is used.
+# ram_a and ram_b are raw images for the PSRAMs, and preload() loads any
+# image at an address.  At the end of a test the memories can be checked
+# without running code to read them back:
+#
+#   before = soc.snapshot()
+#   ...
+#   for addr, old, new in soc.changes(before): ...
+#   assert not soc.diff(RAM_A + 0x1000, "expected.bin")
+#   soc.dump(RAM_A + 0x1000, 0x100, "results.bin")
+#
+# A run can be checkpointed, with the memories and peripherals, so that later
+# runs, in the same test or the next, skip the boot:
+#
+#   await soc.run(boot_clocks)
+#   checkpoint = await soc.checkpoint()
+#   ...
+#   soc = Soc(dut)
+#   await soc.restore(checkpoint)        # instead of reset()
+#
+# Firmware stops with a store to EXIT, which gives the exit code, by trapping
+# (an ecall, ebreak or illegal instruction, as the fetch restarts at the trap
+# vector), or at the clock limit.  The result has the clocks, instructions,
+# fetch restarts and data stall clocks counted by tb_tinyqv, and what the
+# firmware sent to the UARTs and the GPIOs, with the clock of each GPIO write.
+# Everything is counted in clocks, except CPI, which is in the README's cycles
+# of 8 clocks.
+#
+# The peripherals answer in the cycle they are accessed, like on the pico-ice.
+# interrupt_req follows the peripherals, so a test can raise in0 and in1 with
+# Soc.set_inputs.  latency is both the read delay the memory controller is
+# configured with and the latency of the device models, in clocks.
+
+# A store here stops the firmware with the stored value as the exit code.  This
+# is a peripheral register the pico-ice doesn't use, so the same firmware
+# runs on the ISS, where it is ignored.
+EXIT = TP + 0x3C
+
+# The loadable segments of an ELF file as (address, data), by physical
+# address so that initialised data is loaded to flash for the startup code
+# to copy.  Segments without bss are slices of data, so aren't copied from a
+# memoryview.
+def elf_segments(data):
+    assert data[4] == 1 and data[5] == 1, "Not a 32-bit little endian ELF"
+    phoff, = struct.unpack_from("<I", data, 28)
+    phentsize, phnum = struct.unpack_from("<HH", data, 42)
+    segments = []
+    for i in range(phnum):
+        p_type, offset, _, paddr, filesz, memsz = struct.unpack_from("<6I", data, phoff + i * phentsize)
+        if p_type == 1 and memsz == filesz:
+            segments.append((paddr, data[offset:offset + filesz]))
+        elif p_type == 1 and memsz:
+            segments.append((paddr, bytes(data[offset:offset + filesz]) + bytes(memsz - filesz)))
+    return segments
+
+# The functions in an ELF file's symbol table as {name: address}, or the
+# labels if it has no function symbols, as for hand written assembler
+def elf_symbols(data):
+    shoff, = struct.unpack_from("<I", data, 32)
+    shentsize, shnum = struct.unpack_from("<HH", data, 46)
+    sections = [struct.unpack_from("<10I", data, shoff + i * shentsize) for i in range(shnum)]
+    symbols = {0: {}, 2: {}}
+    for _, sh_type, _, _, offset, size, link, _, _, entsize in sections:
+        if sh_type != 2:
+            continue
+        strtab = sections[link][4]
+        for pos in range(offset, offset + size, entsize):
+            name, value, _, info, _, shndx = struct.unpack_from("<3I2BH", data, pos)
+            if info & 0xF in symbols and name and shndx != 0:
+                name = data[strtab + name:data.index(b"\0", strtab + name)].decode()
+                if not name.startswith(("$", ".L")):
+                    symbols[info & 0xF][name] = value
+    return symbols[2] or symbols[0]
+
+class Result:
+    def __init__(self, reason, exit_code, clocks, instret, fetch_restarts, data_stalls, peripherals, gpio_writes):
+        self.reason = reason
+        self.exit_code = exit_code
+        self.clocks = clocks
+        self.instret = instret
+        self.fetch_restarts = fetch_restarts
+        self.data_stalls = data_stalls
+        self.uart = bytes(peripherals.uart_tx)
+        self.debug_uart = bytes(peripherals.debug_uart_tx)
+        self.gpio_writes = gpio_writes
+
+    # Cycles per instruction, in the README's cycles of 8 clocks
+    @property
+    def cpi(self):
+        return self.clocks / 8 / self.instret if self.instret else 0
+
+    def __str__(self):
+        return "{} ({}) after {} clocks, {} instructions, CPI {:.2f}, {} fetch restarts, {} data stall clocks".format(
+            self.reason, self.exit_code, self.clocks, self.instret, self.cpi, self.fetch_restarts, self.data_stalls)
+
+# The differences found by Soc.diff or Soc.changes, a line per run, as hex
+def format_differences(differences, limit=16):
+    lines = ["{:07x}: {} -> {}".format(addr, old[:16].hex(" "), new[:16].hex(" ") + (" ..." if len(new) > 16 else ""))
+             for addr, old, new in differences[:limit]]
+    if len(differences) > limit:
+        lines.append("... {} more".format(len(differences) - limit))
+    return "\n".join(lines)
+
+class Soc:
+    def __init__(self, dut, image=None, latency=1, peripherals=None, ram_a=None, ram_b=None):
+        self.dut = dut
+        self.latency = latency
+        self.peripherals = peripherals if peripherals is not None else Peripherals()
+        self.flash = W25Q128()
+        self.ram_a = APS6404L()
+        self.ram_b = APS6404L()
+        self.pmod = None
+        for addr, preload in ((0, image), (RAM_A, ram_a), (RAM_B, ram_b)):
+            if preload is not None:
+                self.preload(preload, addr)
+
+    # The device and offset for an address in the memory map
+    def _memory(self, addr):
+        if addr < FLASH_SIZE:
+            return self.flash, addr
+        if addr < RAM_B:
+            return self.ram_a, addr - RAM_A
+        assert addr < RAM_B + RAM_SIZE, "Address {:07x} not in flash or RAM".format(addr)
+        return self.ram_b, addr - RAM_B
+
+    # Preload an image, a file or bytes: an ELF file's segments at their
+    # addresses, or anything else at addr.  The first segment on each device
+    # replaces its contents, so the rest of that device is erased, and later
+    # ones are written over it.
+    def preload(self, image, addr=0):
+        if isinstance(image, str):
+            image = map_file(image)
+        segments = elf_segments(image) if image[:4] == b"\x7fELF" else [(addr, image)]
+        loaded = []
+        for addr, data in segments:
+            device, offset = self._memory(addr)
+            if device in loaded:
+                device.memory.write(offset, data)
+            else:
+                device.memory.preload(data, offset)
+                loaded.append(device)
+
+    # Backdoor access to the memories
+    def load(self, addr, data):
+        device, offset = self._memory(addr)
+        device.memory.write(offset, data)
+
+    def read(self, addr, length):
+        device, offset = self._memory(addr)
+        return device.memory.read(offset, length)
+
+    # Write length bytes from addr to a file
+    def dump(self, addr, length, path):
+        with open(path, "wb") as f:
+            f.write(self.read(addr, length))
+
+    # The runs of bytes that differ from the expected bytes (or file) at
+    # addr, as (addr, expected, actual)
+    def diff(self, addr, expected):
+        if isinstance(expected, str):
+            expected = map_file(expected)
+        return diff_bytes(expected, self.read(addr, len(expected)), addr)
+
+    # Copies of the memories, for changes()
+    def snapshot(self):
+        return [device.memory.snapshot() for device in (self.flash, self.ram_a, self.ram_b)]
+
+    # The runs of bytes that have changed since a snapshot, as (addr, before,
+    # after)
+    def changes(self, snapshot):
+        return [(base + addr, old, new)
+                for base, device, memory in zip((0, RAM_A, RAM_B), (self.flash, self.ram_a, self.ram_b), snapshot)
+                for addr, old, new in device.memory.diff(memory)]
+
+    async def reset(self):
+        dut = self.dut
+        cocotb.start_soon(Clock(dut.clk, 4, units="ns").start())
+        dut.data_ready.value = 1
+        dut.data_in.value = 0
+        dut.timer_interrupt.value = 0
+        dut.interrupt_req.value = self.peripherals.interrupt_req()
+
+        # The delay cycles are set through spi_data_in in reset
+        dut.rstn.value = 1
+        await ClockCycles(dut.clk, 2)
+        dut.rstn.value = 0
+        dut.spi_data_in.value = self.latency
+        await ClockCycles(dut.clk, 3, False)
+        dut.rstn.value = 1
+        self.pmod = QspiPmod(dut, self.flash, self.ram_a, self.ram_b, self.latency)
+
+    # Checkpoint between runs, at the next clock where neither the QSPI bus
+    # nor the peripherals are in the middle of an access, as a transaction
+    # in progress in the device models can't be copied
+    async def checkpoint(self):
+        dut = self.dut
+        self._exit = Event()
+        self._gpio_writes = []
+        task = cocotb.start_soon(self._peripherals())
+        while True:
+            await FallingEdge(dut.clk)
+            if (all(select.value == 1 for select, _ in self.pmod.devices) and
+                    dut.data_read_n.value == 3 and dut.data_write_n.value == 3):
+                break
+        task.kill()
+        return await Checkpoint.save(dut, flash=self.flash, ram_a=self.ram_a, ram_b=self.ram_b,
+                                     peripherals=self.peripherals)
+
+    # Restore a checkpoint, in place of reset()
+    async def restore(self, checkpoint):
+        dut = self.dut
+        if self.pmod is None:
+            cocotb.start_soon(Clock(dut.clk, 4, units="ns").start())
+        else:
+            self.pmod.stop()
+        await FallingEdge(dut.clk)
+        models = await checkpoint.restore()
+        self.flash, self.ram_a, self.ram_b = models["flash"], models["ram_a"], models["ram_b"]
+        self.peripherals = models["peripherals"]
+        self.pmod = QspiPmod(dut, self.flash, self.ram_a, self.ram_b, self.latency)
+
+    # Set in0 and in1, which interrupt on a rising edge
+    def set_inputs(self, value):
+        self.peripherals.gpio_in = value
+        self.dut.interrupt_req.value = self.peripherals.interrupt_req()
+
+    async def run(self, max_clocks=1000000):
+        dut = self.dut
+        self._exit = Event()
+        self._gpio_writes = []
+        task = cocotb.start_soon(self._peripherals())
+        trap = RisingEdge(dut.trap)
+        timeout = ClockCycles(dut.clk, max_clocks)
+
+        trigger = await First(self._exit.wait(), trap, timeout)
+        task.kill()
+        if trigger is trap:
+            reason, exit_code = "trap", dut.qv.cpu.i_core.mcause.value.integer
+        elif trigger is timeout:
+            reason, exit_code = "timeout", None
+        else:
+            reason, exit_code = "exit", self._exit.data
+
+        return Result(reason, exit_code, dut.clocks.value.integer, dut.instret.value.integer,
+                      dut.fetch_restarts.value.integer, dut.data_stalls.value.integer,
+                      self.peripherals, self._gpio_writes)
+
+    # Reads and writes above the memories go to the peripherals, which answer
+    # immediately, so each is on the bus for a single cycle
+    async def _peripherals(self):
+        dut = self.dut
+        while True:
+            await RisingEdge(dut.clk)
+            await ReadOnly()
+            write = dut.data_write_n.value.integer != 3
+            read = dut.data_read_n.value.integer != 3
+            if not (read or write):
+                continue
+
+            addr = dut.data_addr.value.integer
+            if write:
+                value = dut.data_out.value.integer
+                if addr == EXIT:
+                    self._exit.set(value)
+                    return
+                if Peripherals.register(addr) == Peripherals.GPIO_OUT:
+                    self._gpio_writes.append((dut.clocks.value.integer, value & 0xFF))
+                self.peripherals.write(addr, value)
+            else:
+                value = self.peripherals.read(addr)
+
+            await FallingEdge(dut.clk)
+            if read:
+                dut.data_in.value = value
+            dut.interrupt_req.value = self.peripherals.interrupt_req()
@@ -0,0 +1,597 @@
+import copy
+import random
+
+from cocotb.triggers import ClockCycles, FallingEdge, RisingEdge, ReadOnly
+
+from asm import Assembler
+from isa import disassemble
+from iss import TinyQV, Hang, decode, ADDR_MASK, PC_MASK, RAM_A
+from timing import Memory
+from backdoor import Backdoor, MSTATUS, MIE, MEPC, MCAUSE, MIP
+
+# Lockstep differential fuzzing of tinyqv_cpu (tb_cpu) against the ISS.
+#
+# Program is a random program over the whole instruction set: the ALU,
+# compressed and custom instructions, loads and stores to flash, RAM and the
+# peripherals, forward branches and jumps, calls, CSR accesses and traps,
+# with random pulses on interrupt_req and timer_interrupt while it runs.
+# lockstep() runs it on the CPU, with timing.Memory (at latencies picked by
+# the program) standing in for the memory controller, and steps the ISS
+# each time an instruction completes.  After every instruction the pc, the
+# registers and CSRs (read from the RTL), every data access and whether an
+# interrupt is taken are compared, and the first difference is raised as a
+# Divergence.  shrink() removes items from a failing program for as long as
+# it still diverges in the same way, leaving a short reproducer.
+#
+#   program = Program(seed)
+#   try:
+#       await lockstep(dut, program)
+#   except Divergence as e:
+#       program, e = await shrink(dut, program, e)
+#       dut._log.error("{}\n{}".format(e, program.listing(e.pc)))
+#
+# When an edge on interrupt_req is seen depends on the CPU's timing, so
+# before each instruction the ISS takes the interrupt inputs and pending
+# edges from the RTL, then has to agree on whether the interrupt is taken.
+# A jal while a store still holds the memory can hang the CPU (see
+# timing.py), as can an interrupt taken part way through a multi word load or
+# store, which leaves data_continue set so the memory controller never ends
+# the transfer.  Programs avoid both: there is no jal between a store and the
+# next load, which waits for the store to finish, and multi word loads and
+# stores run with interrupts masked until a load has waited for them.  If a
+# program still stops with the hang seen coming run() returns "hang", for
+# the caller to count.
+
+READ_CSRS = (MSTATUS, 0x301, MIE, MEPC, MCAUSE, 0xF13)
+
+# Registers the random code writes.  ra is only written by calls, sp and s0
+# hold RAM addresses for the loads and stores relative to them, and x15 is
+# the scratch register of the trap and interrupt handlers.
+DATA_REGS = [5, 6, 7, 9, 10, 11, 12, 13, 14]
+COMPRESSED_REGS = [9, 10, 11, 12, 13, 14]
+SCRATCH = 15
+SP = RAM_A + 0x8000
+S0 = RAM_A + 0x4000
+
+ALU_REG_OPS = ["add", "sub", "and", "or", "xor", "slt", "sltu", "sll", "srl", "sra", "mul16", "czero.eqz", "czero.nez"]
+ALU_IMM_OPS = ["addi", "andi", "ori", "xori", "slti", "sltiu"]
+SHIFT_OPS = ["slli", "srli", "srai"]
+BRANCH_OPS = ["beq", "bne", "blt", "bge", "bltu", "bgeu"]
+LOADS = [("lb", 1), ("lh", 2), ("lw", 4), ("lbu", 1), ("lhu", 2)]
+STORES = [("sb", 1), ("sh", 2), ("sw", 4)]
+LOAD_OPS = {"lb", "lh", "lw", "lbu", "lhu", "lw2", "lw4", "c.lw", "c.lh", "c.lhu", "c.lbu", "c.lwsp", "c.lwtp", "c.lcxt"}
+STORE_OPS = {"sb", "sh", "sw", "sw2", "sw4", "sw4n", "c.sw", "c.sh", "c.sb", "c.swsp", "c.swtp", "c.scxt"}
+
+# An instruction no decoder accepts as anything but a trap (uret), mcause 2
+ILLEGAL = 0x00200073
+
+# Clocks with no instruction completing before the CPU is taken to have
+# stopped, and clocks run after reaching the end for the last stores
+STOPPED_CLOCKS = 1000
+END_CLOCKS = 200
+
+def _nonzero(rng, low, high):
+    return rng.choice([i for i in range(low, high + 1) if i])
+
+###### Program generation ######
+
+# Each item is a list of (instruction, operands), where a branch or jump
+# target can be a label, or ("la", (reg, label)) or ("word", (value,))
+
+def _alu(rng):
+    rd, rs1, rs2 = rng.choice(DATA_REGS), rng.randint(0, 15), rng.randint(1, 15)
+    creg, crs2 = rng.choice(COMPRESSED_REGS), rng.randint(8, 15)
+    choice = rng.randrange(12)
+    if choice == 0: return [(rng.choice(ALU_REG_OPS), (rd, rs1, rs2))]
+    if choice == 1: return [(rng.choice(ALU_IMM_OPS), (rd, rs1, rng.randint(-2048, 2047)))]
+    if choice == 2: return [(rng.choice(SHIFT_OPS), (rd, rs1, rng.randint(0, 31)))]
+    if choice == 3: return [(rng.choice(["lui", "auipc"]), (rd, rng.randint(0, 0xFFFFF)))]
+    if choice == 4: return [(rng.choice(["c.addi", "c.li"]), (rd, _nonzero(rng, -32, 31)))]
+    if choice == 5: return [(rng.choice(["c.lui"]), (rd, _nonzero(rng, -32, 31)))]
+    if choice == 6: return [("c.slli", (rd, rng.randint(1, 31)))]
+    if choice == 7:
+        if rng.randrange(2): return [(rng.choice(["c.srli", "c.srai"]), (creg, rng.randint(1, 31)))]
+        return [("c.andi", (creg, rng.randint(-32, 31)))]
+    if choice == 8: return [(rng.choice(["c.sub", "c.xor", "c.or", "c.and"]), (creg, crs2))]
+    if choice == 9: return [(rng.choice(["c.zext.b", "c.zext.h", "c.not"]), (creg,))]
+    if choice == 10: return [(rng.choice(["c.mv", "c.add", "c.mul16"]), (rd, rs2))]
+    return rng.choice([
+        [("c.addi4spn", (creg, rng.randint(1, 255) * 4))],
+        [("c.addi16sp", (_nonzero(rng, -32, 31) * 16,))],
+        [("nop", ())],
+        [("c.nop", ())],
+    ])
+
+def _load_store(rng):
+    rd, rs2 = rng.choice(DATA_REGS), rng.randint(0, 15)
+    choice = rng.randrange(6)
+    if choice == 0:
+        # Flash, including the program
+        op, size = rng.choice(LOADS)
+        return [(op, (rd, 0, rng.randint(0, 0x7FF) & -size))]
+    if choice in (1, 2):
+        # RAM, relative to gp, sp or s0, or the peripherals relative to tp
+        base = rng.choice([3, 2, 8, 4])
+        offset = rng.randint(0, 0x3F) if base == 4 else rng.randint(-0x400, 0x7FF)
+        if rng.randrange(3):
+            if choice == 1:
+                op, size = rng.choice(LOADS)
+                return [(op, (rd, base, offset & -size))]
+            op, size = rng.choice(STORES)
+            return [(op, (base, rs2, offset & -size))]
+        if choice == 1:
+            op, first = rng.choice([("lw2", [5, 6, 9, 10, 11, 12, 13]), ("lw4", [9, 10, 11])])
+            return _masked([(op, (rng.choice(first), base, offset & -4))])
+        return _masked([(rng.choice(["sw2", "sw4", "sw4n"]), (base, rs2, offset & -4))])
+    if choice == 3:
+        # Compressed, relative to s0
+        creg, crs2 = rng.choice(COMPRESSED_REGS), rng.randint(8, 15)
+        return rng.choice([
+            [("c.lw", (creg, 8, rng.randint(0, 31) * 4))],
+            [(rng.choice(["c.lhu", "c.lh"]), (creg, 8, rng.randint(0, 1) * 2))],
+            [("c.lbu", (creg, 8, rng.randint(0, 3)))],
+            [("c.sw", (8, crs2, rng.randint(0, 31) * 4))],
+            [("c.sh", (8, crs2, rng.randint(0, 1) * 2))],
+            [("c.sb", (8, crs2, rng.randint(0, 3)))],
+        ])
+    if choice == 4:
+        return rng.choice([
+            [("c.lwsp", (rd, rng.randint(0, 63) * 4))],
+            [("c.swsp", (rs2, rng.randint(0, 63) * 4))],
+            [("c.lwtp", (rd, rng.randint(0, 15) * 4))],
+            [("c.swtp", (rs2, rng.randint(0, 15) * 4))],
+        ])
+    # Context loads from x9 stop short of the handlers' scratch register
+    offset = rng.randint(-32, 31) * 16
+    if rng.randrange(2):
+        return _masked([("c.lcxt", (9, rng.randint(1, 6), offset))])
+    first = rng.choice([1, 9])
+    return _masked([("c.scxt", (first, rng.randint(1, 8 if first == 1 else 7), offset))])
+
+# A multi word load or store with interrupts masked, saving mstatus in the
+# handlers' scratch register (CSR immediates aren't implemented), and a load
+# from flash to wait for the transfer to end before they are unmasked
+def _masked(item):
+    return ([("addi", (SCRATCH, 0, 8)), ("csrrc", (SCRATCH, SCRATCH, MSTATUS))] + item +
+            [("lw", (0, 0, 0)), ("csrrw", (0, SCRATCH, MSTATUS))])
+
+# Whether a store in item is still running at its end, as no load follows it
+def _stores(item, storing=False):
+    for name, _ in item:
+        storing = name in STORE_OPS or storing and name not in LOAD_OPS
+    return storing
+
+# Branches and jumps to target, with no jal while storing
+def _jump(rng, target, storing=False):
+    rd = rng.choice([0] + DATA_REGS)
+    choice = rng.choice([0, 1, 4, 5]) if storing else rng.randrange(6)
+    if choice == 0: return [(rng.choice(BRANCH_OPS), (rng.randint(0, 15), rng.randint(0, 15), target))]
+    if choice == 1: return [(rng.choice(["c.beqz", "c.bnez"]), (rng.randint(8, 15), target))]
+    if choice == 2: return [("jal", (rd, target))]
+    if choice == 3: return [("c.j", (target,))]
+    if choice == 4: return [("la", (6, target)), ("jalr", (rd, 6, 0))]
+    return [("la", (6, target)), ("c.jr", (6,))]
+
+def _call(rng, target):
+    return rng.choice([
+        [("jal", (1, target))],
+        [("c.jal", (target,))],
+        [("la", (6, target)), ("jalr", (1, 6, 0))],
+        [("la", (6, target)), ("c.jalr", (6,))],
+    ])
+
+# CSR accesses.  mip is only written, as when an edge is seen on a read
+# depends on the timing, and the counters aren't read: instret is added to
+# at counter 0, so a read straight after an instruction completes misses it.
+def _csr(rng):
+    rd, rs1, zimm = rng.choice([0] + DATA_REGS), rng.randint(0, 15), rng.randint(0, 31)
+    choice = rng.randrange(5)
+    if choice == 0: return [(rng.choice(["csrrw", "csrrs", "csrrc"]), (rd, rs1, rng.choice([MSTATUS, MIE])))]
+    if choice == 1: return [(rng.choice(["csrrwi", "csrrsi", "csrrci"]), (rd, zimm, rng.choice([MSTATUS, MIE])))]
+    if choice == 2:
+        if rng.randrange(2): return [(rng.choice(["csrrw", "csrrs", "csrrc"]), (0, rs1, MIP))]
+        return [(rng.choice(["csrrwi", "csrrsi", "csrrci"]), (0, zimm, MIP))]
+    if choice == 3: return [("csrrs", (rd, 0, rng.choice(READ_CSRS)))]
+    return [("csrrw", (rd, rs1, MEPC))]
+
+# Traps, all 4 bytes as the handler returns to mepc + 4
+def _trap(rng):
+    return rng.choice([
+        [("ecall", ())],
+        [("ebreak", ())],
+        [("word", (ILLEGAL,))],
+        [("c.ebreak", ()), ("c.nop", ())],
+    ])
+
+class Program:
+    # length items after setting up the registers, with branches and jumps
+    # only going forward so that it always finishes
+    def __init__(self, seed, length=60, interrupt_rate=1 / 256):
+        rng = random.Random(seed)
+        self.seed = seed
+        self.interrupt_rate = interrupt_rate
+        self.registers = [(reg, rng.randint(0, 0xFFFFFFFF)) for reg in [1] + DATA_REGS + [SCRATCH]]
+        self.registers += [(2, SP), (8, S0)]
+        if rng.randrange(2):
+            self.latencies = {}
+        else:
+            self.latencies = dict(fetch_latency=rng.randint(18, 40), parcel_clocks=rng.choice([4, 8]),
+                                  flash_read_latency=rng.randint(14, 30), ram_read_latency=rng.randint(14, 30),
+                                  ram_write_latency=rng.randint(10, 24), byte_clocks=rng.choice([2, 4]))
+
+        self.body = []
+        self.functions = []
+        storing = False
+        for i in range(length):
+            choice = rng.randrange(20)
+            if choice < 7 or choice == 14 and storing:
+                item = _alu(rng)
+            elif choice < 11:
+                item = _load_store(rng)
+            elif choice < 14:
+                item = _jump(rng, "i{}".format(min(i + rng.randint(1, 3), length)), storing)
+            elif choice < 15:
+                body = [instr for _ in range(rng.randint(0, 3)) for instr in _alu(rng)]
+                self.functions.append(body + rng.choice([[("c.ret", ())], [("jalr", (0, 1, 0))]]))
+                item = _call(rng, "f{}".format(len(self.functions) - 1))
+            elif choice < 18:
+                item = _csr(rng)
+            else:
+                item = _trap(rng)
+            self.body.append(item)
+            storing = _stores(item, storing)
+        self.kept = list(range(length))
+
+    def __len__(self):
+        return len(self.kept)
+
+    # The program without the body items in indices.  Their labels stay, so
+    # a branch to a removed item goes to the next one.
+    def without(self, indices):
+        program = copy.copy(self)
+        program.kept = [i for i in self.kept if i not in set(indices)]
+        return program
+
+    def memory(self):
+        return Memory(**self.latencies)
+
+    def assemble(self):
+        a = Assembler()
+        a.label("reset")
+        a.j("start")
+        # Branches rather than jal, as a trap or the end can follow a store
+        a.label("trap")
+        a.beq(0, 0, "trap_handler")
+
+        # Disable the level triggered interrupts and clear the edge triggered
+        a.label("interrupt")
+        a.li(SCRATCH, 0xC0080)
+        a.csrrc(0, SCRATCH, MIE)
+        a.li(SCRATCH, 0x30000)
+        a.csrrc(0, SCRATCH, MIP)
+        a.mret()
+
+        # Return past the trap
+        a.label("trap_handler")
+        a.csrrs(SCRATCH, 0, MEPC)
+        a.addi(SCRATCH, SCRATCH, 4)
+        a.csrrw(0, SCRATCH, MEPC)
+        a.mret()
+
+        a.label("start")
+        for reg, value in self.registers:
+            a.li(reg, value)
+        kept = set(self.kept)
+        for i, item in enumerate(self.body):
+            a.label("i{}".format(i))
+            if i in kept:
+                _emit(a, item)
+        a.label("i{}".format(len(self.body)))
+        a.label("end")
+        a.beq(0, 0, "end")
+        for i, function in enumerate(self.functions):
+            a.label("f{}".format(i))
+            _emit(a, function)
+        return a.assemble()
+
+    def listing(self, mark=None):
+        return listing(self.assemble(), mark)
+
+def _emit(a, item):
+    for name, operands in item:
+        if name in ("la", "word"):
+            getattr(a, name)(*operands)
+        else:
+            a.instr(name, *operands)
+
+# Disassembly of an assembled program with its labels, marking the
+# instruction at mark
+def listing(image, mark=None):
+    labels = {}
+    for name, addr in image.labels.items():
+        labels.setdefault(addr, []).append(name)
+    lines = []
+    addr = 0
+    while addr < len(image):
+        if addr in labels:
+            lines.append(" ".join(sorted(labels[addr])) + ":")
+        instr = image[addr] | (image[addr + 1] << 8)
+        size = 4 if instr & 3 == 3 else 2
+        instr = int.from_bytes(image[addr:addr + size], "little")
+        name = disassemble(instr)
+        text = "{} {}".format(name[0], ", ".join(str(op) for op in name[1])) if name else ".word 0x{:08x}".format(instr)
+        lines.append("{} {:06x}: {:0{}x}  {}".format(">" if addr == mark else " ", addr, instr, 2 * size, text))
+        addr += size
+    return "\n".join(lines)
+
+###### Lockstep ######
+
+class Divergence(Exception):
+    def __init__(self, kind, retired, pc, message):
+        super().__init__("{} after {} instructions, at {:06x}: {}".format(kind, retired, pc, message))
+        self.kind = kind
+        self.retired = retired
+        self.pc = pc
+
+def _format_access(access):
+    kind, addr, size, value = access
+    if kind == "read":
+        return "read {} bytes at {:07x}".format(size, addr)
+    return "write {} bytes of {:x} to {:07x}".format(size, value, addr)
+
+# mstatus, mie, mepc and mcause from the core
+def cpu_csrs(backdoor):
+    return {name: backdoor.get_csr(csr) for name, csr in
+            (("mstatus", MSTATUS), ("mie", MIE), ("mepc", MEPC), ("mcause", MCAUSE))}
+
+def iss_csrs(iss):
+    return {
+        "mstatus": iss.csr_read(MSTATUS),
+        "mie": iss.mie,
+        "mepc": iss.mepc & PC_MASK,
+        "mcause": iss.mcause & 0x8000001F,
+    }
+
+class Lockstep:
+    def __init__(self, dut, program, iss_class=TinyQV):
+        self.dut = dut
+        self.backdoor = Backdoor.cpu(dut)
+        self.program = program
+        self.image = program.assemble()
+        self.end = self.image.labels["end"]
+        self.iss = iss_class(self.image)
+        self.data = TinyQV(self.image)
+        self.memory = program.memory()
+        self.retired = 0
+        self.pc = 0
+        self.hang = None
+
+        # Data accesses made by one side and not yet by the other.  The CPU
+        # can finish a store after the instruction completes, so only the
+        # ISS can be ahead.
+        self.iss_accesses = []
+        self.cpu_accesses = []
+        read, write = self.iss.read, self.iss.write
+        def iss_read(addr, size):
+            self.iss_accesses.append(("read", addr & ADDR_MASK, size, None))
+            return read(addr, size)
+        def iss_write(addr, value, size):
+            self.iss_accesses.append(("write", addr & ADDR_MASK, size, value & ((1 << (8 * size)) - 1)))
+            write(addr, value, size)
+        self.iss.read = iss_read
+        self.iss.write = iss_write
+
+    def _diverged(self, kind, message):
+        return Divergence(kind, self.retired, self.pc, message)
+
+    def _match_accesses(self):
+        while self.iss_accesses and self.cpu_accesses:
+            expected, actual = self.iss_accesses.pop(0), self.cpu_accesses.pop(0)
+            if expected != actual:
+                raise self._diverged("access", "CPU made a {}, ISS a {}".format(
+                    _format_access(actual), _format_access(expected)))
+
+    # Step the ISS through c.ret, which never reaches the core, to the
+    # instruction at pc
+    def _skip_returns(self, pc):
+        iss = self.iss
+        while iss.pc != pc and decode(iss.fetch(iss.pc)).is_ret:
+            iss.pc = iss.compile(iss.fetch(iss.pc))(iss.pc)
+            iss.instret += 1
+
+    def _retire(self, pc, interrupt_pending, inputs):
+        iss = self.iss
+        if self.hang is not None and self.hang.startswith("ISS"):
+            raise self._diverged("hang", "CPU completed {:06x}, {}".format(pc, self.hang))
+        self._skip_returns(pc)
+        self.pc = iss.pc
+        if iss.pc != pc:
+            raise self._diverged("pc", "CPU completed the instruction at {:06x}".format(pc))
+
+        iss.sync_interrupts(*inputs)
+        try:
+            iss.pc = iss.compile(iss.fetch(pc))(pc)
+        except Hang as e:
+            self.hang = "ISS {}".format(e)
+            return
+        iss.instret += 1
+        self.retired += 1
+
+        # Reads and writes of peripherals update the ISS's interrupt inputs
+        iss.sync_interrupts(*inputs)
+        if iss.irq != interrupt_pending:
+            raise self._diverged("interrupt", "CPU {} an interrupt pending, mip {:x}".format(
+                "has" if interrupt_pending else "doesn't have", iss.mip))
+        if self.cpu_accesses:
+            self._match_accesses()
+            if self.cpu_accesses:
+                raise self._diverged("access", "CPU made a {} the ISS didn't".format(_format_access(self.cpu_accesses[0])))
+
+    # The CPU takes an interrupt at pc, with the interrupt inputs when it decided to
+    def _interrupt(self, pc, inputs):
+        iss = self.iss
+        self._skip_returns(pc)
+        if iss.pc != pc:
+            raise self._diverged("interrupt", "CPU interrupted at {:06x}, ISS is at {:06x}".format(pc, iss.pc))
+        iss.sync_interrupts(*inputs)
+        if not iss.irq:
+            raise self._diverged("interrupt", "CPU took an interrupt with mip {:x}, mie {:x}".format(iss.mip, iss.mie))
+        iss.pc = iss.interrupt(pc)
+
+    # Compare the registers and CSRs, on the clock after an instruction completes
+    def _check_state(self):
+        registers = self.backdoor.get_regs()
+        differences = ["x{} {:08x}, ISS {:08x}".format(i, value, self.iss.regs[i])
+                       for i, value in enumerate(registers) if value != self.iss.regs[i]]
+        if differences:
+            raise self._diverged("register", "CPU " + ", ".join(differences))
+        csrs = cpu_csrs(self.backdoor)
+        expected = iss_csrs(self.iss)
+        differences = ["{} {:x}, ISS {:x}".format(name, csrs[name], expected[name])
+                       for name in csrs if csrs[name] != expected[name]]
+        if differences:
+            raise self._diverged("csr", "CPU " + ", ".join(differences))
+
+    async def _reset(self):
+        dut = self.dut
+        await FallingEdge(dut.clk)
+        dut.rstn.value = 0
+        dut.instr_fetch_started.value = 0
+        dut.instr_fetch_stopped.value = 0
+        dut.instr_ready.value = 0
+        dut.data_ready.value = 0
+        dut.interrupt_req.value = 0b1000
+        dut.timer_interrupt.value = 0
+        await ClockCycles(dut.clk, 2)
+        dut.rstn.value = 1
+
+        # Start at the beginning of a cycle, with the ISS's registers and mepc,
+        # which reset doesn't clear, as the CPU's
+        await RisingEdge(dut.clk)
+        await ReadOnly()
+        while dut.cpu.debug_counter_0.value == 0:
+            await RisingEdge(dut.clk)
+            await ReadOnly()
+        self.iss.regs[:16] = self.backdoor.get_regs()
+        self.iss.mepc = self.backdoor.get_csr(MEPC)
+
+    # Run until the program reaches its end, returning "end", or stops with
+    # the hang the memory model expects, returning "hang"
+    async def run(self):
+        dut = self.dut
+        cpu = dut.cpu
+        rng = random.Random(self.program.seed)
+        flash = self.image
+        interrupt_req, timer_interrupt = 0b1000, 0
+        await self._reset()
+
+        check = False
+        was_interrupt = False
+        inputs = None
+        next_addr = None
+        last_complete = 0
+        end_clock = None
+        clock = 0
+        while True:
+            if check:
+                self._check_state()
+                check = False
+            is_interrupt = cpu.interrupt_core.value == 1
+            if is_interrupt and not was_interrupt:
+                self._interrupt(cpu.pc.value.integer, inputs)
+                if dut.data_continue.value == 1:
+                    self.hang = "interrupt at {:06x} left a multi word transfer open".format(cpu.pc.value.integer)
+            was_interrupt = is_interrupt
+            inputs = (dut.interrupt_req.value.integer, cpu.i_core.mip_reg.value.integer, dut.timer_interrupt.value.integer)
+
+            read_n, write_n = dut.data_read_n.value.integer, dut.data_write_n.value.integer
+            request = read_n != 3 or write_n != 3
+            data_addr = dut.data_addr.value.integer if request else 0
+            started, stopped, instr_ready, data_ready = self.memory.clock(
+                dut.instr_fetch_restart.value == 1, dut.instr_fetch_stall.value == 1, dut.instr_addr.value.integer << 1,
+                read_n, write_n, data_addr, dut.data_continue.value == 1)
+            if cpu.debug_branch.value == 1 and cpu.was_early_branch.value == 1 and not self.memory.fetching:
+                self.hang = "fetch for the jump at {:06x} didn't start".format(cpu.pc.value.integer)
+
+            if cpu.debug_instr_complete.value == 1:
+                pc = cpu.pc.value.integer
+                self._retire(pc, cpu.debug_interrupt_pending.value == 1, inputs)
+                check = True
+                last_complete = clock
+                if pc == self.end and end_clock is None:
+                    end_clock = clock
+            elif clock - last_complete > STOPPED_CLOCKS:
+                if self.hang is not None and not self.hang.startswith("ISS"):
+                    return "hang"
+                raise self._diverged("stopped", "no instruction completed for {} clocks".format(STOPPED_CLOCKS))
+            if end_clock is not None and clock > end_clock + END_CLOCKS:
+                self._match_accesses()
+                if self.iss_accesses:
+                    raise self._diverged("access", "CPU didn't make the {}".format(_format_access(self.iss_accesses[0])))
+                return "end"
+
+            await FallingEdge(dut.clk)
+            dut.instr_fetch_started.value = started
+            dut.instr_fetch_stopped.value = stopped
+            dut.instr_ready.value = instr_ready
+            if instr_ready:
+                addr = self.memory.parcel_addr
+                dut.instr_data_in.value = flash[addr] | (flash[addr + 1] << 8) if addr + 1 < len(flash) else 0
+            dut.data_ready.value = data_ready
+            if data_ready:
+                # data_addr wraps in 16 bytes, but a continued memory
+                # transaction carries on to the next word
+                if next_addr is not None and data_addr >> 25 == 0:
+                    data_addr = next_addr
+                if read_n != 3:
+                    size = {0: 1, 1: 2}.get(read_n, 4)
+                    dut.data_in.value = self.data.read(data_addr, size)
+                    self.cpu_accesses.append(("read", data_addr, size, None))
+                else:
+                    size = {0: 1, 1: 2}.get(write_n, 4)
+                    value = dut.data_out.value.integer & ((1 << (8 * size)) - 1)
+                    self.data.write(data_addr, value, size)
+                    self.cpu_accesses.append(("write", data_addr, size, value))
+                next_addr = data_addr + 4 if dut.data_continue.value == 1 else None
+                self._match_accesses()
+
+            # The core decides to take an interrupt at the end of a cycle and
+            # picks the cause on the next clock, keep the inputs the same for both
+            if rng.random() < self.program.interrupt_rate and cpu.counter_hi.value != 7:
+                bit = rng.randrange(4)
+                if bit == 3:
+                    timer_interrupt ^= 1
+                else:
+                    interrupt_req ^= 1 << bit
+                dut.interrupt_req.value = interrupt_req
+                dut.timer_interrupt.value = timer_interrupt
+
+            await RisingEdge(dut.clk)
+            await ReadOnly()
+            clock += 1
+
+async def lockstep(dut, program, iss_class=TinyQV):
+    return await Lockstep(dut, program, iss_class).run()
+
+###### Shrinking ######
+
+# Remove items from a program that diverged, halving the size of the chunks
+# removed until single items, keeping each removal after which it still
+# diverges the same way.  Returns the smallest program and its divergence.
+async def shrink(dut, program, divergence, iss_class=TinyQV, max_runs=300):
+    runs = 0
+    chunk = max(len(program) // 2, 1)
+    while chunk >= 1 and runs < max_runs:
+        i = 0
+        while i < len(program) and runs < max_runs:
+            candidate = program.without(program.kept[i:i + chunk])
+            runs += 1
+            try:
+                await lockstep(dut, candidate, iss_class)
+            except Divergence as e:
+                if e.kind == divergence.kind:
+                    program, divergence = candidate, e
+                    continue
+            i += chunk
+        chunk //= 2
+    return program, divergence
@@ -0,0 +1,277 @@
+import functools
+
+# The TinyQV instruction set as tables, for encoding instructions in the tests
+# and naming them again afterwards.
+#
+# Every instruction the CPU runs is a row in INSTRUCTIONS: RV32E with Zcb and
+# Zicond, plus the custom mul16, lw2/lw4/sw2/sw4/sw4n, c.mul16, c.lcxt/c.scxt
+# and c.lwtp/c.swtp.  A row is the instruction with all its operand fields
+# zero, and the operands in the order encode() takes them.  The immediate
+# layouts are the bit tables from the specs, turned into shifts and masks
+# when this module loads.
+#
+#   encode("addi", x1, x0, 5)
+#   encode("sw4n", x8, x9, 16)
+#   encode("c.lwtp", x10, 0x3c)
+#   disassemble(0x00150513)  ->  ("addi", (10, 10, 1))
+#
+# Operands are in riscvmodel's order: rd first, except that stores and
+# branches take (rs1, rs2, imm).  CSRs are numbers 0-0xFFF.  c.lcxt and c.scxt
+# take the first register, x1 or x9, the number of registers and the offset.
+# encode() is memoised, as the tests encode the same few instructions over
+# and over, and it raises ValueError for operands that don't fit, like
+# riscvmodel.  encode_array() does the same on NumPy arrays, without checks.
+
+# The immediate layouts as (instruction bits, immediate bits) slices, high to
+# low, and whether the immediate is signed
+LAYOUTS = {
+    "i":        (True,  [(31, 20, 11, 0)]),
+    "s":        (True,  [(31, 25, 11, 5), (11, 7, 4, 0)]),
+    "b":        (True,  [(31, 31, 12, 12), (30, 25, 10, 5), (11, 8, 4, 1), (7, 7, 11, 11)]),
+    "u":        (False, [(31, 12, 19, 0)]),
+    "j":        (True,  [(31, 31, 20, 20), (30, 21, 10, 1), (20, 20, 11, 11), (19, 12, 19, 12)]),
+    "shamt":    (False, [(24, 20, 4, 0)]),
+    "csr":      (False, [(31, 20, 11, 0)]),
+    "zimm":     (False, [(19, 15, 4, 0)]),
+    "ci":       (True,  [(12, 12, 5, 5), (6, 2, 4, 0)]),
+    "cshamt":   (False, [(12, 12, 5, 5), (6, 2, 4, 0)]),
+    "lwsp":     (False, [(12, 12, 5, 5), (6, 4, 4, 2), (3, 2, 7, 6)]),
+    "swsp":     (False, [(12, 9, 5, 2), (8, 7, 7, 6)]),
+    "clw":      (False, [(12, 10, 5, 3), (6, 6, 2, 2), (5, 5, 6, 6)]),
+    "clb":      (False, [(6, 6, 0, 0), (5, 5, 1, 1)]),
+    "clh":      (False, [(5, 5, 1, 1)]),
+    "addi4spn": (False, [(12, 11, 5, 4), (10, 7, 9, 6), (6, 6, 2, 2), (5, 5, 3, 3)]),
+    "addi16sp": (True,  [(12, 12, 9, 9), (6, 6, 4, 4), (5, 5, 6, 6), (4, 3, 8, 7), (2, 2, 5, 5)]),
+    "scxt":     (True,  [(12, 12, 9, 9), (11, 11, 4, 4), (10, 10, 5, 5), (9, 7, 8, 6)]),
+    "cb":       (True,  [(12, 12, 8, 8), (11, 10, 4, 3), (6, 5, 7, 6), (4, 3, 2, 1), (2, 2, 5, 5)]),
+    "cj":       (True,  [(12, 12, 11, 11), (11, 11, 4, 4), (10, 9, 9, 8), (8, 8, 10, 10),
+                         (7, 7, 6, 6), (6, 6, 7, 7), (5, 3, 3, 1), (2, 2, 5, 5)]),
+}
+
+# Operand fields: registers at a bit position, the 3 bit registers x8-x15 of
+# the compressed forms, the first register of c.lcxt/c.scxt, a register
+# count of 1-8 and immediates
+RD, RS1, RS2 = ("reg", 7), ("reg", 15), ("reg", 20)
+CRD, CRS2 = ("reg", 7), ("reg", 2)
+CRS1P, CRS2P = ("creg", 7), ("creg", 2)
+
+def imm(layout):
+    return ("imm", layout)
+
+R = [RD, RS1, RS2]
+I = [RD, RS1, imm("i")]
+S = [RS1, RS2, imm("s")]
+B = [RS1, RS2, imm("b")]
+SHIFT = [RD, RS1, imm("shamt")]
+CSR = [RD, RS1, imm("csr")]
+CSRI = [RD, imm("zimm"), imm("csr")]
+
+INSTRUCTIONS = {
+    "lui":       (0x00000037, [RD, imm("u")]),
+    "auipc":     (0x00000017, [RD, imm("u")]),
+    "jal":       (0x0000006F, [RD, imm("j")]),
+    "jalr":      (0x00000067, I),
+    "beq":       (0x00000063, B),
+    "bne":       (0x00001063, B),
+    "blt":       (0x00004063, B),
+    "bge":       (0x00005063, B),
+    "bltu":      (0x00006063, B),
+    "bgeu":      (0x00007063, B),
+    "lb":        (0x00000003, I),
+    "lh":        (0x00001003, I),
+    "lw":        (0x00002003, I),
+    "lw2":       (0x00003003, I),
+    "lbu":       (0x00004003, I),
+    "lhu":       (0x00005003, I),
+    "lw4":       (0x00007003, I),
+    "sb":        (0x00000023, S),
+    "sh":        (0x00001023, S),
+    "sw":        (0x00002023, S),
+    "sw2":       (0x00003023, S),
+    "sw4n":      (0x00006023, S),
+    "sw4":       (0x00007023, S),
+    "nop":       (0x00000013, []),
+    "addi":      (0x00000013, I),
+    "slti":      (0x00002013, I),
+    "sltiu":     (0x00003013, I),
+    "xori":      (0x00004013, I),
+    "ori":       (0x00006013, I),
+    "andi":      (0x00007013, I),
+    "slli":      (0x00001013, SHIFT),
+    "srli":      (0x00005013, SHIFT),
+    "srai":      (0x40005013, SHIFT),
+    "add":       (0x00000033, R),
+    "sub":       (0x40000033, R),
+    "sll":       (0x00001033, R),
+    "slt":       (0x00002033, R),
+    "sltu":      (0x00003033, R),
+    "xor":       (0x00004033, R),
+    "srl":       (0x00005033, R),
+    "sra":       (0x40005033, R),
+    "or":        (0x00006033, R),
+    "and":       (0x00007033, R),
+    "mul16":     (0x04000033, R),
+    "czero.eqz": (0x0E005033, R),
+    "czero.nez": (0x0E007033, R),
+    "ecall":     (0x00000073, []),
+    "ebreak":    (0x00100073, []),
+    "mret":      (0x30200073, []),
+    "csrrw":     (0x00001073, CSR),
+    "csrrs":     (0x00002073, CSR),
+    "csrrc":     (0x00003073, CSR),
+    "csrrwi":    (0x00005073, CSRI),
+    "csrrsi":    (0x00006073, CSRI),
+    "csrrci":    (0x00007073, CSRI),
+
+    "c.addi4spn": (0x0000, [CRS2P, imm("addi4spn")]),
+    "c.lw":       (0x4000, [CRS2P, CRS1P, imm("clw")]),
+    "c.sw":       (0xC000, [CRS1P, CRS2P, imm("clw")]),
+    "c.lbu":      (0x8000, [CRS2P, CRS1P, imm("clb")]),
+    "c.lhu":      (0x8400, [CRS2P, CRS1P, imm("clh")]),
+    "c.lh":       (0x8440, [CRS2P, CRS1P, imm("clh")]),
+    "c.sb":       (0x8800, [CRS1P, CRS2P, imm("clb")]),
+    "c.sh":       (0x8C00, [CRS1P, CRS2P, imm("clh")]),
+    "c.scxt":     (0xE000, [("first", 5), ("count", 2), imm("scxt")]),
+    "c.nop":      (0x0001, []),
+    "c.addi":     (0x0001, [CRD, imm("ci")]),
+    "c.jal":      (0x2001, [imm("cj")]),
+    "c.li":       (0x4001, [CRD, imm("ci")]),
+    "c.addi16sp": (0x6101, [imm("addi16sp")]),
+    "c.lui":      (0x6001, [CRD, imm("ci")]),
+    "c.srli":     (0x8001, [CRS1P, imm("cshamt")]),
+    "c.srai":     (0x8401, [CRS1P, imm("cshamt")]),
+    "c.andi":     (0x8801, [CRS1P, imm("ci")]),
+    "c.sub":      (0x8C01, [CRS1P, CRS2P]),
+    "c.xor":      (0x8C21, [CRS1P, CRS2P]),
+    "c.or":       (0x8C41, [CRS1P, CRS2P]),
+    "c.and":      (0x8C61, [CRS1P, CRS2P]),
+    "c.zext.b":   (0x9C61, [CRS1P]),
+    "c.zext.h":   (0x9C69, [CRS1P]),
+    "c.not":      (0x9C75, [CRS1P]),
+    "c.j":        (0xA001, [imm("cj")]),
+    "c.beqz":     (0xC001, [CRS1P, imm("cb")]),
+    "c.bnez":     (0xE001, [CRS1P, imm("cb")]),
+    "c.slli":     (0x0002, [CRD, imm("cshamt")]),
+    "c.lcxt":     (0x2002, [("first", 10), ("count", 7), imm("addi16sp")]),
+    "c.lwsp":     (0x4002, [CRD, imm("lwsp")]),
+    "c.lwtp":     (0x6002, [CRD, imm("lwsp")]),
+    "c.ret":      (0x8082, []),
+    "c.jr":       (0x8002, [CRD]),
+    "c.mv":       (0x8002, [CRD, CRS2]),
+    "c.ebreak":   (0x9002, []),
+    "c.jalr":     (0x9002, [CRD]),
+    "c.add":      (0x9002, [CRD, CRS2]),
+    "c.mul16":    (0xA002, [CRD, CRS2]),
+    "c.swsp":     (0xC002, [CRS2, imm("swsp")]),
+    "c.swtp":     (0xE002, [CRS2, imm("swsp")]),
+}
+
+# Each operand field compiled to (kind, bits it occupies, and for an
+# immediate its range, alignment and (shift, mask, shift) slices)
+def _compile_field(field):
+    kind, where = field
+    if kind == "reg":
+        return kind, 0x1F << where, where
+    if kind in ("creg", "count"):
+        return kind, 0x7 << where, where
+    if kind == "first":
+        return kind, 0x1 << where, where
+
+    signed, layout = LAYOUTS[where]
+    slices = []
+    bits = 0
+    imm_bits = 0
+    for instr_hi, instr_lo, imm_hi, imm_lo in layout:
+        width_mask = (1 << (imm_hi - imm_lo + 1)) - 1
+        slices.append((imm_lo, width_mask, instr_lo))
+        bits |= width_mask << instr_lo
+        imm_bits |= width_mask << imm_lo
+    top = imm_bits.bit_length()
+    low = (imm_bits & -imm_bits) - 1
+    if signed:
+        value_range = (-(1 << (top - 1)), 1 << (top - 1))
+    else:
+        value_range = (0, 1 << top)
+    return kind, bits, (value_range, low, tuple(slices))
+
+_FIELDS = {name: (base, [_compile_field(field) for field in fields])
+           for name, (base, fields) in INSTRUCTIONS.items()}
+
+# For naming instructions: the bits each instruction fixes, most fixed bits
+# first so that c.ret is found before c.jr, and nop before addi
+_MATCH = sorted(((name, base, mask & ~sum(field[1] for field in fields))
+                 for name, (base, fields) in _FIELDS.items()
+                 for mask in [0xFFFFFFFF if base & 3 == 3 else 0xFFFF]),
+                key=lambda entry: -bin(entry[2]).count("1"))
+
+def _check(name, kind, arg, detail):
+    if kind == "reg":
+        ok = 0 <= arg < 32
+    elif kind == "creg":
+        ok = 8 <= arg < 16
+    elif kind == "first":
+        ok = arg in (1, 9)
+    elif kind == "count":
+        ok = 1 <= arg <= 8
+    else:
+        (low, high), align, _ = detail
+        ok = low <= arg < high and arg & align == 0
+    if not ok:
+        raise ValueError("{} operand {} out of range for {}".format(kind, arg, name))
+
+def _field(kind, arg, detail):
+    if kind == "reg":
+        return arg << detail
+    if kind == "creg":
+        return (arg - 8) << detail
+    if kind == "first":
+        return (arg >> 3) << detail
+    if kind == "count":
+        return (arg - 1) << detail
+    result = 0
+    for imm_lo, width_mask, instr_lo in detail[2]:
+        result |= ((arg >> imm_lo) & width_mask) << instr_lo
+    return result
+
+# Encode one instruction
+@functools.lru_cache(maxsize=None)
+def encode(name, *operands):
+    base, fields = _FIELDS[name]
+    if len(operands) != len(fields):
+        raise TypeError("{} takes {} operands, not {}".format(name, len(fields), len(operands)))
+    instr = base
+    for (kind, _, detail), arg in zip(fields, operands):
+        _check(name, kind, arg, detail)
+        instr |= _field(kind, arg, detail)
+    return instr
+
+# Encode arrays of operands, or a mix of arrays and ints, as one array
+def encode_array(name, *operands):
+    base, fields = _FIELDS[name]
+    instr = base
+    for (kind, _, detail), arg in zip(fields, operands):
+        instr = instr | _field(kind, arg, detail)
+    return instr
+
+# The name and operands of an instruction, so that
+# encode(*disassemble(instr)) == instr, or None if it isn't one of ours
+@functools.lru_cache(maxsize=None)
+def disassemble(instr):
+    for name, base, mask in _MATCH:
+        if instr & mask == base:
+            operands = []
+            for kind, bits, detail in _FIELDS[name][1]:
+                if kind == "imm":
+                    (low, high), _, slices = detail
+                    value = 0
+                    for imm_lo, width_mask, instr_lo in slices:
+                        value |= ((instr >> instr_lo) & width_mask) << imm_lo
+                    if low < 0 and value >= high:
+                        value -= high * 2
+                    operands.append(value)
+                else:
+                    value = (instr & bits) >> detail
+                    operands.append({"reg": value, "creg": value + 8,
+                                     "first": value * 8 + 1, "count": value + 1}[kind])
+            return name, tuple(operands)
+    return None
@@ -0,0 +1,818 @@
+#!/usr/bin/env python3
+
+# Instruction set simulator for TinyQV.
+#
+# A golden model of the CPU for the cocotb tests to check against, which can
+# also run firmware on its own without a simulator:
+#
+#   ./iss.py firmware.bin              run until the firmware spins on itself
+#   ./iss.py -n 1000000 firmware.bin   stop after a million instructions
+#
+# The decoder follows cpu/decode.v output for output and execution follows
+# cpu/core.v, so this is RV32EC, Zcb and Zicond plus the TinyQV custom
+# instructions (mul16, lw2/lw4/sw2/sw4/sw4n, c.lcxt/c.scxt and c.lwtp/c.swtp),
+# with gp and tp hardwired, 28-bit data addresses and a 24-bit pc (code only
+# runs from flash), and the CSRs including the mstatus.mte double fault.
+#
+# Each instruction is compiled to a Python function the first time it is
+# seen.  These are cached by pc when running from flash and by instruction
+# word for execute(), so the decode is only done once.
+
+import argparse
+import sys
+import time
+
+MASK = 0xFFFFFFFF
+PC_MASK = 0xFFFFFF
+ADDR_MASK = 0xFFFFFFF
+
+GP = 0x1000400
+TP = 0x8000000
+
+FLASH_SIZE = 0x1000000
+RAM_SIZE = 0x800000
+RAM_A = 0x1000000
+RAM_B = 0x1800000
+
+# Writes to x0, gp and tp are sent to this extra entry of the register list,
+# so the compiled instructions never need to check for them.
+SCRATCH_REG = 16
+
+class Hang(Exception):
+    pass
+
+def bit(value, n):
+    return (value >> n) & 1
+
+def bits(value, hi, lo):
+    return (value >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+def sign_extend(value, width):
+    value &= (1 << width) - 1
+    return (value - (1 << width)) & MASK if value >> (width - 1) else value
+
+def to_signed(value):
+    return value - 0x100000000 if value & 0x80000000 else value
+
+# The outputs of tinyqv_decoder, with instr_len in bytes and imm as an
+# unsigned 32-bit value.  Fields the decoder leaves as X are 0.
+class Decoded:
+    def __init__(self):
+        self.imm = 0
+        self.is_load = False
+        self.is_alu_imm = False
+        self.is_auipc = False
+        self.is_store = False
+        self.is_alu_reg = False
+        self.is_lui = False
+        self.is_branch = False
+        self.is_jalr = False
+        self.is_jal = False
+        self.is_ret = False
+        self.is_system = False
+        self.instr_len = 4
+        self.alu_op = 0
+        self.mem_op = 0
+        self.rs1 = 0
+        self.rs2 = 0
+        self.rd = 0
+        self.additional_mem_ops = 0
+        self.mem_op_increment_reg = True
+
+def decode(instr):
+    d = Decoded()
+
+    if instr & 3 == 3:
+        opcode = bits(instr, 6, 2)
+        funct3 = bits(instr, 14, 12)
+        d.is_load = opcode == 0b00000
+        d.is_alu_imm = opcode == 0b00100
+        d.is_auipc = opcode == 0b00101
+        d.is_store = opcode == 0b01000
+        d.is_alu_reg = opcode == 0b01100
+        d.is_lui = opcode == 0b01101
+        d.is_branch = opcode == 0b11000
+        d.is_jalr = opcode == 0b11001
+        d.is_jal = opcode == 0b11011
+        d.is_system = opcode == 0b11100
+
+        if d.is_auipc or d.is_lui:
+            d.imm = instr & 0xFFFFF000
+        elif d.is_store:
+            d.imm = sign_extend((bits(instr, 31, 25) << 5) | bits(instr, 11, 7), 12)
+        elif d.is_branch:
+            d.imm = sign_extend((bit(instr, 31) << 12) | (bit(instr, 7) << 11) |
+                                (bits(instr, 30, 25) << 5) | (bits(instr, 11, 8) << 1), 13)
+        elif d.is_jal:
+            d.imm = sign_extend((bit(instr, 31) << 20) | (bits(instr, 19, 12) << 12) |
+                                (bit(instr, 20) << 11) | (bits(instr, 30, 21) << 1), 21)
+        else:
+            d.imm = sign_extend(bits(instr, 31, 20), 12)
+
+        if d.is_load or d.is_auipc or d.is_store or d.is_jalr or d.is_jal:
+            d.alu_op = 0b0000
+        elif d.is_branch:
+            d.alu_op = ((1 - bit(instr, 14)) << 2) | bits(instr, 14, 13)
+        elif bit(instr, 26) and d.is_alu_reg:
+            d.alu_op = 0b1000 | (bits(instr, 27, 26) << 1) | bit(instr, 13)  # MUL or CZERO
+        else:
+            d.alu_op = ((bit(instr, 30) and (bit(instr, 5) or funct3 & 3 == 0b01)) << 3) | funct3
+
+        d.mem_op = funct3
+        if (d.is_load or d.is_store) and funct3 & 3 == 0b11:
+            # lw2/lw4/sw2/sw4
+            d.mem_op = 0b010
+            d.additional_mem_ops = (bit(instr, 14) << 1) | 1
+        if d.is_store and funct3 == 0b110:
+            # sw4n
+            d.mem_op = 0b010
+            d.additional_mem_ops = (bit(instr, 14) << 1) | 1
+            d.mem_op_increment_reg = False
+
+        d.rs1 = bits(instr, 18, 15)
+        d.rs2 = bits(instr, 23, 20)
+        d.rd = bits(instr, 10, 7)
+        return d
+
+    d.instr_len = 2
+    rd_rs1 = bits(instr, 10, 7)
+    rs1_c = 8 | bits(instr, 9, 7)
+    rs2_c = 8 | bits(instr, 4, 2)
+    alu_imm = sign_extend((bit(instr, 12) << 5) | bits(instr, 6, 2), 6)
+    lwsp_imm = (bits(instr, 3, 2) << 6) | (bit(instr, 12) << 5) | (bits(instr, 6, 4) << 2)
+    swsp_imm = (bits(instr, 8, 7) << 6) | (bits(instr, 12, 9) << 2)
+    lsw_imm = (bit(instr, 5) << 6) | (bits(instr, 12, 10) << 3) | (bit(instr, 6) << 2)
+    j_imm = sign_extend((bit(instr, 12) << 11) | (bit(instr, 8) << 10) | (bits(instr, 10, 9) << 8) |
+                        (bit(instr, 6) << 7) | (bit(instr, 7) << 6) | (bit(instr, 2) << 5) |
+                        (bit(instr, 11) << 4) | (bits(instr, 5, 3) << 1), 12)
+    b_imm = sign_extend((bit(instr, 12) << 8) | (bits(instr, 6, 5) << 6) | (bit(instr, 2) << 5) |
+                        (bits(instr, 11, 10) << 3) | (bits(instr, 4, 3) << 1), 9)
+    addi16sp_imm = sign_extend((bit(instr, 12) << 9) | (bits(instr, 4, 3) << 7) | (bit(instr, 5) << 6) |
+                               (bit(instr, 2) << 5) | (bit(instr, 6) << 4), 10)
+
+    op = (bits(instr, 1, 0) << 3) | bits(instr, 15, 13)
+    if op == 0b00000:    # ADDI4SPN
+        d.is_alu_imm = True
+        d.imm = (bits(instr, 10, 7) << 6) | (bits(instr, 12, 11) << 4) | (bit(instr, 5) << 3) | (bit(instr, 6) << 2)
+        d.rs1 = 2
+        d.rd = rs2_c
+    elif op == 0b00010:  # LW
+        d.is_load = True
+        d.mem_op = 0b010
+        d.imm = lsw_imm
+        d.rs1 = rs1_c
+        d.rd = rs2_c
+    elif op == 0b00100:  # Load/store byte or halfword
+        d.imm = (bit(instr, 5) << 1) if bit(instr, 10) else (bit(instr, 5) << 1) | bit(instr, 6)
+        d.rs1 = rs1_c
+        if bit(instr, 11):
+            d.is_store = True
+            d.mem_op = bit(instr, 10)
+            d.rs2 = rs2_c
+        else:
+            d.is_load = True
+            d.mem_op = ((1 - (bit(instr, 10) & bit(instr, 6))) << 2) | bit(instr, 10)
+            d.rd = rs2_c
+    elif op == 0b00110:  # SW
+        d.is_store = True
+        d.mem_op = 0b010
+        d.imm = lsw_imm
+        d.rs1 = rs1_c
+        d.rs2 = rs2_c
+    elif op == 0b00111:  # SCXT
+        d.is_store = True
+        d.mem_op = 0b010
+        d.imm = sign_extend((bit(instr, 12) << 9) | (bits(instr, 9, 7) << 6) | (bit(instr, 10) << 5) |
+                            (bit(instr, 11) << 4), 10)
+        d.rs1 = 3
+        d.rs2 = (bit(instr, 5) << 3) | 1
+        d.additional_mem_ops = bits(instr, 4, 2)
+    elif op == 0b01000:  # ADDI
+        d.is_alu_imm = True
+        d.imm = alu_imm
+        d.rs1 = rd_rs1
+        d.rd = rd_rs1
+    elif op == 0b01001:  # JAL
+        d.is_jal = True
+        d.imm = j_imm
+        d.rd = 1
+    elif op == 0b01010:  # LI
+        d.is_alu_imm = True
+        d.imm = alu_imm
+        d.rs1 = 0
+        d.rd = rd_rs1
+    elif op == 0b01011:  # ADDI16SP/LUI
+        d.rd = rd_rs1
+        if rd_rs1 == 2:
+            d.is_alu_imm = True
+            d.imm = addi16sp_imm
+            d.rs1 = 2
+        else:
+            d.is_lui = True
+            d.imm = (alu_imm << 12) & MASK
+    elif op == 0b01100:  # ALU
+        d.rs1 = rs1_c
+        d.rs2 = rs2_c
+        d.rd = rs1_c
+        d.imm = alu_imm
+        if bits(instr, 11, 10) != 0b11:
+            d.is_alu_imm = True
+            if bit(instr, 11) == 0:  # SRx
+                d.alu_op = (bit(instr, 10) << 3) | 0b101
+            else:
+                d.alu_op = 0b0111
+        elif bit(instr, 12):
+            d.is_alu_imm = True
+            if bits(instr, 4, 2) == 0b101:  # NOT
+                d.alu_op = 0b0100
+                d.imm = MASK
+            else:                            # ZEXT
+                d.alu_op = 0b0111
+                d.imm = 0xFFFF if bit(instr, 3) else 0xFF
+        else:
+            d.is_alu_reg = True
+            d.alu_op = [0b1000, 0b0100, 0b0110, 0b0111][bits(instr, 6, 5)]
+    elif op == 0b01101:  # J
+        d.is_jal = True
+        d.imm = j_imm
+        d.rd = 0
+    elif op == 0b01110 or op == 0b01111:  # BEQZ/BNEZ
+        d.is_branch = True
+        d.imm = b_imm
+        d.rs1 = rs1_c
+        d.rs2 = 0
+        d.alu_op = 0b0100
+        d.mem_op = op & 1
+    elif op == 0b10000:  # SLLI
+        d.is_alu_imm = True
+        d.imm = alu_imm
+        d.rs1 = rd_rs1
+        d.rd = rd_rs1
+        d.alu_op = 0b0001
+    elif op == 0b10001:  # LCXT
+        d.is_load = True
+        d.mem_op = 0b010
+        d.imm = addi16sp_imm
+        d.rs1 = 3
+        d.rd = (bit(instr, 10) << 3) | 1
+        d.additional_mem_ops = bits(instr, 9, 7)
+    elif op == 0b10010 or op == 0b10011:  # LWSP/LWTP
+        d.is_load = True
+        d.mem_op = 0b010
+        d.imm = lwsp_imm
+        d.rs1 = 2 if op == 0b10010 else 4
+        d.rd = rd_rs1
+    elif op == 0b10100:
+        if bits(instr, 6, 2) == 0:
+            if bits(instr, 11, 7) == 0:  # EBREAK
+                d.is_system = True
+                d.imm = 1
+            else:                        # J(AL)R
+                d.is_ret = rd_rs1 == 1 and not bit(instr, 12)
+                d.is_jalr = True
+                d.imm = 0
+                d.rs1 = rd_rs1
+                d.rd = bit(instr, 12)
+        else:                            # MV/ADD
+            d.is_alu_reg = True
+            d.rs1 = rd_rs1 if bit(instr, 12) else 0
+            d.rs2 = bits(instr, 5, 2)
+            d.rd = rd_rs1
+    elif op == 0b10101:  # MUL16
+        d.is_alu_reg = True
+        d.alu_op = 0b1010
+        d.rs1 = rd_rs1
+        d.rs2 = bits(instr, 5, 2)
+        d.rd = rd_rs1
+    elif op == 0b10110 or op == 0b10111:  # SWSP/SWTP
+        d.is_store = True
+        d.mem_op = 0b010
+        d.imm = swsp_imm
+        d.rs1 = 2 if op == 0b10110 else 4
+        d.rs2 = bits(instr, 5, 2)
+    else:                # Illegal
+        d.is_system = True
+        d.imm = 2
+
+    return d
+
+def _sll(a, b):
+    return (a << (b & 31)) & MASK
+
+# Left shift with bit 30 of the instruction set, which the shifter fills from the top bit
+def _sll_fill(a, b):
+    b &= 31
+    return ((a << b) | ((1 << b) - 1 if a >> 31 else 0)) & MASK
+
+def _sra(a, b):
+    return ((a ^ 0x80000000) - 0x80000000 >> (b & 31)) & MASK
+
+def _mul16(a, b):
+    return (a * (b & 0xFFFF)) & MASK
+
+# Result of each ALU op for the core's 4-bit alu_op, see cpu/alu.v
+ALU_OPS = [
+    lambda a, b: (a + b) & MASK,                                    # 0000 ADD
+    _sll,                                                           # 0001 SLL
+    lambda a, b: 1 if a ^ 0x80000000 < b ^ 0x80000000 else 0,       # 0010 SLT
+    lambda a, b: 1 if a < b else 0,                                 # 0011 SLTU
+    lambda a, b: a ^ b,                                             # 0100 XOR
+    lambda a, b: a >> (b & 31),                                     # 0101 SRL
+    lambda a, b: a | b,                                             # 0110 OR
+    lambda a, b: a & b,                                             # 0111 AND
+    lambda a, b: (a - b) & MASK,                                    # 1000 SUB
+    _sll_fill,                                                      # 1001 SLL, filling with a[31]
+    _mul16,                                                         # 1010 MUL16
+    _mul16,                                                         # 1011 MUL16
+    lambda a, b: a ^ b,                                             # 1100 XOR
+    _sra,                                                           # 1101 SRA
+    lambda a, b: 0 if b == 0 else a,                                # 1110 CZERO.EQZ
+    lambda a, b: 0 if b != 0 else a,                                # 1111 CZERO.NEZ
+]
+
+# Branch comparisons for the alu_ops a branch can decode to, before mem_op[0] inverts them
+BRANCH_OPS = {
+    0b0100: lambda a, b: a == b,
+    0b0101: lambda a, b: a + b <= MASK,     # funct3 01x: the ALU's carry out of a + b
+    0b0010: lambda a, b: a ^ 0x80000000 < b ^ 0x80000000,
+    0b0011: lambda a, b: a < b,
+}
+
+# The pico-ice peripherals (see pico_ice/pico_ice.v), at tp + 4 * index.  All
+# accesses complete immediately and anything unmapped reads as all ones.
+class Peripherals:
+    GPIO_OUT = 0
+    GPIO_IN = 1
+    GPIO_OUT_SEL = 3
+    UART = 4
+    UART_STATUS = 5
+    DEBUG_UART = 6
+    DEBUG_UART_STATUS = 7
+    SPI = 8
+    SPI_STATUS = 9
+    PWM = 10
+    DEBUG = 12
+
+    # Bytes sent on the UARTs are collected in uart_tx and debug_uart_tx, and
+    # also written to uart and debug_uart if they are given.
+    def __init__(self, uart=None, debug_uart=None):
+        self.uart = uart
+        self.debug_uart = debug_uart
+        self.uart_tx = bytearray()
+        self.debug_uart_tx = bytearray()
+        self.uart_rx = bytearray()
+        self.gpio_out = 0
+        self.gpio_out_sel = 0
+        self.gpio_in = 0
+        self.spi_data = 0
+        self.pwm = 0
+        self.debug = 0
+
+    @staticmethod
+    def register(addr):
+        if addr & ~0x3C != TP:
+            return None
+        return (addr >> 2) & 0xF
+
+    def read(self, addr):
+        reg = self.register(addr)
+        if reg == self.GPIO_OUT: return self.gpio_out
+        if reg == self.GPIO_IN: return self.gpio_in
+        if reg == self.GPIO_OUT_SEL: return self.gpio_out_sel
+        if reg == self.UART:
+            if not self.uart_rx: return 0
+            return self.uart_rx.pop(0)
+        if reg == self.UART_STATUS: return 2 if self.uart_rx else 0
+        if reg == self.DEBUG_UART_STATUS: return 0
+        if reg == self.SPI: return self.spi_data
+        if reg == self.SPI_STATUS: return 0
+        return MASK
+
+    def write(self, addr, value):
+        reg = self.register(addr)
+        if reg == self.GPIO_OUT: self.gpio_out = value & 0xFF
+        elif reg == self.GPIO_OUT_SEL: self.gpio_out_sel = value & 0x3FF
+        elif reg == self.UART: self._send(self.uart_tx, self.uart, value)
+        elif reg == self.DEBUG_UART: self._send(self.debug_uart_tx, self.debug_uart, value)
+        elif reg == self.SPI: self.spi_data = value & 0xFF
+        elif reg == self.PWM: self.pwm = value & 0xFF
+        elif reg == self.DEBUG: self.debug = value & 1
+
+    @staticmethod
+    def _send(buffer, stream, value):
+        buffer.append(value & 0xFF)
+        if stream is not None:
+            stream.write(bytes([value & 0xFF]))
+            stream.flush()
+
+    # interrupt_req as wired to the CPU: UART writeable, UART byte available, in1, in0
+    def interrupt_req(self):
+        return 0b1000 | (0b100 if self.uart_rx else 0) | (self.gpio_in & 3)
+
+class TinyQV:
+    def __init__(self, flash=None, peripherals=None):
+        self.regs = [0] * (SCRATCH_REG + 1)
+        self.regs[3] = GP
+        self.regs[4] = TP
+        self.flash = bytearray(FLASH_SIZE)
+        self.ram_a = bytearray(RAM_SIZE)
+        self.ram_b = bytearray(RAM_SIZE)
+        self.peripherals = peripherals if peripherals is not None else Peripherals()
+        self._by_pc = {}
+        self._by_instr = {}
+        self.reset()
+        if flash is not None:
+            self.load(0, flash)
+
+    # As for rstn: the registers and memory are kept
+    def reset(self):
+        self.pc = 0
+        self.mstatus_mie = True
+        self.mstatus_mte = True
+        self.mstatus_mpie = False
+        self.mie = 0
+        self.mip_reg = 0
+        self.mepc = 0
+        self.mcause = 0
+        self.instret = 0
+        self.interrupt_req = 0
+        self.last_interrupt_req = 0
+        self.timer_interrupt = False
+        self.set_interrupt_req(self.peripherals.interrupt_req())
+
+    ###### Registers ######
+
+    def get_reg(self, reg):
+        return self.regs[reg]
+
+    def set_reg(self, reg, value):
+        if reg not in (0, 3, 4):
+            self.regs[reg] = value & MASK
+
+    ###### Memory ######
+
+    # Backdoor write of bytes to flash or RAM, for loading firmware and data
+    def load(self, addr, data):
+        for i, byte in enumerate(data):
+            mem, offset = self._memory((addr + i) & 0x1FFFFFF)
+            mem[offset] = byte
+        if addr < FLASH_SIZE:
+            self._by_pc.clear()
+
+    # The memory and offset for a data address with addr[27:25] == 0
+    def _memory(self, addr):
+        if addr & 0x1000000:
+            return (self.ram_b if addr & 0x800000 else self.ram_a), addr & (RAM_SIZE - 1)
+        return self.flash, addr & (FLASH_SIZE - 1)
+
+    # Data read of size bytes, as the CPU sees it
+    def read(self, addr, size):
+        addr &= ADDR_MASK
+        if addr >> 25:
+            value = self.peripherals.read(addr) & ((1 << (8 * size)) - 1)
+            self.set_interrupt_req(self.peripherals.interrupt_req())
+            return value
+        mem, offset = self._memory(addr)
+        data = mem[offset:offset + size]
+        if len(data) < size:
+            data += mem[:size - len(data)]
+        return int.from_bytes(data, "little")
+
+    # Data write of size bytes.  Writes to flash are ignored.
+    def write(self, addr, value, size):
+        addr &= ADDR_MASK
+        value &= (1 << (8 * size)) - 1
+        if addr >> 25:
+            self.peripherals.write(addr, value)
+            self.set_interrupt_req(self.peripherals.interrupt_req())
+            return
+        mem, offset = self._memory(addr)
+        if mem is self.flash:
+            return
+        for i in range(size):
+            mem[(offset + i) & (RAM_SIZE - 1)] = (value >> (8 * i)) & 0xFF
+
+    ###### Interrupts and CSRs ######
+
+    @property
+    def mip(self):
+        return ((0x80 if self.timer_interrupt else 0) | ((self.interrupt_req & 0b1100) << 16) |
+                (self.mip_reg << 16))
+
+    def _update_interrupts(self):
+        self.irq = self.mstatus_mie and (self.mip & self.mie) != 0
+
+    # Inputs 0 and 1 interrupt on a rising edge, 2 and 3 are level triggered
+    def set_interrupt_req(self, value):
+        self.mip_reg |= value & ~self.last_interrupt_req & 0b11
+        self.last_interrupt_req = value
+        self.interrupt_req = value
+        self._update_interrupts()
+
+    def set_timer_interrupt(self, value):
+        self.timer_interrupt = bool(value)
+        self._update_interrupts()
+
+    # Take the interrupt inputs and the pending edges (mip bits 17:16) from the
+    # RTL, for running in lockstep with it, as when an edge is seen depends on
+    # its timing
+    def sync_interrupts(self, interrupt_req, mip_reg, timer_interrupt):
+        self.interrupt_req = self.last_interrupt_req = interrupt_req
+        self.mip_reg = mip_reg
+        self.timer_interrupt = bool(timer_interrupt)
+        self._update_interrupts()
+
+    def csr_read(self, csr):
+        if csr == 0x300: return (self.mstatus_mpie << 7) | (self.mstatus_mie << 3) | (self.mstatus_mte << 2)
+        if csr == 0x301: return 0x40000014
+        if csr == 0x304: return self.mie
+        if csr == 0x341: return self.mepc
+        if csr == 0x342: return self.mcause
+        if csr == 0x344: return self.mip
+        if csr == 0xC00: return self.cycle & MASK
+        if csr == 0xC01: return (self.cycle >> 3) & MASK
+        if csr == 0xC02: return self.instret & MASK
+        if csr == 0xF13: return 2
+        return 0
+
+    # op is alu_op[1:0]: 1 write, 2 set, 3 clear
+    def csr_write(self, csr, op, value):
+        def apply(old, mask):
+            if op == 1: return value & mask
+            if op == 2: return old | (value & mask)
+            return old & ~(value & mask)
+
+        if csr == 0x300:
+            self.mstatus_mie = bool(apply(self.mstatus_mie << 3, 0x8))
+            self.mstatus_mpie = bool(apply(self.mstatus_mpie << 7, 0x80))
+        elif csr == 0x304:
+            self.mie = apply(self.mie, 0xF0080)
+        elif csr == 0x341:
+            if op == 1: self.mepc = value & PC_MASK
+        elif csr == 0x344:
+            self.mip_reg = apply(self.mip_reg << 16, 0x30000) >> 16
+        self._update_interrupts()
+
+    # The cycle counter counts once per possible instruction, without a timing
+    # model that is once per instruction.
+    @property
+    def cycle(self):
+        return self.instret
+
+    # ECALL, EBREAK and illegal instructions.  Returns the new pc.
+    def trap(self, pc, imm):
+        self.mepc = pc & PC_MASK
+        self.mcause = 11 if imm & 0xF == 0 else 3 if imm & 0xF == 1 else 2
+        if not self.mstatus_mte:
+            # Double fault, which goes back to the reset vector
+            self.mstatus_mte = True
+            self.mstatus_mie = True
+            self.mstatus_mpie = False
+            self.mie = 0
+            self.mip_reg = 0
+            self._update_interrupts()
+            return 0
+        self.mstatus_mpie = self.mstatus_mie
+        self.mstatus_mie = False
+        self.mstatus_mte = False
+        self._update_interrupts()
+        return 4
+
+    # Take the pending interrupt, pc is the next instruction.  Returns the new pc.
+    def interrupt(self, pc):
+        pending = self.mip & self.mie
+        if pending & 0x80:
+            cause = 7
+        else:
+            cause = 16
+            while not pending & (1 << cause):
+                cause += 1
+        self.mcause = 0x80000000 | cause
+        self.mepc = pc & PC_MASK
+        self.mstatus_mpie = self.mstatus_mie
+        self.mstatus_mie = False
+        self.mstatus_mte = False
+        self._update_interrupts()
+        return 8
+
+    def mret(self):
+        self.mstatus_mie = self.mstatus_mpie
+        self.mstatus_mte = True
+        self._update_interrupts()
+        return self.mepc & 0xFFFFFE
+
+    ###### Execution ######
+
+    # Build the function that executes a decoded instruction, it takes the pc
+    # and returns the next pc.
+    def _compile(self, d):
+        regs = self.regs
+        cpu = self
+        n = d.instr_len
+        rs1, rs2, imm = d.rs1, d.rs2, d.imm
+        rd = SCRATCH_REG if d.rd in (0, 3, 4) else d.rd
+
+        if d.is_alu_imm and d.alu_op == 0:
+            def fn(pc):
+                regs[rd] = (regs[rs1] + imm) & MASK
+                return (pc + n) & PC_MASK
+        elif d.is_alu_imm:
+            alu = ALU_OPS[d.alu_op]
+            def fn(pc):
+                regs[rd] = alu(regs[rs1], imm)
+                return (pc + n) & PC_MASK
+        elif d.is_alu_reg and d.alu_op == 0:
+            def fn(pc):
+                regs[rd] = (regs[rs1] + regs[rs2]) & MASK
+                return (pc + n) & PC_MASK
+        elif d.is_alu_reg:
+            alu = ALU_OPS[d.alu_op]
+            def fn(pc):
+                regs[rd] = alu(regs[rs1], regs[rs2])
+                return (pc + n) & PC_MASK
+        elif d.is_lui:
+            def fn(pc):
+                regs[rd] = imm
+                return (pc + n) & PC_MASK
+        elif d.is_auipc:
+            def fn(pc):
+                regs[rd] = (pc + imm) & MASK
+                return (pc + n) & PC_MASK
+        elif d.is_jal:
+            def fn(pc):
+                regs[rd] = (pc + n) & PC_MASK
+                return (pc + imm) & 0xFFFFFE
+        elif d.is_ret:
+            def fn(pc):
+                # c.ret is handled by instruction fetch and never reaches the core
+                cpu.instret -= 1
+                return regs[1] & 0xFFFFFE
+        elif d.is_jalr:
+            def fn(pc):
+                target = (regs[rs1] + imm) & 0xFFFFFE
+                regs[rd] = (pc + n) & PC_MASK
+                return target
+        elif d.is_branch:
+            compare = BRANCH_OPS[d.alu_op]
+            invert = d.mem_op & 1
+            def fn(pc):
+                if compare(regs[rs1], regs[rs2]) != invert:
+                    return (pc + imm) & 0xFFFFFE
+                return (pc + n) & PC_MASK
+        elif d.is_load or d.is_store:
+            fn = self._compile_mem(d, rd)
+        elif d.is_system and d.alu_op & 3:
+            csr = imm & 0xFFF
+            op = d.alu_op & 3
+            def fn(pc):
+                value = regs[rs1]
+                regs[rd] = cpu.csr_read(csr)
+                cpu.csr_write(csr, op, value)
+                return (pc + n) & PC_MASK
+        elif d.is_system and d.alu_op & 7 == 0 and imm & 0x300 == 0:
+            def fn(pc):
+                return cpu.trap(pc, imm)
+        elif d.is_system and d.alu_op & 7 == 0 and imm & 0x300 == 0x300:
+            def fn(pc):
+                return cpu.mret()
+        elif d.is_system:
+            def fn(pc):
+                return (pc + n) & PC_MASK
+        else:
+            # Nothing completes an instruction with no recognised opcode, so the core stops
+            def fn(pc):
+                raise Hang("Unsupported instruction at {:06x}".format(pc))
+        return fn
+
+    def _compile_mem(self, d, rd):
+        regs = self.regs
+        cpu = self
+        n = d.instr_len
+        rs1, imm = d.rs1, d.imm
+        size = {0: 1, 1: 2}.get(d.mem_op & 3, 4)
+        signed = size < 4 and not d.mem_op & 4
+        count = d.additional_mem_ops + 1
+
+        if d.is_load and count == 1:
+            def fn(pc):
+                value = cpu.read(regs[rs1] + imm, size)
+                if signed: value = sign_extend(value, size * 8)
+                regs[rd] = value
+                return (pc + n) & PC_MASK
+            return fn
+
+        if d.is_store and count == 1:
+            rs2 = d.rs2
+            def fn(pc):
+                cpu.write(regs[rs1] + imm, regs[rs2], size)
+                return (pc + n) & PC_MASK
+            return fn
+
+        # Multiple words: register i of the transfer, and the word offset
+        if d.is_load:
+            targets = [(d.rd + i) & 15 for i in range(count)]
+            targets = [SCRATCH_REG if reg in (0, 3, 4) else reg for reg in targets]
+        else:
+            targets = [(d.rs2 + (i if d.mem_op_increment_reg else 0)) & 15 for i in range(count)]
+
+        def addresses(addr):
+            addr &= ADDR_MASK
+            if addr >> 25:
+                # Peripheral addresses wrap within a 16 byte window
+                return [(addr & ~0xC) | ((addr + 4 * i) & 0xC) for i in range(count)]
+            return [addr + 4 * i for i in range(count)]
+
+        if d.is_load:
+            def fn(pc):
+                for reg, addr in zip(targets, addresses(regs[rs1] + imm)):
+                    regs[reg] = cpu.read(addr, 4)
+                return (pc + n) & PC_MASK
+        else:
+            def fn(pc):
+                for reg, addr in zip(targets, addresses(regs[rs1] + imm)):
+                    cpu.write(addr, regs[reg], 4)
+                return (pc + n) & PC_MASK
+        return fn
+
+    def compile(self, instr):
+        fn = self._by_instr.get(instr)
+        if fn is None:
+            fn = self._compile(decode(instr))
+            self._by_instr[instr] = fn
+        return fn
+
+    def fetch(self, pc):
+        instr = self.flash[pc] | (self.flash[pc + 1] << 8)
+        if instr & 3 == 3:
+            pc = (pc + 2) & PC_MASK
+            instr |= (self.flash[pc] | (self.flash[pc + 1] << 8)) << 16
+        return instr
+
+    def _predecode(self, pc):
+        fn = self.compile(self.fetch(pc))
+        self._by_pc[pc] = fn
+        return fn
+
+    # Execute one instruction word at the current pc, as if it had been fetched
+    def execute(self, instr):
+        pc = self.compile(instr)(self.pc)
+        self.instret += 1
+        if self.irq:
+            pc = self.interrupt(pc)
+        self.pc = pc
+
+    def step(self):
+        self.run(1)
+
+    # Run from flash for at most count instructions, stopping early if the code
+    # branches to itself with no interrupt pending, as then nothing can change.
+    # Returns the number of instructions run.
+    def run(self, count=None):
+        by_pc = self._by_pc
+        pc = self.pc
+        start = self.instret
+        end = start + count if count is not None else float("inf")
+        try:
+            while self.instret < end:
+                fn = by_pc.get(pc)
+                if fn is None:
+                    fn = self._predecode(pc)
+                next_pc = fn(pc)
+                self.instret += 1
+                if self.irq:
+                    next_pc = self.interrupt(next_pc)
+                elif next_pc == pc:
+                    break
+                pc = next_pc
+        finally:
+            self.pc = pc
+        return self.instret - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Run firmware on the TinyQV instruction set simulator")
+    parser.add_argument("firmware", help="binary to load at the start of flash")
+    parser.add_argument("-n", "--max-instructions", type=int, help="stop after this many instructions")
+    parser.add_argument("--uart-input", default="", help="bytes for the UART to receive")
+    args = parser.parse_args()
+
+    with open(args.firmware, "rb") as f:
+        firmware = f.read()
+
+    peripherals = Peripherals(uart=sys.stdout.buffer, debug_uart=sys.stderr.buffer)
+    peripherals.uart_rx += args.uart_input.encode()
+    cpu = TinyQV(firmware, peripherals)
+
+    start = time.monotonic()
+    try:
+        count = cpu.run(args.max_instructions)
+    except Hang as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.monotonic() - start
+
+    print("\n{} instructions in {:.2f}s ({:.2f}M/s), stopped at {:06x}".format(
+        count, elapsed, count / elapsed / 1e6 if elapsed else 0, cpu.pc), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
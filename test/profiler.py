@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+from collections import defaultdict
+
+import cocotb
+from cocotb.triggers import ClockCycles, Edge, ReadOnly, RisingEdge
+
+from firmware import elf_symbols
+from iss import decode, PC_MASK
+
+# A profiler for firmware running on tb_tinyqv, showing where the clocks go.
+#
+# Every clock is counted as execute, fetch (the CPU has no instruction, so is
+# waiting for the memory controller to fetch one) or data (a load or store is
+# waiting for the memory controller), using tb_tinyqv's counters.  Either the
+# clocks since the last sample are given to the pc every period clocks, or
+# with no period each instruction is given the clocks since the one before it
+# completed.  As in firmware.Result, the counts are clocks rather than the
+# README's cycles of 8 clocks.  Calls, interrupts and traps are followed to
+# give each sample a call stack, named by the symbols of the functions
+# called.  c.ret never completes, as the CPU takes it straight from the
+# instruction buffer, so those returns are seen on debug_ret instead.
+#
+#   profiler = Profiler(soc, elf_symbols(data))     # after soc.reset()
+#   result = await soc.run()
+#   profile = profiler.close()
+#   profile.write_collapsed("run.folded")
+#   print(profile.report())
+#
+# The collapsed stacks are the input of flamegraph.pl and speedscope, with
+# the fetch and data clocks as [fetch] and [data] frames on top of the stack,
+# so the stalls stand out in the flame graph:
+#
+#   ./profiler.py run.folded                 report by function
+#   flamegraph.pl run.folded > run.svg
+#
+# A function is the symbol at or before an address, so for labels from the
+# assembler (asm.Image.labels) the frames are named by the labels called,
+# and only the hot addresses in the report use the other labels.
+
+KINDS = ("execute", "fetch", "data")
+
+INTERRUPT_VECTORS = (4, 8)
+MRET = 0x30200073
+
+class Symbols:
+    def __init__(self, symbols):
+        symbols = sorted((addr & PC_MASK, name) for name, addr in symbols.items())
+        self.addrs = [addr for addr, _ in symbols]
+        self.names = [name for _, name in symbols]
+
+    def _find(self, addr):
+        return bisect.bisect_right(self.addrs, addr) - 1
+
+    # The function containing addr
+    def function(self, addr):
+        i = self._find(addr)
+        return self.names[i] if i >= 0 else "{:06x}".format(addr)
+
+    # addr as symbol+offset
+    def location(self, addr):
+        i = self._find(addr)
+        if i < 0:
+            return "{:06x}".format(addr)
+        offset = addr - self.addrs[i]
+        return "{}+{}".format(self.names[i], offset) if offset else self.names[i]
+
+# The symbols of a firmware file, none for a raw binary
+def load_symbols(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return elf_symbols(data) if data[:4] == b"\x7fELF" else {}
+
+class Profile:
+    def __init__(self, symbols=None):
+        self.symbols = symbols if isinstance(symbols, Symbols) else Symbols(symbols or {})
+        # [execute, fetch, data] clocks by call stack and by pc
+        self.stacks = defaultdict(lambda: [0, 0, 0])
+        self.addresses = defaultdict(lambda: [0, 0, 0])
+        self.samples = 0
+
+    def add(self, stack, pc, clocks):
+        self.samples += 1
+        totals = self.stacks[tuple(stack)]
+        for i in range(3):
+            totals[i] += clocks[i]
+        if pc is not None:
+            totals = self.addresses[pc]
+            for i in range(3):
+                totals[i] += clocks[i]
+
+    def total(self):
+        return [sum(clocks[i] for clocks in self.stacks.values()) for i in range(3)]
+
+    # {function: (self clocks [execute, fetch, data], clocks including the
+    # functions it calls)}
+    def functions(self):
+        own = defaultdict(lambda: [0, 0, 0])
+        inclusive = defaultdict(int)
+        for stack, clocks in self.stacks.items():
+            for i in range(3):
+                own[stack[-1]][i] += clocks[i]
+            for name in set(stack):
+                inclusive[name] += sum(clocks)
+        return {name: (own[name], inclusive[name]) for name in inclusive}
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, clocks in sorted(self.stacks.items()):
+                for kind, count in zip(KINDS, clocks):
+                    if count:
+                        frames = stack if kind == "execute" else stack + ("[{}]".format(kind),)
+                        f.write("{} {}\n".format(";".join(frames), count))
+
+    @classmethod
+    def read_collapsed(cls, path):
+        profile = cls()
+        with open(path) as f:
+            for line in f:
+                frames, count = line.rsplit(" ", 1)
+                frames = frames.split(";")
+                clocks = [0, 0, 0]
+                kind = frames[-1][1:-1] if frames[-1].startswith("[") else "execute"
+                if kind != "execute":
+                    frames.pop()
+                clocks[KINDS.index(kind)] = int(count)
+                profile.add(frames, None, clocks)
+        return profile
+
+    # A report of the clocks by function, most first, and the hottest
+    # addresses when known
+    def report(self, limit=20):
+        total = sum(self.total())
+        lines = ["{:24} {:>9} {:>6} {:>9} {:>9} {:>9} {:>9} {:>6}".format(
+            "function", "self", "%", "execute", "fetch", "data", "total", "%")]
+        functions = sorted(self.functions().items(), key=lambda item: -sum(item[1][0]))
+        for name, (clocks, inclusive) in functions[:limit]:
+            lines.append("{:24} {:9} {:6.1f} {:9} {:9} {:9} {:9} {:6.1f}".format(
+                name, sum(clocks), 100 * sum(clocks) / total, *clocks, inclusive, 100 * inclusive / total))
+        if self.addresses:
+            lines.append("")
+            lines.append("{:24} {:>9} {:>6} {:>9} {:>9} {:>9}".format("address", "clocks", "%", *KINDS))
+            addresses = sorted(self.addresses.items(), key=lambda item: -sum(item[1]))
+            for pc, clocks in addresses[:limit]:
+                lines.append("{:24} {:9} {:6.1f} {:9} {:9} {:9}".format(
+                    "{:06x} {}".format(pc, self.symbols.location(pc)), sum(clocks), 100 * sum(clocks) / total, *clocks))
+        return "\n".join(lines)
+
+class Profiler:
+    def __init__(self, soc, symbols=None, period=None):
+        self.soc = soc
+        self.dut = soc.dut
+        self.period = period
+        self.profile = Profile(symbols)
+        self.symbols = self.profile.symbols
+        self.stack = None
+        self._decoded = {}
+        self._returns = 0
+        self._last = self._counters()
+        self._tasks = [cocotb.start_soon(self._retires()), cocotb.start_soon(self._compressed_returns())]
+        if period:
+            self._tasks.append(cocotb.start_soon(self._sample(period)))
+
+    def _counters(self):
+        dut = self.dut
+        return dut.clocks.value.integer, dut.fetch_waits.value.integer, dut.data_waits.value.integer
+
+    # Give the clocks since the last sample to pc
+    def _add(self, pc):
+        counters = self._counters()
+        clocks, fetch, data = (now - last for now, last in zip(counters, self._last))
+        self._last = counters
+        self.profile.add(self.stack or [self.symbols.function(pc)], pc, (clocks - fetch - data, fetch, data))
+
+    def _decode(self, pc):
+        if pc not in self._decoded:
+            instr = int.from_bytes(self.soc.read(pc, 4), "little")
+            d = decode(instr)
+            d.is_mret = instr == MRET
+            self._decoded[pc] = d
+        return self._decoded[pc]
+
+    # Follow the instructions completing to keep the call stack
+    async def _retires(self):
+        dut = self.dut
+        last_pc = None
+        call = False
+        return_addr = None
+        while True:
+            await Edge(dut.instret)
+            await ReadOnly()
+            pc = dut.retired_pc.value.integer
+            if self.stack is None:
+                self.stack = [self.symbols.function(pc)]
+            elif call and pc == return_addr:
+                # A call straight to a c.ret, which has been counted
+                self._returns -= 1
+            elif call or (pc in INTERRUPT_VECTORS and pc != last_pc):
+                self.stack.append(self.symbols.function(pc))
+            if not self.period:
+                self._add(pc)
+
+            # A c.ret is seen as the instruction before it completes, so
+            # returns after that instruction
+            d = self._decode(pc)
+            call = (d.is_jal or d.is_jalr) and d.rd == 1
+            return_addr = pc + d.instr_len
+            returns = int((d.is_jalr and d.rd == 0 and d.rs1 == 1) or d.is_mret) + self._returns
+            self._returns = 0
+            for _ in range(returns):
+                if len(self.stack) > 1:
+                    self.stack.pop()
+            last_pc = pc
+
+    # Count the c.ret instructions taken
+    async def _compressed_returns(self):
+        dut = self.dut
+        while True:
+            await RisingEdge(dut.clk)
+            await ReadOnly()
+            if dut.debug_ret.value == 1:
+                self._returns += 1
+
+    async def _sample(self, period):
+        while True:
+            await ClockCycles(self.dut.clk, period)
+            await ReadOnly()
+            self._add(self.dut.pc.value.integer)
+
+    # Stop profiling, giving the clocks since the last sample to the current
+    # instruction, and return the Profile
+    def close(self):
+        for task in self._tasks:
+            task.kill()
+        self._add(self.dut.pc.value.integer)
+        return self.profile
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on a tinyQV profile by function")
+    parser.add_argument("profile", help="collapsed stacks written by Profile.write_collapsed")
+    parser.add_argument("-n", type=int, default=20, help="functions to list")
+    args = parser.parse_args()
+
+    profile = Profile.read_collapsed(args.profile)
+    print(profile.report(args.n))
+
+if __name__ == "__main__":
+    main()
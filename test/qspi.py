@@ -0,0 +1,162 @@
+import cocotb
+from cocotb.queue import Queue
+from cocotb.triggers import Event, First, FallingEdge, RisingEdge, ReadOnly
+from cocotb.utils import get_sim_time
+
+# A transaction level monitor for the QSPI buses in the testbenches.
+#
+# One coroutine per bus follows the selects and the SPI clock, sampling the
+# data lines once per rising SPI clock edge, and splits each transaction
+# into its command, address, mode, dummy and data phases, keeping the time of
+# each clock.  Tests wait for the header (everything before the data) or the
+# whole transaction and check the Transaction they get back, instead of
+# stepping every half SPI clock.
+# Sampling on the SPI clock edges means the clock delay variant of the
+# controller, which moves the SPI clock half a cycle, needs no special case.
+#
+#   bus = QspiMonitor(dut, [(dut.spi_flash_select, FLASH_CONTINUOUS),
+#                           (dut.spi_ram_a_select, QPI_RAM)])
+#   txn = await bus.header()         # returns on the last falling SPI edge
+#   txn = await bus.transaction()    # returns once deselected
+#
+# The monitor asserts the protocol as it goes: one select at a time, a known
+# command and the data lines driven (or not) in each phase.
+
+# How a device frames its transactions: the clocks taken by the command, 8 for
+# a single bit command on IO0, 2 for a quad command or 0 if the device is in
+# continuous read mode, then for each command the clocks of address, mode and
+# dummy phases and whether the data is written to the device
+class Protocol:
+    def __init__(self, command_clocks, commands):
+        self.command_clocks = command_clocks
+        self.commands = commands
+
+# The flash in continuous read mode, just address, mode byte and dummy
+FLASH_CONTINUOUS = Protocol(0, {None: (6, 2, 4, False)})
+
+# The flash after power on, with a single bit Fast Read Quad I/O command
+FLASH_QUAD_READ = Protocol(8, {0xEB: (6, 2, 4, False)})
+
+# The PSRAMs in QPI mode, with Fast Read and Write commands
+QPI_RAM = Protocol(2, {0x0B: (6, 0, 4, False), 0x02: (6, 0, 0, True)})
+
+class Transaction:
+    def __init__(self, select, start):
+        self.select = select
+        self.start = start
+        self.end = None
+        self.command = None
+        self.addr = 0
+        self.mode = None
+        self.dummy = 0
+        self.write = False
+        self.nibbles = []
+        self.clocks = 0
+        self.header_clocks = None
+        self.clock_times = []
+
+    # The data phase as bytes, high nibble first
+    @property
+    def data(self):
+        return bytes((self.nibbles[i] << 4) | self.nibbles[i + 1] for i in range(0, len(self.nibbles) - 1, 2))
+
+    def __repr__(self):
+        return "Transaction({}, cmd={}, addr={:06x}, {} {} nibbles)".format(
+            self.select._name, "-" if self.command is None else "{:02x}".format(self.command),
+            self.addr, "write" if self.write else "read", len(self.nibbles))
+
+class QspiMonitor:
+    def __init__(self, dut, devices, prefix="spi_"):
+        self.clk = getattr(dut, prefix + "clk_out")
+        self.data_out = getattr(dut, prefix + "data_out")
+        self.data_oe = getattr(dut, prefix + "data_oe")
+        self.data_in = getattr(dut, prefix + "data_in")
+        self.devices = devices
+        self.transactions = Queue()
+        self._header = Event()
+        self._task = cocotb.start_soon(self._run())
+
+    def stop(self):
+        self._task.kill()
+
+    # The current transaction, once its header has been clocked out
+    async def header(self):
+        await self._header.wait()
+        return self._header.data
+
+    # The next complete transaction
+    async def transaction(self):
+        return await self.transactions.get()
+
+    async def _run(self):
+        await First(*(FallingEdge(select) for select, _ in self.devices))
+        while True:
+            # The controller can switch device in one cycle, so the next
+            # select may already be low as the last transaction ends
+            selected = [(select, protocol) for select, protocol in self.devices if select.value == 0]
+            if not selected:
+                await First(*(FallingEdge(select) for select, _ in self.devices))
+                continue
+            assert len(selected) == 1, "{} selects low".format(len(selected))
+            select, protocol = selected[0]
+            txn = Transaction(select, get_sim_time("ns"))
+            await self._clock_transaction(txn, protocol)
+            txn.end = get_sim_time("ns")
+            self._header.clear()
+            self.transactions.put_nowait(txn)
+
+    async def _clock_transaction(self, txn, protocol):
+        select_rise = RisingEdge(txn.select)
+        phases = None
+        header_clocks = None
+        # Straight after a transaction on another device the first SPI clock
+        # can rise with the select
+        clocked = self.clk.value == 1
+        while True:
+            if not clocked and await First(RisingEdge(self.clk), select_rise) is select_rise:
+                return
+            clocked = False
+            await ReadOnly()
+            if txn.select.value != 0:
+                return
+            clock = txn.clocks
+            txn.clocks += 1
+            txn.clock_times.append(get_sim_time("ns"))
+            oe = self.data_oe.value.integer
+            out = self.data_out.value.integer if oe else 0
+
+            if clock < protocol.command_clocks:
+                if protocol.command_clocks == 8:
+                    assert oe & 1, "IO0 not driven in command"
+                    txn.command = ((txn.command or 0) << 1) | (out & 1)
+                else:
+                    assert oe == 0xF, "Data not driven in command"
+                    txn.command = ((txn.command or 0) << 4) | out
+                continue
+
+            if phases is None:
+                assert txn.command in protocol.commands, "Unknown command {}".format(txn.command)
+                address_clocks, mode_clocks, txn.dummy, txn.write = protocol.commands[txn.command]
+                phases = protocol.command_clocks + address_clocks, protocol.command_clocks + address_clocks + mode_clocks
+                txn.header_clocks = header_clocks = phases[1] + txn.dummy
+                if mode_clocks: txn.mode = 0
+
+            if clock < phases[0]:
+                assert oe == 0xF, "Data not driven in address"
+                txn.addr = (txn.addr << 4) | out
+            elif clock < phases[1]:
+                assert oe == 0xF, "Data not driven in mode"
+                txn.mode = (txn.mode << 4) | out
+            elif clock < header_clocks:
+                assert oe == 0, "Data driven in dummy"
+            elif txn.write:
+                assert oe == 0xF, "Data not driven in write"
+                txn.nibbles.append(out)
+            else:
+                assert oe == 0, "Data driven in read"
+                txn.nibbles.append(self.data_in.value.integer)
+
+            if txn.clocks == header_clocks:
+                if await First(FallingEdge(self.clk), select_rise) is select_rise:
+                    return
+                self._header.set(txn)
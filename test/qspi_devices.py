@@ -0,0 +1,347 @@
+import mmap
+import os
+
+# Behavioural models of the memories on the QSPI PMOD, a W25Q128 flash and two
+# APS6404L PSRAMs, so that testbenches can run real programs.
+#
+# A device is modelled a clock at a time: each transaction is a generator that
+# is sent the data lines at every rising SPI clock edge (None if the
+# controller isn't driving them) and yields the nibble to put on spi_data_in
+# for the next edge, or None to leave it.  QspiPmod (qspi_pmod.py) attaches
+# the devices to a testbench, and the models themselves don't need cocotb, so
+# the pico-ice host tests use them too.
+#
+#   flash = W25Q128("firmware.bin")
+#   ram_a, ram_b = APS6404L(), APS6404L()
+#   pmod = QspiPmod(dut, flash, ram_a, ram_b, latency=1)
+#
+# Memory is a bytearray, used as is so the test can look at it, or an image
+# file mapped copy on write, so a large image is paged in as it is read rather
+# than copied up front, and writes never reach the file.  An image can also be
+# preloaded at an address, replacing the contents, and a memoryview of a mapped
+# file (from map_file) is used in place, which is how ELF segments are loaded.
+# snapshot() and diff() compare the contents, as runs of differing bytes.
+#
+# The flash starts in continuous read mode and the PSRAMs in QPI mode, as
+# TinyQV expects.  latency is the number of clk cycles the read data takes to
+# get back to spi_data_in after the falling SPI clock edge, like the round
+# trip through the TT mux.  A controller configured with N delay cycles reads
+# correctly with a latency of N or N + 1, or N - 1 or N with the clock delay.
+
+# Bytes compared at a time when looking for differences
+CHUNK = 4096
+
+# A file mapped copy on write, as a writable memoryview
+def map_file(path):
+    if not os.path.getsize(path):
+        return memoryview(bytearray())
+    with open(path, "rb") as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+# The runs of bytes that differ between a and b, of the same length, as
+# (addr, a, b) with addr counting from base
+def diff_bytes(a, b, base=0):
+    runs = []
+    for chunk in range(0, len(a), CHUNK):
+        x, y = bytes(a[chunk:chunk + CHUNK]), bytes(b[chunk:chunk + CHUNK])
+        if x == y:
+            continue
+        for i in range(len(x)):
+            if x[i] == y[i]:
+                continue
+            addr = base + chunk + i
+            if runs and runs[-1][0] + len(runs[-1][1]) == addr:
+                runs[-1][1].append(x[i])
+                runs[-1][2].append(y[i])
+            else:
+                runs.append((addr, bytearray([x[i]]), bytearray([y[i]])))
+    return [(addr, bytes(x), bytes(y)) for addr, x, y in runs]
+
+class Memory:
+    def __init__(self, size, image=None, fill=0):
+        self.size = size
+        self.fill = fill
+        self.data = bytearray([fill]) * size if image is None else bytearray()
+        self.base = 0
+        self.extra = {}
+        if image is not None:
+            self.preload(image)
+
+    # Replace the contents with an image at addr, with the fill value elsewhere
+    def preload(self, image, addr=0):
+        if isinstance(image, memoryview) and not image.readonly:
+            data = image
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            data = image if isinstance(image, bytearray) else bytearray(image)
+        else:
+            data = map_file(image)
+        assert addr + len(data) <= self.size, "Image larger than the device"
+        self.data, self.base, self.extra = data, addr, {}
+
+    # Bytes outside the image read as the fill value, and writes to them are
+    # kept separately
+    def __getitem__(self, addr):
+        if 0 <= addr - self.base < len(self.data):
+            return self.data[addr - self.base]
+        return self.extra.get(addr, self.fill)
+
+    def __setitem__(self, addr, value):
+        if 0 <= addr - self.base < len(self.data):
+            self.data[addr - self.base] = value
+        elif value == self.fill:
+            self.extra.pop(addr, None)
+        else:
+            self.extra[addr] = value
+
+    def read(self, addr, length):
+        offset = addr - self.base
+        if 0 <= offset and offset + length <= len(self.data):
+            return bytes(self.data[offset:offset + length])
+        return bytes(self[(addr + i) % self.size] for i in range(length))
+
+    def write(self, addr, data):
+        offset = addr - self.base
+        if 0 <= offset and offset + len(data) <= len(self.data):
+            self.data[offset:offset + len(data)] = data
+        else:
+            for i, value in enumerate(data):
+                self[(addr + i) % self.size] = value
+
+    # A copy of the contents, to diff with later
+    def snapshot(self):
+        copy = Memory(self.size, bytearray(), self.fill)
+        copy.data, copy.base, copy.extra = bytearray(self.data), self.base, dict(self.extra)
+        return copy
+
+    # A copy is a snapshot, as a mapped image can't be copied as it is
+    def __deepcopy__(self, memo):
+        return self.snapshot()
+
+    # The runs of bytes that differ from another memory, as (addr, other's
+    # bytes, these bytes)
+    def diff(self, other):
+        spans = []
+        for start, end in sorted((memory.base, memory.base + len(memory.data)) for memory in (self, other)):
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            elif start < end:
+                spans.append([start, end])
+        differences = []
+        for start, end in spans:
+            differences += diff_bytes(other.read(start, end - start), self.read(start, end - start), start)
+
+        # Then the bytes written outside both images
+        for addr in sorted(set(self.extra) | set(other.extra)):
+            if self[addr] == other[addr] or any(start <= addr < end for start, end in spans):
+                continue
+            if differences and differences[-1][0] + len(differences[-1][1]) == addr:
+                start, old, new = differences.pop()
+                differences.append((start, old + bytes([other[addr]]), new + bytes([self[addr]])))
+            else:
+                differences.append((addr, bytes([other[addr]]), bytes([self[addr]])))
+        return sorted(differences)
+
+# The building blocks of the transaction generators: receive a value over some
+# clocks, width bits per clock (on IO0 for single bit), and send bytes
+def receive(clocks, width=4):
+    value = 0
+    for _ in range(clocks):
+        lines = yield None
+        value = (value << width) | ((lines or 0) & ((1 << width) - 1))
+    return value
+
+# Send bytes a nibble per clock, or a bit per clock on IO1
+def send(data, width=4):
+    for byte in data:
+        if width == 4:
+            yield byte >> 4
+            yield byte & 0xF
+        else:
+            for bit in range(7, -1, -1):
+                yield ((byte >> bit) & 1) << 1
+
+# Wait for the end of the transaction, ignoring anything more
+def ignore():
+    while True:
+        yield None
+
+class W25Q128:
+    SIZE = 16 * 1024 * 1024
+    PAGE = 256
+    JEDEC_ID = bytes([0xEF, 0x40, 0x18])
+    DEVICE_ID = bytes([0xEF, 0x17])
+
+    # An erase or a program keeps BUSY set in status register 1 for
+    # erase_busy or program_busy reads of it, ignoring other commands until
+    # then, so a programmer that doesn't wait for it loses data
+    def __init__(self, image=None, continuous=True, erase_busy=0, program_busy=0):
+        self.memory = Memory(self.SIZE, image, 0xFF)
+        self.continuous = continuous
+        self.write_enable = False
+        self.status = [0x00, 0x02, 0x00]   # QE is set on the IQ parts
+        self.erase_busy = erase_busy
+        self.program_busy = program_busy
+        self.busy = 0
+
+    def read(self, addr, length):
+        return self.memory.read(addr, length)
+
+    # Program (only clearing bits) and erase, as the commands do
+    def program(self, addr, data):
+        old = self.memory.read(addr, len(data))
+        self.memory.write(addr, bytes(a & b for a, b in zip(old, data)))
+
+    def erase(self, addr, size):
+        addr &= ~(size - 1)
+        if size == self.SIZE:
+            self.memory.preload(bytearray([0xFF]) * size)
+        else:
+            self.memory.write(addr, bytes([0xFF]) * size)
+
+    def select(self):
+        if self.continuous:
+            return self._fast_read_quad()
+        return self._command()
+
+    def _stream(self, addr, width=4):
+        while True:
+            yield from send([self.memory[addr]], width)
+            addr = (addr + 1) % self.SIZE
+
+    def _fast_read_quad(self):
+        addr = yield from receive(6)
+        mode = yield from receive(2)
+        self.continuous = (mode & 0x30) == 0x20
+        yield from receive(4)
+        yield from self._stream(addr)
+
+    def _command(self):
+        cmd = yield from receive(8, 1)
+        if self.busy and cmd != 0x05:
+            pass
+        elif cmd == 0xEB:
+            yield from self._fast_read_quad()
+        elif cmd == 0x03:
+            addr = yield from receive(24, 1)
+            yield from self._stream(addr, 1)
+        elif cmd == 0x0B:
+            addr = yield from receive(24, 1)
+            yield from receive(8, 1)
+            yield from self._stream(addr, 1)
+        elif cmd == 0x6B:
+            addr = yield from receive(24, 1)
+            yield from receive(8, 1)
+            yield from self._stream(addr)
+        elif cmd == 0x9F:
+            yield from send(self.JEDEC_ID, 1)
+        elif cmd == 0x90:
+            yield from receive(24, 1)
+            while True:
+                yield from send(self.DEVICE_ID, 1)
+        elif cmd == 0xAB:
+            yield from receive(24, 1)
+            yield from send([0x17], 1)
+        elif cmd in (0x05, 0x35, 0x15):
+            reg = [0x05, 0x35, 0x15].index(cmd)
+            while True:
+                busy = reg == 0 and self.busy > 0
+                yield from send([self.status[reg] | (2 if reg == 0 and self.write_enable else 0) | busy], 1)
+                self.busy -= busy
+        elif cmd == 0x06:
+            self.write_enable = True
+        elif cmd == 0x04:
+            self.write_enable = False
+        elif cmd in (0x02, 0x32):
+            addr = yield from receive(24, 1)
+            yield from self._page_program(addr, 1 if cmd == 0x02 else 4)
+        elif cmd in (0x20, 0x52, 0xD8):
+            addr = yield from receive(24, 1)
+            if self.write_enable:
+                self.erase(addr, {0x20: 0x1000, 0x52: 0x8000, 0xD8: 0x10000}[cmd])
+                self.write_enable = False
+                self.busy = self.erase_busy
+        elif cmd in (0xC7, 0x60):
+            if self.write_enable:
+                self.erase(0, self.SIZE)
+                self.write_enable = False
+                self.busy = self.erase_busy
+        yield from ignore()
+
+    # Data is programmed when the flash is deselected, wrapping within the page
+    def _page_program(self, addr, width):
+        page = addr & ~(self.PAGE - 1)
+        data = bytearray(self.memory.read(page, self.PAGE))
+        offset = addr - page
+        written = False
+        try:
+            while True:
+                byte = yield from receive(8 // width, width)
+                data[offset] &= byte
+                offset = (offset + 1) % self.PAGE
+                written = True
+        finally:
+            if written and self.write_enable:
+                self.memory.write(page, data)
+                self.busy = self.program_busy
+            self.write_enable = False
+
+class APS6404L:
+    SIZE = 8 * 1024 * 1024
+    PAGE = 1024
+    ID = bytes([0x0D, 0x5D])
+
+    def __init__(self, image=None, qpi=True):
+        self.memory = Memory(self.SIZE, image)
+        self.qpi = qpi
+
+    def read(self, addr, length):
+        return self.memory.read(addr, length)
+
+    def write(self, addr, data):
+        self.memory.write(addr, data)
+
+    def select(self):
+        return self._command()
+
+    # Bursts wrap within the 1KB page
+    def _next(self, addr):
+        return (addr & ~(self.PAGE - 1)) | ((addr + 1) & (self.PAGE - 1))
+
+    def _read(self, addr, width):
+        while True:
+            yield from send([self.memory[addr]], width)
+            addr = self._next(addr)
+
+    def _write(self, addr, width):
+        while True:
+            self.memory[addr] = yield from receive(8 // width, width)
+            addr = self._next(addr)
+
+    def _command(self):
+        width = 4 if self.qpi else 1
+        cmd = yield from receive(8 // width, width)
+        if cmd == 0x0B:
+            addr = yield from receive(24 // width, width)
+            yield from receive(4 if self.qpi else 8)
+            yield from self._read(addr % self.SIZE, width)
+        elif cmd == 0xEB:
+            addr = yield from receive(6)
+            yield from receive(6)
+            yield from self._read(addr % self.SIZE, 4)
+        elif cmd == 0x03 and not self.qpi:
+            addr = yield from receive(24, 1)
+            yield from self._read(addr % self.SIZE, 1)
+        elif cmd == 0x02:
+            addr = yield from receive(24 // width, width)
+            yield from self._write(addr % self.SIZE, width)
+        elif cmd == 0x38:
+            addr = yield from receive(6)
+            yield from self._write(addr % self.SIZE, 4)
+        elif cmd == 0x9F and not self.qpi:
+            yield from receive(24, 1)
+            yield from send(self.ID, 1)
+        elif cmd == 0x35:
+            self.qpi = True
+        elif cmd in (0xF5, 0x99):
+            self.qpi = False
+        yield from ignore()
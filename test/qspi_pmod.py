@@ -0,0 +1,94 @@
+import cocotb
+from cocotb.queue import Queue
+from cocotb.triggers import First, FallingEdge, RisingEdge, ReadOnly, Timer
+from cocotb.utils import get_sim_time
+
+# Attaches the memory models from qspi_devices.py to the selects of any
+# testbench with the spi_ ports of qspi_controller, tinyqv_mem_ctrl or tinyQV,
+# with one coroutine for the bus.
+#
+#   pmod = QspiPmod(dut, W25Q128("firmware.bin"), APS6404L(), APS6404L(), latency=1)
+#
+# latency is the number of clk cycles the read data takes to get back to
+# spi_data_in after the falling SPI clock edge (see qspi_devices.py).
+
+class QspiPmod:
+    def __init__(self, dut, flash=None, ram_a=None, ram_b=None, latency=0, prefix="spi_"):
+        self.clk = dut.clk
+        self.spi_clk = getattr(dut, prefix + "clk_out")
+        self.data_out = getattr(dut, prefix + "data_out")
+        self.data_oe = getattr(dut, prefix + "data_oe")
+        self.data_in = getattr(dut, prefix + "data_in")
+        self.devices = [(getattr(dut, prefix + name), device) for name, device in
+                        (("flash_select", flash), ("ram_a_select", ram_a), ("ram_b_select", ram_b))
+                        if device is not None]
+        self.latency = latency
+        self.period = None
+        self._delayed = Queue()
+        self._tasks = [cocotb.start_soon(self._run())]
+        if latency:
+            self._tasks.append(cocotb.start_soon(self._drive_delayed()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.kill()
+
+    def _drive(self, value):
+        if value is None:
+            return
+        if self.latency:
+            self._delayed.put_nowait((get_sim_time("ps"), self.clk.value == 1, value))
+        else:
+            self.data_in.value = value
+
+    # Read data reaches spi_data_in latency clk cycles after it is driven.  If
+    # that is on a rising clk edge it arrives just before, rather than racing
+    # the controller sampling it.
+    async def _drive_delayed(self):
+        await RisingEdge(self.clk)
+        start = get_sim_time("ps")
+        await RisingEdge(self.clk)
+        self.period = get_sim_time("ps") - start
+        while True:
+            when, on_rising_edge, value = await self._delayed.get()
+            delay = when + self.latency * self.period - get_sim_time("ps")
+            if on_rising_edge:
+                delay -= self.period // 2
+            if delay > 0:
+                await Timer(delay, "ps")
+            self.data_in.value = value
+
+    async def _run(self):
+        while True:
+            # The controller can switch device in one cycle, so the next
+            # select may already be low as the last transaction ends
+            selected = [(select, device) for select, device in self.devices if select.value == 0]
+            if not selected:
+                await First(*(FallingEdge(select) for select, _ in self.devices))
+                continue
+            select, device = selected[0]
+            txn = device.select()
+            self._drive(next(txn))
+            await self._clock_transaction(select, txn)
+            txn.close()
+
+    async def _clock_transaction(self, select, txn):
+        select_rise = RisingEdge(select)
+        # Straight after a transaction on another device the first SPI clock
+        # can rise with the select
+        clocked = self.spi_clk.value == 1
+        while True:
+            if not clocked and await First(RisingEdge(self.spi_clk), select_rise) is select_rise:
+                return
+            clocked = False
+            await ReadOnly()
+            if select.value != 0:
+                return
+            oe = self.data_oe.value.integer
+            try:
+                value = txn.send(self.data_out.value.integer if oe else None)
+            except StopIteration:
+                return
+            if await First(FallingEdge(self.spi_clk), select_rise) is select_rise:
+                return
+            self._drive(value)
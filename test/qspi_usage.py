@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import csv
+import statistics
+from collections import defaultdict
+
+import cocotb
+from cocotb.triggers import FallingEdge, RisingEdge, ReadOnly
+from cocotb.utils import get_sim_time
+
+from qspi import QspiMonitor, Transaction, FLASH_CONTINUOUS, QPI_RAM
+
+# Where the time on TinyQV's QSPI bus goes, for a simulation or a capture of
+# the pins from hardware.
+#
+# The flash and both PSRAMs share the bus, and a load or store stops the
+# instruction fetch, which has to restart after it.  The time of each
+# transaction is split between its data clocks, the command, address, mode
+# and dummy clocks before them (with the time selected before the first
+# clock), and for the instruction fetch the time stalled with the instruction
+# buffer full.  For each chip select that is:
+#
+#   fetch     data clocks of instruction fetches
+#   read      data clocks of loads
+#   write     data clocks of stores
+#   overhead  everything else in a load or store
+#   restart   the command, address and dummy of each fetch, the cost of
+#             restarting the fetch
+#   stalled   a fetch stalled with the instruction buffer full
+#
+# and the time no device is selected is idle.  A read is a fetch when
+# instr_fetch_restart falls during it, as the restart is held until the fetch
+# starts.  A fetch is restarted after a branch when it was stopped
+# (debug_stop_txn) with the restart high, and after a data access when it
+# was stopped for a load or store.
+#
+#   usage = QspiUsage.soc(dut)              # tb_tinyqv, after reset
+#   await soc.run()
+#   print(usage.close().report())
+#
+#   ./qspi_usage.py capture.csv             report on a logic analyser capture
+#
+# A capture is a CSV file, as exported by sigrok or a Saleae, with a row for
+# each sample or change: the time in seconds then the signals, with the
+# columns named as in CAPTURE_COLUMNS.  The debug signals come out on the
+# pico-ice's debug pins.
+
+KINDS = ("fetch", "read", "write", "overhead", "restart", "stalled")
+
+# The capture's columns, with the selects in the order of CAPTURE_DEVICES
+CAPTURE_COLUMNS = ("spi_clk_out", "spi_flash_select", "spi_ram_a_select", "spi_ram_b_select",
+                   "spi_data0", "spi_data1", "spi_data2", "spi_data3",
+                   "instr_fetch_restart", "debug_stop_txn")
+CAPTURE_DEVICES = (("flash", FLASH_CONTINUOUS), ("ram_a", QPI_RAM), ("ram_b", QPI_RAM))
+
+def device_name(select):
+    name = getattr(select, "_name", select)
+    return name[4:-7] if name.startswith("spi_") and name.endswith("_select") else name
+
+class Usage:
+    # transactions from QspiMonitor or read_capture, the times
+    # instr_fetch_restart fell, the times debug_stop_txn rose with whether the
+    # restart was high, all in ns, and the clk period in ns
+    def __init__(self, transactions, restart_falls, stops, start, end, clock_ns):
+        self.start = start
+        self.end = end
+        self.clock_ns = clock_ns
+        self.transactions = transactions
+        self.time = defaultdict(lambda: dict.fromkeys(KINDS, 0))
+        self.bytes = defaultdict(lambda: dict.fromkeys(KINDS[:3], 0))
+        self.restarts = []
+        self.data_accesses = []
+
+        diffs = [b - a for txn in transactions for a, b in zip(txn.clock_times, txn.clock_times[1:])]
+        self.spi_period = statistics.median(diffs) if diffs else 0
+        stop_times = [t for t, _ in stops]
+
+        cause = "start"
+        for txn in transactions:
+            device = device_name(txn.select)
+            clocks = txn.clocks
+            header = clocks if txn.header_clocks is None else min(clocks, txn.header_clocks)
+            data_times = txn.clock_times[max(header - 1, 0):]
+            stalled = sum(b - a - self.spi_period for a, b in zip(data_times, data_times[1:])
+                          if b - a > 1.5 * self.spi_period)
+            data = (clocks - header) * self.spi_period
+            before_data = txn.end - txn.start - data - stalled
+
+            i = bisect.bisect_right(restart_falls, txn.start)
+            txn.fetch = not txn.write and i < len(restart_falls) and restart_falls[i] <= txn.end
+            if txn.fetch:
+                time = self.time[device]
+                time["fetch"] += data
+                time["restart"] += before_data
+                time["stalled"] += stalled
+                self.bytes[device]["fetch"] += (clocks - header) // 2
+                self.restarts.append((cause, before_data))
+
+                # What stopped the fetch is the cause of the next restart
+                i = bisect.bisect_right(stop_times, txn.end) - 1
+                if i >= 0 and stop_times[i] >= txn.start:
+                    cause = "branch" if stops[i][1] else "data"
+                else:
+                    cause = "unknown"
+            else:
+                kind = "write" if txn.write else "read"
+                self.time[device][kind] += data
+                self.time[device]["overhead"] += before_data + stalled
+                self.bytes[device][kind] += (clocks - header) // 2
+                self.data_accesses.append(txn.end - txn.start)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def total(self, kind):
+        return sum(time[kind] for time in self.time.values())
+
+    def busy(self, device=None):
+        devices = [device] if device else list(self.time)
+        return sum(sum(self.time[d].values()) for d in devices)
+
+    @property
+    def idle(self):
+        return self.duration - self.busy()
+
+    def restart_cost(self, cause=None):
+        costs = [cost for c, cost in self.restarts if cause in (None, c)]
+        return sum(costs) / len(costs) if costs else 0
+
+    # The report, with the bandwidths in MB/s for clk at mhz
+    def report(self, mhz=64):
+        cycles = lambda ns: ns / self.clock_ns
+        mb_per_s = lambda nbytes, ns: mhz * nbytes / cycles(ns) if ns else 0
+        lines = ["QSPI bus over {:.0f} cycles, busy {:.1f}%, SPI clock {:g} cycles".format(
+            cycles(self.duration), 100 * self.busy() / self.duration, cycles(self.spi_period))]
+        lines.append("{:8}".format("cycles") + "".join("{:>10}".format(kind) for kind in KINDS + ("busy",)))
+        for device in sorted(self.time):
+            lines.append("{:8}".format(device) +
+                         "".join("{:10.0f}".format(cycles(self.time[device][kind])) for kind in KINDS) +
+                         "{:10.0f}".format(cycles(self.busy(device))))
+        lines.append("{:8}".format("all") + "".join("{:10.0f}".format(cycles(self.total(kind))) for kind in KINDS) +
+                     "{:10.0f}".format(cycles(self.busy())))
+        lines.append("idle {:.0f} cycles, {:.1f}%".format(cycles(self.idle), 100 * self.idle / self.duration))
+
+        lines.append("")
+        lines.append("Bandwidth at {:g}MHz".format(mhz))
+        for kind in KINDS[:3]:
+            nbytes = sum(counts[kind] for counts in self.bytes.values())
+            line = "{:6} {:7} bytes, {:.2f} MB/s over the run".format(kind, nbytes, mb_per_s(nbytes, self.duration))
+            if kind == "fetch":
+                fetching = self.total("fetch") + self.total("restart") + self.total("stalled")
+                line += ", {:.2f} MB/s while fetching".format(mb_per_s(nbytes, fetching))
+            lines.append(line)
+
+        lines.append("")
+        by_cause = defaultdict(int)
+        for cause, _ in self.restarts:
+            by_cause[cause] += 1
+        lines.append("{} fetch restarts, {:.1f} cycles each: {}".format(
+            len(self.restarts), cycles(self.restart_cost()),
+            ", ".join("{} after {} ({:.1f})".format(count, cause, cycles(self.restart_cost(cause)))
+                      for cause, count in sorted(by_cause.items()))))
+        if self.data_accesses:
+            access = sum(self.data_accesses) / len(self.data_accesses)
+            lines.append("{} data accesses, {:.1f} cycles each, {:.1f} with the fetch restart after".format(
+                len(self.data_accesses), cycles(access), cycles(access + self.restart_cost("data"))))
+        return "\n".join(lines)
+
+class QspiUsage:
+    def __init__(self, dut, devices, restart, stop, clock_ns, prefix="spi_"):
+        self.clock_ns = clock_ns
+        self.monitor = QspiMonitor(dut, devices, prefix)
+        self.start = get_sim_time("ns")
+        self.restart_falls = []
+        self.stops = []
+        self._tasks = [cocotb.start_soon(self._restarts(restart)), cocotb.start_soon(self._stops(stop, restart))]
+
+    # For tb_tinyqv, with the 4ns clock of firmware.Soc
+    @classmethod
+    def soc(cls, dut):
+        return cls(dut, [(dut.spi_flash_select, FLASH_CONTINUOUS), (dut.spi_ram_a_select, QPI_RAM),
+                         (dut.spi_ram_b_select, QPI_RAM)], dut.fetch_restart, dut.stop_txn, 4)
+
+    async def _restarts(self, restart):
+        while True:
+            await FallingEdge(restart)
+            self.restart_falls.append(get_sim_time("ns"))
+
+    async def _stops(self, stop, restart):
+        while True:
+            await RisingEdge(stop)
+            await ReadOnly()
+            self.stops.append((get_sim_time("ns"), restart.value == 1))
+
+    # Stop monitoring and return the Usage of the complete transactions
+    def close(self):
+        self.monitor.stop()
+        for task in self._tasks:
+            task.kill()
+        transactions = []
+        while not self.monitor.transactions.empty():
+            transactions.append(self.monitor.transactions.get_nowait())
+        return Usage(transactions, self.restart_falls, self.stops, self.start, get_sim_time("ns"), self.clock_ns)
+
+# Transactions, restart falls and stops from a capture, as for Usage
+def read_capture(path):
+    transactions = []
+    restart_falls = []
+    stops = []
+    txn = None
+    last = None
+    with open(path, newline="") as f:
+        rows = csv.reader(line for line in f if not line.startswith(";"))
+        header = [name.strip() for name in next(rows)]
+        columns = [header.index(name) if name in header else None for name in CAPTURE_COLUMNS]
+        assert all(i is not None for i in columns[:8]), "Capture needs columns " + ", ".join(CAPTURE_COLUMNS[:8])
+        for row in rows:
+            t = round(float(row[0]) * 1e9, 3)
+            values = [int(row[i]) if i is not None else 0 for i in columns]
+            sck, selects, data, restart, stop = values[0], values[1:4], values[4:8], values[8], values[9]
+            if last is None:
+                start = t
+                last = values
+
+            if txn and selects[txn.select] == 1:
+                _finish(txn, t)
+                transactions.append(txn)
+                txn = None
+            if txn is None and 0 in selects:
+                txn = Transaction(selects.index(0), t)
+            if txn and sck and not last[0]:
+                txn.clocks += 1
+                txn.clock_times.append(t)
+                txn.nibbles.append(sum(bit << i for i, bit in enumerate(data)))
+            if last[8] and not restart:
+                restart_falls.append(t)
+            if stop and not last[9]:
+                stops.append((t, restart == 1))
+            last = values
+    for txn in transactions:
+        txn.select = CAPTURE_DEVICES[txn.select][0]
+    return transactions, restart_falls, stops, start, t
+
+# Split a captured transaction into its header and data, as the monitor does
+def _finish(txn, end):
+    txn.end = end
+    protocol = CAPTURE_DEVICES[txn.select][1]
+    nibbles = txn.nibbles
+    if protocol.command_clocks == 8:
+        txn.command = sum((nibble & 1) << (7 - i) for i, nibble in enumerate(nibbles[:8]))
+    elif protocol.command_clocks == 2:
+        txn.command = sum(nibble << (4 - 4 * i) for i, nibble in enumerate(nibbles[:2]))
+    if txn.command in protocol.commands and len(nibbles) >= protocol.command_clocks:
+        address_clocks, mode_clocks, txn.dummy, txn.write = protocol.commands[txn.command]
+        txn.header_clocks = protocol.command_clocks + address_clocks + mode_clocks + txn.dummy
+        txn.nibbles = nibbles[txn.header_clocks:]
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on the use of TinyQV's QSPI bus from a logic analyser capture")
+    parser.add_argument("capture", help="CSV file of the QSPI and debug signals")
+    parser.add_argument("--clk-mhz", type=float, default=64, help="TinyQV's clock in MHz (default 64)")
+    args = parser.parse_args()
+
+    print(Usage(*read_capture(args.capture), 1000 / args.clk_mhz).report(args.clk_mhz))
+
+if __name__ == "__main__":
+    main()
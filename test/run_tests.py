@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Run the cocotb test modules in parallel and merge their results.
+#
+# Each module is run with its own make process, results file and log, and the
+# compiled models already live in separate build directories (see common.mk),
+# so the modules can all run at once.  The per module results are kept as
+# <module>-results.xml and merged into all-results.xml, with a testsuite per
+# module giving its wall time including the build.
+#
+#   ./run_tests.py                       all modules with Icarus
+#   ./run_tests.py --sim verilator cpu   just test_cpu with Verilator
+#   ./run_tests.py -j 4 DUMP=1           at most 4 at once, passing DUMP=1 to make
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+MODULES = ["alu", "core", "counter", "cpu", "decode", "mem_ctrl", "qspi_ctrl", "qspi_flash", "register", "tinyqv"]
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run one module's tests, name (default the module) names the results and log files
+def run_module(module, sim, make_args, name=None):
+    name = name or module
+    results_file = "{}-results.xml".format(name)
+    log_file = "{}.log".format(name)
+    cmd = ["make", "-f", "test_{}.mk".format(module), "SIM={}".format(sim),
+           "COCOTB_RESULTS_FILE={}".format(results_file)] + make_args
+
+    # Don't pick up results from an earlier run if this one fails to start
+    if os.path.exists(os.path.join(TEST_DIR, results_file)):
+        os.remove(os.path.join(TEST_DIR, results_file))
+
+    start = time.monotonic()
+    with open(os.path.join(TEST_DIR, log_file), "w") as log:
+        returncode = subprocess.call(cmd, cwd=TEST_DIR, stdout=log, stderr=subprocess.STDOUT)
+    wall_time = time.monotonic() - start
+
+    return name, returncode, wall_time
+
+# Convert the cocotb results from one run_module into a testsuite element
+def module_suite(name, returncode, wall_time):
+    suite = ET.Element("testsuite", name=name, time="{:.3f}".format(wall_time))
+
+    results_file = os.path.join(TEST_DIR, "{}-results.xml".format(name))
+    if os.path.exists(results_file):
+        for testcase in ET.parse(results_file).getroot().iter("testcase"):
+            suite.append(testcase)
+
+    if returncode != 0 or len(suite) == 0:
+        # The build or simulator failed, so record that as a failing test
+        testcase = ET.SubElement(suite, "testcase", name="run", classname=name, time="{:.3f}".format(wall_time))
+        ET.SubElement(testcase, "failure", message="make exited with {}, see {}.log".format(returncode, name))
+
+    testcases = suite.findall("testcase")
+    suite.set("tests", str(len(testcases)))
+    suite.set("failures", str(sum(1 for t in testcases if t.find("failure") is not None)))
+    suite.set("skipped", str(sum(1 for t in testcases if t.find("skipped") is not None)))
+    return suite
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cocotb test modules in parallel")
+    parser.add_argument("args", nargs="*", metavar="module|VAR=value", help="modules to run (default all) and make variables")
+    parser.add_argument("--sim", default=os.environ.get("SIM", "icarus"), help="simulator, default icarus")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="modules to run at once")
+    parser.add_argument("-o", "--output", default="all-results.xml", help="merged JUnit results file")
+    args = parser.parse_args()
+
+    modules = [arg for arg in args.args if "=" not in arg] or MODULES
+    make_args = [arg for arg in args.args if "=" in arg]
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        jobs = [pool.submit(run_module, module, args.sim, make_args) for module in modules]
+        runs = [job.result() for job in jobs]
+    total_time = time.monotonic() - start
+
+    failed = write_results(runs, total_time, args.output)
+    return 1 if failed else 0
+
+# Merge the results of several run_modules into one file, printing a summary
+def write_results(runs, total_time, output):
+    testsuites = ET.Element("testsuites", name="results", time="{:.3f}".format(total_time))
+    failed = False
+    for name, returncode, wall_time in runs:
+        suite = module_suite(name, returncode, wall_time)
+        testsuites.append(suite)
+        tests, failures = int(suite.get("tests")), int(suite.get("failures"))
+        failed |= failures != 0
+        print("{:10} {:3} tests {:3} failed {:8.1f}s".format(name, tests, failures, wall_time))
+
+    print("Total time {:.1f}s".format(total_time))
+    ET.ElementTree(testsuites).write(os.path.join(TEST_DIR, output))
+    return failed
+
+if __name__ == "__main__":
+    sys.exit(main())
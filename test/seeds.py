@@ -0,0 +1,27 @@
+import os
+import random
+
+# Seeds and iteration counts for the randomised tests, so a long run can be
+# split across processes (see shard.py) or a single failing seed replayed:
+#   SEED_START=<n>   first seed, by default one is picked using cocotb's RANDOM_SEED
+#   SEED_COUNT=<n>   number of seeds to run
+#   ITERATION_SCALE=<f>  factor on the iteration counts of the loops that don't
+#                        reseed, so each keeps its share of the work
+
+def seed_range(count):
+    seed = random.randint(0, 0xFFFFFFFF)
+    if "SEED_START" in os.environ:
+        seed = int(os.environ["SEED_START"], 0)
+    count = int(os.environ.get("SEED_COUNT", count))
+    return range(seed, seed + count)
+
+def iterations(count):
+    scale = float(os.environ.get("ITERATION_SCALE", 1))
+    return max(round(count * scale), 1) if scale else 0
+
+# Log a failing seed, in the form shard.py looks for
+def seed_failed(dut, seed):
+    dut._log.error("Failed seed {}".format(seed))
+
+def check_seeds(failed_seeds):
+    assert not failed_seeds, "Failed seeds: {}".format(" ".join(str(seed) for seed in failed_seeds))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Split one randomised test across several simulator processes.
+#
+# Tests that loop over seeds (test_core.test_random, test_cpu.test_random_alu)
+# are given a slice of the seed range each, using SEED_START and SEED_COUNT
+# (see seeds.py), and every failing seed is reported so it can be replayed on
+# its own.  Other random tests are run with a different RANDOM_SEED in each
+# shard and ITERATION_SCALE split between them.
+#
+#   ./shard.py core test_random --seeds 10000 --shards 8
+#   ./shard.py decode test_alu_imm --scale 20 --shards 4 --sim verilator
+#
+# The model is built once up front so the shards don't race to build it.
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from run_tests import TEST_DIR, run_module, module_suite, write_results
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one randomised test split across processes")
+    parser.add_argument("module", help="test module, e.g. core for test_core.py")
+    parser.add_argument("test", help="test to run, e.g. test_random")
+    parser.add_argument("args", nargs="*", metavar="VAR=value", help="extra make variables")
+    parser.add_argument("--seeds", type=int, help="total number of seeds, for tests that loop over seeds")
+    parser.add_argument("--scale", type=float, help="total iterations as a multiple of the test's own, for other random tests")
+    parser.add_argument("--start", type=lambda x: int(x, 0), help="first seed, default random")
+    parser.add_argument("--shards", type=int, default=os.cpu_count(), help="number of processes, default one per core")
+    parser.add_argument("--sim", default=os.environ.get("SIM", "icarus"), help="simulator, default icarus")
+    args = parser.parse_args()
+
+    if (args.seeds is None) == (args.scale is None):
+        parser.error("give one of --seeds or --scale")
+
+    start_seed = args.start if args.start is not None else random.randint(0, 0xFFFFFFFF)
+    make_args = ["TESTCASE={}".format(args.test)] + args.args
+
+    name = "{}-{}".format(args.module, args.test)
+    print("Building {}".format(name))
+    _, returncode, _ = run_module(args.module, args.sim, make_args + ["SEED_COUNT=0", "ITERATION_SCALE=0"], name + "-build")
+    if returncode != 0:
+        print("Build failed, see {}-build.log".format(name))
+        return 1
+
+    # Share the work out as evenly as possible
+    shards = []
+    first = 0
+    for i in range(args.shards):
+        if args.seeds is not None:
+            count = args.seeds // args.shards + (1 if i < args.seeds % args.shards else 0)
+            if count == 0:
+                continue
+            shard_args = ["RANDOM_SEED={}".format(start_seed + i), "SEED_START={}".format(start_seed + first), "SEED_COUNT={}".format(count)]
+            first += count
+        else:
+            shard_args = ["RANDOM_SEED={}".format(start_seed + i), "ITERATION_SCALE={:g}".format(args.scale / args.shards)]
+        shards.append(("{}-shard{}".format(name, i), shard_args))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        jobs = [pool.submit(run_module, args.module, args.sim, make_args + shard_args, shard_name)
+                for shard_name, shard_args in shards]
+        runs = [job.result() for job in jobs]
+    total_time = time.monotonic() - start
+
+    failed = write_results(runs, total_time, "{}-results.xml".format(name))
+    if not failed:
+        return 0
+
+    replay = "make -f test_{}.mk SIM={} TESTCASE={}".format(args.module, args.sim, args.test)
+    for (shard_name, shard_args), run in zip(shards, runs):
+        if module_suite(*run).get("failures") == "0":
+            continue
+        with open(os.path.join(TEST_DIR, "{}.log".format(shard_name))) as log:
+            failed_seeds = re.findall(r"Failed seed (\d+)", log.read())
+        if failed_seeds:
+            for seed in failed_seeds:
+                print("Failed: {} SEED_START={} SEED_COUNT=1".format(replay, seed))
+        else:
+            # No seed to report, so replay the whole shard
+            print("Failed: {} {}".format(replay, " ".join(shard_args)))
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
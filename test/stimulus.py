@@ -0,0 +1,58 @@
+import random
+
+import numpy as np
+
+from isa import encode_array
+
+# Random stimulus for the randomised tests, generated a batch at a time as
+# NumPy arrays so the test coroutines only have to walk the arrays between
+# simulator callbacks.  Encoding instructions one at a time and calling
+# random.randint for every field is slow next to a fast simulator.
+#
+# Each batch has its own generator.  The loops over seeds pass the seed in,
+# the others take one from Python's random, which cocotb seeds from
+# RANDOM_SEED, so either way a seed always gives the same stream.
+
+class Stimulus:
+    def __init__(self, count, seed=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+
+    # Values from low to high inclusive, like random.randint
+    def randint(self, low, high, size=None):
+        return self.rng.integers(low, high, size=size or self.count, endpoint=True)
+
+    # Rows picked from a table, an array of values for a list of values, or
+    # one array per column for a list of tuples
+    def choice(self, table):
+        picks = self.rng.integers(0, len(table), size=self.count)
+        if isinstance(table[0], tuple):
+            return tuple(np.array(column)[picks] for column in zip(*table))
+        return np.array(table)[picks]
+
+# Walk the arrays together, with each value as a Python int
+def rows(*columns):
+    return zip(*(np.asarray(column).tolist() for column in columns))
+
+# Encode a batch of instructions, where each row can be a different one
+def encode_batch(names, *operands):
+    names = np.asarray(names)
+    operands = [np.asarray(operand) for operand in operands]
+    encoded = np.zeros(len(names), dtype=np.int64)
+    for name in np.unique(names).tolist():
+        mask = names == name
+        encoded[mask] = encode_array(name, *(operand[mask] for operand in operands))
+    return encoded
+
+# The ALU instructions for the random core and CPU tests
+ALU_OPS = ["addi", "add", "sub", "andi", "and", "ori", "or", "xori", "xor",
+           "slti", "slt", "sltiu", "sltu", "slli", "sll", "srli", "srl", "srai", "sra",
+           "mul16", "czero.eqz", "czero.nez"]
+
+# A batch of ALU instructions on x0-x15, with rs2 or an immediate of 0-15,
+# returning the encoded instructions and the names of the ops
+def alu_instrs(stim):
+    names = stim.choice(ALU_OPS)
+    return encode_batch(names, stim.randint(0, 15), stim.randint(0, 15), stim.randint(0, 15)), names
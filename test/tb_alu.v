@@ -15,11 +15,8 @@ module tb_alu (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("alu.vcd");
-  $dumpvars (0, tb_alu);
-  #1;
-end
+`define DUMP_TOP tb_alu
+`include "dump.vh"
 `endif
 
     reg [4:0] counter = 0;
@@ -19,18 +19,15 @@ module tb_core (
     output branch,
     output [23:1] return_addr,
 
-    input interrupt,
+    input stall,
     input [3:0] interrupt_req,
     input timer_interrupt,
     output interrupt_pending
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("core.vcd");
-  $dumpvars (0, tb_core);
-  #1;
-end
+`define DUMP_TOP tb_core
+`include "dump.vh"
 `endif
 
     wire [31:0] imm;
@@ -125,7 +122,7 @@ end
         is_jal,
         is_system,
         1'b0,
-        interrupt,
+        stall,
 
         alu_op,
         mem_op,
@@ -14,11 +14,8 @@ module tb_counter (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("counter.vcd");
-  $dumpvars (0, tb_counter);
-  #1;
-end
+`define DUMP_TOP tb_counter
+`include "dump.vh"
 `endif
 
     reg [4:0] last_counter;
@@ -31,6 +28,7 @@ end
         end
 
     wire [3:0] data;
+    wire cy_out;
     tinyqv_counter i_mcount(clk, rstn, add, last_counter[4:2], data, cy_out);
 
     always @(posedge clk) begin
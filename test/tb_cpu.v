@@ -32,11 +32,8 @@ module tb_cpu (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("cpu.vcd");
-  $dumpvars (0, tb_cpu);
-  #1;
-end
+`define DUMP_TOP tb_cpu
+`include "dump.vh"
 `endif
 
     wire        debug_instr_complete;
@@ -37,11 +37,8 @@ module tb_decode (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("decode.vcd");
-  $dumpvars (0, tb_decode);
-  #1;
-end
+`define DUMP_TOP tb_decode
+`include "dump.vh"
 `endif
 
     tinyqv_decoder decoder(instr, 
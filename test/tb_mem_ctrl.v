@@ -37,11 +37,8 @@ module tb_mem_ctrl (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("mem_ctrl.vcd");
-  $dumpvars (0, tb_mem_ctrl);
-  #1;
-end
+`define DUMP_TOP tb_mem_ctrl
+`include "dump.vh"
 `endif
 
     tinyqv_mem_ctrl i_memctrl(
@@ -73,7 +70,10 @@ end
         .spi_flash_select(spi_flash_select),
         .spi_ram_a_select(spi_ram_a_select),
         .spi_ram_b_select(spi_ram_b_select),
-        .spi_clk_out(spi_clk_out)
+        .spi_clk_out(spi_clk_out),
+
+        .debug_stall_txn(),
+        .debug_stop_txn()
     );
 
 endmodule
\ No newline at end of file
@@ -32,11 +32,8 @@ module tb_qspi_ctrl (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("qspi_ctrl.vcd");
-  $dumpvars (0, tb_qspi_ctrl);
-  #1;
-end
+`define DUMP_TOP tb_qspi_ctrl
+`include "dump.vh"
 `endif
 
     qspi_controller i_ctrl(
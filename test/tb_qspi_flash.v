@@ -26,11 +26,8 @@ module tb_qspi_flash (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("qspi_flash.vcd");
-  $dumpvars (0, tb_qspi_flash);
-  #1;
-end
+`define DUMP_TOP tb_qspi_flash
+`include "dump.vh"
 `endif
 
     qspi_flash_controller i_flash(
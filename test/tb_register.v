@@ -19,11 +19,8 @@ module tb_register (
 );
 
 `ifdef COCOTB_SIM
-initial begin
-  $dumpfile ("register.vcd");
-  $dumpvars (0, tb_register);
-  #1;
-end
+`define DUMP_TOP tb_register
+`include "dump.vh"
 `endif
 
     reg [4:0] last_counter;
@@ -0,0 +1,185 @@
+/* The whole of TinyQV, CPU and memory controller, for running firmware.
+
+   Counts what the firmware tests report: clocks since reset, instructions,
+   fetch restarts and clocks a load or store to flash or PSRAM waits for the
+   memory controller.  trap is high as the fetch restarts at the trap vector.
+   debug_trace has the debug signals trace.py records.
+
+   For profiler.py: pc is the instruction being executed or waited for,
+   retired_pc the last instruction completed, and fetch_waits and data_waits
+   count clocks the CPU waits for the memory controller, for an instruction
+   or for the data of the load or store it is executing.
+
+   For qspi_usage.py: fetch_restart and stop_txn are the memory controller's
+   instr_fetch_restart and debug_stop_txn, and fetch_txn is high while the
+   transaction on the QSPI bus is an instruction fetch.
+ */
+
+module tb_tinyqv (
+    input clk,
+    input rstn,
+
+    output [27:0] data_addr,
+    output  [1:0] data_write_n,
+    output  [1:0] data_read_n,
+    output        data_read_complete,
+    output [31:0] data_out,
+
+    input         data_ready,
+    input  [31:0] data_in,
+
+    input   [3:0] interrupt_req,
+    input         timer_interrupt,
+
+    // External SPI interface
+    input   [3:0] spi_data_in,
+    output  [3:0] spi_data_out,
+    output  [3:0] spi_data_oe,
+    output        spi_clk_out,
+
+    output        spi_flash_select,
+    output        spi_ram_a_select,
+    output        spi_ram_b_select,
+
+    // Counters
+    output     [31:0] clocks,
+    output     [31:0] instret,
+    output     [31:0] fetch_restarts,
+    output     [31:0] data_stalls,
+    output            trap,
+
+    // For the profiler
+    output     [23:0] pc,
+    output     [23:0] retired_pc,
+    output     [31:0] fetch_waits,
+    output     [31:0] data_waits,
+
+    // For the QSPI bus usage
+    output            fetch_restart,
+    output            stop_txn,
+    output            fetch_txn,
+
+    // The debug signals packed for tracing, see trace.py
+    output     [11:0] debug_trace
+);
+
+`ifdef COCOTB_SIM
+`define DUMP_TOP tb_tinyqv
+`include "dump.vh"
+`endif
+
+    wire       debug_instr_complete;
+    wire       debug_instr_ready;
+    wire       debug_instr_valid;
+    wire       debug_fetch_restart;
+    wire       debug_data_ready;
+    wire       debug_interrupt_pending;
+    wire       debug_branch;
+    wire       debug_early_branch;
+    wire       debug_ret;
+    wire       debug_reg_wen;
+    wire       debug_counter_0;
+    wire       debug_data_continue;
+    wire       debug_stall_txn;
+    wire       debug_stop_txn;
+    wire [3:0] debug_rd;
+
+    tinyQV qv(
+        .clk(clk),
+        .rstn(rstn),
+
+        .data_addr(data_addr),
+        .data_write_n(data_write_n),
+        .data_read_n(data_read_n),
+        .data_read_complete(data_read_complete),
+        .data_out(data_out),
+
+        .data_ready(data_ready),
+        .data_in(data_in),
+
+        .interrupt_req(interrupt_req),
+        .timer_interrupt(timer_interrupt),
+
+        .spi_data_in(spi_data_in),
+        .spi_data_out(spi_data_out),
+        .spi_data_oe(spi_data_oe),
+        .spi_clk_out(spi_clk_out),
+        .spi_flash_select(spi_flash_select),
+        .spi_ram_a_select(spi_ram_a_select),
+        .spi_ram_b_select(spi_ram_b_select),
+
+        .debug_instr_complete(debug_instr_complete),
+        .debug_instr_ready(debug_instr_ready),
+        .debug_instr_valid(debug_instr_valid),
+        .debug_fetch_restart(debug_fetch_restart),
+        .debug_data_ready(debug_data_ready),
+        .debug_interrupt_pending(debug_interrupt_pending),
+        .debug_branch(debug_branch),
+        .debug_early_branch(debug_early_branch),
+        .debug_ret(debug_ret),
+        .debug_reg_wen(debug_reg_wen),
+        .debug_counter_0(debug_counter_0),
+        .debug_data_continue(debug_data_continue),
+        .debug_stall_txn(debug_stall_txn),
+        .debug_stop_txn(debug_stop_txn),
+        .debug_rd(debug_rd)
+    );
+
+    wire mem_access = qv.mem_data_read_n != 2'b11 || qv.mem_data_write_n != 2'b11;
+    wire fetch_wait = !qv.cpu.instr_valid;
+    wire data_wait = qv.cpu.instr_valid && (qv.cpu.is_load || qv.cpu.is_store) && mem_access && !qv.mem_data_ready;
+
+    // The restart is held until the fetch starts, so count its rising edges
+    reg last_fetch_restart;
+
+    // The counters are kept here rather than in output regs, as Verilator's
+    // top level outputs are copies, which checkpoint.py can't restore
+    reg [31:0] clocks_reg;
+    reg [31:0] instret_reg;
+    reg [31:0] fetch_restarts_reg;
+    reg [31:0] data_stalls_reg;
+    reg [23:0] retired_pc_reg;
+    reg [31:0] fetch_waits_reg;
+    reg [31:0] data_waits_reg;
+
+    always @(posedge clk) begin
+        if (!rstn) begin
+            clocks_reg <= 0;
+            instret_reg <= 0;
+            fetch_restarts_reg <= 0;
+            data_stalls_reg <= 0;
+            last_fetch_restart <= 0;
+            retired_pc_reg <= 0;
+            fetch_waits_reg <= 0;
+            data_waits_reg <= 0;
+        end else begin
+            clocks_reg <= clocks_reg + 1;
+            if (debug_instr_complete) instret_reg <= instret_reg + 1;
+            if (debug_fetch_restart && !last_fetch_restart) fetch_restarts_reg <= fetch_restarts_reg + 1;
+            last_fetch_restart <= debug_fetch_restart;
+            if (mem_access && !qv.mem_data_ready) data_stalls_reg <= data_stalls_reg + 1;
+            if (debug_instr_complete) retired_pc_reg <= pc;
+            if (fetch_wait) fetch_waits_reg <= fetch_waits_reg + 1;
+            if (data_wait) data_waits_reg <= data_waits_reg + 1;
+        end
+    end
+
+    assign clocks = clocks_reg;
+    assign instret = instret_reg;
+    assign fetch_restarts = fetch_restarts_reg;
+    assign data_stalls = data_stalls_reg;
+    assign retired_pc = retired_pc_reg;
+    assign fetch_waits = fetch_waits_reg;
+    assign data_waits = data_waits_reg;
+
+    assign trap = debug_fetch_restart && qv.instr_addr == 23'd2;
+    assign pc = qv.cpu.pc[23:0];
+
+    assign fetch_restart = debug_fetch_restart;
+    assign stop_txn = debug_stop_txn;
+    assign fetch_txn = qv.mem.instr_active;
+
+    assign debug_trace = {debug_rd, debug_stop_txn, debug_stall_txn, debug_fetch_restart, debug_reg_wen,
+                          debug_ret, debug_early_branch, debug_branch, debug_instr_complete};
+
+endmodule
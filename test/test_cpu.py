@@ -3,13 +3,19 @@ import random
 import cocotb
 import cocotb.utils
 from cocotb.clock import Clock
-from cocotb.triggers import Timer, ClockCycles
+from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly
 
-from riscvmodel.insn import *
-from riscvmodel.regnames import x0, x1, x2, x3, x5
+from riscvmodel.regnames import x0, x1, x2, x3, x5, x9
 from riscvmodel import csrnames
 
-from core_instr import *
+from isa import encode
+from iss import TinyQV, decode, Hang, to_signed
+from stimulus import Stimulus, alu_instrs, rows
+from seeds import seed_range, seed_failed, check_seeds
+from timing import Timing, Memory
+import fuzz
+from backdoor import Backdoor
+from checkpoint import Checkpoint
 
 async def send_instr(dut, instr, fast=False, len=4):
     await ClockCycles(dut.clk, 1)
@@ -54,7 +60,7 @@ async def expect_store(dut, addr, random_delay=True):
 
 async def read_reg(dut, reg, random_delay=True):
     offset = random.randint(0, 0x7FF)
-    instr = InstructionSW(x0, reg, offset).encode()
+    instr = encode("sw", x0, reg, offset)
     await send_instr(dut, instr)
 
     return await expect_store(dut, offset, random_delay)
@@ -97,14 +103,35 @@ async def expect_load(dut, addr, val):
 
 async def load_reg(dut, reg, value):
     offset = random.randint(0, 0x7FF)
-    instr = InstructionLW(reg, x0, offset).encode()
+    instr = encode("lw", reg, x0, offset)
     await send_instr(dut, instr)
 
     await expect_load(dut, offset, value)
 
+# Wait for the instructions sent to complete, leaving the CPU with none, at
+# a falling edge
+async def wait_idle(dut):
+    await ClockCycles(dut.clk, 1)
+    dut.instr_ready.value = 0
+    await FallingEdge(dut.clk)
+    while dut.debug_instr_valid.value == 0:
+        await FallingEdge(dut.clk)
+    while dut.debug_instr_valid.value == 1:
+        await FallingEdge(dut.clk)
+
+# The CPU just out of reset, saved by the first start() for the other tests
+# to restore rather than reset again
+reset_checkpoint = None
+
 async def start(dut):
+    global reset_checkpoint
     clock = Clock(dut.clk, 4, units="ns")
     cocotb.start_soon(clock.start())
+    if reset_checkpoint is not None:
+        await RisingEdge(dut.clk)
+        await reset_checkpoint.restore()
+        return clock
+
     dut.rstn.value = 1
     await ClockCycles(dut.clk, 1)
     dut.rstn.value = 0
@@ -128,6 +155,7 @@ async def start(dut):
     assert dut.data_read_n.value == 0b11
 
     dut.instr_fetch_started.value = 1
+    reset_checkpoint = await Checkpoint.save(dut)
 
     return clock
 
@@ -135,159 +163,102 @@ async def start(dut):
 async def test_basic(dut):
     await start(dut)
 
-    await send_instr(dut, InstructionADDI(x1, x0, 0x100).encode())
-    await send_instr(dut, InstructionADDI(x2, x0, 0x111).encode())
-    await send_instr(dut, InstructionADDI(x1, x2, 0x23).encode())
+    await send_instr(dut, encode("addi", x1, x0, 0x100))
+    await send_instr(dut, encode("addi", x2, x0, 0x111))
+    await send_instr(dut, encode("addi", x1, x2, 0x23))
 
     assert await read_reg(dut, x1) == 0x134
     await load_reg(dut, x1, 0x47654321)
 
-    await send_instr(dut, InstructionADDI(x2, x1, 0x23).encode())
+    await send_instr(dut, encode("addi", x2, x1, 0x23))
     assert await read_reg(dut, x2) == 0x47654344
 
 
-reg = [0] * 16
-
-# Each Op does reg[d] = fn(a, b)
-# fn will access reg global array
-class Op:
-    def __init__(self, rvm_insn, fn, cycles, name):
-        self.rvm_insn = rvm_insn
-        self.fn = fn
-        self.name = name
-        self.cycles = cycles
-    
-    def execute_fn(self, rd, rs1, arg2):
-        if rd != 0 and rd != 3 and rd != 4:
-            reg[rd] = self.fn(rs1, arg2)
-            while reg[rd] < -0x80000000: reg[rd] += 0x100000000
-            while reg[rd] > 0x7FFFFFFF:  reg[rd] -= 0x100000000
-
-    def encode(self, rd, rs1, arg2):
-        return self.rvm_insn(rd, rs1, arg2).encode()
-
-ops = [
-    Op(InstructionADDI, lambda rs1, imm: reg[rs1] + imm, 1, "+i"),
-    Op(InstructionADD, lambda rs1, rs2: reg[rs1] + reg[rs2], 1, "+"),
-    Op(InstructionSUB, lambda rs1, rs2: reg[rs1] - reg[rs2], 1, "-"),
-    Op(InstructionANDI, lambda rs1, imm: reg[rs1] & imm, 1, "&i"),
-    Op(InstructionAND, lambda rs1, rs2: reg[rs1] & reg[rs2], 1, "&"),
-    Op(InstructionORI, lambda rs1, imm: reg[rs1] | imm, 1, "|i"),
-    Op(InstructionOR, lambda rs1, rs2: reg[rs1] | reg[rs2], 1, "|"),
-    Op(InstructionXORI, lambda rs1, imm: reg[rs1] ^ imm, 1, "^i"),
-    Op(InstructionXOR, lambda rs1, rs2: reg[rs1] ^ reg[rs2], 1, "^"),
-    Op(InstructionSLTI, lambda rs1, imm: 1 if reg[rs1] < imm else 0, 2, "<i"),
-    Op(InstructionSLT, lambda rs1, rs2: 1 if reg[rs1] < reg[rs2] else 0, 2, "<"),
-    Op(InstructionSLTIU, lambda rs1, imm: 1 if (reg[rs1] & 0xFFFFFFFF) < (imm & 0xFFFFFFFF) else 0, 2, "<iu"),
-    Op(InstructionSLTU, lambda rs1, rs2: 1 if (reg[rs1] & 0xFFFFFFFF) < (reg[rs2] & 0xFFFFFFFF) else 0, 2, "<u"),
-    Op(InstructionSLLI, lambda rs1, imm: reg[rs1] << imm, 2, "<<i"),
-    Op(InstructionSLL, lambda rs1, rs2: reg[rs1] << (reg[rs2] & 0x1F), 2, "<<"),
-    Op(InstructionSRLI, lambda rs1, imm: (reg[rs1] & 0xFFFFFFFF) >> imm, 2, ">>li"),
-    Op(InstructionSRL, lambda rs1, rs2: (reg[rs1] & 0xFFFFFFFF) >> (reg[rs2] & 0x1F), 2, ">>l"),
-    Op(InstructionSRAI, lambda rs1, imm: reg[rs1] >> imm, 2, ">>i"),
-    Op(InstructionSRA, lambda rs1, rs2: reg[rs1] >> (reg[rs2] & 0x1F), 2, ">>"),
-    Op(InstructionMUL16, lambda rs1, rs2: reg[rs1] * (reg[rs2] & 0xFFFF), 2, "*"),
-    Op(InstructionCZERO_EQZ, lambda rs1, rs2: 0 if reg[rs2] == 0 else reg[rs1], 0, "?0"),
-    Op(InstructionCZERO_NEZ, lambda rs1, rs2: 0 if reg[rs2] != 0 else reg[rs1], 0, "?!0"),
-]
-
 @cocotb.test()
 async def test_random_alu(dut):
     await start(dut)
 
-    seed = random.randint(0, 0xFFFFFFFF)
-    #seed = 2843241462
     debug = False
-    for test in range(100):
-        random.seed(seed + test)
-        dut._log.info("Running test with seed {}".format(seed + test))
+    failed_seeds = []
+    cpu = TinyQV()
+    regs = Backdoor.cpu(dut)
+    for seed in seed_range(100):
+        stim = Stimulus(25, seed)
+        dut._log.info("Running test with seed {}".format(seed))
+        values = stim.randint(-0x80000000, 0x7FFFFFFF, 16).tolist()
+        await FallingEdge(dut.clk)
         for i in range(1, 16):
-            if i == 3: reg[i] = 0x1000400
-            elif i == 4: reg[i] = 0x8000000
-            else:
-                reg[i] = random.randint(-0x80000000, 0x7FFFFFFF)
-                if debug: print("Set reg {} to {}".format(i, reg[i]))
-                await load_reg(dut, i, reg[i])
-
-        if False:
-            for i in range(16):
-                reg_value = (await read_reg(dut, i)).signed_integer
-                if debug: print("Reg {} is {}".format(i, reg_value))
-                assert reg_value == reg[i]
-
-        last_instr = ops[0]
-        for i in range(25):
-            while True:
-                try:
-                    instr = random.choice(ops)
-                    rd = random.randint(0, 15)
-                    rs1 = random.randint(0, 15)
-                    arg2 = random.randint(0, 15)  # TODO
-
-                    instr.execute_fn(rd, rs1, arg2)
-                    break
-                except ValueError:
-                    pass
-
-            if debug: print("x{} = x{} {} {}, now {} {:08x}".format(rd, rs1, arg2, instr.name, reg[rd], instr.encode(rd, rs1, arg2)))
-            await send_instr(dut, instr.encode(rd, rs1, arg2))
-            #if debug:
-            #    assert await read_reg(dut, rd) == reg[rd] & 0xFFFFFFFF
-
+            if i != 3 and i != 4:
+                cpu.set_reg(i, values[i])
+                if debug: print("Set reg {} to {}".format(i, values[i]))
+                regs.set_reg(i, values[i])
+
+        # Run the ISS first, then send the same instructions
+        instrs, names = alu_instrs(stim)
+        for instr, name in rows(instrs, names):
+            cpu.execute(instr)
+            if debug:
+                rd = decode(instr).rd
+                print("{:08x} {}, x{} now {}".format(instr, name, rd, to_signed(cpu.get_reg(rd))))
+
+        for instr in instrs.tolist():
+            await send_instr(dut, instr)
+        await wait_idle(dut)
+
+        mismatch = False
         for i in range(16):
-            reg_value = (await read_reg(dut, i)).signed_integer
-            if debug: print("Reg x{} = {} should be {}".format(i, reg_value, reg[i]))
-            assert reg_value & 0xFFFFFFFF == reg[i] & 0xFFFFFFFF
+            reg_value = regs.get_reg(i)
+            if debug: print("Reg x{} = {} should be {}".format(i, to_signed(reg_value), to_signed(cpu.get_reg(i))))
+            mismatch |= reg_value != cpu.get_reg(i)
+        if mismatch:
+            seed_failed(dut, seed)
+            failed_seeds.append(seed)
+
+    check_seeds(failed_seeds)
 
 @cocotb.test()
 async def test_jump(dut):
     await start(dut)
 
-    await send_instr(dut, InstructionJAL(x1, 0x5678).encode())
+    await send_instr(dut, encode("jal", x1, 0x5678))
     await expect_branch(dut, 0x5678)
     assert await read_reg(dut, x1) == 0x4
 
-    await send_instr(dut, InstructionADDI(x1, x0, 0x40).encode())
-    await send_instr(dut, InstructionADDI(x1, x0, 0x100).encode())
-    await send_instr(dut, InstructionJAL(x2, -0x1000).encode())
-    await send_instr(dut, InstructionADDI(x1, x0, 0x80).encode(), True)
+    await send_instr(dut, encode("addi", x1, x0, 0x40))
+    await send_instr(dut, encode("addi", x1, x0, 0x100))
+    await send_instr(dut, encode("jal", x2, -0x1000))
+    await send_instr(dut, encode("addi", x1, x0, 0x80), True)
     await expect_branch(dut, 0x4684, True)
     assert await read_reg(dut, x2) == 0x5688
     assert await read_reg(dut, x1) == 0x100
 
-    await send_instr(dut, InstructionJALR(x2, x1, 0x20).encode())
+    await send_instr(dut, encode("jalr", x2, x1, 0x20))
     await expect_branch(dut, 0x120)
     assert await read_reg(dut, x2) == 0x4690
 
-    await send_instr(dut, InstructionAUIPC(x1, 0x1).encode())
-    await send_instr(dut, InstructionJALR(x2, x1, -0x20).encode())
+    await send_instr(dut, encode("auipc", x1, 0x1))
+    await send_instr(dut, encode("jalr", x2, x1, -0x20))
     await expect_branch(dut, 0x1104)
     assert await read_reg(dut, x2) == 0x12C
 
-    def encode_cjalr(dest_reg, reg):
-        if dest_reg == 1:
-            return 0x9002 | (reg << 7)
-        else:
-            return 0x8002 | (reg << 7)
-
-    await send_instr(dut, InstructionADDI(x1, x1, 0x40).encode())
-    await send_instr(dut, encode_cjalr(x0, x1))
+    await send_instr(dut, encode("addi", x1, x1, 0x40))
+    await send_instr(dut, encode("c.jr", x1))
     await expect_branch(dut, 0x1164, True)
 
 @cocotb.test()
 async def test_branch(dut):
     await start(dut)
 
-    await send_instr(dut, InstructionADDI(x1, x0, 0x200).encode())
-    await send_instr(dut, InstructionADDI(x2, x0, -0x200).encode())
-    await send_instr(dut, InstructionBEQ(x0, x1, 0x20).encode())
-    await send_instr(dut, InstructionBNE(x0, x1, 0x20).encode())
+    await send_instr(dut, encode("addi", x1, x0, 0x200))
+    await send_instr(dut, encode("addi", x2, x0, -0x200))
+    await send_instr(dut, encode("beq", x0, x1, 0x20))
+    await send_instr(dut, encode("bne", x0, x1, 0x20))
     await expect_branch(dut, 0x2C)
-    await send_instr(dut, InstructionBLT(x2, x1, -0x1C).encode())
+    await send_instr(dut, encode("blt", x2, x1, -0x1C))
     await expect_branch(dut, 0x10)
-    await send_instr(dut, InstructionBGE(x2, x1, 0x20).encode())
-    await send_instr(dut, InstructionBLTU(x2, x1, -0x20).encode())
-    await send_instr(dut, InstructionBGEU(x2, x1, 0x20).encode())
+    await send_instr(dut, encode("bge", x2, x1, 0x20))
+    await send_instr(dut, encode("bltu", x2, x1, -0x20))
+    await send_instr(dut, encode("bgeu", x2, x1, 0x20))
     await expect_branch(dut, 0x38)
 
 @cocotb.test()
@@ -295,23 +266,23 @@ async def test_csr(dut):
     await start(dut)
     start_sim_time = cocotb.utils.get_sim_time("ns")
 
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.cycle - 0x1000).encode())
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.cycle))
     assert await read_reg(dut, x1, False) == 3
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.cycle - 0x1000).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.cycle))
     assert await read_reg(dut, x2, False) == 9
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.instret - 0x1000).encode())
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.instret))
     assert await read_reg(dut, x1, False) == 4
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.instret - 0x1000).encode())
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.instret))
     assert await read_reg(dut, x1, False) == 6
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.cycle - 0x1000).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.cycle))
     assert await read_reg(dut, x2, False) == 27
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.misa).encode())
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.misa))
     assert await read_reg(dut, x1, False) == 0x40000014
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.time - 0x1000).encode())
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.time))
     assert await read_reg(dut, x1, False) == 39 // 8
 
     # Test time wrap
-    nop = send_instr(dut, InstructionNOP().encode())
+    nop = send_instr(dut, encode("nop"))
     count = ((cocotb.utils.get_sim_time("ns") - start_sim_time) // 4) % 8
     while count != 7:
         await ClockCycles(dut.clk, 1)
@@ -320,15 +291,15 @@ async def test_csr(dut):
     dut.cpu.i_core.i_cycles.register.value = 0xFFFFFEFF
 
     await nop
-    await send_instr(dut, InstructionNOP().encode())
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.time - 0x1000).encode())
+    await send_instr(dut, encode("nop"))
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.time))
     assert await read_reg(dut, x1, False) == 0x1FFFFFFE
     for i in range(5):
-        await send_instr(dut, InstructionNOP().encode())
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.time - 0x1000).encode())
+        await send_instr(dut, encode("nop"))
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.time))
     assert await read_reg(dut, x1, False) == 0x20000000
 
-    nop = send_instr(dut, InstructionNOP().encode())
+    nop = send_instr(dut, encode("nop"))
     count = ((cocotb.utils.get_sim_time("ns") - start_sim_time) // 4) % 8
     while count != 7:
         await ClockCycles(dut.clk, 1)
@@ -337,12 +308,12 @@ async def test_csr(dut):
     dut.cpu.i_core.i_cycles.register.value = 0xFFFFFEFF
 
     await nop
-    await send_instr(dut, InstructionNOP().encode())
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.time - 0x1000).encode())
+    await send_instr(dut, encode("nop"))
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.time))
     assert await read_reg(dut, x1, False) == 0x3FFFFFFE
     for i in range(5):
-        await send_instr(dut, InstructionNOP().encode())
-    await send_instr(dut, InstructionCSRRS(x1, x0, csrnames.time - 0x1000).encode())
+        await send_instr(dut, encode("nop"))
+    await send_instr(dut, encode("csrrs", x1, x0, csrnames.time))
     assert await read_reg(dut, x1, False) == 0x40000000
 
 
@@ -351,122 +322,122 @@ async def test_interrupt(dut):
     await start(dut)
 
     # Jump to a different address
-    await send_instr(dut, InstructionJAL(x0, 0x100).encode())
+    await send_instr(dut, encode("jal", x0, 0x100))
     await expect_branch(dut, 0x100)
 
     # Assert interrupt, this should latch but no interrupt yet
     dut.interrupt_req.value = 1
-    await send_instr(dut, InstructionNOP().encode())
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("nop"))
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     dut.interrupt_req.value = 0
     assert await read_reg(dut, x2, False) == 0x10000
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     assert await read_reg(dut, x2, False) == 0x10000
-    await send_instr(dut, InstructionLUI(x1, 0x10).encode())
+    await send_instr(dut, encode("lui", x1, 0x10))
 
     # Enable the interrupt, it immediately fires
-    await send_instr(dut, InstructionCSRRW(x0, x1, csrnames.mie).encode())
+    await send_instr(dut, encode("csrrw", x0, x1, csrnames.mie))
     await expect_branch(dut, 0x8)
 
     # Interrupts now disabled
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x80
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mepc).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mepc))
     assert await read_reg(dut, x2, False) == 0x11C
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mcause).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mcause))
     assert await read_reg(dut, x2, False) == 0x80000010
 
     # Ack the interrupt
-    await send_instr(dut, InstructionCSRRC(x0, x1, csrnames.mip).encode())
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("csrrc", x0, x1, csrnames.mip))
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     assert await read_reg(dut, x2, False) == 0
-    await send_instr(dut, InstructionMRET().encode())
+    await send_instr(dut, encode("mret"))
     await expect_branch(dut, 0x11C)
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x8C
 
     # Raise a persistent interrupt
     dut.interrupt_req.value = 4
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     assert await read_reg(dut, x2, False) == 0x40000
     dut.interrupt_req.value = 0
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     assert await read_reg(dut, x2, False) == 0
 
     dut.interrupt_req.value = 4
-    await send_instr(dut, InstructionLUI(x1, 0x40).encode())
-    await send_instr(dut, InstructionCSRRW(x0, x1, csrnames.mie).encode())
+    await send_instr(dut, encode("lui", x1, 0x40))
+    await send_instr(dut, encode("csrrw", x0, x1, csrnames.mie))
     await expect_branch(dut, 0x8)
 
     # Interrupts now disabled
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x80
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mcause).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mcause))
     assert await read_reg(dut, x2, False) == 0x80000012
 
     # Clear the interrupt
     dut.interrupt_req.value = 0
-    await send_instr(dut, InstructionMRET().encode())
+    await send_instr(dut, encode("mret"))
     await expect_branch(dut, 0x13C)
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x8C
 
     # Enable and assert interrupt
-    await send_instr(dut, InstructionLUI(x1, 0x20).encode())
-    await send_instr(dut, InstructionCSRRW(x0, x1, csrnames.mie).encode())
+    await send_instr(dut, encode("lui", x1, 0x20))
+    await send_instr(dut, encode("csrrw", x0, x1, csrnames.mie))
     dut.interrupt_req.value = 2
     await expect_branch(dut, 0x8)
     dut.interrupt_req.value = 2
 
     # Interrupts now disabled
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x80
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mcause).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mcause))
     assert await read_reg(dut, x2, False) == 0x80000011
 
     # Trap, this is a double fault so causes reset
-    await send_instr(dut, 0x00100073) # EBREAK
+    await send_instr(dut, encode("ebreak"))
     await expect_branch(dut, 0)
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mcause).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mcause))
     assert await read_reg(dut, x2, False) == 0x3
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     assert await read_reg(dut, x2, False) == 0
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mie).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mie))
     assert await read_reg(dut, x2, False) == 0
 
     # Disable interrupts and then break, this is OK
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0xC
-    await send_instr(dut, InstructionADDI(x1, x0, 0x8).encode())
-    await send_instr(dut, InstructionCSRRC(x0, x1, csrnames.mstatus).encode())
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("addi", x1, x0, 0x8))
+    await send_instr(dut, encode("csrrc", x0, x1, csrnames.mstatus))
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x4
-    await send_instr(dut, 0x00100073) # EBREAK
+    await send_instr(dut, encode("ebreak"))
     await expect_branch(dut, 4)
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mcause).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mcause))
     assert await read_reg(dut, x2, False) == 0x3
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mstatus).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mstatus))
     assert await read_reg(dut, x2, False) == 0x0
 
     # A second break is a double fault
-    await send_instr(dut, 0x00100073) # EBREAK
+    await send_instr(dut, encode("ebreak"))
     await expect_branch(dut, 0)
 
     # Jump to a different address
-    await send_instr(dut, InstructionJAL(x0, 0x80).encode())
+    await send_instr(dut, encode("jal", x0, 0x80))
     await expect_branch(dut, 0x80)
 
     # Assert timer interrupt, but no interrupt yet as not enabled
     dut.timer_interrupt.value = 1
-    await send_instr(dut, InstructionNOP().encode())
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mip).encode())
+    await send_instr(dut, encode("nop"))
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mip))
     assert await read_reg(dut, x2, False) == 0x80
-    await send_instr(dut, InstructionADDI(x1, x0, 0x80).encode())
+    await send_instr(dut, encode("addi", x1, x0, 0x80))
 
     # Enable the timer interrupt, it immediately fires
-    await send_instr(dut, InstructionCSRRW(x0, x1, csrnames.mie).encode())
+    await send_instr(dut, encode("csrrw", x0, x1, csrnames.mie))
     await expect_branch(dut, 0x8)
-    await send_instr(dut, InstructionCSRRS(x2, x0, csrnames.mcause).encode())
+    await send_instr(dut, encode("csrrs", x2, x0, csrnames.mcause))
     assert await read_reg(dut, x2, False) == 0x80000007
 
 
@@ -475,51 +446,303 @@ async def test_context(dut):
     await start(dut)
 
 
-    def encode_clcxt(imm, reg_seg, num_regs):
-        scrambled = (((imm << (12 - 9)) & 0b1000000000000) |
-                     ((imm << ( 6 - 4)) & 0b0000001000000) |
-                     ((imm >> ( 6 - 5)) & 0b0000000100000) |
-                     ((imm >> ( 7 - 3)) & 0b0000000011000) |
-                     ((imm >> ( 5 - 2)) & 0b0000000000100))
-        return 0x2002 | scrambled | (reg_seg << 10) | ((num_regs - 1) << 7)
-    
-    def encode_cscxt(imm, reg_seg, num_regs):
-        scrambled = (((imm << (12 - 9)) & 0b1000000000000) |
-                     ((imm << (11 - 4)) & 0b0100000000000) |
-                     ((imm << (10 - 5)) & 0b0010000000000) |
-                     ((imm << ( 7 - 6)) & 0b0001110000000))
-        return 0xE000 | scrambled | (reg_seg << 5) | ((num_regs - 1) << 2)
-    
     data = []
     for i in range(10):
         data.append(random.randint(0, (1 << 32) - 1))
     await load_reg(dut, x1, data[0])
     await load_reg(dut, x2, data[1])
 
-    await send_instr(dut, encode_cscxt(0, 0, 2), False, 2)
+    await send_instr(dut, encode("c.scxt", x1, 2, 0), False, 2)
     await expect_store(dut, 0x1000400) == data[0]
     await expect_store(dut, 0x1000404) == data[1]
 
     for i in range(8):
         await load_reg(dut, 8+i, data[2+i])
 
-    await send_instr(dut, encode_cscxt(16, 1, 7), False, 2)
+    await send_instr(dut, encode("c.scxt", x9, 7, 16), False, 2)
     for i in range(7):
         await expect_store(dut, 0x1000410 + ((i*4) & 0xF)) == data[i+3]
 
     for i in range(10):
         data[i] = random.randint(0, (1 << 32) - 1)
 
-    await send_instr(dut, encode_clcxt(0, 0, 2), False, 2)
+    await send_instr(dut, encode("c.lcxt", x1, 2, 0), False, 2)
     await expect_load(dut, 0x1000400, data[0])
     await expect_load(dut, 0x1000404, data[1])
 
     assert await read_reg(dut, x1) == data[0]
     assert await read_reg(dut, x2) == data[1]
 
-    await send_instr(dut, encode_clcxt(-0x200 & 0x3F0, 1, 7), False, 2)
+    await send_instr(dut, encode("c.lcxt", x9, 7, -0x200), False, 2)
     for i in range(7):
         await expect_load(dut, 0x1000200 + ((i*4) & 0xF), data[i+3])
 
     for i in range(7):
         assert await read_reg(dut, i+9) == data[i+3]
+
+# Items after a store in random_program before a jal can follow it
+STORE_GUARD = 2
+
+# A random program of length items, returning the flash image and the address
+# of the loop it ends in.  The items are ALU ops, jumps and branches (always
+# forwards), calls to functions that return with c.ret, loads from flash and
+# peripherals and stores to RAM and peripherals.  A jal while a store still
+# holds the memory hangs the CPU (see timing.Timing), so for STORE_GUARD items
+# after a store the jumps are branches or jalr and there are no calls.
+def random_program(length):
+    alu_reg_ops = ["add", "sub", "and", "or", "xor", "slt", "sltu", "sll", "srl", "sra", "mul16", "czero.eqz", "czero.nez"]
+    alu_imm_ops = ["addi", "andi", "ori", "xori", "slti", "sltiu"]
+    shift_ops = ["slli", "srli", "srai"]
+    branch_ops = ["beq", "bne", "blt", "bge", "bltu", "bgeu"]
+
+    # Registers that can be overwritten, ra is kept for returning from calls
+    regs = [2] + list(range(5, 16))
+
+    # Each item is a function from its address and the addresses of the items
+    # (to find branch targets) to the instructions
+    def alu():
+        rd, rs1, rs2 = random.choice(regs), random.randint(0, 15), random.randint(0, 15)
+        choice = random.randint(0, 7)
+        if choice == 0: return lambda addr, addrs: [encode(random.choice(shift_ops), rd, rs1, random.randint(0, 31))]
+        if choice == 1: return lambda addr, addrs: [encode(random.choice(alu_imm_ops), rd, rs1, random.randint(-2048, 2047))]
+        if choice == 2: return lambda addr, addrs: [encode(random.choice(alu_reg_ops), rd, rs1, rs2)]
+        if choice == 3: return lambda addr, addrs: [encode("c.addi", rd, random.randint(1, 31))]
+        if choice == 4: return lambda addr, addrs: [encode("c.slli", rd, random.randint(1, 31))]
+        if choice == 5: return lambda addr, addrs: [encode("c.mv", rd, random.choice(regs))]
+        if choice == 6: return lambda addr, addrs: [encode("c.add", rd, random.choice(regs))]
+        return lambda addr, addrs: [encode("lui", rd, random.randint(0, 0xFFFFF))]
+
+    def mem():
+        reg = random.choice(regs)
+        choice = random.randint(0, 5)
+        if choice == 0:
+            op, align = random.choice([("lb", 0), ("lh", 1), ("lw", 2), ("lbu", 0), ("lhu", 1)])
+            return lambda addr, addrs: [encode(op, reg, x0, random.randint(0, 0x7FF) & ~align)]
+        if choice == 1:
+            op, count = random.choice([("lw2", 2), ("lw4", 4)])
+            reg = random.randint(5, 16 - count)
+            return lambda addr, addrs: [encode(op, reg, x0, random.randint(0, 0x1FF) * 4)]
+        if choice == 2:
+            op = random.choice(["lb", "lw", "lw2", "lw4"])
+            return lambda addr, addrs: [encode(op, reg, 4, random.choice([0x8, 0x30, 0x3C]))]
+        if choice == 3:
+            op = random.choice(["sb", "sh", "sw", "sw2", "sw4n", "sw4"])
+            return lambda addr, addrs: [encode(op, 3, reg, random.randint(-0x200, 0x1FF) * 4)]
+        op = random.choice(["sb", "sw", "sw2", "sw4n", "sw4"])
+        return lambda addr, addrs: [encode(op, 4, reg, random.choice([0x8, 0x30, 0x3C]))]
+
+    def jump(index, near_store):
+        target = min(index + random.randint(1, 3), first + length)
+        choice = random.choice([0, 3]) if near_store else random.randint(0, 3)
+        if choice == 0:
+            op = random.choice(branch_ops)
+            rs1, rs2 = random.randint(0, 15), random.randint(0, 15)
+            return 4, lambda addr, addrs: [encode(op, rs1, rs2, addrs[target] - addr)]
+        if choice == 1: return 4, lambda addr, addrs: [encode("jal", x0, addrs[target] - addr)]
+        if choice == 2: return 2, lambda addr, addrs: [encode("c.j", addrs[target] - addr)]
+        return 8, lambda addr, addrs: [encode("auipc", x5, 0), encode("jalr", x0, x5, addrs[target] - addr)]
+
+    def size(fn):
+        return sum(2 if instr & 3 != 3 else 4 for instr in fn(0, [0] * (length + 1)))
+
+    # Start with random values in all the registers
+    items = []
+    for reg in [1, 2] + list(range(5, 16)):
+        value = random.randint(0, 0xFFFFFFFF)
+        items.append((8, lambda addr, addrs, reg=reg, value=value: [
+            encode("lui", reg, ((value + 0x800) >> 12) & 0xFFFFF),
+            encode("addi", reg, reg, ((value & 0xFFF) ^ 0x800) - 0x800)]))
+
+    functions = []
+    first = len(items)
+    since_store = STORE_GUARD
+    for i in range(length):
+        index = first + i
+        near_store = since_store < STORE_GUARD
+        choice = random.randint(0, 9)
+        if choice < 5 or choice == 9 and near_store:
+            fn = alu()
+        elif choice < 7:
+            fn = mem()
+        elif choice < 9:
+            items.append(jump(index, near_store))
+            since_store += 1
+            continue
+        else:
+            functions.append([alu() for j in range(random.randint(0, 3))])
+            function = len(functions) - 1
+            fn = lambda addr, addrs, function=function: [encode("jal", x1, addrs[first + length + 1 + function] - addr)]
+            items.append((4, fn))
+            since_store += 1
+            continue
+        items.append((size(fn), fn))
+        since_store = 0 if fn(0, [0] * (length + 1))[0] & 0x7F == 0x23 else since_store + 1
+
+    # Finish in a loop, a branch so it can follow a store, with the functions
+    # after
+    items.append((4, lambda addr, addrs: [encode("beq", x0, x0, 0)]))
+    for function in functions:
+        body = [(size(fn), fn) for fn in function]
+        items.append((sum(size for size, fn in body) + 2, lambda addr, addrs, body=body: (
+            [instr for size, fn in body for instr in fn(addr, addrs)] + [0x8082])))
+
+    addrs = []
+    addr = 0
+    for size, fn in items:
+        addrs.append(addr)
+        addr += size
+    addrs.append(addr)
+
+    flash = bytearray()
+    for (size, fn), addr in zip(items, addrs):
+        for instr in fn(addr, addrs):
+            flash += instr.to_bytes(4 if instr & 3 == 3 else 2, "little")
+    return flash, addrs[first + length]
+
+# Run random programs from flash, with timing.Memory standing in for the
+# memory controller, and check each instruction completes on the clock the
+# timing model predicts.
+@cocotb.test()
+async def test_timing(dut):
+    await start(dut)
+    dut.instr_fetch_started.value = 0
+
+    failed_seeds = []
+    for seed in seed_range(20):
+        random.seed(seed)
+        dut._log.info("Running test with seed {}".format(seed))
+        flash, end = random_program(40)
+        if not await check_timing(dut, flash, end):
+            seed_failed(dut, seed)
+            failed_seeds.append(seed)
+
+        await FallingEdge(dut.clk)
+        dut.rstn.value = 0
+        await ClockCycles(dut.clk, 2)
+        dut.rstn.value = 1
+
+    check_seeds(failed_seeds)
+
+# Run the program in flash until it reaches end, returning whether every
+# instruction completed when the timing model said it would.  random_program
+# avoids the jal after a store that hangs the CPU, so a hang is a failure.
+async def check_timing(dut, flash, end):
+    timing = Timing(TinyQV(flash), Memory())
+    memory = Memory()
+    data = TinyQV(flash)
+    next_addr = None
+
+    # The model starts at the beginning of a cycle
+    await RisingEdge(dut.clk)
+    await ReadOnly()
+    while dut.cpu.debug_counter_0.value == 0:
+        await RisingEdge(dut.clk)
+        await ReadOnly()
+
+    for clock in range(20000):
+        request = dut.data_read_n.value != 3 or dut.data_write_n.value != 3
+        data_addr = dut.data_addr.value.integer if request else 0
+        started, stopped, instr_ready, data_ready = memory.clock(
+            dut.instr_fetch_restart.value == 1, dut.instr_fetch_stall.value == 1, dut.instr_addr.value.integer << 1,
+            dut.data_read_n.value.integer, dut.data_write_n.value.integer, data_addr, dut.data_continue.value == 1)
+
+        complete = dut.cpu.debug_instr_complete.value == 1
+        try:
+            expected = timing.clock()
+        except Hang as e:
+            dut._log.error("Model hangs: {}".format(e))
+            return False
+        if complete != expected:
+            if complete:
+                dut._log.error("Instruction completed on clock {}, model expected {:06x} later".format(clock, timing.instr.pc))
+            else:
+                dut._log.error("Instruction {:06x} expected to complete on clock {}".format(timing.completed.pc, clock))
+            return False
+        if complete and timing.completed.pc == end:
+            return True
+
+        await FallingEdge(dut.clk)
+        dut.instr_fetch_started.value = started
+        dut.instr_fetch_stopped.value = stopped
+        dut.instr_ready.value = instr_ready
+        if instr_ready:
+            dut.instr_data_in.value = flash[memory.parcel_addr] | (flash[memory.parcel_addr + 1] << 8) if memory.parcel_addr + 1 < len(flash) else 0
+        dut.data_ready.value = data_ready
+        if data_ready:
+            # data_addr wraps in 16 bytes, but a continued memory transaction
+            # carries on to the next word
+            if next_addr is not None and data_addr >> 25 == 0:
+                data_addr = next_addr
+            if dut.data_read_n.value != 3:
+                dut.data_in.value = data.read(data_addr, {0: 1, 1: 2}.get(dut.data_read_n.value.integer, 4))
+            else:
+                data.write(data_addr, dut.data_out.value.integer, {0: 1, 1: 2}.get(dut.data_write_n.value.integer, 4))
+            next_addr = data_addr + 4 if dut.data_continue.value == 1 else None
+        await RisingEdge(dut.clk)
+        await ReadOnly()
+
+    dut._log.error("Program didn't finish")
+    return False
+
+# Fraction of test_fuzz's programs that may stop with a known CPU hang
+FUZZ_HANGS = 0.05
+
+# Run random programs in lockstep with the ISS, with random interrupts, and
+# shrink any that diverge to a short reproducer.  The programs avoid the
+# known CPU hangs (see fuzz.py), so only FUZZ_HANGS of them may still hang.
+@cocotb.test()
+async def test_fuzz(dut):
+    await start(dut)
+
+    failed_seeds = []
+    hangs = 0
+    seeds = seed_range(10)
+    for seed in seeds:
+        dut._log.info("Running test with seed {}".format(seed))
+        program = fuzz.Program(seed)
+        try:
+            result = await fuzz.lockstep(dut, program)
+            dut._log.info("Program {}".format(result))
+            hangs += result == "hang"
+        except fuzz.Divergence as e:
+            dut._log.error("Diverged: {}".format(e))
+            program, e = await fuzz.shrink(dut, program, e)
+            dut._log.error("Shrunk to {} items: {}\n{}".format(len(program), e, program.listing(e.pc)))
+            seed_failed(dut, seed)
+            failed_seeds.append(seed)
+
+    dut._log.info("{} of {} programs hung".format(hangs, len(seeds)))
+    check_seeds(failed_seeds)
+    assert hangs <= len(seeds) * FUZZ_HANGS, "{} of {} programs hung".format(hangs, len(seeds))
+
+# An ISS with xor broken, as a stand in for a CPU bug
+class BrokenXor(TinyQV):
+    def _compile(self, d):
+        if d.is_alu_reg and d.alu_op == 0b0100:
+            d.alu_op = 0b0110
+        return super()._compile(d)
+
+# The fuzzer finds the broken xor and shrinks the program down to it
+@cocotb.test()
+async def test_fuzz_shrink(dut):
+    await start(dut)
+
+    divergence = None
+    for seed in range(1000):
+        program = fuzz.Program(seed)
+        try:
+            await fuzz.lockstep(dut, program, BrokenXor)
+        except fuzz.Divergence as e:
+            divergence = e
+            break
+    assert divergence is not None, "No program diverged"
+
+    program, e = await fuzz.shrink(dut, program, divergence, BrokenXor)
+    dut._log.info("Seed {} shrunk to {} items: {}\n{}".format(seed, len(program), e, program.listing(e.pc)))
+    assert e.kind == "register"
+    image = program.assemble()
+    instr = image[e.pc] | (image[e.pc + 1] << 8)
+    instr = int.from_bytes(image[e.pc:e.pc + (4 if instr & 3 == 3 else 2)], "little")
+    d = decode(instr)
+    assert d.is_alu_reg and d.alu_op == 0b0100
+    assert len(program) <= 4
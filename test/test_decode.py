@@ -1,11 +1,21 @@
 import random
 
+import numpy as np
+
 import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles
 
-from riscvmodel.insn import *
-from core_instr import *
+from iss import decode
+from isa import encode, encode_array
+from seeds import iterations
+from coverage import Coverage, iss_outputs, random_word
+from stimulus import *
+
+# Directed instructions test_coverage may take to close the coverage.  This
+# isn't scaled by ITERATION_SCALE (see seeds.py), as the test runs until
+# closure rather than for a number of iterations.
+COVERAGE_LIMIT = 5000
 
 @cocotb.test()
 async def test_load(dut):
@@ -15,20 +25,21 @@ async def test_load(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
+    # LW, LH, LB, LBU, LHU as (name, mem_op)
     ops = [
-        (InstructionLW, 0b010),
-        (InstructionLH, 0b001),
-        (InstructionLB, 0b000),
-        (InstructionLBU, 0b100),
-        (InstructionLHU, 0b101),
+        ("lw", 0b010),
+        ("lh", 0b001),
+        ("lb", 0b000),
+        ("lbu", 0b100),
+        ("lhu", 0b101),
     ]
 
-    for i in range(400):
-        reg = random.randint(0, 15)
-        base_reg = random.randint(0, 15)
-        offset = random.randint(-2048, 2047)
-        op = random.choice(ops)
-        dut.instr.value = op[0](reg, base_reg, offset).encode()
+    stim = Stimulus(iterations(400))
+    regs, base_regs, offsets = stim.randint(0, 15), stim.randint(0, 15), stim.randint(-2048, 2047)
+    names, ops = stim.choice(ops)
+    instrs = encode_batch(names, regs, base_regs, offsets)
+    for instr, reg, base_reg, offset, mem_op in rows(instrs, regs, base_regs, offsets, ops):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 1
@@ -45,24 +56,16 @@ async def test_load(dut):
 
         assert dut.imm.value.signed_integer == offset
         assert dut.alu_op.value == 0  # ADD
-        assert dut.mem_op.value == op[1]
+        assert dut.mem_op.value == mem_op
         
         assert dut.rs1.value == base_reg
         assert dut.rd.value == reg
 
         assert dut.additional_mem_ops.value == 0
 
-    def encode_clw(reg, base_reg, imm):
-        scrambled = (((imm << (10 - 3)) & 0b1110000000000) |
-                     ((imm << ( 6 - 2)) & 0b0000001000000) |
-                     ((imm >> ( 6 - 5)) & 0b0000000100000))
-        return 0x4000 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)        
-
-    for i in range(100):
-        reg = random.randint(8, 15)
-        base_reg = random.randint(8, 15)
-        offset = random.randint(0, 31) * 4
-        dut.instr.value = encode_clw(reg, base_reg, offset)
+    stim = Stimulus(iterations(100))
+    for reg, base_reg, offset in rows(stim.randint(8, 15), stim.randint(8, 15), stim.randint(0, 31) * 4):
+        dut.instr.value = encode("c.lw", reg, base_reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 1
@@ -84,20 +87,9 @@ async def test_load(dut):
         assert dut.rs1.value == base_reg
         assert dut.rd.value == reg
 
-    def encode_clwsp(reg, base_reg, imm):
-        scrambled = (((imm << (12 - 5)) & 0b1000000000000) |
-                     ((imm << ( 4 - 2)) & 0b0000001110000) |
-                     ((imm >> ( 6 - 2)) & 0b0000000001100))
-        if base_reg == 2:
-            return 0x4002 | scrambled | (reg << 7)
-        else:
-            return 0x6002 | scrambled | (reg << 7)
-
-    for i in range(100):
-        reg = random.randint(1, 15)
-        base_reg = random.choice((2, 4))
-        offset = random.randint(0, 63) * 4
-        dut.instr.value = encode_clwsp(reg, base_reg, offset)
+    stim = Stimulus(iterations(100))
+    for reg, base_reg, offset in rows(stim.randint(1, 15), stim.choice((2, 4)), stim.randint(0, 63) * 4):
+        dut.instr.value = encode("c.lwsp" if base_reg == 2 else "c.lwtp", reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 1
@@ -119,25 +111,18 @@ async def test_load(dut):
         assert dut.rs1.value == base_reg
         assert dut.rd.value == reg
 
-    def encode_lw2(reg, base_reg, imm):
-        instr = InstructionLW(reg, base_reg, imm).encode()
-        return instr | (1 << 12)
-
-    def encode_lw4(reg, base_reg, imm):
-        instr = InstructionLW(reg, base_reg, imm).encode()
-        return instr | (7 << 12)
-
+    # LW2 and LW4, as (name, additional_mem_ops)
     ops = [
-        (encode_lw2, 1),
-        (encode_lw4, 3)
+        ("lw2", 1),
+        ("lw4", 3)
     ]
 
-    for i in range(100):
-        reg = random.randint(0, 15)
-        base_reg = random.randint(0, 15)
-        offset = random.randint(-2048, 2047)
-        op = random.choice(ops)
-        dut.instr.value = op[0](reg, base_reg, offset)
+    stim = Stimulus(iterations(100))
+    regs, base_regs, offsets = stim.randint(0, 15), stim.randint(0, 15), stim.randint(-2048, 2047)
+    names, additional = stim.choice(ops)
+    instrs = encode_batch(names, regs, base_regs, offsets)
+    for instr, reg, base_reg, offset, additional_mem_ops in rows(instrs, regs, base_regs, offsets, additional):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 1
@@ -159,37 +144,21 @@ async def test_load(dut):
         assert dut.rs1.value == base_reg
         assert dut.rd.value == reg
 
-        assert dut.additional_mem_ops.value == op[1]
+        assert dut.additional_mem_ops.value == additional_mem_ops
         assert dut.mem_op_increment_reg == 1
 
 
-    def encode_lh(reg, base_reg, imm):
-        scrambled = ((imm << (5 - 1)) & 0b100000)
-        return 0x8440 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)
-
-    def encode_lhu(reg, base_reg, imm):
-        scrambled = ((imm << (5 - 1)) & 0b100000)
-        return 0x8400 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)
-
-    def encode_lbu(reg, base_reg, imm):
-        scrambled = (((imm << (5 - 1)) & 0b0100000) |
-                     ((imm << (6 - 0)) & 0b1000000))
-        return 0x8000 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)
-
     ops = [
-        (encode_lh, 0b001),
-        (encode_lhu, 0b101),
-        (encode_lbu, 0b100),
+        ("c.lh", 0b001),
+        ("c.lhu", 0b101),
+        ("c.lbu", 0b100),
     ]
 
-    for i in range(200):
-        reg = random.randint(8, 15)
-        base_reg = random.randint(8, 15)
-        offset = random.randint(0, 1) * 2
-        op = random.choice(ops)
-        if (op[1] & 3) == 0:
-            offset += random.randint(0, 1)
-        dut.instr.value = op[0](reg, base_reg, offset)
+    stim = Stimulus(iterations(200))
+    names, mem_ops = stim.choice(ops)
+    offsets = stim.randint(0, 1) * 2 + np.where(mem_ops & 3 == 0, stim.randint(0, 1), 0)
+    for reg, base_reg, offset, name, mem_op in rows(stim.randint(8, 15), stim.randint(8, 15), offsets, names, mem_ops):
+        dut.instr.value = encode(name, reg, base_reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 1
@@ -206,7 +175,7 @@ async def test_load(dut):
 
         assert dut.imm.value.signed_integer == offset
         assert dut.alu_op.value == 0  # ADD
-        assert dut.mem_op.value == op[1]
+        assert dut.mem_op.value == mem_op
         
         assert dut.rs1.value == base_reg
         assert dut.rd.value == reg
@@ -221,26 +190,27 @@ async def test_alu_imm(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
+    # ADDI, ANDI, ORI, XORI, SLTI, SLTIU, SLLI, SRLI, SRAI as (name, alu_op,
+    # whether the immediate is signed)
     ops = [
-        (InstructionADDI, 0b0000, True),
-        (InstructionANDI, 0b0111, True),
-        (InstructionORI,  0b0110, True),
-        (InstructionXORI, 0b0100, True),
-        (InstructionSLTI, 0b0010, True),
-        (InstructionSLTIU,0b0011, True),
-        (InstructionSLLI, 0b0001, False),
-        (InstructionSRLI, 0b0101, False),
-        (InstructionSRAI, 0b1101, False),
+        ("addi", 0b0000, True),
+        ("andi", 0b0111, True),
+        ("ori", 0b0110, True),
+        ("xori", 0b0100, True),
+        ("slti", 0b0010, True),
+        ("sltiu", 0b0011, True),
+        ("slli", 0b0001, False),
+        ("srli", 0b0101, False),
+        ("srai", 0b1101, False),
     ]
 
-    for i in range(800):
-        src_reg = random.randint(0, 15)
-        dest_reg = random.randint(0, 15)
-        op = random.choice(ops)
-        if op[2]: imm = random.randint(-2048, 2047)
-        else: imm = random.randint(0, 31)
-
-        dut.instr.value = op[0](dest_reg, src_reg, imm).encode()
+    stim = Stimulus(iterations(800))
+    src_regs, dest_regs = stim.randint(0, 15), stim.randint(0, 15)
+    names, alu_ops, signed = stim.choice(ops)
+    imms = np.where(signed, stim.randint(-2048, 2047), stim.randint(0, 31))
+    instrs = encode_batch(names, dest_regs, src_regs, imms)
+    for instr, src_reg, dest_reg, alu_op, signed_imm, imm in rows(instrs, src_regs, dest_regs, alu_ops, signed, imms):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -255,32 +225,16 @@ async def test_alu_imm(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 4
 
-        if op[2]: assert dut.imm.value.signed_integer == imm
+        if signed_imm: assert dut.imm.value.signed_integer == imm
         else: assert dut.imm.value & 0x1F == imm
-        assert dut.alu_op.value == op[1]
+        assert dut.alu_op.value == alu_op
 
         assert dut.rs1.value == src_reg
         assert dut.rd.value == dest_reg
 
-    def encode_ci(reg, imm, opcode):
-        scrambled = (((imm << (12 - 5)) & 0b1000000000000) |
-                     ((imm << ( 2 - 0)) & 0b0000001111100))
-        return opcode | scrambled | (reg << 7)
-    
-    def encode_cli(reg, imm):
-        return encode_ci(reg, imm, 0x4001)
-
-    def encode_caddi(reg, imm):
-        return encode_ci(reg, imm, 0x0001)
-
-    def encode_cslli(reg, imm):
-        return encode_ci(reg, imm, 0x0002)
-
-    for i in range(100):
-        dest_reg = random.randint(1, 15)
-        imm = random.randint(0, 31)
-
-        dut.instr.value = encode_cli(dest_reg, imm)
+    stim = Stimulus(iterations(100))
+    for dest_reg, imm in rows(stim.randint(1, 15), stim.randint(0, 31)):
+        dut.instr.value = encode("c.li", dest_reg, imm)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -302,16 +256,14 @@ async def test_alu_imm(dut):
         assert dut.rd.value == dest_reg        
 
     ops = [
-        (encode_caddi, 0b0000, True),
-        (encode_cslli, 0b0001, False),
+        ("c.addi", 0b0000, True),
+        ("c.slli", 0b0001, False),
     ]
 
-    for i in range(200):
-        dest_reg = random.randint(0, 15)
-        op = random.choice(ops)
-        imm = random.randint(0, 31)
-
-        dut.instr.value = op[0](dest_reg, imm)
+    stim = Stimulus(iterations(200))
+    names, alu_ops, signed = stim.choice(ops)
+    for dest_reg, name, alu_op, signed_imm, imm in rows(stim.randint(0, 15), names, alu_ops, signed, stim.randint(0, 31)):
+        dut.instr.value = encode(name, dest_reg, imm)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -326,37 +278,23 @@ async def test_alu_imm(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 2
 
-        if op[2]: assert dut.imm.value.signed_integer == imm
+        if signed_imm: assert dut.imm.value.signed_integer == imm
         else: assert dut.imm.value & 0x1F == imm
-        assert dut.alu_op.value == op[1]
+        assert dut.alu_op.value == alu_op
 
         assert dut.rs1.value == dest_reg
         assert dut.rd.value == dest_reg
 
-    def encode_ci2(reg, imm, opcode):
-        return encode_ci(reg - 8, imm, opcode)
-    
-    def encode_csrli(reg, imm):
-        return encode_ci2(reg, imm, 0x8001)
-
-    def encode_csrai(reg, imm):
-        return encode_ci2(reg, imm, 0x8401)
-
-    def encode_candi(reg, imm):
-        return encode_ci2(reg, imm, 0x8801)
-
     ops = [
-        (encode_csrli, 0b0101, False),
-        (encode_csrai, 0b1101, False),
-        (encode_candi, 0b0111, True),
+        ("c.srli", 0b0101, False),
+        ("c.srai", 0b1101, False),
+        ("c.andi", 0b0111, True),
     ]
 
-    for i in range(300):
-        dest_reg = random.randint(8, 15)
-        op = random.choice(ops)
-        imm = random.randint(0, 31)
-
-        dut.instr.value = op[0](dest_reg, imm)
+    stim = Stimulus(iterations(300))
+    names, alu_ops, signed = stim.choice(ops)
+    for dest_reg, name, alu_op, signed_imm, imm in rows(stim.randint(8, 15), names, alu_ops, signed, stim.randint(0, 31)):
+        dut.instr.value = encode(name, dest_reg, imm)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -371,25 +309,16 @@ async def test_alu_imm(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 2
 
-        if op[2]: assert dut.imm.value.signed_integer == imm
+        if signed_imm: assert dut.imm.value.signed_integer == imm
         else: assert dut.imm.value & 0x1F == imm
-        assert dut.alu_op.value == op[1]
+        assert dut.alu_op.value == alu_op
 
         assert dut.rs1.value == dest_reg
         assert dut.rd.value == dest_reg
 
-    def encode_caddi4spn(reg, imm):
-        scrambled = (((imm << (11 - 4)) & 0b1100000000000) |
-                     ((imm << ( 7 - 6)) & 0b0011110000000) |
-                     ((imm << ( 6 - 2)) & 0b0000001000000) |
-                     ((imm << ( 5 - 3)) & 0b0000000100000))
-        return 0x0000 | scrambled | ((reg - 8) << 2)
-    
-    for i in range(100):
-        reg = random.randint(8, 15)
-        imm = random.randint(0, 255) * 4
-
-        dut.instr.value = encode_caddi4spn(reg, imm)
+    stim = Stimulus(iterations(100))
+    for reg, imm in rows(stim.randint(8, 15), stim.randint(0, 255) * 4):
+        dut.instr.value = encode("c.addi4spn", reg, imm)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -410,18 +339,9 @@ async def test_alu_imm(dut):
         assert dut.rs1.value == 2
         assert dut.rd.value == reg  
     
-    def encode_caddi16sp(imm):
-        scrambled = (((imm << (12 - 9)) & 0b1000000000000) |
-                     ((imm << ( 6 - 4)) & 0b0000001000000) |
-                     ((imm >> ( 6 - 5)) & 0b0000000100000) |
-                     ((imm >> ( 7 - 3)) & 0b0000000011000) |
-                     ((imm >> ( 5 - 2)) & 0b0000000000100))
-        return 0x6101 | scrambled
-    
-    for i in range(100):
-        imm = random.randint(-32, 31) * 16
-
-        dut.instr.value = encode_caddi16sp(imm)
+    stim = Stimulus(iterations(100))
+    for imm in (stim.randint(-32, 31) * 16).tolist():
+        dut.instr.value = encode("c.addi16sp", imm)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -442,27 +362,16 @@ async def test_alu_imm(dut):
         assert dut.rs1.value == 2
         assert dut.rd.value == 2
 
-    def encode_cnot(reg):
-        return 0x9c75 | ((reg - 8) << 7)
-
-    def encode_czext_b(reg):
-        return 0x9c61 | ((reg - 8) << 7)
-
-    def encode_czext_h(reg):
-        return 0x9c69 | ((reg - 8) << 7)
-
     ops = [
-        (encode_cnot, 0b0100, 0xFFFFFFFF),
-        (encode_czext_b, 0b0111, 0xFF),
-        (encode_czext_h, 0b0111, 0xFFFF),
+        ("c.not", 0b0100, 0xFFFFFFFF),
+        ("c.zext.b", 0b0111, 0xFF),
+        ("c.zext.h", 0b0111, 0xFFFF),
     ]
 
-    for i in range(200):
-        dest_reg = random.randint(8, 15)
-        op = random.choice(ops)
-        imm = random.randint(0, 31)
-
-        dut.instr.value = op[0](dest_reg)
+    stim = Stimulus(iterations(200))
+    names, alu_ops, imms = stim.choice(ops)
+    for dest_reg, name, alu_op, imm in rows(stim.randint(8, 15), names, alu_ops, imms):
+        dut.instr.value = encode(name, dest_reg)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -477,8 +386,8 @@ async def test_alu_imm(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 2
 
-        assert dut.imm.value == op[2]
-        assert dut.alu_op.value == op[1]
+        assert dut.imm.value == imm
+        assert dut.alu_op.value == alu_op
 
         assert dut.rs1.value == dest_reg
         assert dut.rd.value == dest_reg
@@ -492,29 +401,30 @@ async def test_alu_reg(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
+    # ADD, SUB, AND, OR, XOR, SLT, SLTU, SLL, SRL, SRA, MUL16, CZERO.EQZ and
+    # CZERO.NEZ as (name, alu_op)
     ops = [
-        (InstructionADD, 0b0000, True),
-        (InstructionSUB, 0b1000, True),
-        (InstructionAND, 0b0111, True),
-        (InstructionOR,  0b0110, True),
-        (InstructionXOR, 0b0100, True),
-        (InstructionSLT, 0b0010, True),
-        (InstructionSLTU,0b0011, True),
-        (InstructionSLL, 0b0001, False),
-        (InstructionSRL, 0b0101, False),
-        (InstructionSRA, 0b1101, False),
-        (InstructionMUL16, 0b1010, False),
-        (InstructionCZERO_EQZ, 0b1110, False),
-        (InstructionCZERO_NEZ, 0b1111, False),
+        ("add", 0b0000),
+        ("sub", 0b1000),
+        ("and", 0b0111),
+        ("or", 0b0110),
+        ("xor", 0b0100),
+        ("slt", 0b0010),
+        ("sltu", 0b0011),
+        ("sll", 0b0001),
+        ("srl", 0b0101),
+        ("sra", 0b1101),
+        ("mul16", 0b1010),
+        ("czero.eqz", 0b1110),
+        ("czero.nez", 0b1111),
     ]
 
-    for i in range(800):
-        src_reg = random.randint(0, 15)
-        src_reg2 = random.randint(0, 15)
-        dest_reg = random.randint(0, 15)
-        op = random.choice(ops)
-
-        dut.instr.value = op[0](dest_reg, src_reg, src_reg2).encode()
+    stim = Stimulus(iterations(800))
+    src_regs, src_regs2, dest_regs = stim.randint(0, 15), stim.randint(0, 15), stim.randint(0, 15)
+    names, alu_ops = stim.choice(ops)
+    instrs = encode_batch(names, dest_regs, src_regs, src_regs2)
+    for instr, src_reg, src_reg2, dest_reg, alu_op in rows(instrs, src_regs, src_regs2, dest_regs, alu_ops):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -529,30 +439,15 @@ async def test_alu_reg(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 4
 
-        assert dut.alu_op.value == op[1]
+        assert dut.alu_op.value == alu_op
 
         assert dut.rs1.value == src_reg
         assert dut.rs2.value == src_reg2
         assert dut.rd.value == dest_reg
 
-    def encode_cr(dest_reg, src_reg, opcode):
-        return opcode | (dest_reg << 7) | (src_reg << 2)
-    
-    def encode_cmv(dest_reg, src_reg):
-        return encode_cr(dest_reg, src_reg, 0x8002)
-
-    def encode_cadd(dest_reg, src_reg):
-        return encode_cr(dest_reg, src_reg, 0x9002)
-
-    for i in range(200):
-        src_reg = random.randint(1, 15)
-        dest_reg = random.randint(1, 15)
-        move = random.choice((True, False))
-
-        if move:
-            dut.instr.value = encode_cmv(dest_reg, src_reg)
-        else:
-            dut.instr.value = encode_cadd(dest_reg, src_reg)
+    stim = Stimulus(iterations(200))
+    for src_reg, dest_reg, move in rows(stim.randint(1, 15), stim.randint(1, 15), stim.choice((True, False))):
+        dut.instr.value = encode("c.mv" if move else "c.add", dest_reg, src_reg)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -573,14 +468,9 @@ async def test_alu_reg(dut):
         assert dut.rs2.value == src_reg
         assert dut.rd.value == dest_reg
 
-    def encode_cmul16(dest_reg, src_reg):
-        return encode_cr(dest_reg, src_reg, 0xA002)
-    
-    for i in range(100):
-        src_reg = random.randint(1, 15)
-        dest_reg = random.randint(1, 15)
-
-        dut.instr.value = encode_cmul16(dest_reg, src_reg)
+    stim = Stimulus(iterations(100))
+    for src_reg, dest_reg in rows(stim.randint(1, 15), stim.randint(1, 15)):
+        dut.instr.value = encode("c.mul16", dest_reg, src_reg)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -601,34 +491,17 @@ async def test_alu_reg(dut):
         assert dut.rs2.value == src_reg
         assert dut.rd.value == dest_reg
 
-    def encode_ca(dest_reg, src_reg, opcode):
-        return opcode | ((dest_reg - 8) << 7) | ((src_reg - 8) << 2)
-    
-    def encode_csub(dest_reg, src_reg):
-        return encode_ca(dest_reg, src_reg, 0x8C01)
-
-    def encode_cxor(dest_reg, src_reg):
-        return encode_ca(dest_reg, src_reg, 0x8C21)
-
-    def encode_cor(dest_reg, src_reg):
-        return encode_ca(dest_reg, src_reg, 0x8C41)
-
-    def encode_cand(dest_reg, src_reg):
-        return encode_ca(dest_reg, src_reg, 0x8C61)
-
     ops = [
-        (encode_csub, 0b1000, True),
-        (encode_cand, 0b0111, True),
-        (encode_cor,  0b0110, True),
-        (encode_cxor, 0b0100, True),
+        ("c.sub", 0b1000),
+        ("c.and", 0b0111),
+        ("c.or",  0b0110),
+        ("c.xor", 0b0100),
     ]
 
-    for i in range(400):
-        src_reg = random.randint(8, 15)
-        dest_reg = random.randint(8, 15)
-        op = random.choice(ops)
-
-        dut.instr.value = op[0](dest_reg, src_reg)
+    stim = Stimulus(iterations(400))
+    names, alu_ops = stim.choice(ops)
+    for src_reg, dest_reg, name, alu_op in rows(stim.randint(8, 15), stim.randint(8, 15), names, alu_ops):
+        dut.instr.value = encode(name, dest_reg, src_reg)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -643,7 +516,7 @@ async def test_alu_reg(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 2
 
-        assert dut.alu_op.value == op[1]
+        assert dut.alu_op.value == alu_op
 
         assert dut.rs1.value == dest_reg
         assert dut.rs2.value == src_reg
@@ -657,10 +530,10 @@ async def test_auipc(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
-    for i in range(100):
-        reg = random.randint(0, 15)
-        offset = random.randint(0, 0xFFFFF)
-        dut.instr.value = InstructionAUIPC(reg, offset).encode()
+    stim = Stimulus(iterations(100))
+    regs, offsets = stim.randint(0, 15), stim.randint(0, 0xFFFFF)
+    for instr, reg, offset in rows(encode_array("auipc", regs, offsets), regs, offsets):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -688,18 +561,19 @@ async def test_store(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
+    # SW, SH, SB as (name, mem_op)
     ops = [
-        (InstructionSW, 0b010),
-        (InstructionSH, 0b001),
-        (InstructionSB, 0b000),
+        ("sw", 0b010),
+        ("sh", 0b001),
+        ("sb", 0b000),
     ]
 
-    for i in range(200):
-        reg = random.randint(0, 15)
-        base_reg = random.randint(0, 15)
-        offset = random.randint(-2048, 2047)
-        op = random.choice(ops)
-        dut.instr.value = op[0](base_reg, reg, offset).encode()
+    stim = Stimulus(iterations(200))
+    regs, base_regs, offsets = stim.randint(0, 15), stim.randint(0, 15), stim.randint(-2048, 2047)
+    names, ops = stim.choice(ops)
+    instrs = encode_batch(names, base_regs, regs, offsets)
+    for instr, reg, base_reg, offset, mem_op in rows(instrs, regs, base_regs, offsets, ops):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -716,22 +590,14 @@ async def test_store(dut):
 
         assert dut.imm.value.signed_integer == offset
         assert dut.alu_op.value == 0  # ADD
-        assert dut.mem_op.value == op[1]
+        assert dut.mem_op.value == mem_op
         
         assert dut.rs1.value == base_reg
         assert dut.rs2.value == reg
 
-    def encode_csw(base_reg, reg, imm):
-        scrambled = (((imm << (10 - 3)) & 0b1110000000000) |
-                     ((imm << ( 6 - 2)) & 0b0000001000000) |
-                     ((imm >> ( 6 - 5)) & 0b0000000100000))
-        return 0xC000 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)
-
-    for i in range(100):
-        reg = random.randint(8, 15)
-        base_reg = random.randint(8, 15)
-        offset = random.randint(0, 31) * 4
-        dut.instr.value = encode_csw(base_reg, reg, offset)
+    stim = Stimulus(iterations(100))
+    for reg, base_reg, offset in rows(stim.randint(8, 15), stim.randint(8, 15), stim.randint(0, 31) * 4):
+        dut.instr.value = encode("c.sw", base_reg, reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -753,19 +619,9 @@ async def test_store(dut):
         assert dut.rs1.value == base_reg
         assert dut.rs2.value == reg
 
-    def encode_cswsp(base_reg, reg, imm):
-        scrambled = (((imm << ( 9 - 2)) & 0b1111000000000) |
-                     ((imm << ( 7 - 6)) & 0b0000110000000))
-        if base_reg == 2:
-            return 0xC002 | scrambled | (reg << 2)
-        else:
-            return 0xE002 | scrambled | (reg << 2)
-
-    for i in range(100):
-        reg = random.randint(0, 15)
-        base_reg = random.choice((2, 4))
-        offset = random.randint(0, 63) * 4
-        dut.instr.value = encode_cswsp(base_reg, reg, offset)
+    stim = Stimulus(iterations(100))
+    for reg, base_reg, offset in rows(stim.randint(0, 15), stim.choice((2, 4)), stim.randint(0, 63) * 4):
+        dut.instr.value = encode("c.swsp" if base_reg == 2 else "c.swtp", reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -787,30 +643,19 @@ async def test_store(dut):
         assert dut.rs1.value == base_reg
         assert dut.rs2.value == reg
 
-    def encode_sw2(base_reg, reg, imm):
-        instr = InstructionSW(base_reg, reg, imm).encode()
-        return instr | (1 << 12)
-
-    def encode_sw4(base_reg, reg, imm):
-        instr = InstructionSW(base_reg, reg, imm).encode()
-        return instr | (7 << 12)
-
-    def encode_sw4n(base_reg, reg, imm):
-        instr = InstructionSW(base_reg, reg, imm).encode()
-        return instr | (6 << 12)
-
+    # SW2, SW4 and SW4N as (name, additional_mem_ops, mem_op_increment_reg)
     ops = [
-        (encode_sw2, 1, 1),
-        (encode_sw4, 3, 1),
-        (encode_sw4n, 3, 0)
+        ("sw2", 1, 1),
+        ("sw4", 3, 1),
+        ("sw4n", 3, 0)
     ]
 
-    for i in range(200):
-        reg = random.randint(0, 15)
-        base_reg = random.randint(0, 15)
-        offset = random.randint(-2048, 2047)
-        op = random.choice(ops)
-        dut.instr.value = op[0](base_reg, reg, offset)
+    stim = Stimulus(iterations(200))
+    regs, base_regs, offsets = stim.randint(0, 15), stim.randint(0, 15), stim.randint(-2048, 2047)
+    names, additional, increment = stim.choice(ops)
+    instrs = encode_batch(names, base_regs, regs, offsets)
+    for instr, reg, base_reg, offset, additional_mem_ops, increment_reg in rows(instrs, regs, base_regs, offsets, additional, increment):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -832,31 +677,19 @@ async def test_store(dut):
         assert dut.rs1.value == base_reg
         assert dut.rs2.value == reg
 
-        assert dut.additional_mem_ops.value == op[1]
-        assert dut.mem_op_increment_reg == op[2]
-
-    def encode_sh(base_reg, reg, imm):
-        scrambled = ((imm << (5 - 1)) & 0b100000)
-        return 0x8c00 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)
-
-    def encode_sb(base_reg, reg, imm):
-        scrambled = (((imm << (5 - 1)) & 0b0100000) |
-                     ((imm << (6 - 0)) & 0b1000000))
-        return 0x8800 | scrambled | ((base_reg - 8) << 7) | ((reg - 8) << 2)
+        assert dut.additional_mem_ops.value == additional_mem_ops
+        assert dut.mem_op_increment_reg == increment_reg
 
     ops = [
-        (encode_sh, 0b001),
-        (encode_sb, 0b000),
+        ("c.sh", 0b001),
+        ("c.sb", 0b000),
     ]    
 
-    for i in range(100):
-        reg = random.randint(8, 15)
-        base_reg = random.randint(8, 15)
-        offset = random.randint(0, 1) * 2
-        op = random.choice(ops)
-        if (op[1] & 3) == 0:
-            offset += random.randint(0, 1)
-        dut.instr.value = op[0](base_reg, reg, offset)
+    stim = Stimulus(iterations(100))
+    names, mem_ops = stim.choice(ops)
+    offsets = stim.randint(0, 1) * 2 + np.where(mem_ops & 3 == 0, stim.randint(0, 1), 0)
+    for reg, base_reg, offset, name, mem_op in rows(stim.randint(8, 15), stim.randint(8, 15), offsets, names, mem_ops):
+        dut.instr.value = encode(name, base_reg, reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -873,7 +706,7 @@ async def test_store(dut):
 
         assert dut.imm.value.signed_integer == offset
         assert dut.alu_op.value == 0  # ADD
-        assert dut.mem_op.value == op[1]
+        assert dut.mem_op.value == mem_op
         
         assert dut.rs1.value == base_reg
         assert dut.rs2.value == reg
@@ -886,10 +719,10 @@ async def test_lui(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
-    for i in range(100):
-        reg = random.randint(0, 15)
-        imm = random.randint(0, 0xFFFFF)
-        dut.instr.value = InstructionLUI(reg, imm).encode()
+    stim = Stimulus(iterations(100))
+    regs, imms = stim.randint(0, 15), stim.randint(0, 0xFFFFF)
+    for instr, reg, imm in rows(encode_array("lui", regs, imms), regs, imms):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -908,17 +741,9 @@ async def test_lui(dut):
         
         assert dut.rd.value == reg
 
-    def encode_clui(reg, imm):
-        scrambled = (((imm << (12 - 5)) & 0b1000000000000) |
-                     ((imm << ( 2 - 0)) & 0b0000001111100))
-        return 0x6001 | scrambled | (reg << 7)
-
-    for i in range(100):
-        reg = 2
-        while reg == 2:
-            reg = random.randint(1, 15)
-        imm = random.randint(-0x20, 0x1F)
-        dut.instr.value = encode_clui(reg, imm)
+    stim = Stimulus(iterations(100))
+    for reg, imm in rows(stim.choice([1] + list(range(3, 16))), stim.randint(-0x20, 0x1F)):
+        dut.instr.value = encode("c.lui", reg, imm)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -945,22 +770,22 @@ async def test_branch(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
+    # BEQ, BNE, BLT, BLTU, BGE, BGEU as (name, alu_op, whether inverted)
     ops = [
-        (InstructionBEQ, 0b0100, 0),
-        (InstructionBNE, 0b0100, 1),
-        (InstructionBLT, 0b0010, 0),
-        (InstructionBLTU,  0b0011, 0),
-        (InstructionBGE, 0b0010, 1),
-        (InstructionBGEU, 0b0011, 1),
+        ("beq", 0b0100, 0),
+        ("bne", 0b0100, 1),
+        ("blt", 0b0010, 0),
+        ("bltu", 0b0011, 0),
+        ("bge", 0b0010, 1),
+        ("bgeu", 0b0011, 1),
     ]
 
-    for i in range(800):
-        src_reg = random.randint(0, 15)
-        src_reg2 = random.randint(0, 15)
-        offset = random.randint(-2048, 2047) * 2
-        op = random.choice(ops)
-
-        dut.instr.value = op[0](src_reg, src_reg2, offset).encode()
+    stim = Stimulus(iterations(800))
+    src_regs, src_regs2, offsets = stim.randint(0, 15), stim.randint(0, 15), stim.randint(-2048, 2047) * 2
+    names, alu_ops, inverts = stim.choice(ops)
+    instrs = encode_batch(names, src_regs, src_regs2, offsets)
+    for instr, src_reg, src_reg2, offset, alu_op, invert in rows(instrs, src_regs, src_regs2, offsets, alu_ops, inverts):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -975,30 +800,16 @@ async def test_branch(dut):
         assert dut.is_system.value == 0
         assert dut.instr_len.value == 4
 
-        assert dut.alu_op.value == op[1]
-        assert dut.mem_op.value & 1 == op[2]
+        assert dut.alu_op.value == alu_op
+        assert dut.mem_op.value & 1 == invert
 
         assert dut.rs1.value == src_reg
         assert dut.rs2.value == src_reg2
         assert dut.imm.value.signed_integer == offset
 
-    def encode_cbeq(src_reg, offset, neq):
-        scrambled = (((offset << (12 - 8)) & 0b1000000000000) |
-                     ((offset << (10 - 3)) & 0b0110000000000) |
-                     ((offset >> ( 6 - 5)) & 0b0000001100000) |
-                     ((offset << ( 3 - 1)) & 0b0000000011000) |
-                     ((offset >> ( 5 - 2)) & 0b0000000000100))
-        if neq:
-            return 0xE001 | scrambled | ((src_reg - 8) << 7)
-        else:
-            return 0xC001 | scrambled | ((src_reg - 8) << 7)
-
-    for i in range(200):
-        src_reg = random.randint(8, 15)
-        offset = random.randint(-128, 127) * 2
-        neq = random.choice((True, False))
-
-        dut.instr.value = encode_cbeq(src_reg, offset, neq)
+    stim = Stimulus(iterations(200))
+    for src_reg, offset, neq in rows(stim.randint(8, 15), stim.randint(-128, 127) * 2, stim.choice((True, False))):
+        dut.instr.value = encode("c.bnez" if neq else "c.beqz", src_reg, offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -1028,11 +839,10 @@ async def test_jalr(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
-    for i in range(100):
-        reg = random.randint(0, 15)
-        dest_reg = random.randint(0, 15)
-        offset = random.randint(-2048, 2047)
-        dut.instr.value = InstructionJALR(dest_reg, reg, offset).encode()
+    stim = Stimulus(iterations(100))
+    regs, dest_regs, offsets = stim.randint(0, 15), stim.randint(0, 15), stim.randint(-2048, 2047)
+    for instr, reg, dest_reg, offset in rows(encode_array("jalr", dest_regs, regs, offsets), regs, dest_regs, offsets):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -1052,16 +862,9 @@ async def test_jalr(dut):
         assert dut.rs1.value == reg
         assert dut.rd.value == dest_reg
 
-    def encode_cjalr(dest_reg, reg):
-        if dest_reg == 1:
-            return 0x9002 | (reg << 7)
-        else:
-            return 0x8002 | (reg << 7)
-
-    for i in range(200):
-        reg = random.randint(1, 15)
-        dest_reg = random.randint(0, 1)
-        dut.instr.value = encode_cjalr(dest_reg, reg)
+    stim = Stimulus(iterations(200))
+    for reg, dest_reg in rows(stim.randint(1, 15), stim.randint(0, 1)):
+        dut.instr.value = encode("c.jalr" if dest_reg == 1 else "c.jr", reg)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -1091,10 +894,10 @@ async def test_jal(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
-    for i in range(100):
-        dest_reg = random.randint(0, 15)
-        offset = random.randint(-0x80000, 0x7FFFF) * 2
-        dut.instr.value = InstructionJAL(dest_reg, offset).encode()
+    stim = Stimulus(iterations(100))
+    dest_regs, offsets = stim.randint(0, 15), stim.randint(-0x80000, 0x7FFFF) * 2
+    for instr, dest_reg, offset in rows(encode_array("jal", dest_regs, offsets), dest_regs, offsets):
+        dut.instr.value = instr
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -1113,25 +916,9 @@ async def test_jal(dut):
 
         assert dut.rd.value == dest_reg
 
-    # C.J / C.JAL encoder
-    def encode_cjal(dest_reg, offset):
-        scrambled = (((offset << (12 - 11)) & 0b1000000000000) |
-                     ((offset << (11 -  4)) & 0b0100000000000) |
-                     ((offset << ( 9 -  8)) & 0b0011000000000) |
-                     ((offset >> (10 -  8)) & 0b0000100000000) |
-                     ((offset << ( 7 -  6)) & 0b0000010000000) |
-                     ((offset >> ( 7 -  6)) & 0b0000001000000) |
-                     ((offset << ( 3 -  1)) & 0b0000000111000) |
-                     ((offset >> ( 5 -  2)) & 0b0000000000100))
-        if dest_reg == 1:
-            return 0x2001 | scrambled
-        else:
-            return 0xA001 | scrambled
-
-    for i in range(100):
-        dest_reg = random.randint(0, 1)
-        offset = random.randint(-0x400, 0x3FF) * 2
-        dut.instr.value = encode_cjal(dest_reg, offset)
+    stim = Stimulus(iterations(100))
+    for dest_reg, offset in rows(stim.randint(0, 1), stim.randint(-0x400, 0x3FF) * 2):
+        dut.instr.value = encode("c.jal" if dest_reg == 1 else "c.j", offset)
         await Timer(1, "ns")
 
         assert dut.is_load.value == 0
@@ -1158,9 +945,7 @@ async def test_system(dut):
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 1
 
-    # Encoding for EBREAK is broken, so encode manually
-    # ECALL, EBREAK, C.EBREAK
-    encoded_instr = [0x73, 0x00100073, 0x9002]
+    encoded_instr = [encode("ecall"), encode("ebreak"), encode("c.ebreak")]
 
     for instr in encoded_instr:
         dut.instr.value = instr
@@ -1178,4 +963,78 @@ async def test_system(dut):
         assert dut.is_system.value == 1
         assert dut.instr_len.value == (4 if (instr & 3) == 3 else 2)
 
-        assert dut.imm.value == (0 if (instr == 0x73) else 1)
\ No newline at end of file
+        assert dut.imm.value == (0 if (instr == 0x73) else 1)
+
+# Decode instr, checking the outputs against the ISS's decode d, and return
+# them as a dict, with None for X.  Fields the decoder leaves as X are only
+# checked if they are resolvable.
+async def check_decode(dut, instr, d):
+    flags = ["is_load", "is_alu_imm", "is_auipc", "is_store", "is_alu_reg", "is_lui",
+             "is_branch", "is_jalr", "is_jal", "is_ret", "is_system", "mem_op_increment_reg"]
+    fields = ["instr_len", "alu_op", "additional_mem_ops"]
+    x_fields = ["imm", "mem_op", "rs1", "rs2", "rd"]
+
+    dut.instr.value = instr
+    await Timer(1, "ns")
+
+    outputs = {}
+    for name in flags + fields:
+        value = getattr(dut, name).value
+        assert value == getattr(d, name), "{} for {:08x}".format(name, instr)
+        outputs[name] = value.integer
+    for name in x_fields:
+        value = getattr(dut, name).value
+        outputs[name] = None
+        if value.is_resolvable:
+            assert value == getattr(d, name), "{} for {:08x}".format(name, instr)
+            outputs[name] = value.integer
+    return outputs
+
+@cocotb.test()
+async def test_random(dut):
+    clock = Clock(dut.clk, 4, units="ns")
+    cocotb.start_soon(clock.start())
+    dut.rstn.value = 0
+    await ClockCycles(dut.clk, 2)
+    dut.rstn.value = 1
+
+    # Any instruction word should decode the same as in the ISS
+    # Half are compressed, with the top half cleared and the low bits not 11
+    stim = Stimulus(iterations(2000))
+    instrs = stim.randint(0, 0xFFFFFFFF)
+    compressed = stim.randint(0, 1) == 1
+    instrs = np.where(compressed, instrs & 0xFFFF, instrs)
+    instrs ^= np.where(compressed & (instrs & 3 == 3), stim.randint(1, 3), 0)
+
+    # Decode them all with the ISS first
+    expected = [decode(instr) for instr in instrs.tolist()]
+    for instr, d in zip(instrs.tolist(), expected):
+        await check_decode(dut, instr, d)
+
+# Random instructions aimed at the decoder coverage bins not yet hit, checked
+# against the ISS, until every bin is covered.  Blind random words, as in
+# test_random, cover much less in the same number of instructions.
+@cocotb.test()
+async def test_coverage(dut):
+    clock = Clock(dut.clk, 4, units="ns")
+    cocotb.start_soon(clock.start())
+    dut.rstn.value = 0
+    await ClockCycles(dut.clk, 2)
+    dut.rstn.value = 1
+
+    rng = random.Random(random.getrandbits(64))
+    coverage = Coverage()
+    count = 0
+    while not coverage.closed() and count < COVERAGE_LIMIT:
+        for instr in coverage.directed(rng, 100):
+            coverage.sample(instr, await check_decode(dut, instr, decode(instr)))
+            count += 1
+    dut._log.info("After {} directed instructions\n{}".format(count, coverage.report()))
+    assert coverage.closed()
+
+    blind = Coverage()
+    for _ in range(count):
+        instr = random_word(rng)
+        blind.sample(instr, iss_outputs(decode(instr)))
+    dut._log.info("After {} blind random instructions\n{}".format(count, blind.report()))
+    assert blind.covered() < coverage.covered()
@@ -15,5 +15,7 @@ TOPLEVEL = tb_mem_ctrl
 # MODULE is the basename of the Python test file
 MODULE = test_mem_ctrl
 
+include $(PWD)/common.mk
+
 # include cocotb's make rules to take care of the simulator setup
 include $(shell cocotb-config --makefiles)/Makefile.sim
\ No newline at end of file
@@ -5,7 +5,10 @@ from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles
 from cocotb.binary import BinaryValue
 
+from qspi import QspiMonitor, FLASH_CONTINUOUS, QPI_RAM
+
 select = None
+bus = None
 
 async def start_data_read(dut, len_code, read_follows_read):
     global select
@@ -38,59 +41,17 @@ async def start_data_read(dut, len_code, read_follows_read):
         assert dut.spi_clk_out.value == 0
         await ClockCycles(dut.clk, 1, False)     
 
-    assert select.value == 0
-    assert dut.spi_flash_select.value == 0 if dut.spi_flash_select == select else 1
-    assert dut.spi_ram_a_select.value == 0 if dut.spi_ram_a_select == select else 1
-    assert dut.spi_ram_b_select.value == 0 if dut.spi_ram_b_select == select else 1
-    assert dut.spi_clk_out.value == 0
-
-    if dut.spi_flash_select != select:
-        # Command
-        cmd = 0x0B
-        assert dut.spi_data_oe.value == 0xF
-        for i in range(2):
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            assert dut.spi_clk_out.value == 1
-            assert dut.spi_data_out.value == (cmd & 0xF0) >> 4
-            assert dut.spi_data_oe.value == 0xF
-            cmd <<= 4
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            assert dut.spi_clk_out.value == 0
-
-    # Address
-    assert dut.spi_data_oe.value == 0xF
-    for i in range(6):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (addr >> (20 - i * 4)) & 0xF
-        assert dut.spi_data_oe.value == 0xF
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 0
-
-    # Dummy
-    if dut.spi_flash_select == select:
-        for i in range(2):
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            assert dut.spi_clk_out.value == 1
-            assert dut.spi_data_oe.value == 0xF
-            assert dut.spi_data_out.value == 0xA
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            assert dut.spi_clk_out.value == 0
-
-    for i in range(4):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_oe.value == 0
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 0
+    # Command (not for the flash), address, mode (only for the flash) and dummy
+    txn = await bus.header()
+    assert txn.select == select
+    assert txn.addr == addr & 0xFFFFFF
+    if select == dut.spi_flash_select:
+        assert txn.command is None
+        assert txn.mode == 0xAA
+    else:
+        assert txn.command == 0x0B
+    assert txn.dummy == 4
+    await ClockCycles(dut.clk, 1, False)
 
 async def start_data_write(dut, data, len_code, delay_start):
     global select
@@ -119,40 +80,21 @@ async def start_data_write(dut, data, len_code, delay_start):
         assert dut.spi_clk_out.value == 0
     await ClockCycles(dut.clk, 1, False)
 
-    assert select.value == 0
-    assert dut.spi_flash_select.value == 1
-    assert dut.spi_ram_a_select.value == 0 if dut.spi_ram_a_select == select else 1
-    assert dut.spi_ram_b_select.value == 0 if dut.spi_ram_b_select == select else 1
-    assert dut.spi_clk_out.value == 0
-    assert dut.spi_data_oe.value == 0xF
-
-    # Command
-    cmd = 0x02
-    for i in range(2):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (cmd & 0xF0) >> 4
-        assert dut.spi_data_oe.value == 0xF
-        cmd <<= 4
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 0
-
-    # Address
-    for i in range(6):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (addr >> (20 - i * 4)) & 0xF
-        assert dut.spi_data_oe.value == 0xF
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 0
+    # Command and address
+    txn = await bus.header()
+    assert txn.select == select
+    assert txn.command == 0x02
+    assert txn.addr == addr & 0xFFFFFF
+    await ClockCycles(dut.clk, 1, False)
 
 async def reset(dut, latency=1):
+    global bus
+
     clock = Clock(dut.clk, 4, units="ns")
     cocotb.start_soon(clock.start())
+    bus = QspiMonitor(dut, [(dut.spi_flash_select, FLASH_CONTINUOUS),
+                            (dut.spi_ram_a_select, QPI_RAM),
+                            (dut.spi_ram_b_select, QPI_RAM)])
     dut.rstn.value = 1
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 0
@@ -4,7 +4,12 @@ import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles
 
+from qspi import QspiMonitor, FLASH_CONTINUOUS, QPI_RAM
+from qspi_devices import W25Q128, APS6404L
+from qspi_pmod import QspiPmod
+
 select = None
+bus = None
 
 async def start_read(dut, clock_delay = False):
     global select
@@ -29,88 +34,21 @@ async def start_read(dut, clock_delay = False):
     await ClockCycles(dut.clk, 1, False)
     dut.start_read.value = 0
 
-    assert select.value == 0
-    assert dut.spi_flash_select.value == (0 if dut.spi_flash_select == select else 1)
-    assert dut.spi_ram_a_select.value == (0 if dut.spi_ram_a_select == select else 1)
-    assert dut.spi_ram_b_select.value == (0 if dut.spi_ram_b_select == select else 1)
-    assert dut.spi_clk_out.value == 0
-
-    if dut.spi_flash_select != select:
-        # Command
-        cmd = 0x0B
-        assert dut.spi_data_oe.value == 0xF
-        for i in range(2):
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            assert dut.spi_data_out.value == (cmd & 0xF0) >> 4
-            assert dut.spi_data_oe.value == 0xF
-            cmd <<= 4
-            if clock_delay:
-                assert dut.spi_clk_out.value == 0
-                await ClockCycles(dut.clk, 1, True)
-            assert dut.spi_clk_out.value == 1
-
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            if clock_delay:
-                assert dut.spi_clk_out.value == 1
-                await ClockCycles(dut.clk, 1, True)
-            assert dut.spi_clk_out.value == 0
-
-    # Address
-    assert dut.spi_data_oe.value == 0xF
-    for i in range(6):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_data_out.value == (addr >> (20 - i * 4)) & 0xF
-        assert dut.spi_data_oe.value == 0xF
-        if clock_delay:
-            assert dut.spi_clk_out.value == 0
-            await ClockCycles(dut.clk, 1, True)
-        assert dut.spi_clk_out.value == 1
-
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        if clock_delay:
-            assert dut.spi_clk_out.value == 1
-            await ClockCycles(dut.clk, 1, True)
-        assert dut.spi_clk_out.value == 0
-
-    # Dummy
-    if dut.spi_flash_select == select:
-        for i in range(2):
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            assert dut.spi_data_oe.value == 0xF
-            assert dut.spi_data_out.value == 0xA
-            if clock_delay:
-                assert dut.spi_clk_out.value == 0
-                await ClockCycles(dut.clk, 1, True)
-            assert dut.spi_clk_out.value == 1
-            await ClockCycles(dut.clk, 1, False)
-            assert select.value == 0
-            if clock_delay:
-                assert dut.spi_clk_out.value == 1
-                await ClockCycles(dut.clk, 1, True)
-            assert dut.spi_clk_out.value == 0
+    # Command (not for the flash), address, mode (only for the flash) and dummy
+    txn = await bus.header()
+    assert txn.select == select
+    assert txn.addr == addr & 0xFFFFFF
+    if select == dut.spi_flash_select:
+        assert txn.command is None
+        assert txn.mode == 0xAA
+    else:
+        assert txn.command == 0x0B
+    assert txn.dummy == 4
 
-    for i in range(4):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        if clock_delay:
-            assert dut.spi_clk_out.value == 0
-            await ClockCycles(dut.clk, 1, True)
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_oe.value == 0
+    # The header ends on the falling SPI clock, which is delayed to the falling
+    # clk edge with clock_delay
+    if not clock_delay:
         await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        if i != 3:
-            if clock_delay:
-                assert dut.spi_clk_out.value == 1
-                await ClockCycles(dut.clk, 1, True)
-            assert dut.spi_clk_out.value == 0
-        elif not clock_delay:
-            assert dut.spi_clk_out.value == 0
 
 async def start_write(dut, data):
     global select
@@ -134,40 +72,22 @@ async def start_write(dut, data):
     await ClockCycles(dut.clk, 1, False)
     dut.start_write.value = 0
 
-    assert select.value == 0
-    assert dut.spi_flash_select.value == 1
-    assert dut.spi_ram_a_select.value == (0 if dut.spi_ram_a_select == select else 1)
-    assert dut.spi_ram_b_select.value == (0 if dut.spi_ram_b_select == select else 1)
-    assert dut.spi_clk_out.value == 0
-    assert dut.spi_data_oe.value == 0xF
-
-    # Command
-    cmd = 0x02
-    for i in range(2):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (cmd & 0xF0) >> 4
-        assert dut.spi_data_oe.value == 0xF
-        cmd <<= 4
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 0
-
-    # Address
-    for i in range(6):
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (addr >> (20 - i * 4)) & 0xF
-        assert dut.spi_data_oe.value == 0xF
-        await ClockCycles(dut.clk, 1, False)
-        assert select.value == 0
-        assert dut.spi_clk_out.value == 0
+    # Command and address
+    txn = await bus.header()
+    assert txn.select == select
+    assert txn.command == 0x02
+    assert txn.addr == addr & 0xFFFFFF
+    await ClockCycles(dut.clk, 1, False)
 
 async def reset(dut, latency=0):
+    global bus
+
     clock = Clock(dut.clk, 4, units="ns")
     cocotb.start_soon(clock.start())
+    if bus: bus.stop()
+    bus = QspiMonitor(dut, [(dut.spi_flash_select, FLASH_CONTINUOUS),
+                            (dut.spi_ram_a_select, QPI_RAM),
+                            (dut.spi_ram_b_select, QPI_RAM)])
     dut.rstn.value = 1
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 0
@@ -179,6 +99,44 @@ async def reset(dut, latency=0):
     dut.stall_txn.value = 0
     dut.stop_txn.value = 0
 
+# Read and write through the controller's interface, for tests against the
+# device models
+async def read_bytes(dut, addr, length):
+    dut.addr_in.value = addr
+    dut.start_read.value = 1
+    await ClockCycles(dut.clk, 1, False)
+    dut.start_read.value = 0
+
+    data = []
+    while len(data) < length:
+        await ClockCycles(dut.clk, 1, False)
+        if dut.data_ready.value:
+            data.append(dut.data_out.value.integer)
+    await stop(dut)
+    return bytes(data)
+
+async def write_bytes(dut, addr, data):
+    dut.addr_in.value = addr
+    dut.data_in.value = data[0]
+    dut.start_write.value = 1
+    await ClockCycles(dut.clk, 1, False)
+    dut.start_write.value = 0
+
+    for byte in data[1:] + bytes(1):
+        await ClockCycles(dut.clk, 1, False)
+        while not dut.data_req.value:
+            await ClockCycles(dut.clk, 1, False)
+        dut.data_in.value = byte
+    await ClockCycles(dut.clk, 1, False)
+    await stop(dut)
+
+async def stop(dut):
+    dut.stop_txn.value = 1
+    while dut.busy.value:
+        await ClockCycles(dut.clk, 1, False)
+    dut.stop_txn.value = 0
+    await ClockCycles(dut.clk, 2, False)
+
 @cocotb.test()
 async def test_simple_read(dut):
     await reset(dut)
@@ -187,8 +145,10 @@ async def test_simple_read(dut):
         await start_read(dut)
 
         # Read
+        sent = []
         for j in range(10):
             data = random.randint(0, 255)
+            sent.append(data)
             for i in range(2):
                 dut.spi_data_in.value = (data >> (4 - i * 4)) & 0xF
                 await ClockCycles(dut.clk, 1, False)
@@ -215,6 +175,9 @@ async def test_simple_read(dut):
             assert dut.data_ready.value == 0
             dut.stop_txn.value = 0
 
+        txn = await bus.transaction()
+        assert txn.data[:10] == bytes(sent)
+
 @cocotb.test()
 async def test_simple_write(dut):
     await reset(dut)
@@ -223,8 +186,10 @@ async def test_simple_write(dut):
         data = random.randint(0, 255)
         await start_write(dut, data)
 
-        # Read
+        # Write
+        sent = []
         for j in range(10):
+            sent.append(data)
             for i in range(2):
                 assert dut.spi_data_oe.value == 0xF
                 assert dut.spi_data_out.value == (data >> (4 - i * 4)) & 0xF
@@ -262,6 +227,10 @@ async def test_simple_write(dut):
             assert dut.data_ready.value == 0
             dut.stop_txn.value = 0
 
+        txn = await bus.transaction()
+        assert txn.write
+        assert txn.data == bytes(sent)
+
 @cocotb.test()
 async def test_read_stall(dut):
     for latency in range(0,2):
@@ -502,3 +471,30 @@ async def test_latency(dut):
                 assert dut.spi_data_oe.value == 0
                 assert dut.data_ready.value == 0
                 dut.stop_txn.value = 0            
+
+@cocotb.test()
+async def test_models(dut):
+    flash = W25Q128(bytearray(random.randbytes(4096)))
+    rams = APS6404L(), APS6404L()
+
+    # A controller configured with N delay cycles works with N or N + 1 cycles
+    # of round trip latency, or N - 1 or N with the clock delay
+    for latency in range(8):
+        delay = latency & 3
+        for model_latency in (delay, delay + 1) if latency < 4 else (delay - 1, delay):
+            if model_latency < 0:
+                continue
+            await reset(dut, latency)
+            pmod = QspiPmod(dut, flash, *rams, latency=model_latency)
+
+            for k in range(4):
+                addr = random.randint(0, 4000)
+                assert await read_bytes(dut, addr, 16) == flash.read(addr, 16)
+
+                addr = random.randint(1 << 24, (1 << 25) - 1) & ~0x3FF | random.randint(0, 1000)
+                data = random.randbytes(16)
+                await write_bytes(dut, addr, data)
+                assert rams[(addr >> 23) & 1].read(addr & 0x7FFFFF, 16) == data
+                assert await read_bytes(dut, addr, 16) == data
+
+            pmod.stop()
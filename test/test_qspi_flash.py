@@ -4,6 +4,10 @@ import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles
 
+from qspi import QspiMonitor, FLASH_QUAD_READ
+
+bus = None
+
 async def start_read(dut):
     await ClockCycles(dut.clk, 1, False)
     assert dut.spi_data_oe.value == 0
@@ -16,57 +20,21 @@ async def start_read(dut):
     await ClockCycles(dut.clk, 1, False)
     dut.start_read.value = 0
 
-    assert dut.spi_select.value == 0
-    assert dut.spi_clk_out.value == 0
-    assert dut.spi_data_oe.value == 1
-
-    # Command
-    cmd = 0xEB
-    for i in range(8):
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (1 if cmd & 0x80 else 0)
-        assert dut.spi_data_oe.value == 1
-        cmd <<= 1
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 0
-
-    # Address
-    for i in range(6):
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_out.value == (addr >> (20 - i * 4)) & 0xF
-        assert dut.spi_data_oe.value == 0xF
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 0
-
-    # Dummy
-    for i in range(2):
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_oe.value == 0xF
-        assert dut.spi_data_out.value == 0xF
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 0
-
-    for i in range(4):
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 1
-        assert dut.spi_data_oe.value == 0
-        await ClockCycles(dut.clk, 1, False)
-        assert dut.spi_select.value == 0
-        assert dut.spi_clk_out.value == 0
+    # Command, address, mode and dummy.  The controller drives 1 on each
+    # nibble of the mode byte, so it doesn't enter continuous read mode
+    txn = await bus.header()
+    assert txn.command == 0xEB
+    assert txn.addr == addr & 0xFFFFFF
+    assert txn.mode == 0x11
+    assert txn.dummy == 4
+    await ClockCycles(dut.clk, 1, False)
 
 async def reset_and_start_read(dut):
+    global bus
+
     clock = Clock(dut.clk, 4, units="ns")
     cocotb.start_soon(clock.start())
+    bus = QspiMonitor(dut, [(dut.spi_select, FLASH_QUAD_READ)])
     dut.rstn.value = 1
     await ClockCycles(dut.clk, 2)
     dut.rstn.value = 0
@@ -0,0 +1,22 @@
+# Makefile
+# See https://docs.cocotb.org/en/stable/quickstart.html for more info
+
+# defaults
+SIM ?= icarus
+TOPLEVEL_LANG ?= verilog
+
+CPUD = $(PWD)/../cpu
+VERILOG_SOURCES += $(CPUD)/tinyqv.v $(CPUD)/cpu.v $(CPUD)/decode.v $(CPUD)/core.v $(CPUD)/alu.v $(CPUD)/register.v $(CPUD)/counter.v \
+                   $(CPUD)/mem_ctrl.v $(CPUD)/qspi_ctrl.v $(PWD)/tb_tinyqv.v
+COMPILE_ARGS    += -DSIM
+
+# TOPLEVEL is the name of the toplevel module in your Verilog or VHDL file
+TOPLEVEL = tb_tinyqv
+
+# MODULE is the basename of the Python test file
+MODULE = test_tinyqv
+
+include $(PWD)/common.mk
+
+# include cocotb's make rules to take care of the simulator setup
+include $(shell cocotb-config --makefiles)/Makefile.sim
\ No newline at end of file
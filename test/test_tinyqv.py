@@ -0,0 +1,500 @@
+import csv
+import os
+import random
+import tempfile
+
+import cocotb
+from cocotb.triggers import ClockCycles, Edge, ReadOnly, RisingEdge
+from cocotb.utils import get_sim_time
+from riscvmodel.regnames import tp, t0, t1, t2, a0, a2, a3, a4, a5
+
+import benchmarks
+from asm import Assembler
+from firmware import Soc, EXIT, format_differences
+from iss import TinyQV, GP, TP, RAM_A, RAM_B, decode
+from profiler import Profiler, Profile, load_symbols
+from qspi_usage import QspiUsage, Usage, read_capture, CAPTURE_COLUMNS
+from trace import Tracer, Trace, STALL_TXN
+
+# Budgets in clocks (not the README's cycles of 8 clocks) for the benchmarks,
+# the go/no-go gate for RTL changes: each is a little over the clocks taken
+# when it was last updated, so anything that makes a benchmark noticeably
+# slower fails here.  Lower them when the RTL gets faster.
+BUDGET_CLOCKS = {
+    "dhrystone": 80000,
+    "coremark": 310000,
+    "memcpy": 165000,
+    "irq_latency": 8000,
+    "calls": 5000,
+    "timing": 56000,
+}
+
+# Worst case interrupt latency in clocks, from in0 rising to the handler's
+# first store: the worst test_irq_latency measures over IRQ_SWEEP, with in0
+# raised 189 clocks after the loop starts its store.
+IRQ_LATENCY_BUDGET = 131
+
+# Clocks after the irq_latency loop starts its store to gp that
+# test_irq_latency raises in0, once for each.  The loop takes 336 clocks (42
+# cycles), so in0 rises at every clock of it: in every phase of the CPU's 8
+# clock cycle at every point in the loop's fetches, loads and stores.
+IRQ_SWEEP = range(1, 337)
+
+# Run a benchmark on the RTL and on the ISS, checking they agree
+async def run_benchmark(dut, name, image):
+    iss = TinyQV(image)
+    iss.run(10**7)
+
+    soc = Soc(dut, image)
+    await soc.reset()
+    result = await soc.run(BUDGET_CLOCKS[name])
+    dut._log.info("{}: {}".format(name, result))
+    assert result.reason == "exit", "{} didn't finish".format(name)
+    # The run stops as the store to EXIT is on the bus, before it completes
+    assert result.instret == iss.instret - 1
+    return soc, result
+
+def read_word(soc, addr):
+    return int.from_bytes(soc.read(addr, 4), "little")
+
+@cocotb.test()
+async def test_dhrystone(dut):
+    runs = 2
+    soc, result = await run_benchmark(dut, "dhrystone", benchmarks.dhrystone(runs))
+    assert result.exit_code == runs + 10
+
+    # Dhrystone's own checks of the final values
+    ptr_glob = read_word(soc, GP + benchmarks.PTR_GLOB)
+    next_ptr_glob = read_word(soc, GP + benchmarks.NEXT_PTR_GLOB)
+    assert read_word(soc, GP + benchmarks.INT_GLOB) == 5
+    assert read_word(soc, ptr_glob + benchmarks.INT_COMP) == 17
+    assert read_word(soc, next_ptr_glob + benchmarks.INT_COMP) == 18
+    assert soc.read(next_ptr_glob + benchmarks.STR_COMP, 31) == b"DHRYSTONE PROGRAM, SOME STRING\0"
+
+    # The usual figures at 64MHz
+    per_second = 64e6 * runs / result.clocks
+    dut._log.info("{:.0f} Dhrystones/s at 64MHz, {:.3f} DMIPS/MHz".format(per_second, per_second / 1757 / 64))
+
+@cocotb.test()
+async def test_coremark(dut):
+    iterations = 1
+    image = benchmarks.coremark(iterations)
+    iss = TinyQV(image)
+    iss.run(10**7)
+    soc, result = await run_benchmark(dut, "coremark", image)
+    assert result.exit_code == iss.get_reg(10)
+    dut._log.info("{:.0f} clocks per iteration".format(result.clocks / iterations))
+
+@cocotb.test()
+async def test_memcpy(dut):
+    soc, result = await run_benchmark(dut, "memcpy", benchmarks.memcpy())
+    data = benchmarks.memcpy_data()
+    for addr in (benchmarks.MEMCPY_A, benchmarks.MEMCPY_B, benchmarks.MEMCPY_C):
+        assert soc.read(addr, len(data)) == data
+    assert result.exit_code == sum(int.from_bytes(data[i:i + 4], "little") for i in range(0, len(data), 4)) & 0xFFFFFFFF
+
+# Preload flash and a 4MB RAM B image from files, run a copy from the end of
+# RAM B to RAM A, and check the result with a diff of the memories rather
+# than by reading it back on the CPU
+@cocotb.test()
+async def test_preload(dut):
+    size = 4 << 20
+    src, dst = RAM_B + size - 64, RAM_A + 0x1000
+    a = Assembler()
+    a.li(t0, src)
+    a.li(t1, dst)
+    a.addi(t2, t0, 64)
+    a.li(a0, 0)
+    a.label("copy")
+    a.lw4(a2, t0, 0)
+    a.sw4(t1, a2, 0)
+    for reg in (a2, a3, a4, a5):
+        a.add(a0, a0, reg)
+    a.addi(t0, t0, 16)
+    a.addi(t1, t1, 16)
+    a.bltu(t0, t2, "copy")
+    a.sw(tp, a0, EXIT - TP)
+    a.label("halt")
+    a.j("halt")
+
+    ram = random.Random(2).randbytes(size)
+    data = ram[-64:]
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in ("flash.bin", "ram_b.bin", "expected.bin", "dump.bin")]
+        for path, contents in zip(paths, (a.assemble(), ram, data[:32] + bytes(32))):
+            with open(path, "wb") as f:
+                f.write(contents)
+
+        soc = Soc(dut, paths[0], ram_b=paths[1])
+        before = soc.snapshot()
+        await soc.reset()
+        result = await soc.run(10000)
+        assert result.reason == "exit"
+        assert result.exit_code == sum(int.from_bytes(data[i:i + 4], "little") for i in range(0, 64, 4)) & 0xFFFFFFFF
+
+        changes = soc.changes(before)
+        dut._log.info("Changes:\n" + format_differences(changes))
+        assert all(dst <= addr and addr + len(new) <= dst + 64 for addr, _, new in changes)
+        assert soc.diff(dst, data) == []
+        differences = soc.diff(dst, paths[2])
+        assert differences[0][0] >= dst + 32 and all(new == data[addr - dst:addr - dst + len(new)]
+                                                     for addr, _, new in differences)
+
+        soc.dump(dst, 64, paths[3])
+        with open(paths[3], "rb") as f:
+            assert f.read() == data
+
+# Checkpoint Dhrystone part way through, then check that finishing again from
+# the checkpoint gives the same result and memory contents
+@cocotb.test()
+async def test_checkpoint(dut):
+    soc = Soc(dut, benchmarks.dhrystone(1))
+    await soc.reset()
+    await soc.run(2000)
+    checkpoint = await soc.checkpoint()
+    dut._log.info("Checkpointed {} signals at clock {}".format(len(checkpoint), dut.clocks.value.integer))
+
+    first = await soc.run(BUDGET_CLOCKS["dhrystone"])
+    assert first.reason == "exit"
+    memory = soc.snapshot()
+    await soc.restore(checkpoint)
+    second = await soc.run(BUDGET_CLOCKS["dhrystone"])
+    assert str(second) == str(first)
+    assert second.uart == first.uart and second.gpio_writes == first.gpio_writes
+    assert soc.changes(memory) == []
+
+@cocotb.test()
+async def test_irq_latency(dut):
+    count = len(IRQ_SWEEP)
+    soc = Soc(dut, benchmarks.irq_latency(count))
+    await soc.reset()
+
+    # The clock the loop next starts its store to gp, once the store has finished
+    async def loop_store():
+        await RisingEdge(dut.clk)
+        await ReadOnly()
+        while not (dut.qv.mem_data_write_n.value != 3 and dut.data_addr.value == GP):
+            await RisingEdge(dut.clk)
+            await ReadOnly()
+        start = dut.clocks.value.integer
+        while dut.qv.mem_data_write_n.value != 3:
+            await RisingEdge(dut.clk)
+            await ReadOnly()
+        return start
+
+    raised = []
+    loop_clocks = set()
+    async def raise_interrupts():
+        for offset in IRQ_SWEEP:
+            # Time from the loop after the last interrupt, once it has gone
+            # round once as it does without interrupts
+            await loop_store()
+            start = await loop_store()
+            loop_clocks.add(await loop_store() - start)
+            await ClockCycles(dut.clk, offset)
+            raised.append(dut.clocks.value.integer)
+            soc.set_inputs(1)
+            # Interrupt requests are sampled once every 8 clocks
+            await ClockCycles(dut.clk, 16)
+            soc.set_inputs(0)
+    cocotb.start_soon(raise_interrupts())
+
+    result = await soc.run(BUDGET_CLOCKS["irq_latency"] * count)
+    dut._log.info("irq_latency: {}".format(result))
+    assert result.reason == "exit"
+    assert result.exit_code == count
+    assert len(loop_clocks) == 1 and max(loop_clocks) <= len(IRQ_SWEEP), "Loop takes {} clocks".format(loop_clocks)
+
+    latencies = [next(clock for clock, _ in result.gpio_writes if clock >= start) - start for start in raised]
+    worst = max(range(count), key=lambda i: latencies[i])
+    dut._log.info("Interrupt latency {} to {} clocks, mean {:.1f}, worst {} clocks after the loop's store".format(
+        min(latencies), max(latencies), sum(latencies) / len(latencies), IRQ_SWEEP[worst]))
+    assert max(latencies) <= IRQ_LATENCY_BUDGET
+
+# Cycles per instruction, in the README's cycles of 8 clocks, for each class
+# in benchmarks.TIMING when last updated, and how much slower any may get
+# before the test fails
+TIMING_BASELINE = {
+    "c.add":          1,
+    "c.slli":         2,
+    "c.mul16":        2,
+    "add":            2,
+    "xor":            2,
+    "lui":            2,
+    "slli":           2,
+    "sra":            2,
+    "mul16":          2,
+    "branch":         2,
+    "c.beqz taken":   6,
+    "jal":            6,
+    "jalr":           7,
+    "call/c.ret":     11,
+    "sw peripheral":  2,
+    "lw peripheral":  2,
+    "sb ram":         8,
+    "sh ram":         8.5,
+    "sw ram":         9.5,
+    "sw2 ram":        13,
+    "sw4 ram":        21,
+    "lb ram":         9,
+    "lh ram":         9.5,
+    "lw ram":         10.5,
+    "lw2 ram":        15,
+    "lw4 ram":        23,
+    "lb flash":       9,
+    "lh flash":       9.5,
+    "lw flash":       10.5,
+    "lw2 flash":      15,
+    "lw4 flash":      23,
+}
+TIMING_TOLERANCE = 0.5
+
+# How many cycles over the README's figure any class may take.  The README
+# leaves out the cycles spent getting the next instruction going after a jump
+# or a RAM access, which cost up to 2.5 cycles (sh and sw to RAM).
+README_ALLOWANCE = 2.5
+
+# Where test_timing writes its table, kept out of the source tree
+TIMING_TABLE = os.environ.get("TIMING_TABLE", os.path.join("sim_build", "timing.csv"))
+
+# Time each class of instruction and check it against the README's timing
+# table, writing the table to TIMING_TABLE.  The README's cycles are without
+# waiting for the fetch, which can only fetch 16 bits a cycle, so they are
+# compared with the fetch taken into account.  Faster than the README is fine.
+@cocotb.test()
+async def test_timing(dut):
+    soc, result = await run_benchmark(dut, "timing", benchmarks.timing())
+    cycles = benchmarks.timing_cycles(result.gpio_writes)
+
+    rows = []
+    for name, length, readme, _ in benchmarks.TIMING:
+        expected = tuple(max(n, length / 2) for n in readme)
+        if cycles[name] < expected[0]:
+            compared = "faster"
+        elif cycles[name] > expected[1]:
+            compared = "slower"
+        else:
+            compared = "ok"
+        rows.append((name, cycles[name], readme[0], readme[1], expected[0], expected[1], compared,
+                     expected[1] + README_ALLOWANCE, TIMING_BASELINE[name] + TIMING_TOLERANCE))
+
+    if os.path.dirname(TIMING_TABLE):
+        os.makedirs(os.path.dirname(TIMING_TABLE), exist_ok=True)
+    with open(TIMING_TABLE, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("class", "cycles", "readme_min", "readme_max", "expected_min", "expected_max",
+                         "vs_readme", "readme_limit", "limit"))
+        for row in rows:
+            writer.writerow([value if isinstance(value, str) else "{:g}".format(value) for value in row])
+
+    for row in rows:
+        dut._log.info("{:16} {:6.2f}  README {}-{}, expected {:g}-{:g}: {}".format(*row[:7]))
+    for name, measured, *_, readme_limit, limit in rows:
+        assert measured <= readme_limit, "{} took {:g} cycles, the README allows {:g}".format(
+            name, measured, readme_limit)
+        assert measured <= limit, "{} took {:g} cycles, the limit is {:g}".format(name, measured, limit)
+
+# Trace Dhrystone and check the trace agrees with tb_tinyqv's counters and
+# with the branches taken on the ISS
+@cocotb.test()
+async def test_trace(dut):
+    image = benchmarks.dhrystone(1)
+    iss = TinyQV(image)
+    taken = 0
+    while True:
+        pc = iss.pc
+        instr_len = decode(int.from_bytes(iss.flash[pc:pc + 4], "little")).instr_len
+        if iss.run(1) == 0 or iss.pc == pc:
+            break
+        if iss.pc != pc + instr_len:
+            taken += 1
+
+    soc = Soc(dut, image)
+    await soc.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dhrystone.trace")
+        tracer = Tracer(dut, path)
+        result = await soc.run(BUDGET_CLOCKS["dhrystone"])
+        tracer.close()
+
+        trace = Trace(path)
+        dut._log.info("{} bytes of trace for {} clocks".format(os.path.getsize(path), trace.clocks))
+        assert trace.clocks == result.clocks
+        assert trace.instret() == result.instret
+        assert trace.fetch_restarts() == result.fetch_restarts
+        assert trace.branches()["branch"] == taken
+
+        stalls = trace.stalls()
+        assert stalls[:, 1].sum() == trace.count(STALL_TXN)
+        assert all(a[0] + a[1] < b[0] for a, b in zip(stalls, stalls[1:]))
+        assert trace.reg_writes().sum() <= trace.instret()
+
+# Profile Dhrystone, checking the clocks add up and the call stacks follow
+# its calls
+@cocotb.test()
+async def test_profile(dut):
+    image = benchmarks.dhrystone(1)
+    soc = Soc(dut, image)
+    await soc.reset()
+    start = dut.clocks.value.integer
+    profiler = Profiler(soc, image.labels)
+    result = await soc.run(BUDGET_CLOCKS["dhrystone"])
+    profile = profiler.close()
+    dut._log.info("Profile of dhrystone:\n" + profile.report(12))
+
+    execute, fetch, data = profile.total()
+    assert execute + fetch + data == result.clocks - start
+    assert fetch > 0 and data > 0
+    # A sample for each instruction and for the store to EXIT on the bus
+    assert profile.samples == result.instret + 1
+
+    stacks = set(profile.stacks)
+    assert all(stack[0] == "reset" for stack in stacks)
+    for stack in (("reset", "proc_1", "proc_3", "proc_7"), ("reset", "proc_1", "proc_6"),
+                  ("reset", "func_2", "func_1"), ("reset", "func_2", "strcmp"), ("reset", "proc_8")):
+        assert stack in stacks, "No samples in " + ";".join(stack)
+    assert all(stack[-2] == "proc_1" for stack in stacks if stack[-1] == "proc_3")
+    functions = profile.functions()
+    assert functions["reset"][1] == result.clocks - start
+
+    # The collapsed stacks read back to the same profile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dhrystone.folded")
+        profile.write_collapsed(path)
+        assert Profile.read_collapsed(path).functions() == functions
+
+# Profile the interrupt latency test sampling every 16 clocks, checking the
+# samples in the handler are seen as in an interrupt
+@cocotb.test()
+async def test_profile_interrupts(dut):
+    count = 4
+    image = benchmarks.irq_latency(count)
+    soc = Soc(dut, image)
+    await soc.reset()
+    start = dut.clocks.value.integer
+    profiler = Profiler(soc, image.labels, 16)
+
+    async def raise_interrupts():
+        for i in range(count):
+            await ClockCycles(dut.clk, 600)
+            soc.set_inputs(1)
+            await ClockCycles(dut.clk, 16)
+            soc.set_inputs(0)
+    cocotb.start_soon(raise_interrupts())
+
+    result = await soc.run(BUDGET_CLOCKS["irq_latency"])
+    profile = profiler.close()
+    assert result.reason == "exit"
+    assert sum(profile.total()) == result.clocks - start
+    assert set(profile.stacks) == {("reset",), ("reset", "leaf"), ("reset", "interrupt")}
+    interrupt_pcs = [pc for pc in profile.addresses if profile.symbols.function(pc) == "interrupt"]
+    assert interrupt_pcs and all(8 <= pc < image.labels["start"] for pc in interrupt_pcs)
+
+# Profile calls to functions that return with c.ret, which the CPU never
+# completes, checking the call stacks still unwind
+@cocotb.test()
+async def test_profile_compressed_returns(dut):
+    count = 8
+    image = benchmarks.calls(count)
+    soc = Soc(dut, image)
+    await soc.reset()
+    start = dut.clocks.value.integer
+    profiler = Profiler(soc, image.labels)
+    result = await soc.run(BUDGET_CLOCKS["calls"])
+    profile = profiler.close()
+    dut._log.info("Profile of calls:\n" + profile.report(8))
+    assert result.reason == "exit" and result.exit_code == count
+    assert sum(profile.total()) == result.clocks - start
+    assert set(profile.stacks) == {("reset",), ("reset", "outer"), ("reset", "outer", "leaf")}
+    functions = profile.functions()
+    assert sum(functions["leaf"][0]) > 0
+    assert functions["outer"][1] > functions["leaf"][1]
+
+# Write the QSPI and debug signals as a logic analyser would capture them
+async def capture_pins(dut, path):
+    with open(path, "w") as f:
+        f.write(",".join(("Time [s]",) + CAPTURE_COLUMNS) + "\n")
+        last = None
+        while True:
+            await Edge(dut.clk)
+            await ReadOnly()
+            oe, out, data_in = dut.spi_data_oe.value.integer, dut.spi_data_out.value.integer, dut.spi_data_in.value.integer
+            data = (out & oe) | (data_in & ~oe)
+            values = [dut.spi_clk_out.value.integer, dut.spi_flash_select.value.integer,
+                      dut.spi_ram_a_select.value.integer, dut.spi_ram_b_select.value.integer,
+                      data & 1, (data >> 1) & 1, (data >> 2) & 1, (data >> 3) & 1,
+                      dut.fetch_restart.value.integer, dut.stop_txn.value.integer]
+            if values != last:
+                f.write("{:.9f},{}\n".format(get_sim_time("ns") / 1e9, ",".join(map(str, values))))
+                last = values
+
+# Break down the QSPI bus time for the start of Dhrystone, checking the
+# fetches are found from the pins as the memory controller has them, and that
+# a capture of the pins gives the same breakdown
+@cocotb.test()
+async def test_qspi_usage(dut):
+    soc = Soc(dut, benchmarks.dhrystone(1))
+    await soc.reset()
+    usage = QspiUsage.soc(dut)
+
+    fetch_starts = []
+    async def fetches():
+        while True:
+            await RisingEdge(dut.fetch_txn)
+            fetch_starts.append(get_sim_time("ns"))
+    cocotb.start_soon(fetches())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "capture.csv")
+        capture = cocotb.start_soon(capture_pins(dut, path))
+        result = await soc.run(10000)
+        capture.kill()
+        live = usage.close()
+        captured = Usage(*read_capture(path), 4)
+    dut._log.info("QSPI usage:\n" + live.report())
+
+    kinds = set(kind for time in live.time.values() for kind, value in time.items() if value)
+    assert {"fetch", "read", "write", "restart", "overhead"} <= kinds
+    assert all(value >= 0 for time in live.time.values() for value in time.values())
+    assert live.idle >= 0
+    assert live.total("fetch") > live.total("read")
+
+    for txn in live.transactions:
+        assert txn.fetch == any(txn.start <= t < txn.end for t in fetch_starts), txn
+    assert len(live.restarts) + len(live.data_accesses) > 100
+    assert len(live.restarts) <= result.fetch_restarts <= len(live.restarts) + 1
+    causes = set(cause for cause, _ in live.restarts)
+    assert causes == {"start", "branch", "data"}
+
+    assert captured.spi_period == live.spi_period
+    assert captured.restarts == live.restarts
+    assert captured.data_accesses == live.data_accesses
+    assert dict(captured.time) == {device: time for device, time in live.time.items()}
+    assert dict(captured.bytes) == dict(live.bytes)
+
+# Run any firmware, with make -f test_tinyqv.mk FIRMWARE=firmware.elf, and
+# optionally MAX_CLOCKS and LATENCY.  With TRACE=run.trace it is traced, and
+# with PROFILE=run.folded it is profiled, sampling every PROFILE_PERIOD clocks
+# or by default every instruction, and the report is logged.  QSPI_USAGE=1
+# logs a breakdown of the time on the QSPI bus.
+@cocotb.test(skip="FIRMWARE" not in os.environ)
+async def test_firmware(dut):
+    soc = Soc(dut, os.environ["FIRMWARE"], int(os.environ.get("LATENCY", 1)))
+    await soc.reset()
+    tracer = Tracer(dut, os.environ["TRACE"]) if "TRACE" in os.environ else None
+    profiler = None
+    if "PROFILE" in os.environ:
+        profiler = Profiler(soc, load_symbols(os.environ["FIRMWARE"]), int(os.environ.get("PROFILE_PERIOD", 0)))
+    usage = QspiUsage.soc(dut) if os.environ.get("QSPI_USAGE") == "1" else None
+    result = await soc.run(int(os.environ.get("MAX_CLOCKS", 10**7)))
+    if tracer:
+        tracer.close()
+    dut._log.info(str(result))
+    if profiler:
+        profile = profiler.close()
+        profile.write_collapsed(os.environ["PROFILE"])
+        dut._log.info("Profile:\n" + profile.report())
+    if usage:
+        dut._log.info("QSPI usage:\n" + usage.close().report())
+    if result.uart:
+        dut._log.info("UART: {}".format(result.uart.decode(errors="replace")))
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+
+# Timing model for tinyQV, predicting when each instruction completes.
+#
+# core_cycles() gives the cycles an instruction takes in the core once it has
+# been fetched, as in the README:  most instructions take 1 cycle (8 clocks),
+# shifts, slt and mul take 2, czero takes 1 if the result is zero and 2
+# otherwise, and loads take 2 plus however long the memory takes.
+#
+# Timing runs a program on the ISS and models the CPU around the core clock
+# by clock: the 4 parcel instruction buffer filled 16 bits at a time (so a 32
+# bit instruction can't go faster than 2 cycles), JAL and c.ret restarting the
+# fetch as they are decoded, other jumps and taken branches restarting it when
+# they complete, and loads and stores stopping the fetch while the memory is
+# busy.  Memory is the memory controller, it follows the same handshakes as
+# tinyqv_mem_ctrl with the latencies as parameters.  test_cpu.py runs random
+# programs on the RTL and checks every instruction completes on the clock the
+# model predicts.
+#
+#   ./timing.py firmware.bin                 cycles for the whole program
+#   ./timing.py firmware.bin -n 10000 -v     and when each instruction completed
+
+import argparse
+import sys
+
+from iss import TinyQV, Hang, decode, BRANCH_OPS, ADDR_MASK, PC_MASK
+
+CLOCKS_PER_CYCLE = 8
+
+# Cycles taken by the core for an instruction, given the values of rs1 and rs2.
+# For a load this is the minimum, with the data returned straight away.
+def core_cycles(d, rs1_value=0, rs2_value=0):
+    if d.is_load:
+        return 2
+    if d.is_alu_imm or d.is_alu_reg:
+        alu_op = d.alu_op
+        if alu_op >> 1 == 0b111:
+            # czero finishes early if the result is zero
+            return 1 if (rs2_value == 0) != (alu_op & 1) else 2
+        if alu_op >> 1 in (0b001, 0b101) or alu_op & 3 == 0b01:
+            # slt, mul and shifts
+            return 2
+    return 1
+
+# One instruction as seen by the timing model, from running it on the ISS
+class Instr:
+    def __init__(self, pc, d, cycles, next_pc):
+        self.pc = pc
+        self.d = d
+        self.len = d.instr_len
+        self.cycles = cycles
+        self.next_pc = next_pc
+        self.branch = False
+        self.addrs = []
+        self.size = 4
+        self.interrupt = None
+
+# Memory controller timing, responding to the CPU's instruction fetch and
+# data requests one clock at a time.  Instruction data arrives a parcel every
+# parcel_clocks, starting fetch_latency clocks after a fetch starts.  A data
+# request waits for the end of the current parcel, then the fetch stops for
+# the data transaction and restarts afterwards.  Peripherals are outside the
+# memory controller and respond at once.
+#
+# The default latencies are the QSPI transactions at clk/2, 2 clocks a nibble:
+# a continuous read from flash sends 6 address, 2 mode and 4 dummy nibbles,
+# PSRAM 2 command and 6 address nibbles with 4 more dummy on a read.
+class Memory:
+    def __init__(self, fetch_latency=34, parcel_clocks=8, flash_read_latency=26,
+                 ram_read_latency=26, ram_write_latency=18, byte_clocks=4):
+        self.fetch_latency = fetch_latency
+        self.parcel_clocks = parcel_clocks
+        self.flash_read_latency = flash_read_latency
+        self.ram_read_latency = ram_read_latency
+        self.ram_write_latency = ram_write_latency
+        self.byte_clocks = byte_clocks
+        self.reset()
+
+    def reset(self):
+        self.clock_count = 0
+        self.fetching = False
+        self.started_at = None
+        self.next_parcel = 0
+        self.fetch_addr = 0
+        self.parcel_addr = None
+        self.data_pending = False
+        self.data_done = None
+        self.data_open = False
+        self.data_continue = False
+        self.fetch_starts = 0
+        self.data_txns = 0
+
+    # Clocks from starting a data transaction to data_ready
+    def data_latency(self, addr, size, write):
+        if write:
+            return self.ram_write_latency + size * self.byte_clocks
+        if addr < 0x1000000:
+            return self.flash_read_latency + size * self.byte_clocks
+        return self.ram_read_latency + size * self.byte_clocks
+
+    def _start_data(self, t, addr, read_n, write_n, data_continue):
+        size = {0: 1, 1: 2}.get(read_n & write_n, 4)
+        if self.data_open:
+            # Carry on from the previous word of a multi word transfer
+            latency = size * self.byte_clocks
+        else:
+            latency = self.data_latency(addr, size, write_n != 3)
+            self.data_txns += 1
+        self.data_done = t + latency
+        self.data_continue = data_continue
+
+    # Called once a clock with the CPU's outputs for that clock, returns
+    # instr_fetch_started, instr_fetch_stopped, instr_ready and data_ready.
+    # When instr_ready is set the parcel is the one at parcel_addr.
+    def clock(self, restart, stall, instr_addr, read_n, write_n, data_addr, data_continue):
+        t = self.clock_count
+        self.clock_count += 1
+        started = stopped = instr_ready = data_ready = False
+
+        request = read_n != 3 or write_n != 3
+        if request and data_addr >> 25:
+            data_ready = True
+            request = False
+
+        if self.data_done is not None:
+            if t >= self.data_done:
+                data_ready = True
+                self.data_done = None
+                self.data_open = self.data_continue
+            return started, stopped, instr_ready, data_ready
+
+        if request and not self.data_pending:
+            if self.fetching:
+                self.data_pending = True
+            else:
+                self._start_data(t, data_addr, read_n, write_n, data_continue)
+                return started, stopped, instr_ready, data_ready
+        elif self.data_pending and not self.fetching:
+            self.data_pending = False
+            self._start_data(t, data_addr, read_n, write_n, data_continue)
+            return started, stopped, instr_ready, data_ready
+
+        if self.fetching:
+            if restart and t != self.started_at + 1:
+                self.fetching = False
+                stopped = True
+            elif t >= self.next_parcel:
+                if not stall:
+                    instr_ready = True
+                    self.parcel_addr = self.fetch_addr
+                    self.fetch_addr = (self.fetch_addr + 2) & PC_MASK
+                    self.next_parcel = t + self.parcel_clocks
+                if self.data_pending and (stall or instr_ready):
+                    self.fetching = False
+                    stopped = True
+        elif restart and not self.data_open:
+            self.fetching = True
+            self.started_at = t
+            self.fetch_addr = instr_addr
+            self.next_parcel = t + self.fetch_latency
+            self.fetch_starts += 1
+            started = True
+
+        return started, stopped, instr_ready, data_ready
+
+# The CPU around the core, following tinyqv_cpu, running the program in the
+# ISS.  Each call to step() runs until the next instruction completes.
+class Timing:
+    def __init__(self, cpu=None, memory=None):
+        self.cpu = cpu or TinyQV()
+        self.memory = memory or Memory()
+        self.reset()
+
+    def reset(self):
+        self.clock_count = 0
+        self.counter = 0
+        self.instret = 0
+        self.fetch_restarts = 0
+        self.data_stalls = 0
+        self.completed = None
+        self.next_instr = None
+        self.hang = None
+
+        # Instruction buffer, pc is the current instruction, or the next to
+        # decode if nothing is valid, and write the address of the next parcel
+        self.pc = self.cpu.pc
+        self.write = self.cpu.pc
+        self.fetch_running = False
+        self.was_early_branch = False
+        self.early_branch_addr = 0
+
+        self.instr = None
+        self.instr_valid = False
+        self.is_load = False
+        self.is_store = False
+        self.interrupt_core = None
+        self.cycle = 0
+        self.mem_op = 0
+        self.additional_mem_ops = 0
+
+        self.data_addr = 0
+        self.read_n = 3
+        self.write_n = 3
+        self.data_continue = False
+        self.no_write_in_progress = True
+        self.load_started = False
+        self.data_ready_latch = False
+        self.data_ready_sync = False
+        self.load_done = False
+
+    # Run the next instruction on the ISS
+    def _next_instr(self):
+        cpu = self.cpu
+        pc = cpu.pc
+        instr = cpu.fetch(pc)
+        d = decode(instr)
+        rs1_value = cpu.get_reg(d.rs1)
+        rs2_value = cpu.get_reg(d.rs2)
+        cycles = core_cycles(d, rs1_value, rs2_value)
+
+        next_pc = cpu.compile(instr)(pc)
+        cpu.instret += 1
+        i = Instr(pc, d, cycles, next_pc)
+        if d.is_jal or d.is_jalr or d.is_system and d.alu_op & 7 == 0 and d.imm & 0x300 in (0, 0x300):
+            i.branch = True
+        elif d.is_branch:
+            i.branch = BRANCH_OPS[d.alu_op](rs1_value, rs2_value) != d.mem_op & 1
+        elif d.is_load or d.is_store:
+            addr = (rs1_value + d.imm) & ADDR_MASK
+            count = d.additional_mem_ops + 1
+            if addr >> 25:
+                i.addrs = [(addr & ~0xC) | ((addr + 4 * n) & 0xC) for n in range(count)]
+            else:
+                i.addrs = [addr + 4 * n for n in range(count)]
+            i.size = {0: 1, 1: 2}.get(d.mem_op & 3, 4)
+        if cpu.irq:
+            next_pc = cpu.interrupt(next_pc)
+            i.interrupt = next_pc
+        cpu.pc = next_pc
+        return i
+
+    def _peek(self):
+        if self.next_instr is None:
+            self.next_instr = self._next_instr()
+        return self.next_instr
+
+    # Whether the memory controller should stall, the buffer has 4 parcels
+    # from the current instruction.  This is computed from the buffer offsets
+    # after completing the instruction, so it clears a clock early if that
+    # moves on to the next 8 bytes.
+    def _stall(self, instr_complete):
+        if self.write - self.pc != 8:
+            return False
+        return not (instr_complete and (self.pc >> 1 & 3) + self.instr.len // 2 >= 4)
+
+    # Advance one clock
+    def clock(self):
+        if self.hang is not None:
+            raise Hang(self.hang)
+        last_count = self.counter == 7
+        instr = self.instr
+
+        # The core
+        is_load = self.is_load and self.instr_valid and self.no_write_in_progress
+        is_store = self.is_store and self.instr_valid and self.no_write_in_progress
+        stall_core = not self.instr_valid or (self.is_load or self.is_store) and not self.no_write_in_progress
+        complete_core = False
+        branch_target = None
+        if last_count:
+            if self.interrupt_core is not None:
+                complete_core = True
+                branch_target = self.interrupt_core
+            elif stall_core:
+                complete_core = True
+            elif is_load:
+                complete_core = self.load_done
+            else:
+                complete_core = self.cycle + 1 >= instr.cycles
+                if complete_core and instr.branch:
+                    branch_target = instr.next_pc
+        branch = branch_target is not None
+        address_ready = last_count and self.cycle == 0 and (is_load or is_store)
+        any_additional = self.additional_mem_ops != 0
+        instr_complete = complete_core and not stall_core and not any_additional and self.interrupt_core is None
+
+        # Decode
+        decoding = None
+        early_branch = is_ret = False
+        if last_count and not (any_additional and complete_core and not stall_core) and \
+                not (instr_complete and instr.interrupt is not None):
+            if not self.instr_valid or instr_complete:
+                next_pc = (self.pc + instr.len) & PC_MASK if self.instr_valid else self.pc
+                avail = 0 if self.was_early_branch else (self.write - next_pc) // 2
+                if self._peek().len // 2 <= avail and not branch:
+                    decoding = self.next_instr
+                    assert decoding.pc == next_pc, "Buffer at {:06x} but next instruction at {:06x}".format(next_pc, decoding.pc)
+                    early_branch = decoding.d.is_jal
+                    is_ret = decoding.d.is_ret
+
+        restart = not self.fetch_running and (not branch or self.was_early_branch) and not early_branch and not is_ret
+        stall = self._stall(instr_complete)
+        instr_addr = self.early_branch_addr if self.was_early_branch else self.write
+        started, stopped, instr_ready, data_ready = self.memory.clock(
+            restart, stall, instr_addr, self.read_n, self.write_n, self.data_addr, self.data_continue)
+        if started:
+            self.fetch_restarts += 1
+
+        if self.counter == 0:
+            load_data_ready = data_ready or self.data_ready_latch
+        else:
+            load_data_ready = self.data_ready_sync
+
+        # Clock edge: data interface
+        if self.counter == 0:
+            self.load_done = load_data_ready and self.cycle != 0
+            self.data_ready_sync = data_ready or self.data_ready_latch
+            self.data_ready_latch = False
+        elif not self.data_ready_latch:
+            self.data_ready_latch = data_ready
+        elif address_ready:
+            self.data_ready_latch = False
+
+        if address_ready:
+            self.data_addr = instr.addrs[len(instr.addrs) - 1 - self.additional_mem_ops]
+        if self.is_store and address_ready:
+            self.write_n = self.mem_op & 3
+            self.no_write_in_progress = self.data_addr >> 27 != 0
+            self.data_continue = any_additional
+        elif data_ready:
+            self.write_n = 3
+            if last_count: self.no_write_in_progress = True
+        elif last_count:
+            self.no_write_in_progress = self.write_n == 3
+        if self.is_load and not instr_complete:
+            load_started = self.load_started
+            if address_ready:
+                self.read_n = self.mem_op & 3
+                self.load_started = True
+                self.data_continue = any_additional
+            if data_ready and load_started:
+                self.read_n = 3
+        else:
+            self.read_n = 3
+            self.load_started = False
+
+        if last_count and stall_core and self.instr_valid:
+            self.data_stalls += 1
+
+        # Clock edge: instruction buffer
+        if branch:
+            # After a jal the CPU assumes the fetch from the target started
+            # while the jump was in the core, which it can't if a data
+            # transaction held the memory for the whole instruction.
+            if self.was_early_branch and not self.memory.fetching:
+                self.hang = "Fetch for jump at {:06x} didn't start".format(instr.pc)
+            self.pc = self.write = branch_target & ~1
+            self.fetch_running = self.was_early_branch
+        elif is_ret:
+            self.pc = self.write = decoding.next_pc & ~1
+            self.fetch_running = False
+        else:
+            if instr_ready and self.fetch_running:
+                self.write = (self.write + 2) & PC_MASK
+            if early_branch: self.fetch_running = False
+            elif started: self.fetch_running = True
+            elif stopped: self.fetch_running = False
+            if instr_complete:
+                self.pc = (self.pc + instr.len) & PC_MASK
+        if last_count:
+            self.was_early_branch = early_branch and not branch
+            if early_branch:
+                self.early_branch_addr = decoding.next_pc
+
+        # Clock edge: decode and the core
+        if last_count:
+            if any_additional and complete_core and not stall_core:
+                self.additional_mem_ops -= 1
+            elif instr_complete and instr.interrupt is not None:
+                self.instr_valid = False
+                self.interrupt_core = instr.interrupt
+            elif not self.instr_valid or instr_complete or branch:
+                self.interrupt_core = None
+                if decoding is not None:
+                    self.next_instr = None
+                    self.instr = decoding
+                    self.is_load = decoding.d.is_load
+                    self.is_store = decoding.d.is_store
+                    self.mem_op = decoding.d.mem_op
+                    self.additional_mem_ops = decoding.d.additional_mem_ops
+                    self.instr_valid = not is_ret
+                else:
+                    self.instr_valid = False
+            self.cycle = 0 if complete_core else min(self.cycle + 1, 3)
+
+        self.counter = (self.counter + 1) & 7
+        self.clock_count += 1
+        if instr_complete:
+            self.instret += 1
+            self.completed = instr
+        return instr_complete
+
+    # Run until the next instruction completes, returning the clock it completed on
+    def step(self):
+        while not self.clock():
+            pass
+        return self.clock_count - 1
+
+    def run(self, count):
+        for i in range(count):
+            self.step()
+
+    @property
+    def cycles(self):
+        return self.clock_count // CLOCKS_PER_CYCLE
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict how many cycles tinyQV takes to run a program")
+    parser.add_argument("firmware", help="binary image, loaded into flash at address 0")
+    parser.add_argument("-n", "--instructions", type=int, default=100000, help="instructions to run, default 100000")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the cycle each instruction completed")
+    args = parser.parse_args()
+
+    with open(args.firmware, "rb") as f:
+        timing = Timing(TinyQV(f.read()))
+
+    last = 0
+    try:
+        for i in range(args.instructions):
+            clock = timing.step()
+            if args.verbose:
+                print("{:06x} {:8} {:3}".format(timing.completed.pc, clock // CLOCKS_PER_CYCLE, (clock - last) // CLOCKS_PER_CYCLE))
+            last = clock
+    except Hang as e:
+        print(e, file=sys.stderr)
+
+    print("{} instructions in {} cycles, CPI {:.2f}, {} fetch restarts".format(
+        timing.instret, timing.cycles, timing.cycles / max(timing.instret, 1), timing.fetch_restarts))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import mmap
+
+import cocotb
+from cocotb.triggers import Edge
+import numpy as np
+
+# A compact binary trace of the debug signals of tb_tinyqv, for runs too long
+# to dump as VCD.
+#
+# Tracer follows debug_trace and appends a record of the clock and the new
+# value each time it changes, rather than sampling it every clock, so long
+# stretches of stalls and multi-cycle instructions cost nothing.  The records
+# are buffered in an array and appended to the file as it fills.
+#
+#   tracer = Tracer(dut, "run.trace")        # after reset
+#   result = await soc.run()
+#   tracer.close()
+#
+# Trace maps the file and answers queries with numpy, without reading it in:
+#
+#   trace = Trace("run.trace")
+#   trace.instret(), trace.fetch_restarts(), trace.branches(), trace.stalls()
+#
+#   ./trace.py run.trace                     summary of a trace
+#
+# The file is MAGIC then records of (clock, value), both little endian 32 bit,
+# where clock is tb_tinyqv's count of clocks.  A record's value holds from its
+# clock until the next record, the value sampled at the end of a clock being
+# the last record for that clock, and the last record marks the end of the
+# trace.  Times and lengths are all in clocks, and CPI is in the README's
+# cycles of 8 clocks, as for firmware.Result.
+
+MAGIC = b"TQVTRC01"
+
+# The debug_trace bits
+COMPLETE = 1 << 0
+BRANCH = 1 << 1
+EARLY_BRANCH = 1 << 2
+RET = 1 << 3
+REG_WEN = 1 << 4
+FETCH_RESTART = 1 << 5
+STALL_TXN = 1 << 6
+STOP_TXN = 1 << 7
+RD_SHIFT = 8
+
+RECORD = np.dtype([("clock", "<u4"), ("value", "<u4")])
+
+class Tracer:
+    def __init__(self, dut, path, buffer_records=1 << 16):
+        self.dut = dut
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.records = array.array("I")
+        assert self.records.itemsize == 4
+        self.buffer_len = 2 * buffer_records
+        self._task = cocotb.start_soon(self._run())
+
+    def _append(self):
+        self.records.append(self.dut.clocks.value.integer)
+        self.records.append(self.dut.debug_trace.value.integer)
+        if len(self.records) >= self.buffer_len:
+            self.flush()
+
+    def flush(self):
+        self.records.tofile(self.file)
+        self.records = array.array("I")
+
+    async def _run(self):
+        self._append()
+        while True:
+            await Edge(self.dut.debug_trace)
+            self._append()
+
+    # Stop tracing, marking the end of the trace
+    def close(self):
+        self._task.kill()
+        self._append()
+        self.flush()
+        self.file.close()
+
+class Trace:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self._mmap[:len(MAGIC)] == MAGIC, "{} is not a trace".format(path)
+        self.records = np.frombuffer(self._mmap, RECORD, offset=len(MAGIC))
+        assert len(self.records), "Empty trace"
+        self.start = int(self.records["clock"][0])
+        self.end = int(self.records["clock"][-1])
+
+        # The value sampled at the end of each clock, as runs of clocks
+        clock = self.records["clock"]
+        last = np.append(clock[1:] != clock[:-1], True)
+        clock, value = clock[last], self.records["value"][last]
+        self.run_starts = clock[:-1]
+        self.run_lengths = np.diff(clock)
+        self.run_values = value[:-1]
+
+    @property
+    def clocks(self):
+        return self.end - self.start
+
+    # Clocks with all the bits in flags set
+    def count(self, flags):
+        return int(self.run_lengths[(self.run_values & flags) == flags].sum())
+
+    # Times any of the bits in flags went high
+    def edges(self, flags):
+        high = (self.run_values & flags) != 0
+        return int(np.count_nonzero(high[1:] & ~high[:-1]) + (len(high) and high[0]))
+
+    # (start clock, clocks) of each interval with any of the bits in flags set
+    def intervals(self, flags):
+        high = np.concatenate(([False], (self.run_values & flags) != 0, [False]))
+        change = np.flatnonzero(high[1:] != high[:-1])
+        bounds = np.append(self.run_starts, self.end)[change]
+        return np.column_stack((bounds[0::2], bounds[1::2] - bounds[0::2]))
+
+    def instret(self):
+        return self.count(COMPLETE)
+
+    def fetch_restarts(self):
+        return self.edges(FETCH_RESTART)
+
+    # Instructions completing as branches or jumps, with those the fetch
+    # restarted early for and the returns
+    def branches(self):
+        return {
+            "branch": self.count(COMPLETE | BRANCH),
+            "early": self.count(COMPLETE | EARLY_BRANCH),
+            "ret": self.count(COMPLETE | RET),
+        }
+
+    # Intervals the memory controller stalled or stopped a transaction
+    def stalls(self):
+        return self.intervals(STALL_TXN)
+
+    def stops(self):
+        return self.intervals(STOP_TXN)
+
+    # Instructions writing each register
+    def reg_writes(self):
+        writes = np.zeros(16, int)
+        mask = (self.run_values & (COMPLETE | REG_WEN)) == COMPLETE | REG_WEN
+        np.add.at(writes, self.run_values[mask] >> RD_SHIFT & 0xF, self.run_lengths[mask])
+        return writes
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise a tinyQV trace")
+    parser.add_argument("trace", help="trace file written by Tracer")
+    args = parser.parse_args()
+
+    trace = Trace(args.trace)
+    instret = trace.instret()
+    # CPI in the README's cycles of 8 clocks
+    print("{} clocks, {} instructions, CPI {:.2f}".format(trace.clocks, instret, trace.clocks / 8 / instret if instret else 0))
+    print("{} fetch restarts".format(trace.fetch_restarts()))
+    print(", ".join("{} {}".format(count, name) for name, count in trace.branches().items()))
+    for name, intervals in (("Stalls", trace.stalls()), ("Stops", trace.stops())):
+        if len(intervals):
+            lengths = intervals[:, 1]
+            print("{}: {}, {} clocks, mean {:.1f}, longest {} at clock {}".format(
+                name, len(lengths), lengths.sum(), lengths.mean(), lengths.max(), intervals[lengths.argmax(), 0]))
+        else:
+            print("{}: none".format(name))
+
+if __name__ == "__main__":
+    main()